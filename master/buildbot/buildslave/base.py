@@ -83,6 +83,9 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.registration = None
         self.registered_port = None
 
+        # the settings last adopted by reconfigService; see _configDigest
+        self.config_digest = None
+
         # these are set when the service is started, and unset when it is
         # stopped
         self.botmaster = None
@@ -246,24 +249,28 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
                 self.registered_port, self.slavename,
                 self.password, self.getPerspective)
 
-        # adopt new instance's configuration parameters
-        self.max_builds = new.max_builds
-        self.access = new.access
-        self.notify_on_missing = new.notify_on_missing
-        self.keepalive_interval = new.keepalive_interval
-
-        if self.missing_timeout != new.missing_timeout:
-            running_missing_timer = self.missing_timer
-            self.stopMissingTimer()
-            self.missing_timeout = new.missing_timeout
-            if running_missing_timer:
-                self.startMissingTimer()
-
-        properties = Properties()
-        properties.updateFromProperties(new.properties)
-        self.properties = properties
-
-        self.updateLocks()
+        # adopt new instance's configuration parameters, unless they are the
+        # ones adopted by the last reconfig, as they are for most slaves
+        config_digest = self._configDigest(new)
+        if config_digest != self.config_digest:
+            self.config_digest = config_digest
+            self.max_builds = new.max_builds
+            self.access = new.access
+            self.notify_on_missing = new.notify_on_missing
+            self.keepalive_interval = new.keepalive_interval
+
+            if self.missing_timeout != new.missing_timeout:
+                running_missing_timer = self.missing_timer
+                self.stopMissingTimer()
+                self.missing_timeout = new.missing_timeout
+                if running_missing_timer:
+                    self.startMissingTimer()
+
+            properties = Properties()
+            properties.updateFromProperties(new.properties)
+            self.properties = properties
+
+            self.updateLocks()
 
         # update the attached slave's notion of which builders are attached.
         # This assumes that the relevant builders have already been configured,
@@ -280,12 +287,17 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.stopMissingTimer()
         return service.MultiService.stopService(self)
 
+    def _configDigest(self, new):
+        # the parameters that reconfigService adopts from the new instance,
+        # in a form that can be compared cheaply
+        return (new.max_builds, tuple(new.access),
+                tuple(new.notify_on_missing), new.keepalive_interval,
+                new.missing_timeout, new.properties.asDict())
+
     def findNewSlaveInstance(self, new_config):
-        # TODO: called multiple times per reconfig; use 1-element cache?
-        for sl in new_config.slaves:
-            if sl.slavename == self.slavename:
-                return sl
-        assert 0, "no new slave named '%s'" % self.slavename
+        new = new_config.getSlave(self.slavename)
+        assert new, "no new slave named '%s'" % self.slavename
+        return new
 
     def startMissingTimer(self):
         if self.notify_on_missing and self.missing_timeout and self.parent:
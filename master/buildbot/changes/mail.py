@@ -55,24 +55,48 @@ class MaildirSource(MaildirService, util.ComparableMixin):
         return "%s watching maildir '%s'" % (self.__class__.__name__, self.basedir)
 
     def messageReceived(self, filename):
-        d = defer.succeed(None)
-
-        def parse_file(_):
-            f = self.moveToCurDir(filename)
-            return self.parse_file(f, self.prefix)
-        d.addCallback(parse_file)
+        return self.messagesReceived([filename])
+
+    @defer.inlineCallbacks
+    def messagesReceived(self, filenames):
+        # parse all of the new messages, then add their changes together
+        changelist, changefiles = [], []
+        for filename in filenames:
+            try:
+                f = self.moveToCurDir(filename)
+                chtuple = yield defer.maybeDeferred(self.parse_file, f,
+                                                    self.prefix)
+            except:
+                log.err(None, "while reading '%s' from maildir '%s':"
+                        % (filename, self.basedir))
+                continue
 
-        def add_change(chtuple):
             src, chdict = None, None
             if chtuple:
                 src, chdict = chtuple
             if chdict:
-                return self.master.addChange(src=src, **chdict)
+                changelist.append(dict(chdict, src=src))
+                changefiles.append(filename)
             else:
                 log.msg("no change found in maildir file '%s'" % filename)
-        d.addCallback(add_change)
 
-        return d
+        if not changelist:
+            return
+        try:
+            yield self.master.addChanges(changelist)
+            return
+        except:
+            log.err(None, "while adding changes from maildir '%s':"
+                    % self.basedir)
+
+        # the messages are already in cur/, so rather than lose all of them,
+        # add their changes one at a time
+        for filename, chdict in zip(changefiles, changelist):
+            try:
+                yield self.master.addChange(**chdict)
+            except:
+                log.err(None, "change from '%s' in maildir '%s' discarded:"
+                        % (filename, self.basedir))
 
     def parse_file(self, fd, prefix=None):
         m = message_from_file(fd)
@@ -38,6 +38,22 @@ class ChangePerspective(NewCredPerspective):
     def perspective_addChange(self, changedict):
         log.msg("perspective_addChange called")
 
+        d = self.master.addChange(**self._prepareChange(changedict))
+        # since this is a remote method, we can't return a Change instance, so
+        # this just sets the return value to None:
+        d.addCallback(lambda _: None)
+        return d
+
+    def perspective_addChanges(self, changedicts):
+        log.msg("perspective_addChanges called with %d changes"
+                % len(changedicts))
+
+        d = self.master.addChanges([self._prepareChange(changedict)
+                                    for changedict in changedicts])
+        d.addCallback(lambda _: None)
+        return d
+
+    def _prepareChange(self, changedict):
         if 'revlink' in changedict and not changedict['revlink']:
             changedict['revlink'] = ''
         if 'repository' in changedict and not changedict['repository']:
@@ -94,11 +110,7 @@ class ChangePerspective(NewCredPerspective):
             log.msg("Found links: " + repr(changedict['links']))
             del changedict['links']
 
-        d = self.master.addChange(**changedict)
-        # since this is a remote method, we can't return a Change instance, so
-        # this just sets the return value to None:
-        d.addCallback(lambda _: None)
-        return d
+        return changedict
 
 
 class PBChangeSource(config.ReconfigurableServiceMixin, base.ChangeSource):
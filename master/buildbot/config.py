@@ -69,6 +69,7 @@ class MasterConfig(object):
         self.eventHorizon = 50
         self.logHorizon = None
         self.buildHorizon = None
+        self.buildsetHorizon = None
         self.logCompressionLimit = 4 * 1024
         self.logCompressionMethod = 'bz2'
         self.logMaxTailSize = None
@@ -105,9 +106,11 @@ class MasterConfig(object):
         self.status = []
         self.user_managers = []
         self.revlink = default_revlink_matcher
+        self._indexes = {}
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheSize", "builders", "buildHorizon",
+        "buildsetHorizon", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
         'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
@@ -117,6 +120,25 @@ class MasterConfig(object):
         "slaves", "status", "title", "titleURL", "user_managers", "validation"
     ])
 
+    def getBuilderConfig(self, name):
+        """Return the L{BuilderConfig} named C{name}, or None"""
+        return self._getIndex('builders', 'name').get(name)
+
+    def getSlave(self, slavename):
+        """Return the buildslave named C{slavename}, or None"""
+        return self._getIndex('slaves', 'slavename').get(slavename)
+
+    def _getIndex(self, attr, key):
+        # index the list by name, so that each builder and slave can find its
+        # configuration without a linear scan; the index is rebuilt if the
+        # list is replaced or grows
+        objs = getattr(self, attr)
+        cached = self._indexes.get(attr)
+        if not cached or cached[0] is not objs or cached[1] != len(objs):
+            index = dict((getattr(o, key), o) for o in objs)
+            cached = self._indexes[attr] = (objs, len(objs), index)
+        return cached[2]
+
     @classmethod
     def loadConfig(cls, basedir, filename):
         if not os.path.isdir(basedir):
@@ -252,6 +274,7 @@ class MasterConfig(object):
         copy_int_param('eventHorizon')
         copy_int_param('logHorizon')
         copy_int_param('buildHorizon')
+        copy_int_param('buildsetHorizon')
 
         copy_int_param('logCompressionLimit')
 
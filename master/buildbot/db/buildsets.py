@@ -17,12 +17,14 @@
 Support for buildsets in the database
 """
 
+import itertools
 import sqlalchemy as sa
 
 from buildbot.db import base
 from buildbot.util import datetime2epoch
 from buildbot.util import epoch2datetime
 from buildbot.util import json
+from twisted.internet import defer
 from twisted.internet import reactor
 
 
@@ -192,6 +194,111 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return dict(l)
         return self.db.pool.do(thd)
 
+    def pruneBuildsets(self, buildsetHorizon, limit=None):
+        """
+        Called periodically by DBConnector, this method deletes completed
+        buildsets older than C{buildsetHorizon}, oldest first, along with
+        their build requests, claims, builds and properties, and any source
+        stamps no longer used by a buildset.  The buildsets are deleted in
+        small batches, each in its own transaction.  If C{limit} is given, at
+        most that many buildsets are deleted.
+
+        @returns: number of buildsets deleted, via Deferred
+        """
+        if not buildsetHorizon:
+            return defer.succeed(0)
+
+        def thd(conn):
+            model = self.db.model
+            bs_tbl = model.buildsets
+
+            def delete_in(table, column, ids):
+                iterator = iter(ids)
+                while True:
+                    batch = list(itertools.islice(iterator, 100))
+                    if not batch:
+                        break
+                    conn.execute(table.delete(column.in_(batch)))
+
+            def select_in(columns, column, ids, distinct=False):
+                rows = []
+                iterator = iter(ids)
+                while True:
+                    batch = list(itertools.islice(iterator, 100))
+                    if not batch:
+                        break
+                    q = sa.select(columns, whereclause=column.in_(batch),
+                                  distinct=distinct)
+                    rows.extend(conn.execute(q).fetchall())
+                return rows
+
+            def delete_batch(bsids, ssetids):
+                # delete the buildsets and everything that belongs only to
+                # them; this runs in a transaction
+                br_tbl = model.buildrequests
+                brids = [r.id for r in select_in([br_tbl.c.id],
+                                                 br_tbl.c.buildsetid, bsids)]
+                delete_in(model.builds, model.builds.c.brid, brids)
+                delete_in(model.buildrequest_claims,
+                          model.buildrequest_claims.c.brid, brids)
+                delete_in(br_tbl, br_tbl.c.id, brids)
+                delete_in(model.buildset_properties,
+                          model.buildset_properties.c.buildsetid, bsids)
+                delete_in(bs_tbl, bs_tbl.c.id, bsids)
+
+                # source stamp sets can be shared by several buildsets, so
+                # only delete those that are no longer used
+                used = select_in([bs_tbl.c.sourcestampsetid],
+                                 bs_tbl.c.sourcestampsetid, ssetids,
+                                 distinct=True)
+                ssetids -= set([r.sourcestampsetid for r in used])
+                ss_tbl = model.sourcestamps
+                ss_rows = select_in([ss_tbl.c.id, ss_tbl.c.patchid],
+                                    ss_tbl.c.sourcestampsetid, ssetids)
+                ssids = [r.id for r in ss_rows]
+                patchids = [r.patchid for r in ss_rows if r.patchid]
+                delete_in(model.sourcestamp_changes,
+                          model.sourcestamp_changes.c.sourcestampid, ssids)
+                delete_in(ss_tbl, ss_tbl.c.id, ssids)
+                delete_in(model.patches, model.patches.c.id, patchids)
+                delete_in(model.sourcestampsets, model.sourcestampsets.c.id,
+                          ssetids)
+
+            # find the newest buildset beyond the horizon
+            q = sa.select([bs_tbl.c.id], order_by=[sa.desc(bs_tbl.c.id)],
+                          offset=buildsetHorizon, limit=1)
+            row = conn.execute(q).fetchone()
+            if row is None:
+                return 0
+            newest = row.id
+
+            deleted = 0
+            while limit is None or deleted < limit:
+                batch_size = 100
+                if limit is not None:
+                    batch_size = min(batch_size, limit - deleted)
+                # incomplete buildsets are left alone, however old
+                q = sa.select([bs_tbl.c.id, bs_tbl.c.sourcestampsetid],
+                              whereclause=((bs_tbl.c.id <= newest) &
+                                           (bs_tbl.c.complete != 0)),
+                              order_by=[bs_tbl.c.id], limit=batch_size)
+                rows = conn.execute(q).fetchall()
+                if not rows:
+                    break
+                bsids = [r.id for r in rows]
+                ssetids = set([r.sourcestampsetid for r in rows])
+
+                transaction = conn.begin()
+                try:
+                    delete_batch(bsids, ssetids)
+                except:
+                    transaction.rollback()
+                    raise
+                transaction.commit()
+                deleted += len(bsids)
+            return deleted
+        return self.db.pool.do(thd)
+
     def _row2dict(self, row):
         def mkdt(epoch):
             if epoch:
@@ -38,16 +38,21 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                   revision=None, when_timestamp=None, branch=None,
                   category=None, revlink='', properties={}, repository='', codebase='',
                   project='', uid=None, _reactor=reactor):
-        assert project is not None, "project must be a string, not None"
-        assert repository is not None, "repository must be a string, not None"
-
-        if when_timestamp is None:
-            when_timestamp = epoch2datetime(_reactor.seconds())
+        d = self.addChanges([dict(author=author, files=files,
+                                  comments=comments, is_dir=is_dir,
+                                  revision=revision,
+                                  when_timestamp=when_timestamp,
+                                  branch=branch, category=category,
+                                  revlink=revlink, properties=properties,
+                                  repository=repository, codebase=codebase,
+                                  project=project, uid=uid)],
+                            _reactor=_reactor)
+        d.addCallback(lambda changeids: changeids[0])
+        return d
 
-        # verify that source is 'Change' for each property
-        for pv in properties.values():
-            assert pv[1] == 'Change', ("properties must be qualified with"
-                                       "source 'Change'")
+    def addChanges(self, changes, _reactor=reactor):
+        changes = [self._changeDefaults(_reactor=_reactor, **kwargs)
+                   for kwargs in changes]
 
         def thd(conn):
             # note that in a read-uncommitted database like SQLite this
@@ -57,63 +62,92 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             # all in the database, but beware.
 
             transaction = conn.begin()
-
-            ch_tbl = self.db.model.changes
-
-            self.check_length(ch_tbl.c.author, author)
-            self.check_length(ch_tbl.c.branch, branch)
-            self.check_length(ch_tbl.c.revision, revision)
-            self.check_length(ch_tbl.c.revlink, revlink)
-            self.check_length(ch_tbl.c.category, category)
-            self.check_length(ch_tbl.c.repository, repository)
-            self.check_length(ch_tbl.c.project, project)
-
-            r = conn.execute(ch_tbl.insert(), dict(
-                author=author,
-                comments=comments,
-                is_dir=is_dir,
-                branch=branch,
-                revision=revision,
-                revlink=revlink,
-                when_timestamp=datetime2epoch(when_timestamp),
-                category=category,
-                repository=repository,
-                codebase=codebase,
-                project=project))
-            changeid = r.inserted_primary_key[0]
-            if files:
-                tbl = self.db.model.change_files
-                for f in files:
-                    self.check_length(tbl.c.filename, f)
-                conn.execute(tbl.insert(), [
-                    dict(changeid=changeid, filename=f)
-                    for f in files
-                ])
-            if properties:
-                tbl = self.db.model.change_properties
-                inserts = [
-                    dict(changeid=changeid,
-                         property_name=k,
-                         property_value=json.dumps(v))
-                    for k, v in properties.iteritems()
-                ]
-                for i in inserts:
-                    self.check_length(tbl.c.property_name,
-                                      i['property_name'])
-                    self.check_length(tbl.c.property_value,
-                                      i['property_value'])
-
-                conn.execute(tbl.insert(), inserts)
-            if uid:
-                ins = self.db.model.change_users.insert()
-                conn.execute(ins, dict(changeid=changeid, uid=uid))
-
+            changeids = [self._addChange_thd(conn, **kwargs)
+                         for kwargs in changes]
             transaction.commit()
 
-            return changeid
+            return changeids
         d = self.db.pool.do(thd)
         return d
 
+    def _changeDefaults(self, author=None, files=None, comments=None,
+                        is_dir=0, revision=None, when_timestamp=None,
+                        branch=None, category=None, revlink='', properties={},
+                        repository='', codebase='', project='', uid=None,
+                        _reactor=reactor):
+        assert project is not None, "project must be a string, not None"
+        assert repository is not None, "repository must be a string, not None"
+
+        if when_timestamp is None:
+            when_timestamp = epoch2datetime(_reactor.seconds())
+
+        # verify that source is 'Change' for each property
+        for pv in properties.values():
+            assert pv[1] == 'Change', ("properties must be qualified with"
+                                       "source 'Change'")
+
+        return dict(author=author, files=files, comments=comments,
+                    is_dir=is_dir, revision=revision,
+                    when_timestamp=when_timestamp, branch=branch,
+                    category=category, revlink=revlink, properties=properties,
+                    repository=repository, codebase=codebase,
+                    project=project, uid=uid)
+
+    def _addChange_thd(self, conn, author, files, comments, is_dir, revision,
+                       when_timestamp, branch, category, revlink, properties,
+                       repository, codebase, project, uid):
+        ch_tbl = self.db.model.changes
+
+        self.check_length(ch_tbl.c.author, author)
+        self.check_length(ch_tbl.c.branch, branch)
+        self.check_length(ch_tbl.c.revision, revision)
+        self.check_length(ch_tbl.c.revlink, revlink)
+        self.check_length(ch_tbl.c.category, category)
+        self.check_length(ch_tbl.c.repository, repository)
+        self.check_length(ch_tbl.c.project, project)
+
+        r = conn.execute(ch_tbl.insert(), dict(
+            author=author,
+            comments=comments,
+            is_dir=is_dir,
+            branch=branch,
+            revision=revision,
+            revlink=revlink,
+            when_timestamp=datetime2epoch(when_timestamp),
+            category=category,
+            repository=repository,
+            codebase=codebase,
+            project=project))
+        changeid = r.inserted_primary_key[0]
+        if files:
+            tbl = self.db.model.change_files
+            for f in files:
+                self.check_length(tbl.c.filename, f)
+            conn.execute(tbl.insert(), [
+                dict(changeid=changeid, filename=f)
+                for f in files
+            ])
+        if properties:
+            tbl = self.db.model.change_properties
+            inserts = [
+                dict(changeid=changeid,
+                     property_name=k,
+                     property_value=json.dumps(v))
+                for k, v in properties.iteritems()
+            ]
+            for i in inserts:
+                self.check_length(tbl.c.property_name,
+                                  i['property_name'])
+                self.check_length(tbl.c.property_value,
+                                  i['property_value'])
+
+            conn.execute(tbl.insert(), inserts)
+        if uid:
+            ins = self.db.model.change_users.insert()
+            conn.execute(ins, dict(changeid=changeid, uid=uid))
+
+        return changeid
+
     @base.cached("chdicts")
     def getChange(self, changeid):
         assert changeid >= 0
@@ -127,7 +161,21 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             if not row:
                 return None
             # and fetch the ancillary data (files, properties)
-            return self._chdict_from_change_row_thd(conn, row)
+            return self._chdicts_from_change_rows_thd(conn, [row])[0]
+        d = self.db.pool.do(thd)
+        return d
+
+    def getChangesById(self, changeids):
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            rows = []
+            for batch in self._batches(changeids):
+                q = changes_tbl.select(
+                    whereclause=changes_tbl.c.changeid.in_(batch))
+                rows.extend(conn.execute(q).fetchall())
+            chdicts = dict((chdict['changeid'], chdict) for chdict
+                           in self._chdicts_from_change_rows_thd(conn, rows))
+            return [chdicts.get(changeid) for changeid in changeids]
         d = self.db.pool.do(thd)
         return d
 
@@ -144,6 +192,18 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getChangeUidsById(self, changeids):
+        def thd(conn):
+            cu_tbl = self.db.model.change_users
+            uids = dict((changeid, []) for changeid in changeids)
+            for batch in self._batches(changeids):
+                q = cu_tbl.select(whereclause=cu_tbl.c.changeid.in_(batch))
+                for row in conn.execute(q).fetchall():
+                    uids[row.changeid].append(row.uid)
+            return [uids[changeid] for changeid in changeids]
+        d = self.db.pool.do(thd)
+        return d
+
     def getRecentChanges(self, count):
         def thd(conn):
             # get the changeids from the 'changes' table
@@ -176,68 +236,102 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
 
     # utility methods
 
-    def pruneChanges(self, changeHorizon):
+    def pruneChanges(self, changeHorizon, limit=None):
         """
         Called periodically by DBConnector, this method deletes changes older
-        than C{changeHorizon}.
+        than C{changeHorizon}, oldest first.  The changes are deleted in
+        small batches, each in its own transaction, so that other queries are
+        not held up.  If C{limit} is given, at most that many changes are
+        deleted.
+
+        @returns: number of changes deleted, via Deferred
         """
 
         if not changeHorizon:
-            return defer.succeed(None)
+            return defer.succeed(0)
 
         def thd(conn):
             changes_tbl = self.db.model.changes
 
-            # First, get the list of changes to delete.  This could be written
-            # as a subquery but then that subquery would be run for every
-            # table, which is very inefficient; also, MySQL's subquery support
-            # leaves much to be desired, and doesn't support this particular
-            # form.
+            # find the newest change beyond the horizon; it and everything
+            # older will be deleted
             q = sa.select([changes_tbl.c.changeid],
                           order_by=[sa.desc(changes_tbl.c.changeid)],
-                          offset=changeHorizon)
-            res = conn.execute(q)
-            ids_to_delete = [r.changeid for r in res]
-
-            # and delete from all relevant tables, in dependency order
-            for table_name in ('scheduler_changes', 'sourcestamp_changes',
-                               'change_files', 'change_properties', 'changes',
-                               'change_users'):
-                remaining = ids_to_delete[:]
-                while remaining:
-                    batch, remaining = remaining[:100], remaining[100:]
-                    table = self.db.model.metadata.tables[table_name]
-                    conn.execute(
-                        table.delete(table.c.changeid.in_(batch)))
+                          offset=changeHorizon, limit=1)
+            row = conn.execute(q).fetchone()
+            if row is None:
+                return 0
+            newest = row.changeid
+
+            deleted = 0
+            while limit is None or deleted < limit:
+                batch_size = 100
+                if limit is not None:
+                    batch_size = min(batch_size, limit - deleted)
+                q = sa.select([changes_tbl.c.changeid],
+                              whereclause=(changes_tbl.c.changeid <= newest),
+                              order_by=[changes_tbl.c.changeid],
+                              limit=batch_size)
+                batch = [r.changeid for r in conn.execute(q)]
+                if not batch:
+                    break
+
+                # delete from all relevant tables, in dependency order
+                transaction = conn.begin()
+                try:
+                    for table_name in ('scheduler_changes',
+                                       'sourcestamp_changes', 'change_files',
+                                       'change_properties', 'change_users',
+                                       'changes'):
+                        table = self.db.model.metadata.tables[table_name]
+                        conn.execute(
+                            table.delete(table.c.changeid.in_(batch)))
+                except:
+                    transaction.rollback()
+                    raise
+                transaction.commit()
+                deleted += len(batch)
+            return deleted
         return self.db.pool.do(thd)
 
-    def _chdict_from_change_row_thd(self, conn, ch_row):
-        # This method must be run in a db.pool thread, and returns a chdict
-        # given a row from the 'changes' table
+    def _batches(self, changeids):
+        # keep the number of parameters bound in each query well below the
+        # limits of the database engines
+        for i in xrange(0, len(changeids), 100):
+            yield changeids[i:i + 100]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns chdicts
+        # given rows from the 'changes' table, fetching the files and
+        # properties of all of them at once
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
-            changeid=ch_row.changeid,
-            author=ch_row.author,
-            files=[],  # see below
-            comments=ch_row.comments,
-            is_dir=ch_row.is_dir,
-            revision=ch_row.revision,
-            when_timestamp=epoch2datetime(ch_row.when_timestamp),
-            branch=ch_row.branch,
-            category=ch_row.category,
-            revlink=ch_row.revlink,
-            properties={},  # see below
-            repository=ch_row.repository,
-            codebase=ch_row.codebase,
-            project=ch_row.project)
-
-        query = change_files_tbl.select(
-            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
+        chdicts = {}
+        for ch_row in ch_rows:
+            chdicts[ch_row.changeid] = ChDict(
+                changeid=ch_row.changeid,
+                author=ch_row.author,
+                files=[],  # see below
+                comments=ch_row.comments,
+                is_dir=ch_row.is_dir,
+                revision=ch_row.revision,
+                when_timestamp=epoch2datetime(ch_row.when_timestamp),
+                branch=ch_row.branch,
+                category=ch_row.category,
+                revlink=ch_row.revlink,
+                properties={},  # see below
+                repository=ch_row.repository,
+                codebase=ch_row.codebase,
+                project=ch_row.project)
+        changeids = chdicts.keys()
+
+        for batch in self._batches(changeids):
+            query = change_files_tbl.select(
+                whereclause=change_files_tbl.c.changeid.in_(batch))
+            rows = conn.execute(query)
+            for r in rows:
+                chdicts[r.changeid]['files'].append(r.filename)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -251,14 +345,15 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 v, s = vs, "Change"
             return v, s
 
-        query = change_properties_tbl.select(
-            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            try:
-                v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v, s)
-            except ValueError:
-                pass
-
-        return chdict
+        for batch in self._batches(changeids):
+            query = change_properties_tbl.select(
+                whereclause=change_properties_tbl.c.changeid.in_(batch))
+            rows = conn.execute(query)
+            for r in rows:
+                try:
+                    v, s = split_vs(json.loads(r.property_value))
+                    chdicts[r.changeid]['properties'][r.property_name] = (v, s)
+                except ValueError:
+                    pass
+
+        return [chdicts[ch_row.changeid] for ch_row in ch_rows]
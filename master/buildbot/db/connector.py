@@ -22,8 +22,10 @@ from buildbot.db import buildsets
 from buildbot.db import buildslaves
 from buildbot.db import changes
 from buildbot.db import enginestrategy
+from buildbot.db import locks
 from buildbot.db import model
 from buildbot.db import pool
+from buildbot.db import pruner
 from buildbot.db import schedulers
 from buildbot.db import sourcestamps
 from buildbot.db import sourcestampsets
@@ -86,7 +88,9 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
         self.builds = builds.BuildsConnectorComponent(self)
         self.buildslaves = buildslaves.BuildslavesConnectorComponent(self)
         self.users = users.UsersConnectorComponent(self)
+        self.locks = locks.LocksConnectorComponent(self)
 
+        self.pruner = pruner.Pruner(self)
         self.cleanup_timer = internet.TimerService(self.CLEANUP_PERIOD,
                                                    self._doCleanup)
         self.cleanup_timer.setServiceParent(self)
@@ -133,6 +137,6 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
         if not self.configured_url:
             return
 
-        d = self.changes.pruneChanges(self.master.config.changeHorizon)
-        d.addErrback(log.err, 'while pruning changes')
+        d = self.pruner.prune()
+        d.addErrback(log.err, 'while pruning the database')
         return d
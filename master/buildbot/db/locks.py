@@ -0,0 +1,96 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import itertools
+
+from buildbot.db import base
+from buildbot.util import epoch2datetime
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class LocksConnectorComponent(base.DBConnectorComponent):
+    # Documentation is in developer/database.rst
+
+    def addLease(self, name, objectid, mode, _reactor=reactor):
+        def thd(conn):
+            tbl = self.db.model.lock_leases
+            r = conn.execute(tbl.insert(), name=name, objectid=objectid,
+                             mode=mode, heartbeat_at=_reactor.seconds())
+            return r.inserted_primary_key[0]
+        return self.db.pool.do(thd)
+
+    def getLeases(self, name):
+        def thd(conn):
+            tbl = self.db.model.lock_leases
+            q = tbl.select(whereclause=(tbl.c.name == name),
+                           order_by=[tbl.c.id])
+            return [self._leasedictFromRow(row)
+                    for row in conn.execute(q).fetchall()]
+        return self.db.pool.do(thd)
+
+    def refreshLeases(self, leaseids, _reactor=reactor):
+        def thd(conn):
+            tbl = self.db.model.lock_leases
+            heartbeat_at = _reactor.seconds()
+
+            # we'll need to batch the leaseids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            iterator = iter(leaseids)
+
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break  # success!
+
+                q = tbl.update(whereclause=tbl.c.id.in_(batch))
+                conn.execute(q, heartbeat_at=heartbeat_at)
+        return self.db.pool.do(thd)
+
+    def removeLeases(self, leaseids):
+        def thd(conn):
+            tbl = self.db.model.lock_leases
+
+            iterator = iter(leaseids)
+
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break  # success!
+
+                conn.execute(tbl.delete(whereclause=tbl.c.id.in_(batch)))
+        return self.db.pool.do(thd)
+
+    def expireLeases(self, name, old, _reactor=reactor):
+        def thd(conn):
+            tbl = self.db.model.lock_leases
+            old_epoch = _reactor.seconds() - old
+            res = conn.execute(tbl.delete(
+                (tbl.c.name == name) & (tbl.c.heartbeat_at < old_epoch)))
+            return res.rowcount
+        d = self.db.pool.do(thd)
+
+        def log_nonzero_count(count):
+            if count != 0:
+                log.msg("expired %d leases on lock %r (over %d seconds old)"
+                        % (count, name, old))
+            return count
+        d.addCallback(log_nonzero_count)
+        return d
+
+    def _leasedictFromRow(self, row):
+        return dict(leaseid=row.id, name=row.name, objectid=row.objectid,
+                    mode=row.mode,
+                    heartbeat_at=epoch2datetime(row.heartbeat_at))
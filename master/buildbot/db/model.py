@@ -142,6 +142,22 @@ class Model(base.DBConnectorComponent):
                            sa.Column("info", JsonObject, nullable=False),
                            )
 
+    # locks
+
+    # Each row in this table is a lease on a distributed lock, either held or
+    # awaited by the master identified by objectid.  Leases are granted in id
+    # order, and expire when the master stops updating heartbeat_at.
+    lock_leases = sa.Table('lock_leases', metadata,
+                           sa.Column('id', sa.Integer, primary_key=True),
+                           # the lock's name
+                           sa.Column('name', sa.String(256), nullable=False),
+                           sa.Column('objectid', sa.Integer, sa.ForeignKey('objects.id'),
+                                     nullable=False),
+                           # 'counting' or 'exclusive'
+                           sa.Column('mode', sa.String(16), nullable=False),
+                           sa.Column('heartbeat_at', sa.Integer, nullable=False),
+                           )
+
     # changes
 
     # Files touched in changes
@@ -369,6 +385,7 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildset_properties_buildsetid',
              buildset_properties.c.buildsetid)
     sa.Index('buildslaves_name', buildslaves.c.name, unique=True)
+    sa.Index('lock_leases_name', lock_leases.c.name)
     sa.Index('changes_branch', changes.c.branch)
     sa.Index('changes_revision', changes.c.revision)
     sa.Index('changes_author', changes.c.author)
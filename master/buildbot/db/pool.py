@@ -17,13 +17,17 @@ import inspect
 import os
 import shutil
 import sqlalchemy as sa
+import sys
 import tempfile
+import threading
 import time
 import traceback
 
 from buildbot.process import metrics
+from buildbot.util import sautils
 from twisted.internet import reactor
 from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
 from twisted.python import threadpool
 
@@ -80,13 +84,64 @@ def timed_do_fn(f):
         return d
     wrap.__name__ = f.__name__
     wrap.__doc__ = f.__doc__
+    # the query is named after the caller of wrap, not wrap itself
+    _wrapperCodes.add(wrap.func_code)
     return wrap
 
 
+class _Query(object):
+
+    # the timing of one pool.do call, filled in by the pool thread and read
+    # once the result is back in the reactor thread
+
+    __slots__ = ['method', 'queued', 'started', 'finished', 'statements']
+
+    def __init__(self, method):
+        self.method = method
+        self.queued = time.time()
+        self.started = self.finished = None
+        self.statements = []
+
+
+# names of the callers of pool.do, by code object
+_methodNames = {}
+
+# code objects of functions that wrap pool.do, and so are skipped when
+# looking for its caller
+_wrapperCodes = set()
+
+
+def _methodName(frame):
+    while frame.f_code in _wrapperCodes and frame.f_back is not None:
+        frame = frame.f_back
+    code = frame.f_code
+    try:
+        return _methodNames[code]
+    except KeyError:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        name = _methodNames[code] = "%s.%s" % (module, code.co_name)
+        return name
+
+
+def _countRows(rv):
+    if isinstance(rv, (list, tuple)):
+        return len(rv)
+    elif rv is None:
+        return 0
+    return 1
+
+
 class DBThreadPool(threadpool.ThreadPool):
 
     running = False
 
+    # queries which take longer than this many seconds to execute are logged,
+    # and kept in slowQueries with the SQL they ran
+    slowQueryThreshold = 1.0
+    slowQueryCount = 50
+    # the number of SQL statements kept for each query
+    maxStatements = 10
+
     # Some versions of SQLite incorrectly cache metadata about which tables are
     # and are not present on a per-connection basis.  This cache can be flushed
     # by querying the sqlite_master table.  We currently assume all versions of
@@ -118,6 +173,11 @@ class DBThreadPool(threadpool.ThreadPool):
                                        maxthreads=pool_size,
                                        name='DBThreadPool')
         self.engine = engine
+        self.slowQueries = metrics.FiniteList(self.slowQueryCount)
+        self._current = threading.local()
+        if sautils.sa_version() >= (0, 7, 0):
+            sa.event.listen(engine, 'before_cursor_execute',
+                            self._before_cursor_execute)
         if engine.dialect.name == 'sqlite':
             vers = self.get_sqlite_version()
             if vers < (3, 7):
@@ -172,7 +232,16 @@ class DBThreadPool(threadpool.ThreadPool):
     BACKOFF_MULT = 1.05
     MAX_OPERATIONALERROR_TIME = 3600 * 24  # one day
 
-    def __thd(self, with_engine, callable, args, kwargs):
+    def __thd(self, with_engine, query, callable, args, kwargs):
+        query.started = time.time()
+        self._current.query = query
+        try:
+            return self.__retry(with_engine, callable, args, kwargs)
+        finally:
+            self._current.query = None
+            query.finished = time.time()
+
+    def __retry(self, with_engine, callable, args, kwargs):
         # try to call callable(arg, *args, **kwargs) repeatedly until no
         # OperationalErrors occur, where arg is either the engine (with_engine)
         # or a connection (not with_engine)
@@ -223,12 +292,47 @@ class DBThreadPool(threadpool.ThreadPool):
         return rv
 
     def do(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                                         self.__thd, False, callable, args, kwargs)
+        query = _Query(_methodName(sys._getframe(1)))
+        d = threads.deferToThreadPool(reactor, self, self.__thd, False,
+                                      query, callable, args, kwargs)
+        d.addBoth(self._queryDone, query)
+        return d
 
     def do_with_engine(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                                         self.__thd, True, callable, args, kwargs)
+        query = _Query(_methodName(sys._getframe(1)))
+        d = threads.deferToThreadPool(reactor, self, self.__thd, True,
+                                      query, callable, args, kwargs)
+        d.addBoth(self._queryDone, query)
+        return d
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        # called in the pool thread for each SQL statement
+        query = getattr(self._current, 'query', None)
+        if query and len(query.statements) < self.maxStatements:
+            query.statements.append(statement)
+
+    def _queryDone(self, res, query):
+        if query.finished is None:
+            # never ran
+            return res
+        wait = query.started - query.queued
+        elapsed = query.finished - query.started
+        if isinstance(res, failure.Failure):
+            rows = 0
+        else:
+            rows = _countRows(res)
+        metrics.MetricDBQueryEvent.log(query.method, wait, elapsed, rows)
+        if elapsed >= self.slowQueryThreshold:
+            self.slowQueries.append(dict(method=query.method,
+                                         started=query.started, wait=wait,
+                                         elapsed=elapsed, rows=rows,
+                                         statements=query.statements))
+            log.msg("slow query: %s took %.2fs (after waiting %.2fs for a "
+                    "thread), returning %d rows:\n  %s"
+                    % (query.method, elapsed, wait, rows,
+                       "\n  ".join(query.statements)))
+        return res
 
     def detect_bug1810(self):
         # detect buggy SQLite implementations; call only for a known-sqlite
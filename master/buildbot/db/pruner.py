@@ -0,0 +1,91 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+from buildbot.process import metrics
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.python import log
+
+
+class Pruner(object):
+
+    """
+    Delete old rows from the database, as configured by the horizons in the
+    master config.  Rows are deleted a small batch at a time, with a pause
+    between batches, so that pruning a large backlog does not monopolize the
+    database.  The total number of rows pruned from each table is recorded in
+    the master's state, and reported as a metric.
+    """
+
+    # number of rows deleted in each transaction
+    BATCH_SIZE = 100
+
+    # seconds to wait between batches
+    BATCH_DELAY = 1
+
+    _reactor = reactor
+
+    def __init__(self, db):
+        self.db = db
+        self.pruning = False
+
+    @defer.inlineCallbacks
+    def prune(self):
+        # a slow prune may still be running when the next one is due
+        if self.pruning:
+            return
+        self.pruning = True
+        try:
+            config = self.db.master.config
+            yield self._pruneTable('changes', self.db.changes.pruneChanges,
+                                   config.changeHorizon)
+            yield self._pruneTable('buildsets',
+                                   self.db.buildsets.pruneBuildsets,
+                                   config.buildsetHorizon)
+        finally:
+            self.pruning = False
+
+    @defer.inlineCallbacks
+    def _pruneTable(self, table, pruneFn, horizon):
+        if not horizon:
+            return
+
+        timer = metrics.Timer("Pruner.%s" % table)
+        timer.start()
+        pruned = 0
+        try:
+            while self.db.running:
+                count = yield pruneFn(horizon, limit=self.BATCH_SIZE)
+                if count:
+                    pruned += count
+                    metrics.MetricCountEvent.log("Pruner.pruned_%s" % table,
+                                                 count)
+                if count < self.BATCH_SIZE:
+                    break
+                yield task.deferLater(self._reactor, self.BATCH_DELAY,
+                                      lambda: None)
+        finally:
+            timer.stop()
+
+        if pruned:
+            log.msg("pruned %d old %s from the database" % (pruned, table))
+            objectid = yield self.db.state.getObjectId('pruner',
+                                                       'buildbot.db.pruner.Pruner')
+            total = yield self.db.state.getState(objectid, 'pruned_' + table,
+                                                 0)
+            yield self.db.state.setState(objectid, 'pruned_' + table,
+                                         total + pruned)
@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import itertools
 import sqlalchemy as sa
 
 from sqlalchemy.sql.expression import and_
@@ -136,6 +137,56 @@ class UsersConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getUsersByUids(self, uids):
+        def thd(conn):
+            return self._getUsersBy_thd(conn, 'uid', uids)
+        d = self.db.pool.do(thd)
+        return d
+
+    def getUsersByUsernames(self, usernames):
+        def thd(conn):
+            return self._getUsersBy_thd(conn, 'bb_username', usernames)
+        d = self.db.pool.do(thd)
+        return d
+
+    def _getUsersBy_thd(self, conn, key, values):
+        # return usdicts for the users whose column C{key} has one of the
+        # given values, keyed by that value
+        tbl = self.db.model.users
+        tbl_info = self.db.model.users_info
+
+        usdicts = {}
+        # batch the values into groups of 100, so that the parameter lists
+        # supported by the DBAPI aren't exhausted
+        iterator = iter(set(values))
+        while True:
+            batch = list(itertools.islice(iterator, 100))
+            if not batch:
+                break
+
+            q = tbl.select(whereclause=(tbl.c[key].in_(batch)))
+            users_rows = conn.execute(q).fetchall()
+            if not users_rows:
+                continue
+
+            batch_dicts = dict((row.uid, UsDict()) for row in users_rows)
+            q = tbl_info.select(
+                whereclause=(tbl_info.c.uid.in_(batch_dicts.keys())))
+            for row in conn.execute(q).fetchall():
+                batch_dicts[row.uid][row.attr_type] = row.attr_data
+
+            # add the users_row data *after* the attributes in case
+            # attr_type matches one of these keys.
+            for users_row in users_rows:
+                usdict = batch_dicts[users_row.uid]
+                usdict['uid'] = users_row.uid
+                usdict['identifier'] = users_row.identifier
+                usdict['bb_username'] = users_row.bb_username
+                usdict['bb_password'] = users_row.bb_password
+                usdicts[users_row[key]] = usdict
+
+        return usdicts
+
     def getUsers(self):
         def thd(conn):
             tbl = self.db.model.users
@@ -14,16 +14,95 @@
 # Copyright Buildbot Team Members
 
 
+from collections import deque
+
 from buildbot import util
 from buildbot.util import subscription
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.python import log
 
 if False:  # for debugging
-    debuglog = log.msg
+    def debuglog(fmt, *args):
+        log.msg(fmt % args)
 else:
-    debuglog = lambda m: None
+    # the arguments are only formatted when debugging, as isAvailable is
+    # called very often
+    debuglog = lambda fmt, *args: None
+
+
+class _WaitQueue(object):
+
+    """
+    FIFO queue of lock waiters, indexed by waiter.
+
+    Entries are (access, deferred) pairs.  Replacing the entry of a waiter
+    that is already queued keeps its position.  Removed entries are left in
+    the underlying deque and skipped when iterating, and the deque is
+    compacted once they outnumber the live entries.  Iterating yields
+    (waiter, access, deferred) tuples, as the old list-based queue did.
+    """
+
+    def __init__(self):
+        self._order = deque()  # (seq, waiter) in FIFO order, including stale
+        self._entries = {}     # waiter -> (seq, access, deferred)
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, waiter):
+        return waiter in self._entries
+
+    def __iter__(self):
+        entries = self._entries
+        for seq, waiter in self._order:
+            entry = entries.get(waiter)
+            if entry is not None and entry[0] == seq:
+                yield waiter, entry[1], entry[2]
+
+    def get(self, waiter):
+        entry = self._entries.get(waiter)
+        if entry is None:
+            return None
+        return entry[1], entry[2]
+
+    def put(self, waiter, access, d):
+        entry = self._entries.get(waiter)
+        if entry is not None:
+            self._entries[waiter] = (entry[0], access, d)
+            return
+        self._seq += 1
+        self._entries[waiter] = (self._seq, access, d)
+        self._order.append((self._seq, waiter))
+
+    def remove(self, waiter):
+        if waiter not in self._entries:
+            return
+        del self._entries[waiter]
+        self._trim()
+        if len(self._order) > 2 * len(self._entries) + 16:
+            entries = self._entries
+            self._order = deque([(seq, w) for seq, w in self._order
+                                 if w in entries and entries[w][0] == seq])
+
+    def head(self):
+        """Return the waiter at the head of the queue, or None"""
+        self._trim()
+        if self._order:
+            return self._order[0][1]
+        return None
+
+    def _trim(self):
+        # drop stale entries from the head of the queue
+        order, entries = self._order, self._entries
+        while order:
+            seq, waiter = order[0]
+            entry = entries.get(waiter)
+            if entry is not None and entry[0] == seq:
+                break
+            order.popleft()
 
 
 class BaseLock:
@@ -35,15 +114,22 @@ class BaseLock:
     We maintain the wait queue in FIFO order, and ensure that counting waiters
     in the queue behind exclusive waiters cannot acquire the lock. This ensures
     that exclusive waiters are not starved.
+
+    The wait queue is indexed by waiter, and the number of exclusive and
+    counting owners is kept up to date as the lock is claimed and released,
+    so the cost of the operations below depends on C{maxCount}, not on the
+    number of waiters.
     """
     description = "<BaseLock>"
 
     def __init__(self, name, maxCount=1):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (waiter, LockAccess,
-                                  #                        deferred)
+        self.waiting = _WaitQueue()  # Current queue, waiter ->
+                                     #     (LockAccess, deferred)
         self.owners = []          # Current owners, tuples (owner, LockAccess)
         self.maxCount = maxCount  # maximal number of counting owners
+        self._num_excl = 0        # number of exclusive owners
+        self._num_counting = 0    # number of counting owners
 
         # subscriptions to this lock being released
         self.release_subs = subscription.SubscriptionPoint("%r releases"
@@ -57,51 +143,57 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else:  # mode == 'counting'
-                num_counting = num_counting + 1
-
+        num_excl, num_counting = self._num_excl, self._num_counting
         assert (num_excl == 1 and num_counting == 0) \
             or (num_excl == 0 and num_counting <= self.maxCount)
         return num_excl, num_counting
 
     def isAvailable(self, requester, access):
         """ Return a boolean whether the lock is available for claiming """
-        debuglog("%s isAvailable(%s, %s): self.owners=%r"
-                 % (self, requester, access, self.owners))
+        debuglog("%s isAvailable(%s, %s): self.owners=%r",
+                 self, requester, access, self.owners)
         num_excl, num_counting = self._getOwnersCount()
-
-        # Find all waiters ahead of the requester in the wait queue
-        for idx, waiter in enumerate(self.waiting):
-            if waiter[0] == requester:
-                w_index = idx
-                break
-        else:
-            w_index = len(self.waiting)
-        ahead = self.waiting[:w_index]
+        if num_excl > 0:
+            return False
 
         if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting + len(ahead) < self.maxCount \
-                and all([w[1].mode == 'counting' for w in ahead])
+            # Wants counting access; there must be room for the requester and
+            # every waiter ahead of it, all of which must be counting too.  Only
+            # the first (maxCount - num_counting) waiters can qualify, so we
+            # never look any further than that into the queue.
+            room = self.maxCount - num_counting
+            if requester not in self.waiting and len(self.waiting) >= room:
+                return False
+            for idx, (w_owner, w_access, d) in enumerate(self.waiting):
+                if idx >= room:
+                    return False
+                if w_owner == requester:
+                    return True
+                if w_access.mode != 'counting':
+                    return False
+            return len(self.waiting) < room
         else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0 and len(ahead) == 0
+            # Wants exclusive access; only the head of the queue qualifies
+            if num_counting > 0:
+                return False
+            head = self.waiting.head()
+            return head is None or head == requester
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
-        debuglog("%s claim(%s, %s)" % (self, owner, access.mode))
+        debuglog("%s claim(%s, %s)", self, owner, access.mode)
         assert owner is not None
         assert self.isAvailable(owner, access), "ask for isAvailable() first"
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        self.waiting.remove(owner)
         self.owners.append((owner, access))
-        debuglog(" %s is claimed '%s'" % (self, access.mode))
+        if access.mode == 'exclusive':
+            self._num_excl += 1
+        else:
+            self._num_counting += 1
+        debuglog(" %s is claimed '%s'", self, access.mode)
 
     def subscribeToReleases(self, callback):
         """Schedule C{callback} to be invoked every time this lock is
@@ -112,17 +204,22 @@ class BaseLock:
         """ Release the lock """
         assert isinstance(access, LockAccess)
 
-        debuglog("%s release(%s, %s)" % (self, owner, access.mode))
+        debuglog("%s release(%s, %s)", self, owner, access.mode)
         entry = (owner, access)
         if not entry in self.owners:
-            debuglog("%s already released" % self)
+            debuglog("%s already released", self)
             return
         self.owners.remove(entry)
+        if access.mode == 'exclusive':
+            self._num_excl -= 1
+        else:
+            self._num_counting -= 1
         # who can we wake up?
         # After an exclusive access, we may need to wake up several waiting.
         # Break out of the loop when the first waiting client should not be awakened.
         num_excl, num_counting = self._getOwnersCount()
-        for i, (w_owner, w_access, d) in enumerate(self.waiting):
+        woken = []
+        for w_owner, w_access, d in self.waiting:
             if w_access.mode == 'counting':
                 if num_excl > 0 or num_counting == self.maxCount:
                     break
@@ -135,11 +232,14 @@ class BaseLock:
                 else:
                     num_excl = num_excl + 1
 
-            # If the waiter has a deferred, wake it up and clear the deferred
-            # from the wait queue entry to indicate that it has been woken.
             if d:
-                self.waiting[i] = (w_owner, w_access, None)
-                eventually(d.callback, self)
+                woken.append((w_owner, w_access, d))
+
+        # If the waiter has a deferred, wake it up and clear the deferred
+        # from the wait queue entry to indicate that it has been woken.
+        for w_owner, w_access, d in woken:
+            self.waiting.put(w_owner, w_access, None)
+            eventually(d.callback, self)
 
         # notify any listeners
         self.release_subs.deliver()
@@ -151,25 +251,21 @@ class BaseLock:
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
         """
-        debuglog("%s waitUntilAvailable(%s)" % (self, owner))
+        debuglog("%s waitUntilAvailable(%s)", self, owner)
         assert isinstance(access, LockAccess)
         if self.isAvailable(owner, access):
             return defer.succeed(self)
         d = defer.Deferred()
 
-        # Are we already in the wait queue?
-        w = [i for i, w in enumerate(self.waiting) if w[0] == owner]
-        if w:
-            self.waiting[w[0]] = (owner, access, d)
-        else:
-            self.waiting.append((owner, access, d))
+        # if we are already in the wait queue, this keeps our position
+        self.waiting.put(owner, access, d)
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
-        debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
+        debuglog("%s stopWaitingUntilAvailable(%s)", self, owner)
         assert isinstance(access, LockAccess)
-        assert (owner, access, d) in self.waiting
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        assert self.waiting.get(owner) == (access, d)
+        self.waiting.remove(owner)
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
@@ -212,6 +308,243 @@ class RealSlaveLock:
         return self.locks[slavename]
 
 
+class RealDistributedLock:
+
+    """
+    A master lock shared by all masters using the same database.
+
+    Each owner or waiter on this master has a lease on the lock in the
+    database.  Leases are granted in FIFO order across all masters, following
+    the same counting/exclusive rules as L{BaseLock}.  While this master has
+    any leases, it polls the database every C{pollInterval} seconds to
+    refresh them, to find out which of its waiters have been granted the
+    lock, and to expire the leases of masters that have not refreshed theirs
+    for C{leaseTimeout} seconds.  It keeps polling while the last poll saw
+    leases held by other masters, so that C{isAvailable(None)} finds out when
+    they are released.
+
+    If another master expires the lease of an owner on this master, the
+    owner no longer holds the lock, and it is interrupted.
+    """
+
+    _reactor = reactor
+
+    def __init__(self, lockid):
+        self.name = lockid.name
+        self.maxCount = lockid.maxCount
+        self.pollInterval = lockid.pollInterval
+        self.leaseTimeout = lockid.leaseTimeout
+        self.description = "<DistributedMasterLock(%s, %s)>" % (self.name,
+                                                                self.maxCount)
+        self.master = None  # set by the botmaster
+
+        self.owners = []    # Current owners, tuples (owner, LockAccess)
+        self.waiting = {}   # Waiters, owner -> deferred
+        self.leases = {}    # owner -> [leaseid, LockAccess]; leaseid is None
+                            # until the lease is added to the database
+        self.granted = set()  # leaseids granted at the last poll
+        self.queue = []     # lease dicts of all masters, at the last poll
+
+        self._polling = False
+        self._pollAgain = False
+        self._pollTimer = None
+
+        # subscriptions to this lock being released
+        self.release_subs = subscription.SubscriptionPoint("%r releases"
+                                                           % (self,))
+
+    def __repr__(self):
+        return self.description
+
+    def getLock(self, slave):
+        return self
+
+    def isAvailable(self, requester, access):
+        """ Return a boolean whether the lock is available for claiming """
+        if requester is None:
+            # whether a build can start; answer whether a new lease would be
+            # granted, as far as we know from the last poll
+            pending = [dict(leaseid=None, mode=l[1].mode)
+                       for l in self.leases.itervalues() if l[0] is None]
+            new = dict(leaseid=object(), mode=access.mode)
+            return new['leaseid'] in self._grantLeases(
+                self.queue + pending + [new])
+        lease = self.leases.get(requester)
+        return lease is not None and lease[1] == access \
+            and lease[0] in self.granted
+
+    def claim(self, owner, access):
+        """ Claim the lock (lock must be available) """
+        debuglog("%s claim(%s, %s)", self, owner, access.mode)
+        assert owner is not None
+        assert self.isAvailable(owner, access), "ask for isAvailable() first"
+        self.waiting.pop(owner, None)
+        self.owners.append((owner, access))
+
+    def subscribeToReleases(self, callback):
+        """Schedule C{callback} to be invoked every time this lock is
+        released.  Returns a L{Subscription}."""
+        return self.release_subs.subscribe(callback)
+
+    def release(self, owner, access):
+        """ Release the lock """
+        debuglog("%s release(%s, %s)", self, owner, access.mode)
+        entry = (owner, access)
+        if not entry in self.owners:
+            debuglog("%s already released", self)
+            return
+        self.owners.remove(entry)
+        self._removeLease(owner)
+
+        # notify any listeners
+        self.release_subs.deliver()
+
+    def waitUntilMaybeAvailable(self, owner, access):
+        """Fire when the lock *might* be available, as for L{BaseLock}."""
+        debuglog("%s waitUntilAvailable(%s)", self, owner)
+        assert isinstance(access, LockAccess)
+        if self.isAvailable(owner, access):
+            return defer.succeed(self)
+        d = defer.Deferred()
+        self.waiting[owner] = d
+
+        lease = self.leases.get(owner)
+        if lease is not None and lease[1] != access:
+            self._removeLease(owner)
+            lease = None
+        if lease is None:
+            # the lease is added to the database by the next poll
+            self.leases[owner] = [None, access]
+            self._poll()
+        return d
+
+    def stopWaitingUntilAvailable(self, owner, access, d):
+        debuglog("%s stopWaitingUntilAvailable(%s)", self, owner)
+        assert isinstance(access, LockAccess)
+        assert self.waiting.get(owner) is d
+        del self.waiting[owner]
+        self._removeLease(owner)
+
+    def isOwner(self, owner, access):
+        return (owner, access) in self.owners
+
+    def _removeLease(self, owner):
+        lease = self.leases.pop(owner, None)
+        if lease is None or lease[0] is None:
+            return
+        leaseid = lease[0]
+        self.granted.discard(leaseid)
+        self.queue = [l for l in self.queue if l['leaseid'] != leaseid]
+        d = self.master.db.locks.removeLeases([leaseid])
+        # the lease may have been holding back others
+        d.addCallback(lambda _: self._poll())
+        d.addErrback(log.err, "while removing lease on %r" % (self,))
+
+    def _grantLeases(self, leases):
+        # walk the queue, granting leases the same way BaseLock.release wakes
+        # waiters
+        granted = set()
+        num_excl, num_counting = 0, 0
+        for lease in leases:
+            if lease['mode'] == 'counting':
+                if num_excl > 0 or num_counting == self.maxCount:
+                    break
+                num_counting += 1
+            else:
+                if num_excl > 0 or num_counting > 0:
+                    break
+                num_excl += 1
+            granted.add(lease['leaseid'])
+        return granted
+
+    def _poll(self):
+        if self._polling:
+            self._pollAgain = True
+            return
+        if self._pollTimer and self._pollTimer.active():
+            self._pollTimer.cancel()
+        self._pollTimer = None
+
+        self._polling = True
+        d = self._doPoll()
+        d.addErrback(log.err, "while polling %r" % (self,))
+
+        @d.addCallback
+        def done(_):
+            self._polling = False
+            if self._pollAgain:
+                self._pollAgain = False
+                self._poll()
+            elif self.leases or self.queue:
+                self._pollTimer = self._reactor.callLater(self.pollInterval,
+                                                          self._poll)
+
+    @defer.inlineCallbacks
+    def _doPoll(self):
+        db = self.master.db
+        objectid = yield self.master.getObjectId()
+
+        # add new leases; all leases are added here, so that the list fetched
+        # below always includes them
+        for owner, lease in self.leases.items():
+            if lease[0] is not None:
+                continue
+            leaseid = yield db.locks.addLease(self.name, objectid,
+                                              lease[1].mode,
+                                              _reactor=self._reactor)
+            if self.leases.get(owner) is lease:
+                lease[0] = leaseid
+            else:
+                # no longer waiting
+                yield db.locks.removeLeases([leaseid])
+
+        leaseids = [l[0] for l in self.leases.itervalues()
+                    if l[0] is not None]
+        yield db.locks.refreshLeases(leaseids, _reactor=self._reactor)
+        yield db.locks.expireLeases(self.name, self.leaseTimeout,
+                                    _reactor=self._reactor)
+        leases = yield db.locks.getLeases(self.name)
+        current = set([l['leaseid'] for l in leases])
+        released = [l for l in self.queue if l['leaseid'] not in current]
+        self.queue = leases
+        self.granted = self._grantLeases(leases)
+
+        for owner, lease in self.leases.items():
+            if lease[0] is None or lease[0] in current:
+                continue
+            # another master expired this lease, because we did not refresh
+            # it in time
+            if owner in self.waiting:
+                log.msg("%r: lease for %r expired; requeueing" % (self, owner))
+                lease[0] = None
+                self._pollAgain = True
+            else:
+                log.msg("%r: lease for %r, which owns the lock, expired; "
+                        "interrupting it" % (self, owner))
+                del self.leases[owner]
+                self._interruptOwner(owner)
+
+        for owner, d in self.waiting.items():
+            lease = self.leases.get(owner)
+            if lease and lease[0] in self.granted:
+                del self.waiting[owner]
+                eventually(d.callback, self)
+
+        if released:
+            # other masters released leases; let anything that checked
+            # isAvailable(None) try again
+            self.release_subs.deliver()
+
+    def _interruptOwner(self, owner):
+        # owners are builds or steps; either way, stop what they are doing,
+        # since another master may now hold the lock
+        reason = "lease on %s expired" % (self.description,)
+        if hasattr(owner, 'stopBuild'):
+            eventually(owner.stopBuild, reason)
+        elif hasattr(owner, 'interrupt'):
+            eventually(owner.interrupt, reason)
+
+
 class LockAccess(util.ComparableMixin):
 
     """ I am an object representing a way to access a lock.
@@ -319,3 +652,28 @@ class SlaveLock(BaseLockId):
         self._maxCountForSlaveList = self.maxCountForSlave.items()
         self._maxCountForSlaveList.sort()
         self._maxCountForSlaveList = tuple(self._maxCountForSlaveList)
+
+
+class DistributedMasterLock(MasterLock):
+
+    """I am a MasterLock that is shared by all masters using the same database.
+
+    Builds and BuildSteps on every master queue for me in the database, in
+    the order they asked for me.  Each master refreshes the leases of its
+    owners and waiters every pollInterval seconds, and the leases of a master
+    that stops doing so are expired after leaseTimeout seconds, so a master
+    that dies does not keep the lock forever.
+
+    Use this to protect a resource that is shared among several masters, for
+    example a license server or a deployment target.  All masters must
+    configure the lock with the same name and maxCount.
+    """
+
+    compare_attrs = ['name', 'maxCount', 'pollInterval', 'leaseTimeout']
+    lockClass = RealDistributedLock
+
+    def __init__(self, name, maxCount=1, pollInterval=10, leaseTimeout=120):
+        MasterLock.__init__(self, name, maxCount)
+        assert leaseTimeout > pollInterval
+        self.pollInterval = pollInterval
+        self.leaseTimeout = leaseTimeout
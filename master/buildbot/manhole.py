@@ -164,6 +164,8 @@ class _BaseManhole(service.MultiService):
                 'master': master,
                 'status': master.getStatus(),
                 'show': show,
+                'blockers': lambda n=5, profile=False:
+                    blockers(master, n, profile),
             }
             return namespace
 
@@ -340,3 +342,13 @@ def show(x):
             v = str(t)
         print "%*s : %s" % (maxlen, k, v)
     return x
+
+
+def blockers(master, n=5, profile=False):
+    """Display the stacks most often seen blocking the reactor or, with
+    profile=True, sampled by the profiler"""
+    detector = master.metrics.stallDetector
+    if not detector:
+        print "the reactor stall detector is not enabled; see c['metrics']"
+        return
+    print detector.report(n, profile)
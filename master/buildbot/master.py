@@ -178,6 +178,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         _reactor.callWhenRunning(d.callback, None)
         yield d
 
+        # time each phase of the startup, as well as the whole
+        startup_timer = metrics.Timer("BuildMaster.startup")
+        startup_timer.start()
+        timer = metrics.Timer("BuildMaster.startup.loadConfig")
+        timer.start()
+
         try:
             # load the configuration file, treating errors as fatal
             try:
@@ -196,14 +202,19 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 _reactor.stop()
                 return
 
+            timer.stop()
+
             # set up services that need access to the config before everything else
             # gets told to reconfig
+            timer = metrics.Timer("BuildMaster.startup.setupDatabase")
+            timer.start()
             try:
                 yield self.db.setup()
             except connector.DatabaseNotReadyError:
                 # (message was already logged)
                 _reactor.stop()
                 return
+            timer.stop()
 
             if hasattr(signal, "SIGHUP"):
                 def sighup(*args):
@@ -221,12 +232,16 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
             # give all services a chance to load the new configuration, rather than
             # the base configuration
+            timer = metrics.Timer("BuildMaster.startup.reconfigService")
+            timer.start()
             yield self.reconfigService(self.config)
+            timer.stop()
         except:
             f = failure.Failure()
             log.err(f, 'while starting BuildMaster')
             _reactor.stop()
 
+        startup_timer.stop()
         log.msg("BuildMaster is running")
 
     @defer.inlineCallbacks
@@ -433,6 +448,88 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         metrics.MetricCountEvent.log("added_changes", 1)
 
+        chdict = self._prepareChange(who=who, files=files, comments=comments,
+                                     author=author, isdir=isdir, is_dir=is_dir,
+                                     revision=revision, when=when,
+                                     when_timestamp=when_timestamp,
+                                     branch=branch, category=category,
+                                     revlink=revlink, properties=properties,
+                                     repository=repository, codebase=codebase,
+                                     project=project)
+
+        d = defer.succeed(None)
+        if src:
+            # create user object, returning a corresponding uid
+            d.addCallback(lambda _: users.createUserObject(
+                self, chdict['author'], src))
+
+        # add the Change to the database
+        d.addCallback(lambda uid:
+                      self.db.changes.addChange(uid=uid, **chdict))
+
+        # convert the changeid to a Change instance
+        d.addCallback(self._getNewChange)
+
+        def notify(change):
+            self._notifyNewChanges([change])
+            return change
+        d.addCallback(notify)
+        return d
+
+    @defer.inlineCallbacks
+    def addChanges(self, changelist):
+        """
+        Add several changes to the buildmaster and act on them.
+
+        The changes are added to the database in a single transaction, and
+        only announced once all of them are there, in order.  This is more
+        efficient than calling L{addChange} for each change when many changes
+        arrive at once, e.g., from a large push.
+
+        @param changelist: the changes to add, each as a dictionary of
+        L{addChange} keyword arguments (including C{src})
+        @type changelist: list of dictionaries
+
+        @returns: list of L{Change} instances via Deferred
+        """
+        metrics.MetricCountEvent.log("added_changes", len(changelist))
+
+        chdicts = []
+        # a push usually has few distinct authors, so look each one up once
+        uids = {}
+        for kwargs in changelist:
+            kwargs = kwargs.copy()
+            src = kwargs.pop('src', None)
+            chdict = self._prepareChange(**kwargs)
+            chdict['uid'] = None
+            if src:
+                key = (chdict['author'], src)
+                if key not in uids:
+                    uids[key] = yield users.createUserObject(
+                        self, chdict['author'], src)
+                chdict['uid'] = uids[key]
+            chdicts.append(chdict)
+
+        changeids = yield self.db.changes.addChanges(chdicts)
+
+        # read the new changes back in one go, rather than one at a time
+        newchdicts = yield self.db.changes.getChangesById(changeids)
+        newchanges = []
+        for chdict in newchdicts:
+            change = yield changes.Change.fromChdict(self, chdict)
+            newchanges.append(change)
+
+        self._notifyNewChanges(newchanges)
+        defer.returnValue(newchanges)
+
+    def _prepareChange(self, who=None, files=None, comments=None, author=None,
+                       isdir=None, is_dir=None, revision=None, when=None,
+                       when_timestamp=None, branch=None, category=None,
+                       revlink='', properties={}, repository='', codebase=None,
+                       project=''):
+        # translate the arguments of addChange into those of
+        # db.changes.addChange, apart from uid
+
         # handle translating deprecated names into new names for db.changes
         def handle_deprec(oldname, old, newname, new, default=None,
                           converter=lambda x: x):
@@ -458,58 +555,44 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         for n in properties:
             properties[n] = (properties[n], 'Change')
 
+        chdict = {
+            'author': author,
+            'files': files,
+            'comments': comments,
+            'is_dir': is_dir,
+            'revision': revision,
+            'when_timestamp': when_timestamp,
+            'branch': branch,
+            'category': category,
+            'revlink': revlink,
+            'properties': properties,
+            'repository': repository,
+            'project': project,
+        }
+
         if codebase is None:
             if self.config.codebaseGenerator is not None:
-                chdict = {
-                    'changeid': None,
-                    'author': author,
-                    'files': files,
-                    'comments': comments,
-                    'is_dir': is_dir,
-                    'revision': revision,
-                    'when_timestamp': when_timestamp,
-                    'branch': branch,
-                    'category': category,
-                    'revlink': revlink,
-                    'properties': properties,
-                    'repository': repository,
-                    'project': project,
-                }
-                codebase = self.config.codebaseGenerator(chdict)
+                codebase = self.config.codebaseGenerator(
+                    dict(chdict, changeid=None))
             else:
                 codebase = ''
+        chdict['codebase'] = codebase
+        return chdict
 
-        d = defer.succeed(None)
-        if src:
-            # create user object, returning a corresponding uid
-            d.addCallback(lambda _: users.createUserObject(self, author, src))
-
-        # add the Change to the database
-        d.addCallback(lambda uid:
-                      self.db.changes.addChange(author=author, files=files,
-                                                comments=comments, is_dir=is_dir,
-                                                revision=revision,
-                                                when_timestamp=when_timestamp,
-                                                branch=branch, category=category,
-                                                revlink=revlink, properties=properties,
-                                                repository=repository, codebase=codebase,
-                                                project=project, uid=uid))
-
-        # convert the changeid to a Change instance
-        d.addCallback(lambda changeid:
-                      self.db.changes.getChange(changeid))
+    def _getNewChange(self, changeid):
+        d = self.db.changes.getChange(changeid)
         d.addCallback(lambda chdict:
                       changes.Change.fromChdict(self, chdict))
+        return d
 
-        def notify(change):
+    def _notifyNewChanges(self, newchanges):
+        for change in newchanges:
             msg = u"added change %s to database" % change
             log.msg(msg.encode('utf-8', 'replace'))
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
+        # only deliver messages immediately if we're not polling
+        if not self.config.db['db_poll_interval']:
+            for change in newchanges:
                 self._change_subs.deliver(change)
-            return change
-        d.addCallback(notify)
-        return d
 
     def subscribeToChanges(self, callback):
         """
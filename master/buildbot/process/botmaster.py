@@ -29,6 +29,7 @@ from buildbot import util
 from buildbot.process import metrics
 from buildbot.process.builder import Builder
 from buildbot.process.buildrequestdistributor import BuildRequestDistributor
+from buildbot.util import eventual
 
 
 class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
@@ -39,6 +40,10 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     debug = 0
 
+    # number of builders and slaves to reconfigure before letting the reactor
+    # run
+    reconfig_chunk_size = 100
+
     def __init__(self, master):
         service.MultiService.__init__(self)
         self.setName("botmaster")
@@ -49,6 +54,11 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # builders maps Builder names to instances of bb.p.builder.Builder,
         # which is the master-side object that defines and controls a build.
 
+        # maps slavename to the builders configured to use that slave; built
+        # on demand, and discarded whenever builders or their slavenames
+        # change
+        self._builders_by_slave = None
+
         # self.slaves contains a ready BuildSlave instance for each
         # potential buildslave, i.e. all the ones listed in the config file.
         # If the slave is connected, self.slaves[slavename].slave will
@@ -137,8 +147,20 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     @metrics.countMethod('BotMaster.getBuildersForSlave()')
     def getBuildersForSlave(self, slavename):
-        return [b for b in self.builders.values()
-                if slavename in b.config.slavenames]
+        by_slave = self._builders_by_slave
+        if by_slave is None or by_slave[0] is not self.builders \
+                or by_slave[1] != len(self.builders):
+            index = {}
+            for b in self.builders.values():
+                for sn in b.config.slavenames:
+                    index.setdefault(sn, []).append(b)
+            by_slave = self._builders_by_slave = \
+                (self.builders, len(self.builders), index)
+        return by_slave[2].get(slavename, [])[:]
+
+    def builderConfigChanged(self, builder):
+        """Called by a builder when its configuration has changed"""
+        self._builders_by_slave = None
 
     def getBuildernames(self):
         return self.builderNames
@@ -161,12 +183,22 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # reconfigure slaves
         yield self.reconfigServiceSlaves(new_config)
 
-        # reconfigure builders
-        yield self.reconfigServiceBuilders(new_config)
-
-        # call up
-        yield config.ReconfigurableServiceMixin.reconfigService(self,
-                                                                new_config)
+        # reconfigure builders; this also configures the new builders
+        added = yield self.reconfigServiceBuilders(new_config)
+
+        # reconfigure the builders and slaves themselves, as
+        # ReconfigurableServiceMixin would, but in chunks; a master with
+        # thousands of them would otherwise block the reactor for the whole
+        # reconfig.  Every builder already has a config by now.
+        added = set(added)
+        children = [svc for svc in self
+                    if isinstance(svc, config.ReconfigurableServiceMixin)
+                    and svc not in added]
+        children.sort(key=lambda svc: -svc.reconfig_priority)
+        for i, svc in enumerate(children):
+            if i and i % self.reconfig_chunk_size == 0:
+                yield eventual.fireEventually()
+            yield svc.reconfigService(new_config)
 
         # try to start a build for every builder; this is necessary at master
         # startup, and a good idea in any other case
@@ -228,6 +260,7 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     @defer.inlineCallbacks
     def reconfigServiceBuilders(self, new_config):
+        # returns the builders added, which are already configured
 
         timer = metrics.Timer("BotMaster.reconfigServiceBuilders")
         timer.start()
@@ -244,6 +277,7 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # calculate new builders, by name, and removed builders
         removed_names, added_names = util.diffSets(old_set, new_set)
 
+        added = []
         if removed_names or added_names:
             log.msg("adding %d new builders, removing %d" %
                     (len(added_names), len(removed_names)))
@@ -260,18 +294,33 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
             for n in added_names:
                 builder = Builder(n)
-                self.builders[n] = builder
-
                 builder.botmaster = self
                 builder.master = self.master
                 builder.setServiceParent(self)
+                added.append(builder)
+
+            # load the saved status of all of the new builders in parallel
+            status_timer = metrics.Timer("BotMaster.loadBuilderStatus")
+            status_timer.start()
+            yield defer.gatherResults([
+                b.loadStatus(new_by_name[b.name]) for b in added])
+            status_timer.stop()
+
+            # configure the new builders before anything else can see them,
+            # so that all builders in self.builders have a config even while
+            # the reactor runs during the rest of the reconfig
+            for builder in added:
+                yield builder.reconfigService(new_config)
+                self.builders[builder.name] = builder
 
         self.builderNames = self.builders.keys()
+        self._builders_by_slave = None
 
         metrics.MetricCountEvent.log("num_builders",
                                      len(self.builders), absolute=True)
 
         timer.stop()
+        defer.returnValue(added)
 
     def stopService(self):
         if self.buildrequest_sub:
@@ -285,11 +334,14 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
     def getLockByID(self, lockid):
         """Convert a Lock identifier into an actual Lock instance.
         @param lockid: a locks.MasterLock or locks.SlaveLock instance
-        @return: a locks.RealMasterLock or locks.RealSlaveLock instance
+        @return: a locks.RealMasterLock, locks.RealSlaveLock or
+                 locks.RealDistributedLock instance
         """
         assert isinstance(lockid, (locks.MasterLock, locks.SlaveLock))
         if not lockid in self.locks:
-            self.locks[lockid] = lockid.lockClass(lockid)
+            lock = self.locks[lockid] = lockid.lockClass(lockid)
+            if isinstance(lockid, locks.DistributedMasterLock):
+                lock.master = self.master
         # if the master.cfg file has changed maxCount= on the lock, the next
         # time a build is started, they'll get a new RealLock instance. Note
         # that this requires that MasterLock and SlaveLock (marker) instances
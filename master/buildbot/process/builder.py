@@ -73,7 +73,10 @@ class Builder(config.ReconfigurableServiceMixin,
         # Build is about to start, to make sure that they're still alive.
         self.slaves = []
 
+        self.botmaster = None
         self.config = None
+        # the settings last applied by reconfigService; see _configDigest
+        self.config_digest = None
         self.builder_status = None
 
         if _addServices:
@@ -86,23 +89,44 @@ class Builder(config.ReconfigurableServiceMixin,
                                                              self.updateBigStatus)
             self.updateStatusService.setServiceParent(self)
 
+    def loadStatus(self, builder_config):
+        """Set up this builder's status object, reading any saved status from
+        disk without blocking the reactor.  The botmaster calls this for all
+        new builders at once, before reconfiguring them."""
+        d = self.master.status.loadBuilder(
+            builder_config.name,
+            builder_config.builddir,
+            builder_config.category,
+            builder_config.description)
+
+        def set_status(builder_status):
+            self.builder_status = builder_status
+        d.addCallback(set_status)
+        return d
+
+    @defer.inlineCallbacks
     def reconfigService(self, new_config):
         # find this builder in the config
-        for builder_config in new_config.builders:
-            if builder_config.name == self.name:
-                break
-        else:
-            assert 0, "no config found for builder '%s'" % self.name
+        builder_config = new_config.getBuilderConfig(self.name)
+        assert builder_config, "no config found for builder '%s'" % self.name
 
         # set up a builder status object on the first reconfig
         if not self.builder_status:
-            self.builder_status = self.master.status.builderAdded(
-                builder_config.name,
-                builder_config.builddir,
-                builder_config.category,
-                builder_config.description)
+            yield self.loadStatus(builder_config)
 
+        # the builder reads most of its configuration (factory, locks,
+        # nextSlave, ..) from self.config as it needs it, so adopting the new
+        # config is all that is required unless the settings applied below
+        # have changed, which most reconfigs leave alone
         self.config = builder_config
+        config_digest = self._configDigest(builder_config, new_config)
+        if config_digest == self.config_digest:
+            return
+        old_digest, self.config_digest = self.config_digest, config_digest
+
+        if old_digest is None or old_digest[0] != config_digest[0]:
+            if self.botmaster:
+                self.botmaster.builderConfigChanged(self)
 
         self.builder_status.setDescription(builder_config.description)
         self.builder_status.setCategory(builder_config.category)
@@ -115,7 +139,14 @@ class Builder(config.ReconfigurableServiceMixin,
         self.slaves = [s for s in self.slaves
                        if s.slave.slavename in new_slavenames]
 
-        return defer.succeed(None)
+    def _configDigest(self, builder_config, new_config):
+        # the settings that reconfigService applies to the builder and its
+        # status; comparing these is much cheaper than comparing the whole
+        # config, which includes the factory and all of its steps
+        return (tuple(builder_config.slavenames),
+                builder_config.category,
+                builder_config.description,
+                new_config.caches['Builds'])
 
     def stopService(self):
         d = defer.maybeDeferred(lambda:
@@ -54,6 +54,7 @@ class RemoteCommand(pb.Referenceable):
     active = False
     rc = None
     debug = False
+    _logBatch = None
 
     def __init__(self, remote_command, args, ignore_updates=False,
                  collectStdout=False, collectStderr=False, decodeRC={0: SUCCESS}):
@@ -182,20 +183,38 @@ class RemoteCommand(pb.Referenceable):
         """
         self.buildslave.messageReceivedFromSlave()
         max_updatenum = 0
+        # the output from all of the updates is added to each log in a single
+        # batch, once the updates have been processed
+        self._logBatch = []
         for (update, num) in updates:
             #log.msg("update[%d]:" % num)
             try:
                 if self.active and not self.ignore_updates:
                     self.remoteUpdate(update)
             except:
-                # log failure, terminate build, let slave retire the update
-                self._finished(Failure())
+                # log failure, terminate build, let slave retire the update;
+                # the output received so far goes to the logs before they are
+                # closed
+                failure = Failure()
+                self._flushLogBatch()
+                self._finished(failure)
                 # TODO: what if multiple updates arrive? should
                 # skip the rest but ack them all
             if num > max_updatenum:
                 max_updatenum = num
+        failure = self._flushLogBatch()
+        if failure and self.active:
+            self._finished(failure)
         return max_updatenum
 
+    def _flushLogBatch(self):
+        batch, self._logBatch = self._logBatch, None
+        try:
+            for loog, entries in batch or []:
+                loog.addEntries(entries)
+        except:
+            return Failure()
+
     def remote_complete(self, failure=None):
         """
         Called by the slave's L{buildbot.slave.bot.SlaveBuilder} to
@@ -214,19 +233,36 @@ class RemoteCommand(pb.Referenceable):
 
     def addStdout(self, data):
         if 'stdio' in self.logs:
-            self.logs['stdio'].addStdout(data)
+            self._addLogEntry(self.logs['stdio'],
+                              interfaces.LOG_CHANNEL_STDOUT, data)
         if self.collectStdout:
             self.stdout += data
 
     def addStderr(self, data):
         if 'stdio' in self.logs:
-            self.logs['stdio'].addStderr(data)
+            self._addLogEntry(self.logs['stdio'],
+                              interfaces.LOG_CHANNEL_STDERR, data)
         if self.collectStderr:
             self.stderr += data
 
     def addHeader(self, data):
         if 'stdio' in self.logs:
-            self.logs['stdio'].addHeader(data)
+            self._addLogEntry(self.logs['stdio'],
+                              interfaces.LOG_CHANNEL_HEADER, data)
+
+    _channelMethods = {interfaces.LOG_CHANNEL_STDOUT: 'addStdout',
+                       interfaces.LOG_CHANNEL_STDERR: 'addStderr',
+                       interfaces.LOG_CHANNEL_HEADER: 'addHeader'}
+
+    def _addLogEntry(self, loog, channel, data):
+        if self._logBatch is None or not hasattr(loog, 'addEntries'):
+            getattr(loog, self._channelMethods[channel])(data)
+            return
+        for batched, entries in self._logBatch:
+            if batched is loog:
+                entries.append((channel, data))
+                return
+        self._logBatch.append((loog, [(channel, data)]))
 
     def addToLog(self, logname, data):
         # Activate delayed logs on first data.
@@ -238,7 +274,8 @@ class RemoteCommand(pb.Referenceable):
             self._closeWhenFinished[logname] = closeWhenFinished
 
         if logname in self.logs:
-            self.logs[logname].addStdout(data)
+            self._addLogEntry(self.logs[logname],
+                              interfaces.LOG_CHANNEL_STDOUT, data)
         else:
             log.msg("%s.addToLog: no such log %s" % (self, logname))
 
@@ -260,6 +297,19 @@ class RemoteCommand(pb.Referenceable):
             # 'log': (logname, data)
             logname, data = update['log']
             self.addToLog(logname, data)
+        if "segments" in update:
+            # 'segments': [(logname, data), ..] in the order the data was
+            # produced, where logname is 'stdout', 'stderr', 'header' or
+            # ('log', logname)
+            for logname, data in update['segments']:
+                if logname == 'stdout':
+                    self.addStdout(data)
+                elif logname == 'stderr':
+                    self.addStderr(data)
+                elif logname == 'header':
+                    self.addHeader(data)
+                else:
+                    self.addToLog(logname[1], data)
         if "rc" in update:
             rc = self.rc = update['rc']
             log.msg("%s rc=%s" % (self, rc))
@@ -269,7 +319,7 @@ class RemoteCommand(pb.Referenceable):
 
         # TODO: these should be handled at the RemoteCommand level
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc', 'segments'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
@@ -44,8 +44,13 @@ from twisted.internet.task import LoopingCall
 from twisted.python import log
 
 import gc
+import math
 import os
+import re
 import sys
+import thread
+import threading
+import time
 # Make use of the resource module if we can
 try:
     import resource
@@ -63,10 +68,11 @@ class MetricEvent(object):
 
 class MetricCountEvent(MetricEvent):
 
-    def __init__(self, counter, count=1, absolute=False):
+    def __init__(self, counter, count=1, absolute=False, labels=None):
         self.counter = counter
         self.count = count
         self.absolute = absolute
+        self.labels = labels
 
 
 class MetricTimeEvent(MetricEvent):
@@ -75,6 +81,15 @@ class MetricTimeEvent(MetricEvent):
         self.timer = timer
         self.elapsed = elapsed
 
+
+class MetricDBQueryEvent(MetricEvent):
+
+    def __init__(self, method, wait, elapsed, rows):
+        self.method = method
+        self.wait = wait
+        self.elapsed = elapsed
+        self.rows = rows
+
 ALARM_OK, ALARM_WARN, ALARM_CRIT = range(3)
 ALARM_TEXT = ["OK", "WARN", "CRIT"]
 
@@ -174,6 +189,50 @@ class AveragingFiniteList(FiniteList):
         return self.average
 
 
+class Histogram(object):
+
+    """
+    A histogram of timings, in logarithmically sized buckets.  Quantiles are
+    estimated from the bucket counts, so no samples are kept; the estimate is
+    within a factor of C{GROWTH} of the true value.
+    """
+
+    # bucket i counts the values in (MIN * GROWTH ** (i-1), MIN * GROWTH ** i];
+    # bucket 0 counts everything up to MIN
+    MIN = 1e-6
+    GROWTH = 1.1
+    _logGrowth = math.log(GROWTH)
+
+    def __init__(self):
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= self.MIN:
+            self.buckets[0] += 1
+        else:
+            self.buckets[int(math.ceil(
+                math.log(value / self.MIN) / self._logGrowth))] += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                break
+        # the upper bound of the bucket, but never more than was seen
+        return min(self.MIN * self.GROWTH ** i, self.max)
+
+
 class MetricHandler(object):
 
     def __init__(self, metrics):
@@ -207,18 +266,31 @@ class MetricHandler(object):
     def asDict(self):
         raise NotImplementedError
 
+    def exposition(self):
+        # lines of Prometheus text exposition format; handlers with nothing
+        # to export may leave this alone
+        return []
+
 
 class MetricCountHandler(MetricHandler):
     _counters = None
+    _labelled = None
 
     def reset(self):
         self._counters = defaultdict(int)
+        self._labelled = defaultdict(int)
 
     def handle(self, eventDict, metric):
+        if metric.labels:
+            key = (metric.counter, tuple(sorted(metric.labels.iteritems())))
+            counters = self._labelled
+        else:
+            key = metric.counter
+            counters = self._counters
         if metric.absolute:
-            self._counters[metric.counter] = metric.count
+            counters[key] = metric.count
         else:
-            self._counters[metric.counter] += metric.count
+            counters[key] += metric.count
 
     def keys(self):
         return self._counters.keys()
@@ -226,6 +298,15 @@ class MetricCountHandler(MetricHandler):
     def get(self, counter):
         return self._counters[counter]
 
+    def getLabelled(self, counter):
+        """
+        Return a dictionary mapping the label values seen for C{counter}, as
+        sorted tuples of (name, value) pairs, to their counts.
+        """
+        return dict((labels, count)
+                    for (c, labels), count in self._labelled.iteritems()
+                    if c == counter)
+
     def report(self):
         retval = []
         for counter in sorted(self.keys()):
@@ -238,15 +319,31 @@ class MetricCountHandler(MetricHandler):
             retval[counter] = self.get(counter)
         return dict(counters=retval)
 
+    def exposition(self):
+        lines = ["# TYPE buildbot_counter gauge"]
+        for counter in sorted(self.keys()):
+            lines.append("buildbot_counter{%s} %s"
+                         % (_labels(counter=counter), self.get(counter)))
+        for (counter, labels), count in sorted(self._labelled.items()):
+            lines.append("buildbot_counter{%s} %s"
+                         % (_labels(labels, counter=counter), count))
+        return lines
+
 
 class MetricTimeHandler(MetricHandler):
     _timers = None
+    _histograms = None
+
+    # quantiles given in the exposition
+    quantiles = (0.5, 0.9, 0.99)
 
     def reset(self):
         self._timers = defaultdict(AveragingFiniteList)
+        self._histograms = defaultdict(Histogram)
 
     def handle(self, eventDict, metric):
         self._timers[metric.timer].append(metric.elapsed)
+        self._histograms[metric.timer].add(metric.elapsed)
 
     def keys(self):
         return self._timers.keys()
@@ -254,6 +351,9 @@ class MetricTimeHandler(MetricHandler):
     def get(self, timer):
         return self._timers[timer].average
 
+    def getHistogram(self, timer):
+        return self._histograms[timer]
+
     def report(self):
         retval = []
         for timer in sorted(self.keys()):
@@ -266,6 +366,95 @@ class MetricTimeHandler(MetricHandler):
             retval[timer] = self.get(timer)
         return dict(timers=retval)
 
+    def exposition(self):
+        lines = ["# TYPE buildbot_timer_seconds summary"]
+        for timer in sorted(self.keys()):
+            lines.extend(_summary('buildbot_timer_seconds',
+                                  self.getHistogram(timer), self.quantiles,
+                                  timer=timer))
+        return lines
+
+
+class MetricDBQueryHandler(MetricHandler):
+
+    """
+    Aggregates the database queries made through the DB thread pool, by the
+    connector method that made them: the number of queries, the time spent
+    waiting for a pool thread and executing, and the rows returned.
+    """
+
+    _queries = None
+    _wait = None
+    _elapsed = None
+
+    quantiles = MetricTimeHandler.quantiles
+
+    def reset(self):
+        # method -> [queries, wait, elapsed, rows]
+        self._queries = {}
+        self._wait = Histogram()
+        self._elapsed = defaultdict(Histogram)
+
+    def handle(self, eventDict, metric):
+        try:
+            q = self._queries[metric.method]
+        except KeyError:
+            q = self._queries[metric.method] = [0, 0, 0, 0]
+        q[0] += 1
+        q[1] += metric.wait
+        q[2] += metric.elapsed
+        q[3] += metric.rows
+        self._wait.add(metric.wait)
+        self._elapsed[metric.method].add(metric.elapsed)
+
+    def keys(self):
+        return self._queries.keys()
+
+    def get(self, method):
+        queries, wait, elapsed, rows = self._queries[method]
+        return dict(queries=queries, wait=wait, elapsed=elapsed, rows=rows)
+
+    def getWaitHistogram(self):
+        return self._wait
+
+    def getHistogram(self, method):
+        return self._elapsed[method]
+
+    def report(self):
+        retval = []
+        for method in sorted(self.keys()):
+            q = self.get(method)
+            retval.append("Query %s: %d queries, %.3gs waiting, "
+                          "%.3gs executing, %d rows"
+                          % (method, q['queries'], q['wait'], q['elapsed'],
+                             q['rows']))
+        return "\n".join(retval)
+
+    def asDict(self):
+        retval = {}
+        for method in self.keys():
+            retval[method] = self.get(method)
+        return dict(queries=retval)
+
+    def exposition(self):
+        lines = []
+        methods = sorted(self.keys())
+        for name, i in [('queries', 0), ('rows', 3)]:
+            lines.append("# TYPE buildbot_db_%s_total counter" % name)
+            for method in methods:
+                lines.append("buildbot_db_%s_total{%s} %d"
+                             % (name, _labels(method=method),
+                                self._queries[method][i]))
+        lines.append("# TYPE buildbot_db_wait_seconds summary")
+        lines.extend(_summary('buildbot_db_wait_seconds', self._wait,
+                              self.quantiles))
+        lines.append("# TYPE buildbot_db_execute_seconds summary")
+        for method in methods:
+            lines.extend(_summary('buildbot_db_execute_seconds',
+                                  self._elapsed[method], self.quantiles,
+                                  method=method))
+        return lines
+
 
 class MetricAlarmHandler(MetricHandler):
     _alarms = None
@@ -291,6 +480,42 @@ class MetricAlarmHandler(MetricHandler):
             retval[alarm] = (ALARM_TEXT[level], msg)
         return dict(alarms=retval)
 
+    def exposition(self):
+        lines = ["# TYPE buildbot_alarm_level gauge"]
+        for alarm, (level, msg) in sorted(self._alarms.items()):
+            lines.append("buildbot_alarm_level{%s} %d"
+                         % (_labels(alarm=alarm), level))
+        return lines
+
+
+def _summary(name, histogram, quantiles, **labels):
+    # the lines of a Prometheus summary for the histogram
+    lines = []
+    for q in quantiles:
+        value = histogram.quantile(q)
+        if value is None:
+            value = 'NaN'
+        else:
+            value = repr(float(value))
+        lines.append("%s{%s} %s" % (name, _labels(quantile=q, **labels),
+                                    value))
+    labels = _labels(**labels)
+    if labels:
+        labels = "{%s}" % labels
+    lines.append("%s_sum%s %r" % (name, labels, float(histogram.sum)))
+    lines.append("%s_count%s %d" % (name, labels, histogram.count))
+    return lines
+
+
+def _labels(pairs=(), **kwargs):
+    # format a Prometheus label set; the label names are sanitized and the
+    # values escaped
+    pairs = list(pairs) + sorted(kwargs.items())
+    return ",".join('%s="%s"' % (re.sub(r'[^a-zA-Z0-9_]', '_', str(name)),
+                                 str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in pairs)
+
 
 class PollerWatcher(object):
 
@@ -402,6 +627,181 @@ def periodicCheck(_reactor=reactor):
         log.err(None, "while collecting VM metrics")
 
 
+class StallDetector(object):
+
+    """
+    Watch for the reactor being blocked.  A heartbeat in the reactor thread
+    records the time every C{threshold / 4} seconds, and a watchdog thread
+    samples the reactor thread's Python stack whenever the heartbeat is more
+    than C{threshold} seconds late.  The samples are aggregated by stack, so
+    the most common blockers can be listed.
+
+    With C{profileInterval}, the watchdog also samples the reactor thread's
+    stack every C{profileInterval} seconds whether or not it is blocked, as a
+    low-rate sampling profiler.
+
+    At most C{maxStacks} distinct stacks are kept for each of these; when a
+    new stack arrives, the least sampled one is dropped.  Likewise, only the
+    first C{maxStacks} innermost frames get their own label in the
+    C{reactorStall.blocker} counter; the rest are counted as C{'other'}.
+    """
+
+    # deepest stack frames kept for each sample
+    maxDepth = 30
+
+    # most distinct stacks kept for the blockers and the profile
+    maxStacks = 100
+
+    # the clock shared by both threads
+    _time = time.time
+
+    def __init__(self, threshold, profileInterval=None, _reactor=reactor):
+        self.threshold = threshold
+        self.profileInterval = profileInterval
+        self.beatInterval = threshold / 4.0
+        self._reactor = _reactor
+
+        self.stalls = 0
+        # samples taken while the reactor was blocked, and by the profiler,
+        # keyed by stack; both are updated by the watchdog thread
+        self.blockers = defaultdict(int)
+        self.profile = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stallStack = None
+        # frames used as labels for the reactorStall.blocker counter
+        self._blockerLabels = set()
+
+        self._lastBeat = None
+        self._nextProfile = None
+        self._heartbeat = None
+        self._watchdog = None
+        self._stopping = None
+
+    def start(self):
+        # the reactor thread is the one we're started in
+        self._reactorThread = thread.get_ident()
+        self._lastBeat = self._time()
+        if self.profileInterval:
+            self._nextProfile = self._lastBeat + self.profileInterval
+        self._heartbeat = LoopingCall(self._beat)
+        self._heartbeat.clock = self._reactor
+        self._heartbeat.start(self.beatInterval, now=False)
+
+        self._stopping = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name='reactor stall detector')
+        self._watchdog.setDaemon(True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._heartbeat:
+            self._heartbeat.stop()
+            self._heartbeat = None
+        if self._watchdog:
+            self._stopping.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _beat(self):
+        now = self._time()
+        stalled = now - self._lastBeat - self.beatInterval
+        self._lastBeat = now
+        if stalled < self.threshold:
+            return
+
+        with self._lock:
+            stack, self._stallStack = self._stallStack, None
+        self.stalls += 1
+        MetricTimeEvent.log('reactorStall', stalled)
+        if not stack:
+            # the watchdog didn't get a look at it
+            log.msg("reactor was blocked for %.1fs" % stalled)
+            return
+        frame = stack[-1]
+        if frame not in self._blockerLabels:
+            if len(self._blockerLabels) < self.maxStacks:
+                self._blockerLabels.add(frame)
+            else:
+                frame = 'other'
+        MetricCountEvent.log('reactorStall.blocker',
+                             labels=dict(frame=frame))
+        log.msg("reactor was blocked for %.1fs in:\n  %s"
+                % (stalled, "\n  ".join(stack)))
+
+    def _watch(self):
+        interval = self.beatInterval
+        if self.profileInterval:
+            interval = min(interval, self.profileInterval)
+        while True:
+            # Event.wait only returns the flag in Python 2.7 and later
+            self._stopping.wait(interval)
+            if self._stopping.isSet():
+                return
+            self.check()
+
+    def check(self):
+        """
+        Sample the reactor thread's stack if it is blocked, or if the
+        profiler is due.  This is called from the watchdog thread.
+        """
+        now = self._time()
+        stalled = now - self._lastBeat - self.beatInterval >= self.threshold
+        profiling = self._nextProfile is not None and now >= self._nextProfile
+        if not stalled and not profiling:
+            return
+
+        frame = sys._current_frames().get(self._reactorThread)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < self.maxDepth:
+            code = frame.f_code
+            stack.append("%s:%d(%s)" % (code.co_filename, frame.f_lineno,
+                                        code.co_name))
+            frame = frame.f_back
+        del frame
+        stack.reverse()
+        stack = tuple(stack)
+
+        with self._lock:
+            if stalled:
+                self._addSample(self.blockers, stack)
+                self._stallStack = stack
+            if profiling:
+                self._addSample(self.profile, stack)
+                self._nextProfile = now + self.profileInterval
+
+    def _addSample(self, samples, stack):
+        if stack not in samples and len(samples) >= self.maxStacks:
+            least = min(samples.iteritems(), key=lambda s: s[1])[0]
+            del samples[least]
+        samples[stack] += 1
+
+    def topBlockers(self, n=10, profile=False):
+        """
+        Return the C{n} most frequently sampled stacks, as a list of (count,
+        stack) tuples, most frequent first.  The stacks are those sampled
+        while the reactor was blocked or, with C{profile}, by the profiler.
+        """
+        with self._lock:
+            if profile:
+                samples = self.profile.items()
+            else:
+                samples = self.blockers.items()
+        samples = [(count, stack) for stack, count in samples]
+        samples.sort(key=lambda s: s[0], reverse=True)
+        return samples[:n]
+
+    def report(self, n=5, profile=False):
+        retval = []
+        if not profile:
+            retval.append("%d reactor stalls" % self.stalls)
+        for count, stack in self.topBlockers(n, profile):
+            retval.append("%d samples in:" % count)
+            retval.extend("  " + frame for frame in stack)
+        return "\n".join(retval)
+
+
 class MetricLogObserver(config.ReconfigurableServiceMixin,
                         service.MultiService):
     _reactor = reactor
@@ -415,6 +815,7 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
         self.periodic_interval = None
         self.log_task = None
         self.log_interval = None
+        self.stallDetector = None
 
         # Mapping of metric type to handlers for that type
         self.handlers = {}
@@ -423,6 +824,7 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
         self.registerHandler(MetricCountEvent, MetricCountHandler(self))
         self.registerHandler(MetricTimeEvent, MetricTimeHandler(self))
         self.registerHandler(MetricAlarmEvent, MetricAlarmHandler(self))
+        self.registerHandler(MetricDBQueryEvent, MetricDBQueryHandler(self))
 
         # Make sure our changes poller is behaving
         self.getHandler(MetricTimeEvent).addWatcher(PollerWatcher(self))
@@ -461,6 +863,19 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
                     self.periodic_task.clock = self._reactor
                     self.periodic_task.start(periodic_interval)
 
+            # and the stall detector
+            stall_threshold = metrics_config.get('stall_threshold')
+            profile_interval = metrics_config.get('profile_interval')
+            sd = self.stallDetector
+            if not sd or (sd.threshold, sd.profileInterval) != \
+                    (stall_threshold, profile_interval):
+                self.stopStallDetector()
+                if stall_threshold:
+                    self.stallDetector = StallDetector(stall_threshold,
+                                                       profile_interval,
+                                                       _reactor=self._reactor)
+                    self.stallDetector.start()
+
         # upcall
         return config.ReconfigurableServiceMixin.reconfigService(self,
                                                                  new_config)
@@ -487,9 +902,16 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
             self.log_task.stop()
             self.log_task = None
 
+        self.stopStallDetector()
+
         log.removeObserver(self.emit)
         self.enabled = False
 
+    def stopStallDetector(self):
+        if self.stallDetector:
+            self.stallDetector.stop()
+            self.stallDetector = None
+
     def registerHandler(self, interface, handler):
         old = self.getHandler(interface)
         self.handlers[interface] = handler
@@ -518,6 +940,16 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
             retval.update(handler.asDict())
         return retval
 
+    def exposition(self):
+        """
+        Return the current metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for interface, handler in sorted(self.handlers.items(),
+                                         key=lambda i: i[0].__name__):
+            lines.extend(handler.exposition())
+        return "".join(line + "\n" for line in lines)
+
     def report(self):
         try:
             for interface, handler in self.handlers.iteritems():
@@ -44,16 +44,33 @@ class Properties(util.ComparableMixin):
 
     As a special case, a property value of None is returned as an empty
     string when used as a mapping.
+
+    Internally, the properties are kept as a stack of layers: dictionaries
+    shared with the L{Properties} objects they were copied from by
+    L{updateFromProperties}, and never modified.  Only the top, local layer
+    is written to.  Accessing the C{properties} attribute directly collapses
+    the layers into a single local dictionary.
+
+    This remains an old-style class, so that its pickles can be loaded by
+    older versions; C{properties} is therefore provided by C{__getattr__}
+    and C{__setattr__} rather than as a descriptor.
     """
 
-    compare_attrs = ('properties',)
+    compare_attrs = ('_merged',)
     implements(IProperties)
 
+    # collapse the layers once there are more than this many of them, to
+    # bound the cost of a lookup
+    max_layers = 8
+
     def __init__(self, **kwargs):
         """
         @param kwargs: initial property values (for testing)
         """
-        self.properties = {}
+        self._layers = ()
+        self._local = {}
+        # true if _local is also a layer of another Properties object
+        self._shared = False
         # Track keys which are 'runtime', and should not be
         # persisted if a build is rebuilt
         self.runtime = set()
@@ -68,42 +85,112 @@ class Properties(util.ComparableMixin):
             properties.setProperty(name, value, source)
         return properties
 
+    def __getattr__(self, name):
+        # only called for attributes that are not found otherwise
+        if name == 'properties':
+            if self._layers or self._shared:
+                self._local = self._getMerged()
+                self._layers = ()
+                self._shared = False
+            return self._local
+        if name == '_merged':
+            return self._getMerged()
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name == 'properties':
+            self._local = value
+            self._layers = ()
+            self._shared = False
+        else:
+            self.__dict__[name] = value
+
+    def _getMerged(self):
+        # a new dictionary with the contents of all layers
+        merged = {}
+        for layer in self._layers:
+            merged.update(layer)
+        merged.update(self._local)
+        return merged
+
+    def _lookup(self, name):
+        if name in self._local:
+            return self._local[name]
+        for layer in reversed(self._layers):
+            if name in layer:
+                return layer[name]
+        raise KeyError(name)
+
+    def _share(self):
+        # return our layers for use by another Properties object; from now
+        # on, a write must not modify the current local layer
+        if self._local:
+            self._shared = True
+            return self._layers + (self._local,)
+        return self._layers
+
+    def _setLayers(self, layers):
+        if len(layers) > self.max_layers:
+            merged = {}
+            for layer in layers:
+                merged.update(layer)
+            layers = (merged,)
+        self._layers = layers
+        self._local = {}
+        self._shared = False
+
+    def _set(self, name, value):
+        if self._shared:
+            self._setLayers(self._layers + (self._local,))
+        self._local[name] = value
+
     def __getstate__(self):
-        d = self.__dict__.copy()
-        d['build'] = None
-        return d
+        # serialize a single flat dictionary, in the same form as older
+        # versions, rather than the layers and the objects they came from
+        return dict(properties=self._getMerged(), runtime=self.runtime,
+                    build=None)
 
     def __setstate__(self, d):
-        self.__dict__ = d
-        if not hasattr(self, 'runtime'):
-            self.runtime = set()
+        self.__dict__.update(_layers=(), _local=d.get('properties', {}),
+                             _shared=False, runtime=d.get('runtime', set()),
+                             build=d.get('build'))
 
     def __contains__(self, name):
-        return name in self.properties
+        try:
+            self._lookup(name)
+        except KeyError:
+            return False
+        return True
 
     def __getitem__(self, name):
         """Just get the value for this property."""
-        rv = self.properties[name][0]
+        rv = self._lookup(name)[0]
         return rv
 
     def __nonzero__(self):
-        return not not self.properties
+        if self._local:
+            return True
+        for layer in self._layers:
+            if layer:
+                return True
+        return False
 
     def getPropertySource(self, name):
-        return self.properties[name][1]
+        return self._lookup(name)[1]
 
     def asList(self):
         """Return the properties as a sorted list of (name, value, source)"""
-        l = sorted([(k, v[0], v[1]) for k, v in self.properties.iteritems()])
+        l = sorted([(k, v[0], v[1]) for k, v in self._getMerged().iteritems()])
         return l
 
     def asDict(self):
         """Return the properties as a simple key:value dictionary"""
-        return dict(self.properties)
+        return self._getMerged()
 
     def __repr__(self):
         return ('Properties(**' +
-                repr(dict((k, v[0]) for k, v in self.properties.iteritems())) +
+                repr(dict((k, v[0])
+                          for k, v in self._getMerged().iteritems())) +
                 ')')
 
     def update(self, dict, source, runtime=False):
@@ -113,23 +200,39 @@ class Properties(util.ComparableMixin):
 
     def updateFromProperties(self, other):
         """Update this object based on another object; the other object's """
-        self.properties.update(other.properties)
+        if not isinstance(other, Properties):
+            for k, v in other.properties.iteritems():
+                self._set(k, v)
+            self.runtime.update(other.runtime)
+            return
+        # share the other object's layers rather than copying them
+        layers = self._layers
+        if self._local:
+            layers = layers + (self._local,)
+        self._setLayers(layers + other._share())
         self.runtime.update(other.runtime)
 
     def updateFromPropertiesNoRuntime(self, other):
         """Update this object based on another object, but don't
         include properties that were marked as runtime."""
-        for k, v in other.properties.iteritems():
+        if isinstance(other, Properties):
+            items = other._getMerged()
+        else:
+            items = other.properties
+        for k, v in items.iteritems():
             if k not in other.runtime:
-                self.properties[k] = v
+                self._set(k, v)
 
     # IProperties methods
 
     def getProperty(self, name, default=None):
-        return self.properties.get(name, (default,))[0]
+        try:
+            return self._lookup(name)[0]
+        except KeyError:
+            return default
 
     def hasProperty(self, name):
-        return name in self.properties
+        return name in self
 
     has_propkey = hasProperty
 
@@ -142,7 +245,7 @@ class Properties(util.ComparableMixin):
                 "will be explicitly disallowed in a future version.",
                 DeprecationWarning, stacklevel=2)
 
-        self.properties[name] = (value, source)
+        self._set(name, (value, source))
         if runtime:
             self.runtime.add(name)
 
@@ -275,6 +378,65 @@ class _PropertyMap(object):
         self.temp_vals[key] = val
 
 
+class _PropertyTemplate(object):
+
+    """
+    Privately-used compiled form of the keys of a WithProperties format
+    string.  Each key is matched against the L{_PropertyMap} patterns once,
+    so that rendering is just a few dictionary lookups per key.
+    """
+
+    def __init__(self, keys):
+        self.lookups = []
+        for key in keys:
+            for mode, regexp in [
+                ('-', _PropertyMap.colon_minus_re),
+                ('~', _PropertyMap.colon_tilde_re),
+                ('+', _PropertyMap.colon_plus_re),
+            ]:
+                mo = regexp.match(key)
+                if mo:
+                    prop, repl = mo.group(1, 2)
+                    break
+            else:
+                mode, prop, repl = None, key, None
+            self.lookups.append((key, mode, prop, repl))
+
+    def lookup(self, properties, temp_vals):
+        """Return a list of (key, value) pairs, with the same values a
+        L{_PropertyMap} would return"""
+        rv = []
+        for key, mode, prop, repl in self.lookups:
+            if mode is None:
+                if prop in temp_vals:
+                    val = temp_vals[prop]
+                else:
+                    val = properties[prop]
+            elif mode == '-':
+                if prop in temp_vals:
+                    val = temp_vals[prop]
+                elif prop in properties:
+                    val = properties[prop]
+                else:
+                    val = repl
+            elif mode == '~':
+                if prop in temp_vals and temp_vals[prop]:
+                    val = temp_vals[prop]
+                elif prop in properties and properties[prop]:
+                    val = properties[prop]
+                else:
+                    val = repl
+            else:
+                if prop in properties or prop in temp_vals:
+                    val = repl
+                else:
+                    val = ''
+            if val is None:
+                val = ''
+            rv.append((key, val))
+        return rv
+
+
 class WithProperties(util.ComparableMixin):
 
     """
@@ -296,7 +458,39 @@ class WithProperties(util.ComparableMixin):
         elif lambda_subs:
             raise ValueError('WithProperties takes either positional or keyword substitutions, not both.')
 
+    def _getTemplate(self):
+        # compile the format string on first use; a format string whose keys
+        # cannot be found this way is rendered with a _PropertyMap instead
+        try:
+            return self._template
+        except AttributeError:
+            pass
+        try:
+            if self.args:
+                keys = self.args
+            else:
+                keys = _getInterpolationList(self.fmtstring,
+                                             collections.defaultdict(int))
+            self._template = _PropertyTemplate(keys)
+        except (TypeError, ValueError):
+            self._template = None
+        return self._template
+
     def getRenderingFor(self, build):
+        template = self._getTemplate()
+        if template is None:
+            return self._renderWithPropertyMap(build)
+        properties = build.getProperties()
+        if self.args:
+            values = template.lookup(properties, {})
+            return self.fmtstring % tuple([v for k, v in values])
+        else:
+            temp_vals = dict([(k, v(build))
+                              for k, v in self.lambda_subs.iteritems()])
+            return self.fmtstring % dict(template.lookup(properties,
+                                                         temp_vals))
+
+    def _renderWithPropertyMap(self, build):
         pmap = _PropertyMap(build.getProperties())
         if self.args:
             strings = []
@@ -312,6 +506,30 @@ class WithProperties(util.ComparableMixin):
 
 _notHasKey = object()  # Marker object for _Lookup(..., hasKey=...) default
 
+# Marker returned by _renderNow for values that need a full render
+_notSimple = object()
+
+_simpleTypes = (basestring, int, long, float, bool, type(None))
+
+
+def _renderNow(build, value):
+    """
+    Render C{value} immediately, without any Deferreds, if that can be done
+    without side effects: for plain values, the dictionaries used by
+    L{Interpolate}, and nested L{Interpolate} and L{_Lookup} instances.
+    Anything else gives C{_notSimple}, and must be rendered with
+    C{build.render}.
+    """
+    if isinstance(value, _simpleTypes):
+        return value
+    if isinstance(value, (Interpolate, _Lookup)):
+        return value._renderNow(build)
+    if value is _thePropertyDict:
+        return build.getProperties()
+    if isinstance(value, (_SourceStampDict, _Lazy)):
+        return value.getRenderingFor(build)
+    return _notSimple
+
 
 class _Lookup(util.ComparableMixin, object):
     implements(IRenderable)
@@ -363,10 +581,37 @@ class _Lookup(util.ComparableMixin, object):
             rv = yield build.render(self.elideNoneAs)
         defer.returnValue(rv)
 
+    def _renderNow(self, build):
+        # the same logic as getRenderingFor, but giving up with _notSimple as
+        # soon as a value would need a Deferred
+        value = _renderNow(build, self.value)
+        index = _renderNow(build, self.index)
+        if value is _notSimple or index is _notSimple:
+            return _notSimple
+        if not index in value:
+            rv = _renderNow(build, self.default)
+        else:
+            if self.defaultWhenFalse:
+                rv = _renderNow(build, value[index])
+                if rv is _notSimple:
+                    return rv
+                if not rv:
+                    rv = _renderNow(build, self.default)
+                elif self.hasKey is not _notHasKey:
+                    rv = _renderNow(build, self.hasKey)
+            elif self.hasKey is not _notHasKey:
+                rv = _renderNow(build, self.hasKey)
+            else:
+                rv = _renderNow(build, value[index])
+        if rv is None:
+            rv = _renderNow(build, self.elideNoneAs)
+        return rv
+
 
-def _getInterpolationList(fmtstring):
+def _getInterpolationList(fmtstring, dd=None):
     # TODO: Verify that no positional substitutions are requested
-    dd = collections.defaultdict(str)
+    if dd is None:
+        dd = collections.defaultdict(str)
     fmtstring % dd
     return dd.keys()
 
@@ -579,11 +824,30 @@ class Interpolate(util.ComparableMixin, object):
                           self.fmtstring % tuple(args))
             return d
         else:
+            # most interpolations only look up properties, so try to render
+            # without the overhead of a Deferred for every substitution
+            try:
+                rv = self._renderNow(props)
+            except:
+                return defer.fail()
+            if rv is not _notSimple:
+                return defer.succeed(rv)
             d = props.render(self.interpolations)
             d.addCallback(lambda res:
                           self.fmtstring % res)
             return d
 
+    def _renderNow(self, props):
+        if self.args:
+            return _notSimple
+        res = {}
+        for key, lookup in self.interpolations.iteritems():
+            rv = _renderNow(props, lookup)
+            if rv is _notSimple:
+                return rv
+            res[key] = rv
+        return self.fmtstring % res
+
 
 class Property(util.ComparableMixin):
 
@@ -108,6 +108,14 @@ class AbstractSlaveBuilder(pb.Referenceable):
         d.addCallback(lambda _:
                       self.remote.callRemote("setMaster", self))
 
+        @d.addCallback
+        def setMasterFeatures(_):
+            # tell the slave which optional update formats we understand;
+            # older slaves do not know about this
+            d1 = self.remote.callRemote("setMasterFeatures", ['segments'])
+            d1.addErrback(lambda why: why.trap(pb.NoSuchMethod))
+            return d1
+
         d.addCallback(lambda _:
                       self.remote.callRemote("print", "attached"))
 
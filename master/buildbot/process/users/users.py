@@ -107,8 +107,12 @@ def _filter(contacts):
 
 
 def getUsersContacts(master, contact_types, uids):
-    d = defer.gatherResults([getUserContact(master, contact_types, uid) for uid in uids])
-    d.addCallback(_filter)
+    d = master.db.users.getUsersByUids(uids)
+
+    @d.addCallback
+    def extract(usdicts):
+        return _filter([_extractContact(usdicts.get(uid), contact_types, uid)
+                        for uid in uids])
     return d
 
 
@@ -131,23 +135,52 @@ def getSourceStampContacts(master, ss, contact_types):
 
 
 def getBuildContacts(master, build, contact_types):
-    dl = []
-    ss_list = build.getSourceStamps()
-    for ss in ss_list:
-        dl.append(getSourceStampContacts(master, ss, contact_types))
-    d = defer.gatherResults(dl)
-    d.addCallback(flatten)
+    return getBuildsContacts(master, [build], contact_types)
+
+
+def getBuildsContacts(master, builds, contact_types):
+    """
+    Get the contacts for everyone responsible for, or interested in, any of
+    the given builds.  Changes, users and owners shared between the builds
+    are only looked up once, and the changes' users and the owners are each
+    fetched in a single batch.
+
+    @returns: list of contacts via Deferred
+    """
+    changeids, seen_changeids = [], set()
+    owners, seen_owners = [], set()
+    for build in builds:
+        for ss in build.getSourceStamps():
+            for change in ss.changes:
+                if change.number not in seen_changeids:
+                    seen_changeids.add(change.number)
+                    changeids.append(change.number)
+        for owner in build.getInterestedUsers():
+            if owner not in seen_owners:
+                seen_owners.add(owner)
+                owners.append(owner)
+
+    d = master.db.changes.getChangeUidsById(changeids)
+
+    @d.addCallback
+    def getContacts(uidlists):
+        uids = []
+        seen = set()
+        for uid in flatten(uidlists):
+            if uid not in seen:
+                seen.add(uid)
+                uids.append(uid)
+        return getUsersContacts(master, contact_types, uids)
 
     @d.addCallback
     def addOwners(recipients):
-        dl = []
-        for owner in build.getInterestedUsers():
-            d = master.db.users.getUserByUsername(owner)
-            d.addCallback(_extractContact, contact_types, owner)
-            dl.append(d)
-        d = defer.gatherResults(dl)
-        d.addCallback(_filter)
-        d.addCallback(lambda owners: recipients + owners)
+        d = master.db.users.getUsersByUsernames(owners)
+
+        @d.addCallback
+        def extract(usdicts):
+            return recipients + _filter([
+                _extractContact(usdicts.get(owner), contact_types, owner)
+                for owner in owners])
         return d
     return d
 
@@ -115,6 +115,7 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
         # internal variables
         self._change_subscription = None
         self._change_consumption_lock = defer.DeferredLock()
+        self._pending_changes = []
 
     # service handling
 
@@ -191,9 +192,15 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
             else:
                 important = True
 
+            # changes which arrive while earlier changes are being processed
+            # are handed to gotChanges together
+            self._pending_changes.append((change, important))
+            if len(self._pending_changes) > 1:
+                return
+
             # use change_consumption_lock to ensure the service does not stop
             # while this change is being processed
-            d = self._change_consumption_lock.run(self.gotChange, change, important)
+            d = self._change_consumption_lock.run(self._consumePendingChanges)
             d.addErrback(log.err, 'while processing change')
         self._change_subscription = self.master.subscribeToChanges(changeCallback)
 
@@ -210,6 +217,27 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
                 self._change_subscription = None
         return self._change_consumption_lock.run(stop)
 
+    def _consumePendingChanges(self):
+        changes, self._pending_changes = self._pending_changes, []
+        return self.gotChanges(changes)
+
+    @defer.inlineCallbacks
+    def gotChanges(self, changes):
+        """
+        Called with the changes received together; returns a Deferred.  The
+        default implementation calls L{gotChange} for each change in turn, but
+        subclasses may handle the changes as a batch.
+
+        @param changes: list of (change, important) tuples, in the order in
+        which the changes were received
+        @returns: Deferred
+        """
+        for change, important in changes:
+            try:
+                yield self.gotChange(change, important)
+            except:
+                log.err(failure.Failure(), 'while processing change')
+
     def gotChange(self, change, important):
         """
         Called when a change is received; returns a Deferred.  If the
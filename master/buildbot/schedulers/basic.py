@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import inspect
+
 from buildbot import config
 from buildbot import util
 from buildbot.changes import changes
@@ -138,29 +140,60 @@ class BaseBasicScheduler(base.BaseScheduler):
             return self.addBuildsetForChanges(reason=self.reason,
                                               changeids=[change.number])
 
-        timer_name = self.getTimerNameForChange(change)
-
         # if we have a treeStableTimer, then record the change's importance
         # and:
         # - for an important change, start the timer
         # - for an unimportant change, reset the timer if it is running
         d = self.master.db.schedulers.classifyChanges(
             self.objectid, {change.number: important})
+        d.addCallback(lambda _: self._fixStableTimer(
+            self.getTimerNameForChange(change), important))
+        return d
+
+    def gotChanges(self, changes):
+        if not self.treeStableTimer or len(changes) == 1 \
+                or self._gotChangeOverridden():
+            return base.BaseScheduler.gotChanges(self, changes)
+        return self._classifyChanges(changes)
+
+    def _gotChangeOverridden(self):
+        # a subclass that overrides gotChange but not gotChanges expects its
+        # gotChange to see every change, so it does not get batches
+        mro = inspect.getmro(self.__class__)
+        for cls in mro:
+            if 'gotChanges' in cls.__dict__:
+                return False
+            if 'gotChange' in cls.__dict__:
+                return True
+
+    @util.deferredLocked('_stable_timers_lock')
+    def _classifyChanges(self, changes):
+        # record the importance of all of the changes at once, then adjust
+        # the timers just as gotChange would have for each change
+        classifications = dict((change.number, important)
+                               for change, important in changes)
+        d = self.master.db.schedulers.classifyChanges(
+            self.objectid, classifications)
 
-        def fix_timer(_):
-            if not important and not self._stable_timers[timer_name]:
-                return
-            if self._stable_timers[timer_name]:
-                self._stable_timers[timer_name].cancel()
-
-            def fire_timer():
-                d = self.stableTimerFired(timer_name)
-                d.addErrback(log.err, "while firing stable timer")
-            self._stable_timers[timer_name] = self._reactor.callLater(
-                self.treeStableTimer, fire_timer)
-        d.addCallback(fix_timer)
+        def fix_timers(_):
+            for change, important in changes:
+                self._fixStableTimer(self.getTimerNameForChange(change),
+                                     important)
+        d.addCallback(fix_timers)
         return d
 
+    def _fixStableTimer(self, timer_name, important):
+        if not important and not self._stable_timers[timer_name]:
+            return
+        if self._stable_timers[timer_name]:
+            self._stable_timers[timer_name].cancel()
+
+        def fire_timer():
+            d = self.stableTimerFired(timer_name)
+            d.addErrback(log.err, "while firing stable timer")
+        self._stable_timers[timer_name] = self._reactor.callLater(
+            self.treeStableTimer, fire_timer)
+
     @defer.inlineCallbacks
     def scanExistingClassifiedChanges(self):
         # call gotChange for each classified change.  This is called at startup
@@ -243,9 +276,25 @@ class SingleBranchScheduler(BaseBasicScheduler):
             return defer.succeed(None)
 
     def gotChange(self, change, important):
-        d = defer.succeed(None)
+        d = self._updateLastCodebases([change])
+        d.addCallback(lambda _:
+                      BaseBasicScheduler.gotChange(self, change, important))
+        return d
 
-        if self.createAbsoluteSourceStamps:
+    def gotChanges(self, changes):
+        # note that any calls to gotChange from here find the codebases
+        # already up to date, so the state is written once per batch
+        d = self._updateLastCodebases([change for change, _ in changes])
+        d.addCallback(lambda _:
+                      BaseBasicScheduler.gotChanges(self, changes))
+        return d
+
+    def _updateLastCodebases(self, changes):
+        if not self.createAbsoluteSourceStamps:
+            return defer.succeed(None)
+
+        updated = False
+        for change in changes:
             self._lastCodebases.setdefault(change.codebase, {})
             lastChange = self._lastCodebases[change.codebase].get('lastChange', -1)
 
@@ -256,12 +305,11 @@ class SingleBranchScheduler(BaseBasicScheduler):
 
             if change.number > lastChange:
                 self._lastCodebases[change.codebase] = codebaseDict
-                d.addCallback(lambda _:
-                              self.setState('lastCodebases', self._lastCodebases))
+                updated = True
 
-        d.addCallback(lambda _:
-                      BaseBasicScheduler.gotChange(self, change, important))
-        return d
+        if not updated:
+            return defer.succeed(None)
+        return self.setState('lastCodebases', self._lastCodebases)
 
     def getCodebaseDict(self, codebase):
         if self.createAbsoluteSourceStamps:
@@ -36,11 +36,18 @@ class Dependent(base.BaseScheduler):
         self.upstream_name = upstream.name
         self._buildset_addition_subscr = None
         self._buildset_completion_subscr = None
-        self._cached_upstream_bsids = None
+
+        # the upstream buildsets we are waiting on, as a dictionary mapping
+        # bsid to sourcestampsetid; this is loaded from the state when the
+        # first event arrives, and then kept up to date from the buildset
+        # subscriptions, so that completions need no further queries.
+        self._upstream = None
+        self._saving = False
+        self._saveAgain = False
+        self._saveWaiters = []
 
         # the subscription lock makes sure that we're done inserting a
-        # subcription into the DB before registering that the buildset is
-        # complete.
+        # subcription before registering that the buildset is complete.
         self._subscription_lock = defer.DeferredLock()
 
     def startService(self):
@@ -58,11 +65,25 @@ class Dependent(base.BaseScheduler):
             self._buildset_addition_subscr.unsubscribe()
         if self._buildset_completion_subscr:
             self._buildset_completion_subscr.unsubscribe()
-        self._cached_upstream_bsids = None
-        return defer.succeed(None)
+        return self._forgetUpstreamBuildsets()
 
     @util.deferredLocked('_subscription_lock')
-    def _buildsetAdded(self, bsid=None, properties=None, **kwargs):
+    def _forgetUpstreamBuildsets(self):
+        # wait for any handlers still running and for the state to be
+        # written, then forget it, so that it is reloaded on restart
+        d = defer.Deferred()
+        if self._saving:
+            self._saveWaiters.append(d)
+        else:
+            d.callback(None)
+
+        @d.addCallback
+        def forget(_):
+            self._upstream = None
+        return d
+
+    def _buildsetAdded(self, bsid=None, properties=None,
+                       sourcestampsetid=None, **kwargs):
         # check if this was submitetted by our upstream by checking the
         # scheduler property
         submitter = properties.get('scheduler', (None, None))[0]
@@ -70,7 +91,7 @@ class Dependent(base.BaseScheduler):
             return
 
         # record our interest in this buildset
-        d = self._addUpstreamBuildset(bsid)
+        d = self._addUpstreamBuildset(bsid, sourcestampsetid)
         d.addErrback(log.err, 'while subscribing to buildset %d' % bsid)
 
     def _buildsetCompleted(self, bsid, result):
@@ -80,72 +101,104 @@ class Dependent(base.BaseScheduler):
     @util.deferredLocked('_subscription_lock')
     @defer.inlineCallbacks
     def _checkCompletedBuildsets(self, bsid, result):
-        subs = yield self._getUpstreamBuildsets()
+        # the first call also finds the buildsets which completed while we
+        # were not watching
+        completed = yield self._loadUpstreamBuildsets()
+        if bsid in self._upstream:
+            completed.append((bsid, result))
+        yield self._completeUpstreamBuildsets(completed)
 
-        sub_bsids = []
-        for (sub_bsid, sub_sssetid, sub_complete, sub_results) in subs:
-            # skip incomplete builds, handling the case where the 'complete'
-            # column has not been updated yet
-            if not sub_complete and sub_bsid != bsid:
+    @defer.inlineCallbacks
+    def _completeUpstreamBuildsets(self, completed):
+        # handle a list of (bsid, results) for completed upstream buildsets
+        for sub_bsid, sub_results in completed:
+            if sub_bsid not in self._upstream:
                 continue
 
             # build a dependent build if the status is appropriate
             if sub_results in (SUCCESS, WARNINGS):
-                yield self.addBuildsetForSourceStamp(setid=sub_sssetid,
-                                                     reason='downstream')
+                yield self.addBuildsetForSourceStamp(
+                    setid=self._upstream[sub_bsid], reason='downstream')
+
+            # and regardless of status, remove the subscription
+            del self._upstream[sub_bsid]
+
+        if completed:
+            self._saveState()
 
-            sub_bsids.append(sub_bsid)
+    @util.deferredLocked('_subscription_lock')
+    @defer.inlineCallbacks
+    def _addUpstreamBuildset(self, bsid, sourcestampsetid=None):
+        completed = yield self._loadUpstreamBuildsets()
+        yield self._completeUpstreamBuildsets(completed)
+
+        if bsid in self._upstream:
+            return
+        if sourcestampsetid is None:
+            bsdict = yield self.master.db.buildsets.getBuildset(bsid)
+            if not bsdict:
+                return
+            sourcestampsetid = bsdict['sourcestampsetid']
 
-        # and regardless of status, remove the subscriptions
-        yield self._removeUpstreamBuildsets(sub_bsids)
+        self._upstream[bsid] = sourcestampsetid
+        self._saveState()
 
     @defer.inlineCallbacks
-    def _updateCachedUpstreamBuilds(self):
-        if self._cached_upstream_bsids is None:
-            bsids = yield self.master.db.state.getState(self.objectid,
-                                                        'upstream_bsids', [])
-            self._cached_upstream_bsids = bsids
+    def _loadUpstreamBuildsets(self):
+        # load self._upstream, if necessary, returning a list of (bsid,
+        # results) for the upstream buildsets which are already complete
+        if self._upstream is not None:
+            defer.returnValue([])
+
+        subs = yield self._getUpstreamBuildsets()
+        self._upstream = {}
+        completed = []
+        for (sub_bsid, sub_sssetid, sub_complete, sub_results) in subs:
+            self._upstream[sub_bsid] = sub_sssetid
+            if sub_complete:
+                completed.append((sub_bsid, sub_results))
+        defer.returnValue(completed)
 
     @defer.inlineCallbacks
     def _getUpstreamBuildsets(self):
         # get a list of (bsid, sssid, complete, results) for all
-        # upstream buildsets
-        yield self._updateCachedUpstreamBuilds()
+        # upstream buildsets in the state
+        bsids = yield self.master.db.state.getState(self.objectid,
+                                                    'upstream_bsids', [])
 
-        changed = False
         rv = []
-        for bsid in self._cached_upstream_bsids[:]:
+        for bsid in bsids:
             bsdict = yield self.master.db.buildsets.getBuildset(bsid)
             if not bsdict:
-                self._cached_upstream_bsids.remove(bsid)
-                changed = True
                 continue
 
             rv.append((bsid, bsdict['sourcestampsetid'], bsdict['complete'],
                        bsdict['results']))
 
-        if changed:
+        if len(rv) != len(bsids):
             yield self.master.db.state.setState(self.objectid,
-                                                'upstream_bsids', self._cached_upstream_bsids)
+                                                'upstream_bsids', [sub[0] for sub in rv])
 
         defer.returnValue(rv)
 
-    @defer.inlineCallbacks
-    def _addUpstreamBuildset(self, bsid):
-        yield self._updateCachedUpstreamBuilds()
-
-        if bsid not in self._cached_upstream_bsids:
-            self._cached_upstream_bsids.append(bsid)
-
-            yield self.master.db.state.setState(self.objectid,
-                                                'upstream_bsids', self._cached_upstream_bsids)
-
-    @defer.inlineCallbacks
-    def _removeUpstreamBuildsets(self, bsids):
-        yield self._updateCachedUpstreamBuilds()
-
-        old = set(self._cached_upstream_bsids)
-        self._cached_upstream_bsids = list(old - set(bsids))
-
-        yield self.master.db.state.setState(self.objectid,
-                                            'upstream_bsids', self._cached_upstream_bsids)
+    def _saveState(self):
+        # write the upstream bsids to the state.  Changes made while a write
+        # is in progress are written together once it finishes.
+        if self._saving:
+            self._saveAgain = True
+            return
+        self._saving = True
+        self._saveAgain = False
+        d = self.master.db.state.setState(self.objectid, 'upstream_bsids',
+                                          sorted(self._upstream))
+        d.addErrback(log.err, 'while saving upstream buildsets')
+
+        @d.addCallback
+        def saved(_):
+            self._saving = False
+            if self._saveAgain:
+                self._saveState()
+                return
+            waiters, self._saveWaiters = self._saveWaiters, []
+            for w in waiters:
+                w.callback(None)
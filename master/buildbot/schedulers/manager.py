@@ -29,6 +29,7 @@ class SchedulerManager(config.ReconfigurableServiceMixin,
         service.MultiService.__init__(self)
         self.setName('scheduler_manager')
         self.master = master
+        self._compare_attrs = {}
 
     @defer.inlineCallbacks
     def reconfigService(self, new_config):
@@ -57,7 +58,7 @@ class SchedulerManager(config.ReconfigurableServiceMixin,
 
             # compare using ComparableMixin if they don't support reconfig
             elif not hasattr(old, 'reconfigService'):
-                if old != new:
+                if self._configDigest(old) != self._configDigest(new):
                     removed_names.add(n)
                     added_names.add(n)
 
@@ -97,3 +98,24 @@ class SchedulerManager(config.ReconfigurableServiceMixin,
                                                                 new_config)
 
         timer.stop()
+
+    def _configDigest(self, sch):
+        # the values that ComparableMixin would compare, in a form that can
+        # be compared directly.  The digest is kept on the scheduler, so a
+        # running scheduler's digest is only computed once, and the
+        # compare_attrs of each class are only collected once.
+        if not isinstance(sch, util.ComparableMixin):
+            return sch
+        digest = sch.__dict__.get('_config_digest')
+        if digest is None:
+            cls = sch.__class__
+            compare_attrs = self._compare_attrs.get(cls)
+            if compare_attrs is None:
+                compare_attrs = []
+                reflect.accumulateClassList(cls, 'compare_attrs',
+                                            compare_attrs)
+                compare_attrs = self._compare_attrs[cls] = tuple(compare_attrs)
+            digest = (cls, tuple([getattr(sch, name, sch._None)
+                                  for name in compare_attrs]))
+            sch._config_digest = digest
+        return digest
@@ -66,6 +66,18 @@ class JobdirService(MaildirService):
         f = self.moveToCurDir(filename)
         return self.parent.handleJobFile(filename, f)
 
+    def messagesReceived(self, filenames):
+        # move all of the new job files to cur/, then hand them to the
+        # scheduler together
+        jobfiles = []
+        for filename in filenames:
+            try:
+                jobfiles.append((filename, self.moveToCurDir(filename)))
+            except:
+                log.err(None, "while reading '%s' from maildir '%s':"
+                        % (filename, self.basedir))
+        return self.parent.handleJobFiles(jobfiles)
+
 
 class Try_Jobdir(TryBase):
 
@@ -160,21 +172,50 @@ class Try_Jobdir(TryBase):
         return parsed_job
 
     def handleJobFile(self, filename, f):
+        job = self._parseJobFile(filename, f)
+        if job is None:
+            return defer.succeed(None)
+        return self._submitJob(*job)
+
+    def handleJobFiles(self, jobfiles):
+        """
+        Handle several new job files at once: parse all of them, then submit
+        the valid jobs together.  Errors while submitting a job are logged.
+
+        @param jobfiles: list of (filename, file) tuples
+        @returns: Deferred
+        """
+        jobs = [self._parseJobFile(filename, f) for filename, f in jobfiles]
+        d = defer.DeferredList([self._submitJob(*job) for job in jobs if job],
+                               consumeErrors=True)
+
+        @d.addCallback
+        def logErrors(results):
+            for success, result in results:
+                if not success:
+                    log.err(result, "while submitting a try job")
+        return d
+
+    def _parseJobFile(self, filename, f):
+        # returns (parsed_job, builderNames), or None if the job should be
+        # ignored
         try:
             parsed_job = self.parseJob(f)
             builderNames = parsed_job['builderNames']
         except BadJobfile:
             log.msg("%s reports a bad jobfile in %s" % (self, filename))
             log.err()
-            return defer.succeed(None)
+            return None
 
         # Validate/fixup the builder names.
         builderNames = self.filterBuilderList(builderNames)
         if not builderNames:
             log.msg(
                 "incoming Try job did not specify any allowed builder names")
-            return defer.succeed(None)
+            return None
+        return parsed_job, builderNames
 
+    def _submitJob(self, parsed_job, builderNames):
         who = ""
         if parsed_job['who']:
             who = parsed_job['who']
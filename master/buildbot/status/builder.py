@@ -22,12 +22,14 @@ import re
 
 from cPickle import dump
 from cPickle import load
+from cPickle import loads
 
 from buildbot import interfaces
 from buildbot import util
 from buildbot.status.build import BuildStatus
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.status.event import Event
+from buildbot.util import json
 from buildbot.util.lru import LRUCache
 from twisted.persisted import styles
 from twisted.python import log
@@ -47,6 +49,37 @@ _hush_pyflakes = [SUCCESS, WARNINGS, FAILURE, SKIPPED,
                   EXCEPTION, RETRY, Results, worst_status]
 
 
+METADATA_FILENAME = "builder.meta"
+
+
+def loadNextBuildNumber(basedir):
+    """Return the number of the next build for the builder whose status is
+    saved in C{basedir}.  This reads the builder's metadata file, falling back
+    to a scan of the directory if it is missing.  It only reads from the disk,
+    so it is safe to call from a thread."""
+    number = None
+    try:
+        with open(os.path.join(basedir, METADATA_FILENAME)) as metafile:
+            number = int(json.load(metafile)['nextBuildNumber'])
+    except IOError:
+        pass
+    except Exception:
+        log.msg("ignoring invalid metadata for builder in %s" % basedir)
+
+    if number is None:
+        existing_builds = [int(f)
+                           for f in os.listdir(basedir)
+                           if re.match(r"^\d+$", f)]
+        if existing_builds:
+            return max(existing_builds) + 1
+        return 0
+
+    # skip any builds which were saved after the metadata was last written
+    while os.path.exists(os.path.join(basedir, "%d" % number)):
+        number += 1
+    return number
+
+
 class BuilderStatus(styles.Versioned):
 
     """I handle status information for a single process.build.Builder object.
@@ -100,7 +133,9 @@ class BuilderStatus(styles.Versioned):
         # when saving, don't record transient stuff like what builds are
         # currently running, because they won't be there when we start back
         # up. Nor do we save self.watchers, nor anything that gets set by our
-        # parent like .basedir and .status
+        # parent like .basedir and .status.  Any saved events which have not
+        # been loaded yet are loaded first, so that they are saved again.
+        self.events
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
@@ -128,6 +163,54 @@ class BuilderStatus(styles.Versioned):
         # self.status must be filled in by our parent
         # self.master must be filled in by our parent
 
+    def setSavedEvents(self, pickled):
+        """Take our events, and anything else which is only found there,
+        from C{pickled}, the pickle saved by an earlier master, but only
+        unpickle it when one of them is first needed.  The rest comes from
+        the configuration or from our metadata, so most builders never need
+        the pickle at startup."""
+        del self.events
+        self.savedEvents = pickled
+
+    def __getattr__(self, name):
+        # this is only called for attributes which are missing, like .events
+        # before the saved events are loaded
+        if 'savedEvents' in self.__dict__:
+            self.loadSavedEvents(self.__dict__.pop('savedEvents'))
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def loadSavedEvents(self, pickled):
+        # the pickle was read from disk in a thread, but must be unpickled
+        # here, since twisted.persisted.styles tracks the objects it upgrades
+        # in a process-wide registry
+        upgraded = False
+        try:
+            log.msg("loading saved events for builder %s" % self.name)
+            saved = loads(pickled)
+
+            # (bug #1068) if we need to upgrade, we probably need to rewrite
+            # this pickle, too.  We determine this by looking at the list of
+            # Versioned objects that have been unpickled, and (after
+            # doUpgrade) checking to see if any of them set wasUpgraded.  The
+            # Versioneds' upgradeToVersionNN methods all set this.
+            versioneds = styles.versionedsToUpgrade
+            styles.doUpgrade()
+            upgraded = True in [hasattr(o, 'wasUpgraded')
+                                for o in versioneds.values()]
+            # keep what was set up from the configuration and metadata
+            for k, v in saved.__dict__.items():
+                if k not in self.__dict__:
+                    setattr(self, k, v)
+        except:
+            log.msg("error while loading status pickle, ignoring its events")
+            log.err()
+            self.events = []
+
+        if upgraded:
+            log.msg("re-writing upgraded builder pickle")
+            self.saveYourself()
+
     def upgradeToVersion1(self):
         if hasattr(self, 'slavename'):
             self.slavenames = [self.slavename]
@@ -137,18 +220,29 @@ class BuilderStatus(styles.Versioned):
         self.wasUpgraded = True
 
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
-        what our self.nextBuildNumber should be. Set it one larger than the
-        highest-numbered build we discover. This is called by the top-level
-        Status object shortly after we are created or loaded from disk.
+        """Determine what our self.nextBuildNumber should be: one larger
+        than the highest-numbered build saved in our directory. This is
+        called by the top-level Status object shortly after we are created or
+        loaded from disk.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match(r"^\d+$", f)]
-        if existing_builds:
-            self.nextBuildNumber = max(existing_builds) + 1
-        else:
-            self.nextBuildNumber = 0
+        self.nextBuildNumber = loadNextBuildNumber(self.basedir)
+
+    def saveMetadata(self):
+        """Save the small metadata file which lets L{loadNextBuildNumber}
+        avoid scanning our directory."""
+        filename = os.path.join(self.basedir, METADATA_FILENAME)
+        tmpfilename = filename + ".tmp"
+        try:
+            with open(tmpfilename, "w") as f:
+                json.dump(dict(nextBuildNumber=self.nextBuildNumber), f)
+            if runtime.platformType == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(filename):
+                    os.unlink(filename)
+            os.rename(tmpfilename, filename)
+        except:
+            log.msg("unable to save metadata for builder %s" % self.name)
+            log.err()
 
     def saveYourself(self):
         for b in self.currentBuilds:
@@ -169,6 +263,7 @@ class BuilderStatus(styles.Versioned):
         except:
             log.msg("unable to save builder %s" % self.name)
             log.err()
+        self.saveMetadata()
 
     # build cache management
 
@@ -406,11 +501,25 @@ class BuilderStatus(styles.Versioned):
         # interleave two event streams (one from self.getBuild and the other
         # from self.getEvent), which would be simpler than this control flow
 
+        # remember the events and the newest build number, so that a
+        # generator which is kept around (e.g., by the waterfall's event
+        # cache) is not confused by builds or events added after it was
+        # created.  Events are only appended to the list, and prune replaces
+        # it, so there is no need to copy it.
+        events = self.events
+        numEvents = len(events)
+        lastBuildNumber = self.nextBuildNumber - 1
+
+        def getEvent(index):
+            if numEvents + index < 0:
+                return None
+            return events[numEvents + index]
+
         eventIndex = -1
-        e = self.getEvent(eventIndex)
+        e = getEvent(eventIndex)
         branches = set(branches)
-        for Nb in range(1, self.nextBuildNumber + 1):
-            b = self.getBuild(-Nb)
+        for Nb in range(1, lastBuildNumber + 2):
+            b = self.getBuild(lastBuildNumber + 1 - Nb)
             if not b:
                 # HACK: If this is the first build we are looking at, it is
                 # possible it's in progress but locked before it has written a
@@ -437,13 +546,13 @@ class BuilderStatus(styles.Versioned):
                     while e is not None and e.getTimes()[0] > step_start:
                         yield e
                         eventIndex -= 1
-                        e = self.getEvent(eventIndex)
+                        e = getEvent(eventIndex)
                     yield steps[-Ns]
             yield b
         while e is not None:
             yield e
             eventIndex -= 1
-            e = self.getEvent(eventIndex)
+            e = getEvent(eventIndex)
             if e and e.getTimes()[0] < minTime:
                 break
 
@@ -513,10 +622,6 @@ class BuilderStatus(styles.Versioned):
         Steps). Create a BuildStatus object that it can use."""
         number = self.nextBuildNumber
         self.nextBuildNumber += 1
-        # TODO: self.saveYourself(), to make sure we don't forget about the
-        # build number we've just allocated. This is not quite as important
-        # as it was before we switch to determineNextBuildNumber, but I think
-        # it may still be useful to have the new build save itself.
         s = BuildStatus(self, self.master, number)
         s.waitUntilFinished().addCallback(self._buildFinished)
         return s
@@ -13,9 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+import bisect
 import os
 
 from bz2 import BZ2File
+from collections import deque
 from cStringIO import StringIO
 from gzip import GzipFile
 
@@ -48,6 +50,122 @@ class LogFileScanner(netstrings.NetstringParser):
             self.chunk_cb((channel, line[1:]))
 
 
+def _fileSize(f):
+    """Return the size of the (possibly compressed) file C{f}"""
+    try:
+        f.seek(0, 2)
+        return f.tell()
+    except ValueError:
+        # GzipFile can't seek relative to the end; read through instead
+        f.seek(0)
+        size = 0
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                return size
+            size += len(data)
+
+
+def _readChunkHeader(f, offset):
+    """Parse the netstring header of the log chunk at C{offset}.  Return
+    (channel, textOffset, textLength, nextOffset), or None if there is no
+    valid header at that offset."""
+    f.seek(offset)
+    header = f.read(16)
+    colon = header.find(':')
+    if colon < 1 or colon + 1 >= len(header) or not header[:colon].isdigit():
+        return None
+    channel = header[colon + 1]
+    if not channel.isdigit():
+        return None
+    # the netstring is "<length>:<channel><text>,"
+    length = int(header[:colon])
+    textOffset = offset + colon + 2
+    return (int(channel), textOffset, length - 1, offset + colon + 2 + length)
+
+
+def _iterChunkHeaders(f, offset, end):
+    """Yield (channel, textOffset, textLength) for each log chunk between
+    C{offset}, which must be a chunk boundary, and C{end}, reading only the
+    chunk headers."""
+    while offset < end:
+        header = _readChunkHeader(f, offset)
+        if header is None:
+            return
+        channel, textOffset, textLength, offset = header
+        yield channel, textOffset, textLength
+
+
+def _findChunkBoundary(f, start, end):
+    """Find the first chunk boundary at or after C{start}: the first offset
+    from which the chunk headers form an unbroken chain ending exactly at
+    C{end}.  This allows reading a log from somewhere other than its
+    beginning."""
+    if start <= 0:
+        return 0
+    # every chunk ends with ',', so a boundary directly follows one
+    offset = start - 1
+    while offset < end:
+        f.seek(offset)
+        data = f.read(LogFile.BUFFERSIZE)
+        if not data:
+            break
+        comma = data.find(',')
+        while comma != -1:
+            candidate = offset + comma + 1
+            pos = candidate
+            while pos < end:
+                header = _readChunkHeader(f, pos)
+                if header is None:
+                    break
+                pos = header[3]
+                f.seek(pos - 1)
+                if f.read(1) != ',':
+                    break
+            if pos == end:
+                return candidate
+            comma = data.find(',', comma + 1)
+        offset += len(data)
+    return end
+
+
+def _lastLines(chunks, lines):
+    """Return a list of the chunks making up the last C{lines} lines of the
+    (channel, text) tuples in the iterable C{chunks}, which is consumed one
+    chunk at a time."""
+    tail = deque()
+    newlines = 0
+    for chunk in chunks:
+        tail.append(chunk)
+        newlines += chunk[1].count('\n')
+        # drop the oldest chunk once the rest hold enough lines
+        while newlines - tail[0][1].count('\n') > lines:
+            newlines -= tail.popleft()[1].count('\n')
+    chunks = list(tail)
+
+    # walk backwards to the newline before the first wanted line; a
+    # trailing newline does not start another line
+    wanted = lines
+    if chunks and chunks[-1][1].endswith('\n'):
+        wanted += 1
+    for i in range(len(chunks) - 1, -1, -1):
+        channel, text = chunks[i]
+        count = text.count('\n')
+        if count < wanted:
+            wanted -= count
+            continue
+        cut = len(text)
+        for _ in range(wanted):
+            cut = text.rfind('\n', 0, cut)
+        chunks = chunks[i:]
+        if cut + 1 < len(text):
+            chunks[0] = (channel, text[cut + 1:])
+        else:
+            chunks.pop(0)
+        break
+    return chunks
+
+
 class LogFileProducer:
 
     """What's the plan?
@@ -85,14 +203,36 @@ class LogFileProducer:
 
     paused = False
     subscribed = False
+    pending = None
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, tail=None, channels=[]):
         self.logfile = logfile
         self.consumer = consumer
-        self.chunkGenerator = self.getChunks()
+        if tail is not None:
+            self.chunkGenerator = self.getTailChunks(tail, channels)
+        else:
+            self.chunkGenerator = self.getChunks()
         consumer.registerProducer(self, True)
 
+    def getTailChunks(self, lines, channels):
+        # Only the last few lines are read from the file, and then the
+        # consumer follows the log from there.  The consumer may pause us
+        # while we deliver those lines, so new chunks are held in
+        # self.pending until we've caught up.
+        chunks = self.logfile.getTailChunks(lines, channels)
+        self.pending = []
+        self.subscribed = True
+        self.logfile.watchers.append(self)
+        d = self.logfile.waitUntilFinished()
+
+        for chunk in chunks:
+            yield chunk
+        while self.pending:
+            yield self.pending.pop(0)
+        self.pending = None
+        d.addCallback(self.logfileFinished)
+
     def getChunks(self):
         f = self.logfile.getFile()
         offset = 0
@@ -171,9 +311,18 @@ class LogFileProducer:
         # pause anymore
 
     def logChunk(self, build, step, logfile, channel, chunk):
-        if self.consumer:
+        if self.pending is not None:
+            self.pending.append((channel, chunk))
+        elif self.consumer:
             self.consumer.writeChunk((channel, chunk))
 
+    def logChunks(self, build, step, logfile, chunks):
+        if self.pending is not None:
+            self.pending.extend(chunks)
+        elif self.consumer:
+            for chunk in chunks:
+                self.consumer.writeChunk(chunk)
+
     def logfileFinished(self, logfile):
         self.done()
         if self.consumer:
@@ -212,6 +361,18 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None  # relative to the Builder's basedir
     openfile = None
+    _pendingWrites = None
+    # a sparse index of the chunks on disk, built by getTextRange: the file
+    # offset of every chunkIndexInterval'th chunk, and the amount of text
+    # in each channel before it.  _chunkIndexEnd is where the scan stopped.
+    chunkIndexInterval = 64
+    _chunkIndexOffsets = None
+    _chunkIndexTotals = None
+    _chunkIndexEnd = None
+    # size of the uncompressed log, once it is finished; finding the size of
+    # a compressed log means decompressing all of it, so it is found along
+    # with the chunk index, in one pass
+    _uncompressedSize = None
 
     def __init__(self, parent, name, logfilename):
         """
@@ -355,11 +516,7 @@ class LogFile:
             offset = 0
             remaining = None
 
-        leftover = None
-        if self.runEntries and (not channels or
-                                (self.runEntries[0][0] in channels)):
-            leftover = (self.runEntries[0][0],
-                        "".join([c[1] for c in self.runEntries]))
+        leftover = self._getLeftover(channels)
 
         # freeze the state of the LogFile by passing a lot of parameters into
         # a generator
@@ -401,6 +558,195 @@ class LogFile:
             else:
                 yield leftover
 
+    def _getLeftover(self, channels):
+        if self.runEntries and (not channels or
+                                (self.runEntries[0][0] in channels)):
+            return (self.runEntries[0][0],
+                    "".join([c[1] for c in self.runEntries]))
+        return None
+
+    def getTailChunks(self, lines, channels=[]):
+        """
+        Return a list of the chunks making up the last C{lines} lines of the
+        log, limited to the given channels.  Only the end of the log file is
+        read.
+
+        @param lines: number of lines to return
+        @param channels: channels to consider, or an empty list for all
+        @returns: list of (channel, text) tuples
+        """
+        f = self.getFile()
+        leftover = self._getLeftover(channels)
+
+        if isinstance(f, (BZ2File, GzipFile)):
+            # compressed files can only be read from the start efficiently,
+            # so read all of it, keeping no more chunks than needed
+            chunks = self._generateChunks(f, 0, None, leftover, channels,
+                                          False)
+            return _lastLines(chunks, lines)
+
+        end = self._getFileSize(f)
+        window = max(self.BUFFERSIZE, lines * 128)
+        while True:
+            offset = self._findChunkBoundary(f, end - window, end)
+            chunks = list(self._generateChunks(f, offset, end - offset,
+                                               leftover, channels, False))
+            newlines = sum([text.count('\n') for _, text in chunks])
+            if newlines > lines or offset == 0:
+                break
+            window *= 4
+        return _lastLines(chunks, lines)
+
+    def getTextRange(self, first, last, channels=[]):
+        """
+        Return a byte range of the log's text, as it would appear if all of
+        the chunks in the given channels were concatenated.  Only the chunk
+        headers and the chunks overlapping the range are read.
+
+        The arguments follow the HTTP Range header: C{first} and C{last} are
+        both inclusive, C{last} may be None to read to the end of the log,
+        and if C{first} is None then C{last} is the length of a suffix.
+
+        @returns: tuple (first, last, total, text), with first and last set
+        to None if the range can't be satisfied
+        """
+        f = self.getFile()
+        compressed = isinstance(f, (BZ2File, GzipFile))
+        if compressed and self._indexCompressedFile(f):
+            # start again, rather than seeking back from the end
+            f = self.getFile()
+        end = self._getFileSize(f)
+        leftover = self._getLeftover(channels)
+        scanEnd, endTotals = self._updateChunkIndex(f, end)
+
+        def textBefore(totals):
+            if channels:
+                return sum([totals[c] for c in channels])
+            return sum(totals)
+
+        fileTotal = textBefore(endTotals)
+        total = fileTotal
+        if leftover:
+            total += len(leftover[1])
+
+        if first is None:
+            first, last = max(0, total - last), total - 1
+        elif last is None or last >= total:
+            last = total - 1
+        if first > last:
+            return (None, None, total, '')
+
+        # start from the last indexed chunk that begins at or before first
+        lo, hi = 0, len(self._chunkIndexOffsets) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if textBefore(self._chunkIndexTotals[mid]) <= first:
+                lo = mid
+            else:
+                hi = mid - 1
+        offset = self._chunkIndexOffsets[lo]
+        pos = textBefore(self._chunkIndexTotals[lo])
+
+        text = []
+        if compressed:
+            # seeking backwards in a compressed file decompresses it again
+            # from the start, so read the chunks forwards from there
+            for channel, chunk in self._generateChunks(
+                    f, offset, scanEnd - offset, None, channels, False):
+                if pos > last:
+                    break
+                if pos + len(chunk) > first:
+                    text.append(chunk[max(first - pos, 0):last + 1 - pos])
+                pos += len(chunk)
+        else:
+            for channel, textOffset, textLength in \
+                    _iterChunkHeaders(f, offset, scanEnd):
+                if pos > last:
+                    break
+                if channels and channel not in channels:
+                    continue
+                if pos + textLength > first:
+                    start = max(first - pos, 0)
+                    stop = min(last + 1 - pos, textLength)
+                    f.seek(textOffset + start)
+                    text.append(f.read(stop - start))
+                pos += textLength
+        if leftover and fileTotal <= last:
+            start = max(first - fileTotal, 0)
+            text.append(leftover[1][start:last + 1 - fileTotal])
+        return (first, last, total, ''.join(text))
+
+    def _getFileSize(self, f):
+        if self._uncompressedSize is not None:
+            return self._uncompressedSize
+        size = _fileSize(f)
+        if self.finished:
+            self._uncompressedSize = size
+        return size
+
+    def _updateChunkIndex(self, f, end):
+        # extend the chunk index to cover the file up to end, reading only
+        # the headers of the chunks added since the last call; returns the
+        # offset where the chunks stop, and the text totals before it
+        if self._chunkIndexEnd is None:
+            self._chunkIndexOffsets = [0]
+            self._chunkIndexTotals = [(0,) * 10]
+            self._chunkIndexEnd = (0, (0,) * 10, 0)
+        offset, totals, count = self._chunkIndexEnd
+        if offset < end:
+            totals = list(totals)
+            while offset < end:
+                header = _readChunkHeader(f, offset)
+                if header is None:
+                    break
+                channel, _, textLength, offset = header
+                totals[channel] += textLength
+                count += 1
+                if count % self.chunkIndexInterval == 0:
+                    self._chunkIndexOffsets.append(offset)
+                    self._chunkIndexTotals.append(tuple(totals))
+            totals = tuple(totals)
+            self._chunkIndexEnd = (offset, totals, count)
+        return offset, totals
+
+    def _indexCompressedFile(self, f):
+        # a compressed log is finished, so index all of it at once, reading
+        # it forwards in a single pass instead of seeking from one chunk
+        # header to the next; returns True if f was read
+        if (self._uncompressedSize is not None and
+                self._chunkIndexEnd is not None and
+                self._chunkIndexEnd[0] == self._uncompressedSize):
+            return False
+        offsets, totalsList = [0], [(0,) * 10]
+        totals = [0] * 10
+        offset = count = 0
+        for channel, text in self._generateChunks(f, 0, None, None, [],
+                                                  False):
+            totals[channel] += len(text)
+            # each chunk is stored as the netstring "<length>:<channel><text>,"
+            offset += len(str(len(text) + 1)) + len(text) + 3
+            count += 1
+            if count % self.chunkIndexInterval == 0:
+                offsets.append(offset)
+                totalsList.append(tuple(totals))
+        self._chunkIndexOffsets = offsets
+        self._chunkIndexTotals = totalsList
+        self._chunkIndexEnd = (offset, tuple(totals), count)
+        self._uncompressedSize = offset
+        return True
+
+    def _findChunkBoundary(self, f, start, end):
+        # use the chunk index if getTextRange has built one; otherwise,
+        # search near start rather than reading all of the headers
+        if self._chunkIndexEnd is None or start <= 0:
+            return _findChunkBoundary(f, start, end)
+        scanEnd = self._updateChunkIndex(f, end)[0]
+        offset = self._chunkIndexOffsets[
+            bisect.bisect_right(self._chunkIndexOffsets, start) - 1]
+        while offset < start and offset < scanEnd:
+            offset = _readChunkHeader(f, offset)[3]
+        return offset
+
     def readlines(self):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
@@ -422,8 +768,8 @@ class LogFile:
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
-    def subscribeConsumer(self, consumer):
-        p = LogFileProducer(self, consumer)
+    def subscribeConsumer(self, consumer, tail=None, channels=[]):
+        p = LogFileProducer(self, consumer, tail=tail, channels=channels)
         p.resumeProducing()
 
     # interface used by the build steps to add things to the log
@@ -436,15 +782,21 @@ class LogFile:
         channel = self.runEntries[0][0]
         text = "".join([c[1] for c in self.runEntries])
         assert channel < 10, "channel number must be a single decimal digit"
-        f = self.openfile
-        f.seek(0, 2)
+        parts = []
         offset = 0
         while offset < len(text):
             size = min(len(text) - offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset + size])
-            f.write(",")
+            parts.append("%d:%d" % (1 + size, channel))
+            parts.append(text[offset:offset + size])
+            parts.append(",")
             offset += size
+        if self._pendingWrites is not None:
+            # addEntries writes everything at once when it is done
+            self._pendingWrites.extend(parts)
+        else:
+            f = self.openfile
+            f.seek(0, 2)
+            f.write("".join(parts))
         self.runEntries = []
         self.runLength = 0
 
@@ -519,6 +871,52 @@ class LogFile:
 
         self.length += len(text)
 
+    def addEntries(self, entries):
+        """
+        Add several entries to the logfile at once.  This is equivalent to
+        calling L{addEntry} for each entry, but consecutive entries on the
+        same channel are merged, watchers are notified once for the whole
+        batch, and the new data is written to disk with a single write.
+
+        Watchers with a C{logChunks(build, step, log, chunks)} method are
+        given the list of merged C{(channel, text)} chunks; others have
+        C{logChunk} called for each chunk.
+
+        @param entries: list of C{(channel, text)} tuples
+        """
+
+        assert not self.finished, "logfile is already finished"
+
+        chunks = []
+        for channel, text in entries:
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            if chunks and chunks[-1][0] == channel:
+                chunks[-1][1].append(text)
+            else:
+                chunks.append((channel, [text]))
+        chunks = [(channel, "".join(texts)) for channel, texts in chunks]
+
+        build = self.step.build
+        for w in self.watchers:
+            logChunks = getattr(w, 'logChunks', None)
+            if logChunks:
+                logChunks(build, self.step, self, chunks)
+            else:
+                for channel, text in chunks:
+                    w.logChunk(build, self.step, self, channel, text)
+
+        self._pendingWrites = []
+        try:
+            for channel, text in chunks:
+                self.addEntry(channel, text, _no_watchers=True)
+        finally:
+            pending, self._pendingWrites = self._pendingWrites, None
+            if pending:
+                f = self.openfile
+                f.seek(0, 2)
+                f.write("".join(pending))
+
     def addStdout(self, text):
         """
         Shortcut to add stdout text to the logfile
@@ -634,6 +1032,9 @@ class LogFile:
             del d['finished']
         if "openfile" in d:
             del d['openfile']
+        for k in ('_chunkIndexOffsets', '_chunkIndexTotals',
+                  '_chunkIndexEnd', '_uncompressedSize'):
+            d.pop(k, None)
         return d
 
     def __setstate__(self, d):
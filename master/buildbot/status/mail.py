@@ -19,6 +19,7 @@ import types
 import urllib
 
 from StringIO import StringIO
+from collections import deque
 from email.message import Message
 from email.mime.multipart import MIMEMultipart
 from email.mime.nonmultipart import MIMENonMultipart
@@ -26,15 +27,16 @@ from email.mime.text import MIMEText
 from email.utils import formatdate
 
 from twisted.internet import defer
+from twisted.internet import protocol
 from twisted.internet import reactor
 from twisted.python import log as twlog
 from zope.interface import implements
 
 try:
-    from twisted.mail.smtp import ESMTPSenderFactory
-    ESMTPSenderFactory = ESMTPSenderFactory  # for pyflakes
+    from twisted.mail import smtp
+    smtp = smtp  # for pyflakes
 except ImportError:
-    ESMTPSenderFactory = None
+    smtp = None
 
 have_ssl = True
 try:
@@ -53,6 +55,7 @@ from buildbot import interfaces
 from buildbot import util
 from buildbot.process.users import users
 from buildbot.status import base
+from buildbot.status import logfile
 from buildbot.status.results import EXCEPTION
 from buildbot.status.results import FAILURE
 from buildbot.status.results import Results
@@ -92,6 +95,174 @@ class Domain(util.ComparableMixin):
         return name + "@" + self.domain
 
 
+class _QueuedMessage(object):
+    __slots__ = ['text', 'recipients', 'd']
+
+    def __init__(self, text, recipients, d):
+        self.text = text
+        self.recipients = recipients
+        self.d = d
+
+
+if smtp:
+    class _PooledESMTPSender(smtp.ESMTPSender):
+
+        """An ESMTP client which, rather than sending a single message, keeps
+        taking messages from its pool until the pool's queue is empty."""
+
+        current = None
+
+        def getMailFrom(self):
+            self.current = self.factory.pool.nextMessage()
+            if self.current is None:
+                return None  # sends QUIT
+            self.factory.attempted += 1
+            return str(self.factory.pool.fromaddr)
+
+        def getMailTo(self):
+            return self.current.recipients
+
+        def getMailData(self):
+            return StringIO(self.current.text)
+
+        def sentMail(self, code, resp, numOk, addresses, log):
+            msg, self.current = self.current, None
+            if code not in smtp.SUCCESS:
+                errlog = []
+                for addr, acode, aresp in addresses:
+                    if acode not in smtp.SUCCESS:
+                        errlog.append("%s: %03d %s" % (addr, acode, aresp))
+                errlog.append(log.str())
+                msg.d.errback(smtp.SMTPDeliveryError(code, resp,
+                                                     '\n'.join(errlog),
+                                                     addresses))
+            else:
+                msg.d.callback((numOk, addresses))
+
+        def sendError(self, exc):
+            # closes the connection; the pool decides what happens next
+            smtp.SMTPClient.sendError(self, exc)
+            self.factory.error = exc
+            self._failCurrent(exc)
+
+        def connectionLost(self, reason=protocol.connectionDone):
+            smtp.ESMTPSender.connectionLost(self, reason)
+            self._failCurrent(smtp.SMTPConnectError(
+                -1, "Connection lost while sending a message."))
+
+        def _failCurrent(self, exc):
+            msg, self.current = self.current, None
+            if msg is not None:
+                msg.d.errback(exc)
+
+
+class _SMTPPoolFactory(protocol.ClientFactory):
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.attempted = 0
+        self.error = None
+
+    def buildProtocol(self, addr):
+        pool = self.pool
+        p = _PooledESMTPSender(pool.username, pool.password,
+                               pool.contextFactory, smtp.DNSNAME, 20)
+        p.heloFallback = False
+        p.requireAuthentication = bool(pool.username and pool.password)
+        p.requireTransportSecurity = pool.requireTransportSecurity
+        p.factory = self
+        p.timeout = pool.timeout
+        return p
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool.connectionDone(self, reason)
+
+    def clientConnectionLost(self, connector, reason):
+        self.pool.connectionDone(self, reason)
+
+
+class SMTPSenderPool(object):
+
+    """I deliver messages through an SMTP relay, using at most
+    C{maxConnections} connections at a time.  Messages wait in a queue until
+    a connection is free, and each connection keeps sending until the queue
+    is empty, so a burst of mail reuses a few connections instead of opening
+    one per message."""
+
+    _reactor = reactor
+
+    def __init__(self, relayhost, port, fromaddr, username=None,
+                 password=None, contextFactory=None,
+                 requireTransportSecurity=False, maxConnections=2,
+                 timeout=300):
+        self.relayhost = relayhost
+        self.port = port
+        self.fromaddr = fromaddr
+        self.username = username
+        self.password = password
+        self.contextFactory = contextFactory
+        self.requireTransportSecurity = requireTransportSecurity
+        self.maxConnections = maxConnections
+        self.timeout = timeout
+        self.queue = deque()
+        self.factories = []
+        self._idleWaiters = []
+
+    def send(self, text, recipients):
+        """Queue a message for delivery.
+
+        @returns: Deferred that fires when the relay has accepted (or
+        refused) the message
+        """
+        if not smtp:
+            raise RuntimeError("twisted-mail is not installed - cannot "
+                               "send mail")
+        d = defer.Deferred()
+        self.queue.append(_QueuedMessage(text, recipients, d))
+        self._connect()
+        return d
+
+    def waitUntilIdle(self):
+        """
+        @returns: Deferred that fires once every queued message has been
+        handled and all connections are closed
+        """
+        if not self.queue and not self.factories:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._idleWaiters.append(d)
+        return d
+
+    def nextMessage(self):
+        if self.queue:
+            return self.queue.popleft()
+        return None
+
+    def _connect(self):
+        while (len(self.factories) < self.maxConnections and
+               len(self.factories) < len(self.queue)):
+            factory = _SMTPPoolFactory(self)
+            self.factories.append(factory)
+            self._reactor.connectTCP(self.relayhost, self.port, factory)
+
+    def connectionDone(self, factory, reason):
+        self.factories.remove(factory)
+        if self.queue:
+            if factory.attempted:
+                self._connect()
+            elif not self.factories:
+                # the relay can't be reached, or won't talk to us; rather
+                # than retrying forever, fail everything that is waiting
+                error = factory.error or reason.value
+                queue, self.queue = self.queue, deque()
+                for msg in queue:
+                    msg.d.errback(error)
+        if not self.queue and not self.factories:
+            waiters, self._idleWaiters = self._idleWaiters, []
+            for d in waiters:
+                d.callback(None)
+
+
 def defaultMessage(mode, name, build, results, master_status):
     """Generate a buildbot mail message and return a tuple of message text
         and type."""
@@ -204,10 +375,17 @@ class MailNotifier(base.StatusReceiverMultiService):
     compare_attrs = ["extraRecipients", "lookup", "fromaddr", "mode",
                      "categories", "builders", "addLogs", "relayhost",
                      "subject", "sendToInterestedUsers", "customMesg",
-                     "messageFormatter", "extraHeaders"]
+                     "messageFormatter", "extraHeaders", "maxLogLines"]
 
     possible_modes = ("change", "failing", "passing", "problem", "warnings", "exception")
 
+    # number of SMTP connections used to deliver mail
+    smtpConnections = 2
+
+    # number of messages which may be in the works (reading logs, looking up
+    # recipients or waiting for the relay) at once; later builds wait
+    maxPendingMessages = 10
+
     def __init__(self, fromaddr, mode=("failing", "passing", "warnings"),
                  categories=None, builders=None, addLogs=False,
                  relayhost="localhost", buildSetSummary=False,
@@ -217,7 +395,8 @@ class MailNotifier(base.StatusReceiverMultiService):
                  messageFormatter=defaultMessage, extraHeaders=None,
                  addPatch=True, useTls=False,
                  smtpUser=None, smtpPassword=None, smtpPort=25,
-                 previousBuildGetter=defaultGetPreviousBuild):
+                 previousBuildGetter=defaultGetPreviousBuild,
+                 maxLogLines=None):
         """
         @type  fromaddr: string
         @param fromaddr: the email address to be used in the 'From' header.
@@ -271,6 +450,11 @@ class MailNotifier(base.StatusReceiverMultiService):
                         set to a list of log names, to send a subset of the
                         logs. Defaults to False.
 
+        @type  maxLogLines: int
+        @param maxLogLines: if set, only attach the last maxLogLines lines of
+                            each log, reading just the end of the logfile.
+                            Defaults to None (attach whole logs).
+
         @type  addPatch: boolean
         @param addPatch: if True, include the patch when the source stamp
                          includes one.
@@ -373,6 +557,10 @@ class MailNotifier(base.StatusReceiverMultiService):
         self.categories = categories
         self.builders = builders
         self.addLogs = addLogs
+        if maxLogLines is not None and (not isinstance(maxLogLines, int)
+                                        or maxLogLines < 1):
+            config.error("maxLogLines must be a positive integer")
+        self.maxLogLines = maxLogLines
         self.relayhost = relayhost
         if '\n' in subject:
             config.error(
@@ -399,6 +587,8 @@ class MailNotifier(base.StatusReceiverMultiService):
         self.getPreviousBuild = previousBuildGetter
         self.watched = []
         self.master_status = None
+        self.senderPool = None
+        self._messageSlots = defer.DeferredSemaphore(self.maxPendingMessages)
 
         # you should either limit on builders or categories, not both
         if self.builders is not None and self.categories is not None:
@@ -426,12 +616,17 @@ class MailNotifier(base.StatusReceiverMultiService):
 
         base.StatusReceiverMultiService.startService(self)
 
+    @defer.inlineCallbacks
     def stopService(self):
         if self.buildSetSubscription is not None:
             self.buildSetSubscription.unsubscribe()
             self.buildSetSubscription = None
 
-        return base.StatusReceiverMultiService.stopService(self)
+        # let any queued mail go out first
+        if self.senderPool is not None:
+            yield self.senderPool.waitUntilIdle()
+
+        yield base.StatusReceiverMultiService.stopService(self)
 
     def disownServiceParent(self):
         self.master_status.unsubscribe(self)
@@ -654,7 +849,7 @@ class MailNotifier(base.StatusReceiverMultiService):
                                   log.getName())
                 if (self._shouldAttachLog(log.getName()) or
                         self._shouldAttachLog(name)):
-                    text = log.getText()
+                    text = self._getLogText(log)
                     if not isinstance(text, unicode):
                         # guess at the encoding, and use replacement symbols
                         # for anything that's not in that encoding
@@ -688,6 +883,14 @@ class MailNotifier(base.StatusReceiverMultiService):
 
         return defer.succeed(m)
 
+    def _getLogText(self, log):
+        # HTML logs don't have chunks, and are always attached whole
+        if self.maxLogLines and hasattr(log, 'getTailChunks'):
+            chunks = log.getTailChunks(self.maxLogLines,
+                                       [logfile.STDOUT, logfile.STDERR])
+            return ''.join([text for channel, text in chunks])
+        return log.getText()
+
     def buildMessageDict(self, name, build, results):
         if self.customMesg:
             # the customMesg stuff can be *huge*, so we prefer not to load it
@@ -702,6 +905,12 @@ class MailNotifier(base.StatusReceiverMultiService):
         return msgdict
 
     def buildMessage(self, name, builds, results):
+        # a burst of finished builds shouldn't read all of their logs into
+        # memory at once, so limit how many messages are in the works
+        return self._messageSlots.run(self._buildMessage, name, builds,
+                                      results)
+
+    def _buildMessage(self, name, builds, results):
         patches = []
         logs = []
         msgdict = {"body": ""}
@@ -730,17 +939,22 @@ class MailNotifier(base.StatusReceiverMultiService):
         def getRecipients(m):
             # now, who is this message going to?
             if self.sendToInterestedUsers:
-                dl = []
-                for build in builds:
-                    if self.lookup:
-                        d = self.useLookup(build)
-                    else:
-                        d = self.useUsers(build)
-                    dl.append(d)
-                d = defer.gatherResults(dl)
+                if self.lookup:
+                    d = defer.gatherResults([self.useLookup(build)
+                                             for build in builds])
+                elif self._useUsersOverridden():
+                    # a subclass (or instance) still finds recipients a build
+                    # at a time, so keep asking it
+                    d = defer.gatherResults([self.useUsers(build)
+                                             for build in builds])
+                else:
+                    # look up the users for all of the builds in one batch
+                    d = self.useUsersForBuilds(builds)
+                    d.addCallback(lambda contacts: [contacts])
             else:
                 d = defer.succeed([])
             d.addCallback(self._gotRecipients, m)
+            return d
         return d
 
     def useLookup(self, build):
@@ -753,6 +967,22 @@ class MailNotifier(base.StatusReceiverMultiService):
     def useUsers(self, build):
         return users.getBuildContacts(self.master, build, ['email'])
 
+    def useUsersForBuilds(self, builds):
+        """Look up the email addresses of the users responsible for, or
+        interested in, C{builds}.  The users of all of the builds are looked
+        up in one batch.  This is not used if L{useUsers} is overridden.
+
+        @returns: list of addresses via Deferred
+        """
+        return users.getBuildsContacts(self.master, builds, ['email'])
+
+    def _useUsersOverridden(self):
+        if 'useUsers' in self.__dict__:
+            return True
+        useUsers = getattr(type(self), 'useUsers', None)
+        return (getattr(useUsers, 'im_func', useUsers)
+                is not MailNotifier.__dict__['useUsers'])
+
     def _shouldAttachLog(self, logname):
         if isinstance(self.addLogs, bool):
             return self.addLogs
@@ -791,32 +1021,21 @@ class MailNotifier(base.StatusReceiverMultiService):
         return self.sendMessage(m, list(to_recipients | cc_recipients))
 
     def sendmail(self, s, recipients):
-        result = defer.Deferred()
-
-        if have_ssl and self.useTls:
-            client_factory = ssl.ClientContextFactory()
-            client_factory.method = SSLv3_METHOD
-        else:
-            client_factory = None
-
-        if self.smtpUser and self.smtpPassword:
-            useAuth = True
-        else:
-            useAuth = False
-
-        if not ESMTPSenderFactory:
-            raise RuntimeError("twisted-mail is not installed - cannot "
-                               "send mail")
-        sender_factory = ESMTPSenderFactory(
-            self.smtpUser, self.smtpPassword,
-            self.fromaddr, recipients, StringIO(s),
-            result, contextFactory=client_factory,
-            requireTransportSecurity=self.useTls,
-            requireAuthentication=useAuth)
+        if self.senderPool is None:
+            if have_ssl and self.useTls:
+                client_factory = ssl.ClientContextFactory()
+                client_factory.method = SSLv3_METHOD
+            else:
+                client_factory = None
 
-        reactor.connectTCP(self.relayhost, self.smtpPort, sender_factory)
+            self.senderPool = SMTPSenderPool(
+                self.relayhost, self.smtpPort, self.fromaddr,
+                username=self.smtpUser, password=self.smtpPassword,
+                contextFactory=client_factory,
+                requireTransportSecurity=self.useTls,
+                maxConnections=self.smtpConnections)
 
-        return result
+        return self.senderPool.send(s, recipients)
 
     def sendMessage(self, m, recipients):
         s = m.as_string()
@@ -27,10 +27,9 @@ from buildbot.status import buildrequest
 from buildbot.status import buildset
 from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
-from cPickle import load
 from twisted.application import service
 from twisted.internet import defer
-from twisted.persisted import styles
+from twisted.internet import threads
 from twisted.python import log
 from zope.interface import implements
 
@@ -340,48 +339,56 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         """
         @rtype: L{BuilderStatus}
         """
-        filename = os.path.join(self.basedir, basedir, "builder")
-        log.msg("trying to load status pickle from %s" % filename)
-        builder_status = None
-        try:
+        builddir = os.path.join(self.basedir, basedir)
+        saved, nextBuildNumber = self._readBuilderFiles(builddir)
+        return self._makeBuilderStatus(saved, nextBuildNumber, name,
+                                       builddir, category, description)
+
+    def loadBuilder(self, name, basedir, category=None, description=None):
+        """
+        Like L{builderAdded}, but read the builder's metadata from disk in a
+        thread, so that loading many builders neither blocks the reactor nor
+        waits for each builder in turn.
+
+        @returns: L{BuilderStatus} via Deferred
+        """
+        builddir = os.path.join(self.basedir, basedir)
+        d = threads.deferToThread(self._readBuilderFiles, builddir)
+
+        def make(res):
+            saved, nextBuildNumber = res
+            return self._makeBuilderStatus(saved, nextBuildNumber, name,
+                                           builddir, category, description)
+        d.addCallback(make)
+        return d
+
+    def _readBuilderFiles(self, builddir):
+        # this may run in a thread, so it only touches the disk; the pickle
+        # is unpickled later, in the reactor
+        if not os.path.isdir(builddir):
+            os.makedirs(builddir)
+        pickled = None
+        filename = os.path.join(builddir, "builder")
+        if os.path.exists(filename):
             with open(filename, "rb") as f:
-                builder_status = load(f)
-            builder_status.master = self.master
-
-            # (bug #1068) if we need to upgrade, we probably need to rewrite
-            # this pickle, too.  We determine this by looking at the list of
-            # Versioned objects that have been unpickled, and (after doUpgrade)
-            # checking to see if any of them set wasUpgraded.  The Versioneds'
-            # upgradeToVersionNN methods all set this.
-            versioneds = styles.versionedsToUpgrade
-            styles.doUpgrade()
-            if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
-                log.msg("re-writing upgraded builder pickle")
-                builder_status.saveYourself()
-
-        except IOError:
+                pickled = f.read()
+        return pickled, builder.loadNextBuildNumber(builddir)
+
+    def _makeBuilderStatus(self, saved, nextBuildNumber, name, builddir,
+                           category, description):
+        builder_status = builder.BuilderStatus(name, category, self.master,
+                                               description)
+        if saved is None:
             log.msg("no saved status pickle, creating a new one")
-        except:
-            log.msg("error while loading status pickle, creating a new one")
-            log.msg("error follows:")
-            log.err()
-        if not builder_status:
-            builder_status = builder.BuilderStatus(name, category, self.master,
-                                                   description)
             builder_status.addPointEvent(["builder", "created"])
+        else:
+            # everything else comes from the configuration and the metadata,
+            # so the pickle is only loaded when its events are first needed
+            builder_status.setSavedEvents(saved)
         log.msg("added builder %s in category %s" % (name, category))
-        # an unpickled object might not have category set from before,
-        # so set it here to make sure
-        builder_status.category = category
-        builder_status.description = description
-        builder_status.master = self.master
-        builder_status.basedir = os.path.join(self.basedir, basedir)
-        builder_status.name = name  # it might have been updated
+        builder_status.basedir = builddir
         builder_status.status = self
-
-        if not os.path.isdir(builder_status.basedir):
-            os.makedirs(builder_status.basedir)
-        builder_status.determineNextBuildNumber()
+        builder_status.nextBuildNumber = nextBuildNumber
 
         builder_status.setBigState("offline")
 
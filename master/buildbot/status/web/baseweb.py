@@ -32,10 +32,12 @@ from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.change_hook import ChangeHookResource
 from buildbot.status.web.changes import ChangesResource
 from buildbot.status.web.console import ConsoleStatusResource
+from buildbot.status.web.events import StatusEventsResource
 from buildbot.status.web.feeds import Atom10StatusResource
 from buildbot.status.web.feeds import Rss20StatusResource
 from buildbot.status.web.grid import GridStatusResource
 from buildbot.status.web.grid import TransposedGridStatusResource
+from buildbot.status.web.metrics import MetricsTextResource
 from buildbot.status.web.olpb import OneLinePerBuild
 from buildbot.status.web.pngstatus import PngStatusResource
 from buildbot.status.web.root import RootPage
@@ -282,10 +284,11 @@ class WebStatus(service.MultiService):
 
 
         @type  provide_feeds: None or list
-        @param provide_feeds: If empty, provides atom, json, and rss feeds.
-                              Otherwise, a dictionary of strings of
-                              the type of feeds provided.  Current
-                              possibilities are "atom", "json", and "rss"
+        @param provide_feeds: If empty, provides atom, events, json, metrics
+                              and rss feeds.  Otherwise, a dictionary of
+                              strings of the type of feeds provided.  Current
+                              possibilities are "atom", "events", "json",
+                              "metrics" and "rss"
 
         @type  jinja_loaders: None or list
         @param jinja_loaders: If not empty, a list of additional Jinja2 loader
@@ -370,6 +373,7 @@ class WebStatus(service.MultiService):
 
         # create the web site page structure
         self.childrenToBeAdded = {}
+        self.events_resource = None
         self.setupUsualPages(numbuilds=numbuilds, num_events=num_events,
                              num_events_max=num_events_max)
 
@@ -394,7 +398,7 @@ class WebStatus(service.MultiService):
 
         # Set default feeds
         if provide_feeds is None:
-            self.provide_feeds = ["atom", "json", "rss"]
+            self.provide_feeds = ["atom", "events", "json", "metrics", "rss"]
         else:
             self.provide_feeds = provide_feeds
 
@@ -551,6 +555,11 @@ class WebStatus(service.MultiService):
             root.putChild("atom", Atom10StatusResource(status))
         if "json" in self.provide_feeds:
             root.putChild("json", JsonStatusResource(status))
+        if "events" in self.provide_feeds:
+            self.events_resource = StatusEventsResource(status)
+            root.putChild("events", self.events_resource)
+        if "metrics" in self.provide_feeds:
+            root.putChild("metrics", MetricsTextResource(status))
 
         root.putChild("png", PngStatusResource(status))
 
@@ -574,6 +583,13 @@ class WebStatus(service.MultiService):
                 log.err()
         yield service.MultiService.stopService(self)
 
+        # stop any caches and event streams from listening to status events
+        for child_resource in self.childrenToBeAdded.itervalues():
+            if isinstance(child_resource, WaterfallStatusResource):
+                child_resource.eventCache.unsubscribe()
+        if self.events_resource:
+            self.events_resource.hub.unsubscribe()
+
         # having shut them down, now remove our child services so they don't
         # start up again if we're re-started
         if self.http_svc:
@@ -136,6 +136,8 @@ class ChangeHookResource(resource.Resource):
     @defer.inlineCallbacks
     def submitChanges(self, changes, request, src):
         master = request.site.buildbot_service.master
-        for chdict in changes:
-            change = yield master.addChange(src=src, **chdict)
+        # add all of the changes from this request in a single transaction
+        changes = yield master.addChanges([dict(chdict, src=src)
+                                           for chdict in changes])
+        for change in changes:
             log.msg("injected change %s" % change)
@@ -0,0 +1,451 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""Live status updates, pushed to web clients as they happen.
+
+Clients either keep an HTTP connection open and receive server-sent events
+(text/event-stream), or long-poll with ?poll=1 and receive a JSON batch.  In
+both cases each event carries a cursor which can be handed back (as the
+Last-Event-ID header or the since= argument) to resume where the client left
+off."""
+
+from collections import deque
+
+from twisted.internet import interfaces
+from twisted.internet import reactor
+from twisted.python import log
+from twisted.web import resource
+from twisted.web import server
+
+from buildbot import util
+from buildbot.status import base
+from buildbot.util import json
+from zope.interface import implements
+
+
+class StatusEvent(object):
+
+    """A single status update, serialized once and shared by every client"""
+
+    __slots__ = ['seq', 'type', 'builder', 'data', 'frame']
+
+    def __init__(self, seq, cursor, type, builder, data):
+        self.seq = seq
+        self.type = type
+        self.builder = builder
+        self.data = data
+        self.frame = "id: %s\nevent: %s\ndata: %s\n\n" % (
+            cursor, type, json.dumps(data, sort_keys=True, separators=(',', ':')))
+
+
+class _Subscriber(object):
+
+    def __init__(self, request, builders, logs):
+        self.request = request
+        self.builders = builders
+        self.logs = logs
+
+    def wants(self, event):
+        if event.type == 'logChunk' and not self.logs:
+            return False
+        if self.builders and event.builder not in self.builders:
+            return False
+        return True
+
+
+class _StreamSubscriber(_Subscriber):
+
+    """I write events to a text/event-stream response.
+
+    I am the response's producer, so the transport pauses me while the client
+    is not keeping up.  Nothing is queued for me in the meantime: when I am
+    resumed, I send the events I missed from the hub's buffer, or tell the
+    client to reset if they have fallen out of it.  A slow client therefore
+    never holds more of the master's memory than the shared buffer."""
+
+    implements(interfaces.IPushProducer)
+
+    def __init__(self, request, builders, logs, hub, seq):
+        _Subscriber.__init__(self, request, builders, logs)
+        self.hub = hub
+        # the last event this client has been sent (or has skipped)
+        self.seq = seq
+        self.paused = False
+
+    def send(self, events):
+        if self.paused or not events:
+            return False
+        frames = [e.frame for e in events if self.wants(e)]
+        if frames:
+            self.request.write(''.join(frames))
+        self.seq = events[-1].seq
+        return False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.hub.canResume(self.seq):
+            self.send(self.hub.getEventsSince(self.seq))
+        else:
+            self.request.write(self.hub.makeResetFrame())
+            self.seq = self.hub.seq
+
+    def stopProducing(self):
+        self.paused = True
+
+
+class _PollSubscriber(_Subscriber):
+
+    def __init__(self, request, builders, logs, hub, timer):
+        _Subscriber.__init__(self, request, builders, logs)
+        self.hub = hub
+        self.timer = timer
+
+    def send(self, events):
+        events = [e for e in events if self.wants(e)]
+        if not events:
+            return False
+        self.hub.writePollResponse(self.request, events)
+        if self.timer.active():
+            self.timer.cancel()
+        return True  # one batch per long-poll request
+
+
+class StatusEventHub(base.StatusReceiverBase):
+
+    """I listen to the buildmaster's status and fan the resulting events out
+    to every connected web client.
+
+    Each event is converted to a small JSON delta and an SSE frame exactly
+    once, no matter how many clients are listening.  The most recent
+    C{bufferSize} events are kept so that clients can resume after a
+    reconnect; clients whose cursor is too old are told to C{reset} and fetch
+    the complete state again."""
+
+    bufferSize = 1000
+
+    # seconds between buildETAUpdate events for running builds
+    etaInterval = 30
+
+    # seconds between keepalive comments on idle event streams
+    keepaliveInterval = 30
+
+    # seconds to stay subscribed to the status after the last client leaves;
+    # long-poll clients leave after every batch and return right away
+    idleTimeout = 60
+
+    # maximum number of characters of a log chunk sent to clients
+    maxLogChunkSize = 4096
+
+    _reactor = reactor
+
+    def __init__(self, status):
+        self.status = status
+        # cursors from a different hub (e.g., before a restart) can't be
+        # resumed
+        self.generation = '%x' % int(util.now())
+        self.seq = 0
+        self.buffer = deque()
+        self.subscribers = []
+        self.builders = {}
+        self.subscribed = False
+        self.keepalive = None
+        self.idle = None
+
+    def subscribe(self):
+        if self.idle and self.idle.active():
+            self.idle.cancel()
+        self.idle = None
+        if self.subscribed:
+            return
+        self.subscribed = True
+        self.status.subscribe(self)
+
+    def unsubscribe(self):
+        if not self.subscribed:
+            return
+        self.subscribed = False
+        self.status.unsubscribe(self)
+        for builder_status in self.builders.values():
+            builder_status.unsubscribe(self)
+        self.builders = {}
+        subscribers, self.subscribers = self.subscribers, []
+        for sub in subscribers:
+            if isinstance(sub, _PollSubscriber) and sub.timer.active():
+                sub.timer.cancel()
+            if isinstance(sub, _StreamSubscriber):
+                sub.request.unregisterProducer()
+            sub.request.finish()
+        if self.keepalive and self.keepalive.active():
+            self.keepalive.cancel()
+        self.keepalive = None
+        if self.idle and self.idle.active():
+            self.idle.cancel()
+        self.idle = None
+        # events are missed from now on, so none of the cursors handed out
+        # so far can be resumed
+        self.buffer.clear()
+        self.seq += 1
+
+    # cursors
+
+    def makeCursor(self, seq):
+        return '%s-%d' % (self.generation, seq)
+
+    def parseCursor(self, cursor):
+        """Return the sequence number of the last event the client has seen,
+        or None if the cursor can't be resumed."""
+        try:
+            generation, seq = cursor.rsplit('-', 1)
+            seq = int(seq)
+        except ValueError:
+            return None
+        if generation != self.generation or not self.canResume(seq):
+            return None
+        return seq
+
+    def canResume(self, seq):
+        """Return true if the events after C{seq} are all still buffered"""
+        if seq > self.seq:
+            return False
+        if seq < self.seq and (not self.buffer or
+                               seq < self.buffer[0].seq - 1):
+            return False  # fell out of the buffer
+        return True
+
+    def makeResetFrame(self):
+        return "id: %s\nevent: reset\ndata: {}\n\n" % self.makeCursor(self.seq)
+
+    def getEventsSince(self, seq):
+        if not self.buffer or seq >= self.seq:
+            return []
+        start = seq + 1 - self.buffer[0].seq
+        return [self.buffer[i] for i in xrange(start, len(self.buffer))]
+
+    # subscribers
+
+    def addSubscriber(self, sub):
+        self.subscribers.append(sub)
+        if isinstance(sub, _StreamSubscriber) and self.keepalive is None:
+            self.keepalive = self._reactor.callLater(self.keepaliveInterval,
+                                                     self.sendKeepalive)
+
+    def removeSubscriber(self, sub):
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
+        self._maybeIdle()
+
+    def _maybeIdle(self):
+        # stop listening to the status (and to every build) if no client
+        # comes back soon
+        if not self.subscribers and self.subscribed and self.idle is None:
+            self.idle = self._reactor.callLater(self.idleTimeout,
+                                                self.unsubscribe)
+
+    def wantsLogs(self):
+        for sub in self.subscribers:
+            if sub.logs:
+                return True
+        return False
+
+    def sendKeepalive(self):
+        self.keepalive = None
+        streams = [sub for sub in self.subscribers
+                   if isinstance(sub, _StreamSubscriber)]
+        for sub in streams:
+            if not sub.paused:
+                sub.request.write(': keepalive\n\n')
+        if streams:
+            self.keepalive = self._reactor.callLater(self.keepaliveInterval,
+                                                     self.sendKeepalive)
+
+    def writePollResponse(self, request, events, reset=False):
+        # the client has now seen (or skipped) everything up to self.seq
+        body = dict(cursor=self.makeCursor(self.seq),
+                    events=[dict(type=e.type, data=e.data) for e in events])
+        if reset:
+            body['reset'] = True
+        request.write(json.dumps(body, sort_keys=True, separators=(',', ':')))
+        request.finish()
+
+    def publish(self, type, builder, **data):
+        self.seq += 1
+        data['builder'] = builder
+        event = StatusEvent(self.seq, self.makeCursor(self.seq), type,
+                            builder, data)
+        self.buffer.append(event)
+        if len(self.buffer) > self.bufferSize:
+            self.buffer.popleft()
+
+        events = [event]
+        for sub in self.subscribers[:]:
+            try:
+                if sub.send(events):
+                    self.removeSubscriber(sub)
+            except:
+                log.msg("Exception caught sending status event to %r"
+                        % (sub.request,))
+                log.err()
+                self.removeSubscriber(sub)
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        if self.builders.get(builderName) is builder:
+            return None  # already subscribed
+        self.builders[builderName] = builder
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builders.pop(builderName, None)
+        self.publish('builderRemoved', builderName)
+
+    def builderChangedState(self, builderName, state):
+        self.publish('builderChangedState', builderName, state=state)
+
+    def buildStarted(self, builderName, build):
+        self.publish('buildStarted', builderName, number=build.getNumber(),
+                     reason=build.getReason())
+        return (self, self.etaInterval)
+
+    def buildETAUpdate(self, build, ETA):
+        self.publish('buildETAUpdate', build.getBuilder().getName(),
+                     number=build.getNumber(), eta=ETA)
+
+    def stepStarted(self, build, step):
+        self.publish('stepStarted', build.getBuilder().getName(),
+                     number=build.getNumber(), step=step.getName())
+        if self.wantsLogs():
+            return self
+
+    def stepFinished(self, build, step, results):
+        self.publish('stepFinished', build.getBuilder().getName(),
+                     number=build.getNumber(), step=step.getName(),
+                     results=results[0], text=step.getText())
+
+    def logStarted(self, build, step, loog):
+        if self.wantsLogs():
+            return self
+
+    def logChunk(self, build, step, loog, channel, text):
+        if not self.wantsLogs():
+            return
+        if len(text) > self.maxLogChunkSize:
+            text = text[-self.maxLogChunkSize:]
+        self.publish('logChunk', build.getBuilder().getName(),
+                     number=build.getNumber(), step=step.getName(),
+                     log=loog.getName(), channel=channel, text=text)
+
+    def buildFinished(self, builderName, build, results):
+        self.publish('buildFinished', builderName, number=build.getNumber(),
+                     results=results, text=build.getText())
+
+
+class StatusEventsResource(resource.Resource):
+
+    """Streams status events to web clients.
+
+    Arguments:
+      - builder: only send events about this builder (may be repeated)
+      - logs: also send log chunks, if set to 1
+      - since: resume after this cursor (same as the Last-Event-ID header)
+      - poll: if set to 1, wait for the next batch of events and return it
+        as JSON, instead of streaming server-sent events
+      - timeout: the longest a poll request waits before returning an empty
+        batch, in seconds
+    """
+
+    isLeaf = True
+    maxPollTimeout = 60
+
+    def __init__(self, status):
+        resource.Resource.__init__(self)
+        self.hub = StatusEventHub(status)
+
+    def render_GET(self, request):
+        hub = self.hub
+        hub.subscribe()
+
+        builders = set(b for b in request.args.get('builder', []) if b)
+        logs = request.args.get('logs', ['0'])[0] in ('1', 'true')
+        cursor = (request.getHeader('Last-Event-ID')
+                  or request.args.get('since', [None])[0])
+        poll = request.args.get('poll', ['0'])[0] in ('1', 'true')
+
+        seq = None
+        if cursor:
+            seq = hub.parseCursor(cursor)
+        reset = bool(cursor) and seq is None
+        if seq is None:
+            seq = hub.seq
+
+        request.setHeader("Access-Control-Allow-Origin", "*")
+        request.setHeader("Cache-Control", "no-cache")
+        if poll:
+            return self.renderPoll(request, seq, reset, builders, logs)
+        return self.renderStream(request, seq, reset, builders, logs)
+
+    def renderStream(self, request, seq, reset, builders, logs):
+        hub = self.hub
+        request.setHeader("Content-Type", "text/event-stream")
+        sub = _StreamSubscriber(request, builders, logs, hub, hub.seq)
+        request.registerProducer(sub, True)
+        if reset:
+            request.write(hub.makeResetFrame())
+        else:
+            # an initial comment gets the headers out to the client
+            request.write(": %s\n\n" % hub.makeCursor(hub.seq))
+            sub.seq = seq
+            sub.send(hub.getEventsSince(seq))
+        hub.addSubscriber(sub)
+        request.notifyFinish().addBoth(lambda _: hub.removeSubscriber(sub))
+        return server.NOT_DONE_YET
+
+    def renderPoll(self, request, seq, reset, builders, logs):
+        hub = self.hub
+        request.setHeader("Content-Type", "application/json")
+        sub = _PollSubscriber(request, builders, logs, hub, None)
+        # requests answered right away never become subscribers, so they
+        # must start the idle timer that render_GET cancelled
+        if reset:
+            hub.writePollResponse(request, [], reset=True)
+            hub._maybeIdle()
+            return server.NOT_DONE_YET
+        events = [e for e in hub.getEventsSince(seq) if sub.wants(e)]
+        if events:
+            hub.writePollResponse(request, events)
+            hub._maybeIdle()
+            return server.NOT_DONE_YET
+
+        try:
+            timeout = float(request.args.get('timeout', [30])[0])
+        except ValueError:
+            timeout = 30
+        timeout = max(0, min(timeout, self.maxPollTimeout))
+
+        def expire():
+            hub.removeSubscriber(sub)
+            hub.writePollResponse(request, [])
+        sub.timer = hub._reactor.callLater(timeout, expire)
+
+        def cancel(_):
+            hub.removeSubscriber(sub)
+            if sub.timer.active():
+                sub.timer.cancel()
+        request.notifyFinish().addErrback(cancel)
+        hub.addSubscriber(sub)
+        return server.NOT_DONE_YET
@@ -16,6 +16,7 @@
 
 from twisted.python import components
 from twisted.spread import pb
+from twisted.web import http
 from twisted.web import server
 from twisted.web.resource import NoResource
 from twisted.web.resource import Resource
@@ -118,6 +119,43 @@ class TextLog(Resource):
         req.setHeader("content-length", self.original.length)
         return ''
 
+    def _getTail(self, req):
+        try:
+            tail = int(req.args.get("tail", [None])[0])
+        except (TypeError, ValueError):
+            return None
+        return max(tail, 0)
+
+    def _getRange(self, req):
+        # only a single range is supported; anything else gets the whole log
+        header = req.getHeader("range")
+        if not header or not header.startswith("bytes="):
+            return None
+        spec = header[len("bytes="):].strip()
+        if "," in spec or "-" not in spec:
+            return None
+        try:
+            first, last = [int(n) if n.strip() else None
+                           for n in spec.split("-", 1)]
+        except ValueError:
+            return None
+        if first is None and last is None:
+            return None
+        if first is not None and last is not None and last < first:
+            return None
+        return first, last
+
+    def _renderRange(self, req, first, last):
+        first, last, total, text = self.original.getTextRange(
+            first, last, [logfile.STDOUT, logfile.STDERR])
+        if first is None:
+            req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader("content-range", "bytes */%d" % total)
+            return ''
+        req.setResponseCode(http.PARTIAL_CONTENT)
+        req.setHeader("content-range", "bytes %d-%d/%d" % (first, last, total))
+        return text
+
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
@@ -127,6 +165,13 @@ class TextLog(Resource):
         else:
             req.setHeader("Cache-Control", "no-cache")
 
+        if self.asText:
+            req.setHeader("Accept-Ranges", "bytes")
+            byteRange = self._getRange(req)
+            if byteRange:
+                self.req = None
+                return self._renderRange(req, *byteRange)
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")
 
@@ -137,7 +182,18 @@ class TextLog(Resource):
             data = data.encode('utf-8')
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        consumer = ChunkConsumer(req, self)
+        tail = self._getTail(req)
+        if tail is None:
+            self.original.subscribeConsumer(consumer)
+        else:
+            # only read the end of the log, then follow it if it is running
+            if self.asText:
+                channels = [logfile.STDOUT, logfile.STDERR]
+            else:
+                channels = []
+            self.original.subscribeConsumer(consumer, tail=tail,
+                                            channels=channels)
         return server.NOT_DONE_YET
 
     def _setContentType(self, req):
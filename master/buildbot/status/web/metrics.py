@@ -0,0 +1,41 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+"""Master metrics in the Prometheus text exposition format, for scraping by
+monitoring systems.  Rendering only reads the metrics handlers; it does not
+touch any builder or build status objects."""
+
+from twisted.web import resource
+
+
+class MetricsTextResource(resource.Resource):
+
+    isLeaf = True
+    contentType = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, status):
+        resource.Resource.__init__(self)
+        self.status = status
+
+    def render_GET(self, request):
+        request.setHeader('content-type', self.contentType)
+        request.setHeader('cache-control', 'no-cache')
+        metrics = self.status.getMetrics()
+        if not metrics or not metrics.enabled:
+            # metrics are disabled
+            request.setResponseCode(404)
+            return "metrics are disabled\n"
+        return metrics.exposition()
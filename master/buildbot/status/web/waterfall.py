@@ -21,6 +21,7 @@ from twisted.python import components
 from twisted.python import log
 from zope.interface import implements
 
+import itertools
 import locale
 import operator
 import time
@@ -28,6 +29,7 @@ import time
 from buildbot import interfaces
 from buildbot import util
 from buildbot.changes import changes
+from buildbot.status import base
 from buildbot.status import build
 from buildbot.status import builder
 from buildbot.status import buildstep
@@ -365,6 +367,247 @@ class ChangeEventSource(object):
             yield change
 
 
+def _groupEvents(gen, bucketSize):
+    """Split the events yielded by a builder's eventGenerator into groups,
+    each ending with a build, and yield (bucket, group) for each.  The bucket
+    is the start of the C{bucketSize}-second interval in which the group's
+    build started, but is never newer than the bucket of the group before
+    it.  Any events older than the oldest build join its bucket."""
+    bucket = None
+    group = []
+    for e in gen:
+        group.append(e)
+        if isinstance(e, build.BuildStatus):
+            started = e.getTimes()[0]
+            started -= started % bucketSize
+            if bucket is None or started < bucket:
+                bucket = started
+            yield bucket, group
+            group = []
+    if group:
+        yield bucket, group
+
+
+def _spliceGroups(groups, older):
+    """Yield the (bucket, group) pairs from C{groups} until they reach the
+    newest bucket of the C{older} column, and then that column's buckets and
+    the rest of its groups."""
+    for bucket, group in groups:
+        if older is not None and bucket == older.bucket:
+            for pair in list(older.buckets):
+                yield pair
+            if older.truncated:
+                # carry on past the older column's buckets, uncached
+                end = older.buckets[-1][0]
+                groups = (pair for pair in groups if pair[0] < end)
+            else:
+                groups, older.groups = older.groups or [], None
+            for pair in groups:
+                yield pair
+            return
+        if older is not None and bucket < older.bucket:
+            # the older column was not reached, so it is stale
+            older = None
+        yield bucket, group
+
+
+class _FrozenEventColumn(object):
+
+    """The part of one builder's event column which can no longer change,
+    starting at C{bucket}: a list of (bucket, events) pairs, newest first.
+    The buckets are read from C{groups} only as consumers ask for them.
+    Once the column holds C{maxEvents} events, no more buckets are added,
+    and the column is C{truncated}."""
+
+    def __init__(self, bucket, groups, maxEvents=None):
+        self.bucket = bucket
+        self.buckets = []
+        self.groups = groups
+        self.maxEvents = maxEvents
+        self.size = 0
+        self.truncated = False
+
+    def _extend(self):
+        if self.groups is None:
+            return False
+        try:
+            bucket, events = self.groups.next()
+        except StopIteration:
+            self.groups = None
+            return False
+        if self.buckets and self.buckets[-1][0] == bucket:
+            self.buckets[-1][1].extend(events)
+        elif self.maxEvents and self.size >= self.maxEvents:
+            self.groups = None
+            self.truncated = True
+            return False
+        else:
+            self.buckets.append((bucket, list(events)))
+        self.size += len(events)
+        return True
+
+    def __iter__(self):
+        i = j = 0
+        while True:
+            if i < len(self.buckets):
+                events = self.buckets[i][1]
+                if j < len(events):
+                    yield events[j]
+                    j += 1
+                    continue
+                if i + 1 < len(self.buckets):
+                    i, j = i + 1, 0
+                    continue
+            if not self._extend():
+                return
+
+
+class EventColumnCache(base.StatusReceiverBase):
+
+    """I cache the per-builder event columns displayed by the waterfall.
+
+    The events in each column are grouped into buckets by the time their
+    build started.  Once a bucket is over, and every build in it and before
+    it has finished, its events can no longer change, so they are kept
+    between requests; only the newer buckets are recomputed.  Status
+    callbacks about a build drop any cached bucket which might contain
+    it."""
+
+    # length of a bucket, in seconds
+    bucketSize = 600
+
+    # maximum number of distinct filter combinations cached for a builder
+    maxColumnsPerBuilder = 10
+
+    # maximum number of events cached in each column; the cached events keep
+    # their builds in memory, so consumers that go deeper than this walk the
+    # builder's history instead
+    maxEventsPerColumn = 1000
+
+    def __init__(self):
+        self.status = None
+        self.builders = {}
+        self.columns = {}
+
+    def subscribe(self, status):
+        if self.status is status:
+            return
+        self.unsubscribe()
+        self.status = status
+        status.subscribe(self)
+
+    def unsubscribe(self):
+        if self.status is None:
+            return
+        self.status.unsubscribe(self)
+        for builder_status in self.builders.values():
+            builder_status.unsubscribe(self)
+        self.status = None
+        self.builders = {}
+        self.columns = {}
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        if self.builders.get(builderName) is builder:
+            return None  # already subscribed
+        self.builders[builderName] = builder
+        self.columns.pop(builderName, None)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builders.pop(builderName, None)
+        self.columns.pop(builderName, None)
+
+    def buildStarted(self, builderName, build):
+        return self
+
+    def stepStarted(self, build, step):
+        self.invalidate(build)
+
+    def stepFinished(self, build, step, results):
+        self.invalidate(build)
+
+    def buildFinished(self, builderName, build, results):
+        self.invalidate(build)
+
+    def invalidate(self, build):
+        """Forget any cached events which might include C{build}"""
+        name = build.getBuilder().getName()
+        columns = self.columns.get(name)
+        if not columns:
+            return
+        started = build.getTimes()[0]
+        bucket = started - started % self.bucketSize
+        for key, column in columns.items():
+            if column.bucket >= bucket:
+                del columns[key]
+
+    # event generation
+
+    def eventGenerator(self, builder_status, branches, categories,
+                       committers, projects, minTime):
+        """Like L{BuilderStatus.eventGenerator}, but reusing the events
+        cached from earlier calls wherever possible"""
+        if minTime:
+            # time-limited views are rare, and do not walk the whole history
+            return builder_status.eventGenerator(branches, categories,
+                                                 committers, projects, minTime)
+        key = (tuple(branches), tuple(categories), tuple(committers),
+               tuple(projects))
+        return self._cachedEvents(builder_status, key)
+
+    def _cachedEvents(self, builder_status, key):
+        columns = self.columns.setdefault(builder_status.getName(), {})
+        now = util.now()
+        openBucket = now - now % self.bucketSize
+        running = [b.getNumber() for b in builder_status.getCurrentBuilds()]
+        firstRunning = None
+        if running:
+            firstRunning = min(running)
+
+        groups = _groupEvents(builder_status.eventGenerator(*key),
+                              self.bucketSize)
+        lastBucket, frozen = None, False
+        for bucket, group in groups:
+            if frozen and bucket != lastBucket and bucket < openBucket:
+                # this group starts a bucket which is over, and nothing
+                # from here on can change any more
+                column = columns.get(key)
+                if column is None or column.bucket != bucket:
+                    if key not in columns and \
+                            len(columns) >= self.maxColumnsPerBuilder:
+                        columns.clear()
+                    groups = _spliceGroups(
+                        itertools.chain([(bucket, group)], groups), column)
+                    column = columns[key] = _FrozenEventColumn(
+                        bucket, groups, self.maxEventsPerColumn)
+                for e in self._replay(builder_status, key, column):
+                    yield e
+                return
+            for e in group:
+                yield e
+            # new events are only ever added before a finished build, once
+            # no older build is running
+            e = group[-1]
+            frozen = (isinstance(e, build.BuildStatus) and e.isFinished()
+                      and (firstRunning is None
+                           or e.getNumber() < firstRunning))
+            lastBucket = bucket
+
+    def _replay(self, builder_status, key, column):
+        for e in column:
+            yield e
+        if column.truncated:
+            # the column is full; walk the rest of the history uncached
+            end = column.buckets[-1][0]
+            for bucket, group in _groupEvents(
+                    builder_status.eventGenerator(*key), self.bucketSize):
+                if bucket < end:
+                    for e in group:
+                        yield e
+
+
 class WaterfallStatusResource(HtmlResource):
 
     """This builds the main status page, with the waterfall display, and
@@ -375,6 +618,7 @@ class WaterfallStatusResource(HtmlResource):
         self.categories = categories
         self.num_events = num_events
         self.num_events_max = num_events_max
+        self.eventCache = EventColumnCache()
         self.putChild("help", WaterfallHelp(categories))
 
     def getPageTitle(self, request):
@@ -576,7 +820,6 @@ class WaterfallStatusResource(HtmlResource):
 
     def buildGrid(self, request, builders, changes):
         debug = False
-        # TODO: see if we can use a cached copy
 
         showEvents = False
         if request.args.get("show_events", ["false"])[0].lower() == "true":
@@ -641,14 +884,19 @@ class WaterfallStatusResource(HtmlResource):
                 event = None
             return event
 
+        self.eventCache.subscribe(self.getStatus(request))
         for s in sources:
-            gen = insertGaps(s.eventGenerator(filterBranches,
-                                              filterCategories,
-                                              filterCommitters,
-                                              filterProjects,
-                                              minTime),
-                             showEvents,
-                             lastEventTime)
+            if s is commit_source:
+                events = s.eventGenerator(filterBranches, filterCategories,
+                                          filterCommitters, filterProjects,
+                                          minTime)
+            else:
+                events = self.eventCache.eventGenerator(s, filterBranches,
+                                                        filterCategories,
+                                                        filterCommitters,
+                                                        filterProjects,
+                                                        minTime)
+            gen = insertGaps(events, showEvents, lastEventTime)
             sourceGenerators.append(gen)
             # get the first event
             sourceEvents.append(get_event_from(gen))
@@ -17,6 +17,7 @@ import random
 import re
 import shlex
 
+from collections import deque
 from string import capitalize
 from string import join
 from string import lower
@@ -143,6 +144,106 @@ class IrcBuildRequest:
         d.addCallback(self.parent.watchedBuildFinished)
 
 
+class _Broadcast(object):
+
+    def __init__(self, dest, group):
+        self.dest = dest
+        self.group = group
+        self.messages = []
+        self.items = []
+
+
+class OutboundQueue(object):
+
+    """I rate-limit the messages the bot sends to the IRC server, so that it
+    isn't kicked off for flooding.  This is a token bucket: up to C{burst}
+    messages go out at once, then one every C{interval} seconds.
+
+    Replies to commands always go before notifications.  Notifications of the
+    same group, for the same destination, which pile up while waiting are
+    coalesced into a single summary, such as "12 builds completed with
+    failure: a #1, b #7, ..."."""
+
+    _reactor = reactor
+
+    # number of items listed in a summary
+    maxItems = 5
+
+    def __init__(self, sendMessage, burst=5, interval=2.0):
+        self.sendMessage = sendMessage
+        self.burst = burst
+        self.interval = interval
+        self.tokens = burst
+        self.lastRefill = self._reactor.seconds()
+        self.replies = deque()
+        self.broadcasts = []
+        self.timer = None
+
+    def reply(self, send):
+        """Queue a reply; C{send} is called, with no arguments, to send it"""
+        self.replies.append(send)
+        self._run()
+
+    def broadcast(self, dest, message, group, item):
+        """Queue a notification for C{dest}.  C{message} may be a callable,
+        which is only called if the message is sent on its own.  If it is
+        coalesced instead, C{item} names it in the summary for C{group}."""
+        for bcast in self.broadcasts:
+            if bcast.dest == dest and bcast.group == group:
+                break
+        else:
+            bcast = _Broadcast(dest, group)
+            self.broadcasts.append(bcast)
+        bcast.messages.append(message)
+        bcast.items.append(item)
+        self._run()
+
+    def clear(self):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.replies.clear()
+        self.broadcasts = []
+
+    def _run(self):
+        if self.timer is not None:
+            return  # still waiting for a token
+        now = self._reactor.seconds()
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.lastRefill) / self.interval)
+        self.lastRefill = now
+
+        while self.tokens >= 1 and (self.replies or self.broadcasts):
+            self.tokens -= 1
+            try:
+                if self.replies:
+                    self.replies.popleft()()
+                else:
+                    self._sendBroadcast(self.broadcasts.pop(0))
+            except Exception:
+                log.err(None, "while sending an IRC message")
+
+        if self.replies or self.broadcasts:
+            self.timer = self._reactor.callLater(
+                (1 - self.tokens) * self.interval, self._timerFired)
+
+    def _timerFired(self):
+        self.timer = None
+        self._run()
+
+    def _sendBroadcast(self, bcast):
+        if len(bcast.messages) == 1:
+            message = bcast.messages[0]
+            if callable(message):
+                message = message()
+        else:
+            message = "%d %s: %s" % (len(bcast.items), bcast.group,
+                                     ", ".join(bcast.items[:self.maxItems]))
+            if len(bcast.items) > self.maxItems:
+                message += " and %d more" % (len(bcast.items) - self.maxItems)
+        self.sendMessage(bcast.dest, message.encode("ascii", "replace"))
+
+
 class IRCContact(base.StatusReceiver):
     implements(IStatusReceiver)
     """I hold the state for a single user's interaction with the buildbot.
@@ -413,10 +514,11 @@ class IRCContact(base.StatusReceiver):
         if not self.notify_for('started'):
             return
 
-        if self.useRevisions:
-            r = "build containing revision(s) [%s] on %s started" % \
-                (build.getRevisions(), builder.getName())
-        else:
+        def message():
+            if self.useRevisions:
+                return "build containing revision(s) [%s] on %s started" % \
+                    (build.getRevisions(), builder.getName())
+
             # Abbreviate long lists of changes to simply two
             # revisions, and the number of additional changes.
             changes = [str(c.revision) for c in build.getChanges()][:2]
@@ -435,8 +537,10 @@ class IRCContact(base.StatusReceiver):
 
             if changes_str:
                 r += " (%s)" % changes_str
+            return r
 
-        self.send(r)
+        self.broadcast(message, "builds started",
+                       "%s #%d" % (builder.getName(), build.getNumber()))
 
     results_descriptions = {
         SUCCESS: ("Success", 'GREEN'),
@@ -465,22 +569,26 @@ class IRCContact(base.StatusReceiver):
 
         results = self.getResultsDescriptionAndColor(build.getResults())
         if self.reportBuild(builder_name, buildnum):
-            if self.useRevisions:
-                r = "build containing revision(s) [%s] on %s is complete: %s" % \
-                    (buildrevs, builder_name, results[0])
-            else:
-                r = "build #%d of %s is complete: %s" % \
-                    (buildnum, builder_name, results[0])
+            def message():
+                if self.useRevisions:
+                    r = "build containing revision(s) [%s] on %s is complete: %s" % \
+                        (buildrevs, builder_name, results[0])
+                else:
+                    r = "build #%d of %s is complete: %s" % \
+                        (buildnum, builder_name, results[0])
 
-            r += ' [%s]' % maybeColorize(" ".join(build.getText()), results[1], self.useColors)
-            buildurl = self.bot.status.getURLForThing(build)
-            if buildurl:
-                r += "  Build details are at %s" % buildurl
+                r += ' [%s]' % maybeColorize(" ".join(build.getText()), results[1], self.useColors)
+                buildurl = self.bot.status.getURLForThing(build)
+                if buildurl:
+                    r += "  Build details are at %s" % buildurl
 
-            if self.bot.showBlameList and build.getResults() != SUCCESS and len(build.changes) != 0:
-                r += '  blamelist: ' + ', '.join(list(set([c.who for c in build.changes])))
+                if self.bot.showBlameList and build.getResults() != SUCCESS and len(build.changes) != 0:
+                    r += '  blamelist: ' + ', '.join(list(set([c.who for c in build.changes])))
+                return r
 
-            self.send(r)
+            self.broadcast(message,
+                           "builds completed with %s" % lower(results[0]),
+                           "%s #%d" % (builder_name, buildnum))
 
     def notify_for_finished(self, build):
         results = build.getResults()
@@ -814,6 +922,12 @@ class IRCContact(base.StatusReceiver):
         if not self.muted:
             self.bot.describe(self.dest, action.encode("ascii", "replace"))
 
+    def broadcast(self, message, group, item):
+        # notifications may be delayed, and coalesced with others of the same
+        # group; see OutboundQueue
+        if not self.muted:
+            self.bot.broadcast(self.dest, message, group, item)
+
     # main dispatchers for incoming messages
 
     def getCommandMethod(self, command):
@@ -881,6 +995,11 @@ class IrcStatusBot(irc.IRCClient):
     """
     contactClass = IRCContact
 
+    # outgoing messages: up to messageBurst at once, then one every
+    # messageInterval seconds
+    messageBurst = 5
+    messageInterval = 2.0
+
     def __init__(self, nickname, password, channels, pm_to_nicks, status,
                  categories, notify_events, noticeOnChannel=False,
                  useRevisions=False, showBlameList=False, useColors=True):
@@ -899,6 +1018,9 @@ class IrcStatusBot(irc.IRCClient):
         self.useRevisions = useRevisions
         self.showBlameList = showBlameList
         self._keepAliveCall = task.LoopingCall(lambda: self.ping(self.nickname))
+        self.outbox = OutboundQueue(self._msgOrNotice,
+                                    burst=self.messageBurst,
+                                    interval=self.messageInterval)
 
     def connectionMade(self):
         irc.IRCClient.connectionMade(self)
@@ -907,9 +1029,21 @@ class IrcStatusBot(irc.IRCClient):
     def connectionLost(self, reason):
         if self._keepAliveCall.running:
             self._keepAliveCall.stop()
+        self.outbox.clear()
         irc.IRCClient.connectionLost(self, reason)
 
+    # everything the contacts send goes through the outbox
+
     def msgOrNotice(self, dest, message):
+        self.outbox.reply(lambda: self._msgOrNotice(dest, message))
+
+    def describe(self, dest, action):
+        self.outbox.reply(lambda: irc.IRCClient.describe(self, dest, action))
+
+    def broadcast(self, dest, message, group, item):
+        self.outbox.broadcast(dest, message, group, item)
+
+    def _msgOrNotice(self, dest, message):
         if self.noticeOnChannel and dest[0] == '#':
             self.notice(dest, message)
         else:
@@ -15,6 +15,7 @@
 
 import stat
 
+from buildbot import config
 from buildbot.interfaces import BuildSlaveTooOldError
 from buildbot.process import buildstep
 from buildbot.status.results import FAILURE
@@ -128,12 +129,17 @@ class CopyDirectory(SlaveBuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
-    def __init__(self, src, dest, timeout=None, maxTime=None, **kwargs):
+    def __init__(self, src, dest, timeout=None, maxTime=None, method='copy',
+                 **kwargs):
         buildstep.BuildStep.__init__(self, **kwargs)
         self.src = src
         self.dest = dest
         self.timeout = timeout
         self.maxTime = maxTime
+        if method not in ('copy', 'hardlink', 'reflink'):
+            config.error("CopyDirectory: method must be one of 'copy', "
+                         "'hardlink' or 'reflink'")
+        self.method = method
 
     def start(self):
         slavever = self.slaveVersion('cpdir')
@@ -146,6 +152,9 @@ class CopyDirectory(SlaveBuildStep):
             args['timeout'] = self.timeout
         if self.maxTime:
             args['maxTime'] = self.maxTime
+        if self.method != 'copy':
+            # older slaves ignore this, and copy
+            args['method'] = self.method
 
         cmd = buildstep.RemoteCommand('cpdir', args)
         d = self.runCommand(cmd)
@@ -181,16 +190,21 @@ class RemoveDirectory(SlaveBuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
-    def __init__(self, dir, **kwargs):
+    def __init__(self, dir, background=False, **kwargs):
         buildstep.BuildStep.__init__(self, **kwargs)
         self.dir = dir
+        self.background = background
 
     def start(self):
         slavever = self.slaveVersion('rmdir')
         if not slavever:
             raise BuildSlaveTooOldError("slave is too old, does not know "
                                         "about rmdir")
-        cmd = buildstep.RemoteCommand('rmdir', {'dir': self.dir})
+        args = {'dir': self.dir}
+        if self.background:
+            # older slaves ignore this, and remove the directory right away
+            args['background'] = True
+        cmd = buildstep.RemoteCommand('rmdir', args)
         d = self.runCommand(cmd)
         d.addCallback(lambda res: self.commandComplete(cmd))
         d.addErrback(self.failed)
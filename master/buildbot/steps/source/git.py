@@ -62,11 +62,12 @@ class Git(Source):
 
     """ Class for Git with all the smarts """
     name = 'git'
-    renderables = ["repourl", "reference", "branch", "codebase"]
+    renderables = ["repourl", "reference", "branch", "codebase", "mirror"]
 
     def __init__(self, repourl=None, branch='HEAD', mode='incremental', method=None,
                  reference=None, submodules=False, shallow=False, progress=False, retryFetch=False,
-                 clobberOnFailure=False, getDescription=False, config=None, **kwargs):
+                 clobberOnFailure=False, getDescription=False, config=None,
+                 mirror=False, **kwargs):
         """
         @type  repourl: string
         @param repourl: the URL which points at the git repository
@@ -106,6 +107,12 @@ class Git(Source):
 
         @type  config: dict
         @param config: Git configuration options to enable when running git
+
+        @type  mirror: boolean or string
+        @param mirror: Clone using a mirror of the repository kept by the
+                       slave and shared by all of its builders.  A string
+                       gives the directory holding the mirrors, relative to
+                       the builder's directory.
         """
         if not getDescription and not isinstance(getDescription, dict):
             getDescription = False
@@ -123,6 +130,10 @@ class Git(Source):
         self.mode = mode
         self.getDescription = getDescription
         self.config = config
+        if mirror is True:
+            mirror = '../git-mirrors'
+        self.mirror = mirror
+        self.mirrorpath = None
         self.supportsBranch = True
         self.srcdir = 'source'
         Source.__init__(self, **kwargs)
@@ -138,6 +149,8 @@ class Git(Source):
             bbconfig.error("Git: shallow only possible with mode 'full' and method 'clobber'.")
         if not isinstance(self.getDescription, (bool, dict)):
             bbconfig.error("Git: getDescription must be a boolean or a dict.")
+        if self.mirror and self.reference:
+            bbconfig.error("Git: mirror and reference are mutually exclusive.")
 
     def startVC(self, branch, revision, patch):
         self.branch = branch or 'HEAD'
@@ -145,6 +158,18 @@ class Git(Source):
         self.method = self._getMethod()
         self.stdio_log = self.addLogForRemoteCommands("stdio")
 
+        if (self.method not in ('clobber', 'copy') and
+                not self.slaveVersionIsOlderThan('gitsync', '2.19')):
+            d = self._syncOrFallback(patch)
+        else:
+            d = self._updateSourcedir(patch)
+        d.addCallback(self.parseCommitDescription)
+        d.addCallback(self.finish)
+        d.addErrback(self.failed)
+        return d
+
+    def _updateSourcedir(self, patch):
+        """Update the source directory one git command at a time"""
         d = self.checkBranchSupport()
 
         def checkInstall(gitInstalled):
@@ -169,11 +194,55 @@ class Git(Source):
         if patch:
             d.addCallback(self.patch, patch)
         d.addCallback(self.parseGotRevision)
-        d.addCallback(self.parseCommitDescription)
-        d.addCallback(self.finish)
-        d.addErrback(self.failed)
         return d
 
+    @defer.inlineCallbacks
+    def _syncOrFallback(self, patch):
+        """Update an existing source directory with a single slave command,
+           falling back to _updateSourcedir if the slave cannot do that.
+        """
+        cmd = buildstep.RemoteCommand('gitsync',
+                                      {'workdir': self.workdir,
+                                       'repourl': self.repourl,
+                                       'branch': self.branch,
+                                       'revision': self.revision,
+                                       'mode': self.mode,
+                                       'method': self.method,
+                                       'submodules': self.submodules,
+                                       'progress': self.prog,
+                                       'retryFetch': self.retryFetch,
+                                       'config': self.config,
+                                       'env': self.env,
+                                       'logEnviron': self.logEnviron,
+                                       'timeout': self.timeout, })
+        cmd.useLog(self.stdio_log, False)
+        yield self.runCommand(cmd)
+
+        if cmd.updates.get('action', [None])[-1] == 'fallback':
+            res = yield self._updateSourcedir(patch)
+            defer.returnValue(res)
+            return
+
+        if cmd.didFail():
+            if not self.clobberOnFailure:
+                log.msg("Source step failed while running command %s" % cmd)
+                raise buildstep.BuildStepFailed()
+            yield self.clobber()
+            if patch:
+                yield self.patch(None, patch)
+            res = yield self.parseGotRevision()
+            defer.returnValue(res)
+            return
+
+        if patch:
+            yield self.patch(None, patch)
+        revision = cmd.updates['got_revision'][-1]
+        if len(revision) != 40:
+            raise buildstep.BuildStepFailed()
+        log.msg("Got Git revision %s" % (revision, ))
+        self.updateSourceProperty('got_revision', revision)
+        defer.returnValue(0)
+
     @defer.inlineCallbacks
     def full(self):
         if self.method == 'clobber':
@@ -414,6 +483,8 @@ class Git(Source):
             args += ['--depth', '1']
         if self.reference:
             args += ['--reference', self.reference]
+        elif self.mirrorpath:
+            args += ['--reference', self.mirrorpath]
         command = ['clone'] + args + [self.repourl, '.']
 
         if self.prog:
@@ -448,7 +519,11 @@ class Git(Source):
         """Perform full clone and checkout to the revision if specified
            In the case of shallow clones if any of the step fail abort whole build step.
         """
-        d = self._clone(shallowClone)
+        if self.mirror:
+            d = self._updateMirror()
+            d.addCallback(lambda _: self._clone(shallowClone))
+        else:
+            d = self._clone(shallowClone)
         # If revision specified checkout that revision
         if self.revision:
             d.addCallback(lambda _: self._dovccmd(['reset', '--hard',
@@ -462,6 +537,26 @@ class Git(Source):
                                                   shallowClone))
         return d
 
+    @defer.inlineCallbacks
+    def _updateMirror(self):
+        """Have the slave bring its shared mirror of the repository up to
+           date, and use it as the reference repository if it is available.
+        """
+        self.mirrorpath = None
+        if self.slaveVersionIsOlderThan('gitmirror', '2.18'):
+            log.msg("slave does not support git mirrors; cloning directly")
+            return
+        cmd = buildstep.RemoteCommand('gitmirror',
+                                      {'repourl': self.repourl,
+                                       'mirrordir': self.mirror,
+                                       'logEnviron': self.logEnviron,
+                                       'timeout': self.timeout, })
+        cmd.useLog(self.stdio_log, False)
+        yield self.runCommand(cmd)
+        # a failed update of an existing mirror still leaves it usable
+        if cmd.updates.get('mirror'):
+            self.mirrorpath = cmd.updates['mirror'][-1]
+
     def _fullCloneOrFallback(self):
         """Wrapper for _fullClone(). In the case of failure, if clobberOnFailure
            is set to True remove the build directory and try a full clone again.
@@ -17,8 +17,12 @@ from __future__ import with_statement
 
 
 import os.path
+import re
+import shutil
 import tarfile
 import tempfile
+
+from hashlib import sha1
 try:
     from cStringIO import StringIO
     assert StringIO
@@ -33,14 +37,195 @@ from buildbot.process.buildstep import SKIPPED
 from buildbot.process.buildstep import SUCCESS
 from buildbot.util import json
 from buildbot.util.eventual import eventually
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
 from twisted.python import log
+from twisted.python import threadpool
 from twisted.spread import pb
 
 
+class _WriterPool(object):
+
+    """
+    A small, bounded pool of threads shared by all uploads, used to keep disk
+    writes and archive extraction out of the reactor thread.  The pool is
+    started on first use and stopped when the reactor shuts down.
+    """
+
+    maxthreads = 4
+
+    def __init__(self):
+        self.pool = None
+
+    def deferToThread(self, f, *args, **kwargs):
+        if self.pool is None:
+            self.pool = threadpool.ThreadPool(minthreads=0,
+                                              maxthreads=self.maxthreads,
+                                              name='upload writers')
+            self.pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self._stop)
+        return threads.deferToThreadPool(reactor, self.pool, f, *args, **kwargs)
+
+    def _stop(self):
+        pool, self.pool = self.pool, None
+        if pool:
+            pool.stop()
+
+writerPool = _WriterPool()
+
+
+def _hashFile(path):
+    digest = sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+# digests of the files sent by FileDownload, by path, with the size and
+# modification time they were computed for; a file that changes is hashed
+# again
+_digests = {}
+_maxDigests = 1000
+
+
+def _fileDigest(path):
+    st = os.stat(path)
+    path = os.path.abspath(path)
+    stamp = (st.st_size, st.st_mtime)
+    cached = _digests.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = _hashFile(path)
+    if len(_digests) >= _maxDigests:
+        _digests.clear()
+    _digests[path] = (stamp, digest)
+    return digest
+
+
+def _copyFile(src, dest):
+    # copy through a temporary file, so that dest never holds a partial file
+    dirname = os.path.dirname(dest)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmpname = tempfile.mkstemp(dir=dirname)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmpname)
+        # on windows, os.rename does not automatically unlink
+        if os.path.exists(dest):
+            os.unlink(dest)
+        os.rename(tmpname, dest)
+    except:
+        os.unlink(tmpname)
+        raise
+
+
+def _linkFile(src, dest):
+    # the cache and the files it serves hold the same content, so hard link
+    # them where possible, falling back to a copy across filesystems
+    if not hasattr(os, 'link'):
+        return _copyFile(src, dest)
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+    dirname = os.path.dirname(dest)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmpname = tempfile.mkstemp(dir=dirname)
+    os.close(fd)
+    os.unlink(tmpname)
+    try:
+        os.link(src, tmpname)
+    except OSError:
+        return _copyFile(src, dest)
+    try:
+        os.rename(tmpname, dest)
+    except:
+        os.unlink(tmpname)
+        raise
+
+
+# the digest reported by a slave names a file in the master's cache, so it
+# must not be able to name anything else
+_digest_re = re.compile(r'^[0-9a-f]{40}$')
+
+
+# default limit on the total size of the files in each cache, in bytes
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+def _fetchFromCache(cachedir, digest, dest, mode, link=False):
+    if not isinstance(digest, basestring) or not _digest_re.match(digest):
+        log.msg("ignoring invalid upload cache digest %r" % (digest,))
+        return False
+    cached = os.path.join(cachedir, digest)
+    if not os.path.exists(cached):
+        return False
+    if link:
+        _linkFile(cached, dest)
+    else:
+        _copyFile(cached, dest)
+    # mark the entry as recently used, so that pruning keeps it
+    os.utime(cached, None)
+    if mode is not None:
+        os.chmod(dest, mode)
+    return True
+
+
+def _storeInCache(cachedir, path, cachesize, link=False):
+    # store the file under its actual digest, in case it has changed since
+    # the slave computed one
+    cached = os.path.join(cachedir, _hashFile(path))
+    if not os.path.exists(cached):
+        if link:
+            _linkFile(path, cached)
+        else:
+            _copyFile(path, cached)
+    _pruneCache(cachedir, cachesize)
+
+
+def _pruneCache(cachedir, cachesize):
+    # remove the least recently used entries until the cache fits in
+    # cachesize bytes
+    entries = []
+    total = 0
+    for name in os.listdir(cachedir):
+        if not _digest_re.match(name):
+            continue  # a copy in progress
+        path = os.path.join(cachedir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= cachesize:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+
+
 class _FileWriter(pb.Referenceable):
 
     """
     Helper class that acts as a file-object with write access
+
+    The file operations run in the shared writer pool, one at a time for each
+    writer.  The slave waits for each call to return before sending the next
+    block, so a slow disk slows the upload down rather than stalling the
+    reactor or buffering data in the master.
     """
 
     def __init__(self, destfile, maxsize, mode):
@@ -55,6 +240,14 @@ class _FileWriter(pb.Referenceable):
         fd, self.tmpname = tempfile.mkstemp(dir=dirname)
         self.fp = os.fdopen(fd, 'wb')
         self.remaining = maxsize
+        self._pending = defer.succeed(None)
+
+    def _inThread(self, f, *args):
+        # run f in the writer pool once all earlier operations have finished
+        result = defer.Deferred()
+        self._pending.addBoth(lambda _: writerPool.deferToThread(f, *args))
+        self._pending.addBoth(result.callback)
+        return result
 
     def remote_write(self, data):
         """
@@ -64,6 +257,9 @@ class _FileWriter(pb.Referenceable):
         @type  data: C{string}
         @param data: String of data to write
         """
+        return self._inThread(self._write, data)
+
+    def _write(self, data):
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
@@ -73,12 +269,15 @@ class _FileWriter(pb.Referenceable):
             self.fp.write(data)
 
     def remote_utime(self, accessed_modified):
-        os.utime(self.destfile, accessed_modified)
+        return self._inThread(os.utime, self.destfile, accessed_modified)
 
     def remote_close(self):
         """
         Called by remote slave to state that no more data will be transfered
         """
+        return self._inThread(self._close)
+
+    def _close(self):
         self.fp.close()
         self.fp = None
         # on windows, os.rename does not automatically unlink, so do it manually
@@ -92,10 +291,14 @@ class _FileWriter(pb.Referenceable):
     def cancel(self):
         # unclean shutdown, the file is probably truncated, so delete it
         # altogether rather than deliver a corrupted file
+        return self._inThread(self._cancel)
+
+    def _cancel(self):
         fp = getattr(self, "fp", None)
         if fp:
             fp.close()
-            os.unlink(self.destfile)
+            if os.path.exists(self.destfile):
+                os.unlink(self.destfile)
             if self.tmpname and os.path.exists(self.tmpname):
                 os.unlink(self.tmpname)
 
@@ -141,11 +344,17 @@ class _DirectoryWriter(_FileWriter):
     """
     A DirectoryWriter is implemented as a FileWriter, with an added post-processing
     step to unpack the archive, once the transfer has completed.
+
+    If given, C{progress} is called in the reactor thread with the number of
+    files unpacked so far, every C{progressInterval} files.
     """
 
-    def __init__(self, destroot, maxsize, compress, mode):
+    progressInterval = 100
+
+    def __init__(self, destroot, maxsize, compress, mode, progress=None):
         self.destroot = destroot
         self.compress = compress
+        self.progress = progress
 
         self.fd, self.tarname = tempfile.mkstemp()
         os.close(self.fd)
@@ -157,8 +366,11 @@ class _DirectoryWriter(_FileWriter):
         Called by remote slave to state that no more data will be transfered
         """
         # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
+        d = self.remote_close()
+        d.addCallback(lambda _: self._inThread(self._unpack))
+        return d
 
+    def _unpack(self):
         # Map configured compression to a TarFile setting
         if self.compress == 'bz2':
             mode = 'r|bz2'
@@ -173,10 +385,21 @@ class _DirectoryWriter(_FileWriter):
 
         # Unpack archive and clean up after self
         archive = tarfile.open(name=self.tarname, mode=mode)
-        archive.extractall(path=self.destroot)
-        archive.close()
+        try:
+            archive.extractall(path=self.destroot,
+                               members=self._countMembers(archive))
+        finally:
+            archive.close()
         os.remove(self.tarname)
 
+    def _countMembers(self, archive):
+        count = 0
+        for tarinfo in archive:
+            yield tarinfo
+            count += 1
+            if self.progress and count % self.progressInterval == 0:
+                reactor.callFromThread(self.progress, count)
+
 
 def makeStatusRemoteCommand(step, remote_command, args):
     self = buildstep.RemoteCommand(remote_command, args, decodeRC={None: SUCCESS, 0: SUCCESS})
@@ -197,6 +420,7 @@ class _TransferBuildStep(BuildStep):
 
     haltOnFailure = True
     flunkOnFailure = True
+    cache = False
 
     def __init__(self, workdir=None, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
@@ -213,6 +437,19 @@ class _TransferBuildStep(BuildStep):
         if self.workdir is None:
             self.workdir = workdir
 
+    def _useCache(self):
+        # a truncated transfer cannot be served from the cache
+        return (self.cache and self.maxsize is None
+                and not self.slaveVersionIsOlderThan("fileCache", "2.20"))
+
+    def _fileCacheCommand(self, action, **args):
+        args['action'] = action
+        args['workdir'] = self._getWorkdir()
+        cmd = buildstep.RemoteCommand('fileCache', args)
+        d = self.runCommand(cmd)
+        d.addCallback(lambda _: cmd)
+        return d
+
     def _getWorkdir(self):
         if self.workdir is None:
             workdir = self.DEFAULT_WORKDIR
@@ -246,8 +483,8 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 keepstamp=False, url=None,
-                 **buildstep_kwargs):
+                 keepstamp=False, url=None, cache=False,
+                 cachesize=DEFAULT_CACHE_SIZE, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -260,6 +497,8 @@ class FileUpload(_TransferBuildStep):
         self.mode = mode
         self.keepstamp = keepstamp
         self.url = url
+        self.cache = cache
+        self.cachesize = cachesize
 
     def start(self):
         self.checkSlaveVersion("uploadFile")
@@ -278,14 +517,54 @@ class FileUpload(_TransferBuildStep):
         if self.url is not None:
             self.addURL(os.path.basename(masterdest), self.url)
 
-        # we use maxsize to limit the amount of data on both sides
-        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
-
         if self.keepstamp and self.slaveVersionIsOlderThan("uploadFile", "2.13"):
             m = ("This buildslave (%s) does not support preserving timestamps. "
                  "Please upgrade the buildslave." % self.build.slavename)
             raise BuildSlaveTooOldError(m)
 
+        if self._useCache():
+            d = self._cachedUpload(source, masterdest)
+        else:
+            d = self._upload(source, masterdest)
+        d.addCallback(self.finished).addErrback(self.failed)
+
+    @defer.inlineCallbacks
+    def _cachedUpload(self, source, masterdest):
+        # ask the slave for the digest of the file first, and skip the
+        # transfer if the master already has a file with that content
+        cachedir = os.path.join(self.master.basedir, 'upload-cache')
+        # a hard link shares its mode and timestamps with the cache entry, so
+        # only link files that keep the defaults
+        link = self.mode is None and not self.keepstamp
+        cmd = yield self._fileCacheCommand('digest', file=source)
+        if not cmd.didFail():
+            digest = cmd.updates['digest'][-1]
+            cached = yield writerPool.deferToThread(
+                _fetchFromCache, cachedir, digest, masterdest, self.mode, link)
+            if cached:
+                if self.keepstamp:
+                    yield writerPool.deferToThread(
+                        os.utime, masterdest, tuple(cmd.updates['stamp'][-1]))
+                self.step_status.setText(['uploaded',
+                                          os.path.basename(source),
+                                          '(cached)'])
+                self.cmd = cmd
+                return
+
+        yield self._upload(source, masterdest)
+        if not self.cmd.didFail():
+            try:
+                yield writerPool.deferToThread(_storeInCache, cachedir,
+                                               masterdest, self.cachesize,
+                                               link)
+            except Exception:
+                log.err(None, "while storing %r in the upload cache"
+                        % masterdest)
+
+    def _upload(self, source, masterdest):
+        # we use maxsize to limit the amount of data on both sides
+        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
+
         # default arguments
         args = {
             'slavesrc': source,
@@ -303,12 +582,13 @@ class FileUpload(_TransferBuildStep):
         def cancel(res):
             fileWriter.cancel()
             return res
-        d.addCallback(self.finished).addErrback(self.failed)
+        return d
 
 
 class DirectoryUpload(_TransferBuildStep):
 
     name = 'upload'
+    progressMetrics = ('files',)
 
     renderables = ['slavesrc', 'masterdest', 'url']
 
@@ -345,7 +625,8 @@ class DirectoryUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
 
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress,
+                                     0600, progress=self._unpackProgress)
 
         # default arguments
         args = {
@@ -366,6 +647,11 @@ class DirectoryUpload(_TransferBuildStep):
             return res
         d.addCallback(self.finished).addErrback(self.failed)
 
+    def _unpackProgress(self, count):
+        self.setProgress('files', count)
+        self.step_status.setText(['unpacking', os.path.basename(self.slavesrc),
+                                  '(%d files)' % count])
+
     def finished(self, result):
         # Subclasses may choose to skip a transfer. In those cases, self.cmd
         # will be None, and we should just let BuildStep.finished() handle
@@ -373,6 +659,10 @@ class DirectoryUpload(_TransferBuildStep):
         if result == SKIPPED:
             return BuildStep.finished(self, SKIPPED)
 
+        # drop any unpacking progress from the step text
+        self.step_status.setText(['uploading',
+                                  os.path.basename(self.slavesrc)])
+
         if self.cmd.didFail():
             return BuildStep.finished(self, FAILURE)
         return BuildStep.finished(self, SUCCESS)
@@ -420,7 +710,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 **buildstep_kwargs):
+                 cache=False, cachesize=DEFAULT_CACHE_SIZE, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.mastersrc = mastersrc
@@ -431,6 +721,8 @@ class FileDownload(_TransferBuildStep):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
+        self.cache = cache
+        self.cachesize = cachesize
 
     def start(self):
         self.checkSlaveVersion("downloadFile")
@@ -458,9 +750,41 @@ class FileDownload(_TransferBuildStep):
             return
         fileReader = _FileReader(fp)
 
+        if self._useCache():
+            d = self._cachedDownload(source, fileReader)
+        else:
+            d = self._download(fileReader)
+        d.addCallback(self.finished).addErrback(self.failed)
+
+    @defer.inlineCallbacks
+    def _cachedDownload(self, source, fileReader):
+        # send the digest of the file first, and skip the transfer if the
+        # slave already has a file with that content
+        digest = yield writerPool.deferToThread(_fileDigest, source)
+        cmd = yield self._fileCacheCommand('fetch', file=self.slavedest,
+                                           digest=digest, mode=self.mode)
+        if not cmd.didFail() and cmd.updates['cached'][-1]:
+            fileReader.remote_close()
+            self.step_status.setText(['downloaded', "to",
+                                      os.path.basename(self.slavedest),
+                                      '(cached)'])
+            self.cmd = cmd
+            return
+
+        yield self._download(fileReader)
+        if not self.cmd.didFail():
+            # failing to cache the file is not a reason to fail the step
+            try:
+                yield self._fileCacheCommand('store', file=self.slavedest,
+                                             cachesize=self.cachesize)
+            except Exception:
+                log.err(None, "while storing %r in the slave's file cache"
+                        % self.slavedest)
+
+    def _download(self, fileReader):
         # default arguments
         args = {
-            'slavedest': slavedest,
+            'slavedest': self.slavedest,
             'maxsize': self.maxsize,
             'reader': fileReader,
             'blocksize': self.blocksize,
@@ -469,8 +793,7 @@ class FileDownload(_TransferBuildStep):
         }
 
         self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runCommand(self.cmd)
-        d.addCallback(self.finished).addErrback(self.failed)
+        return self.runCommand(self.cmd)
 
 
 class StringDownload(_TransferBuildStep):
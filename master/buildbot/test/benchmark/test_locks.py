@@ -0,0 +1,98 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import time
+
+from buildbot import locks
+from buildbot.util import eventual
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class LockBenchmark(unittest.TestCase):
+
+    # number of steps waiting on the lock
+    WAITERS = 5000
+    MAX_COUNT = 40
+
+    def setUp(self):
+        self.lockid = locks.MasterLock('bench', maxCount=self.MAX_COUNT)
+        self.lock = locks.BaseLock('bench', maxCount=self.MAX_COUNT)
+        self.counting = locks.LockAccess(self.lockid, 'counting')
+        self.exclusive = locks.LockAccess(self.lockid, 'exclusive')
+
+    def tearDown(self):
+        return eventual.flushEventualQueue()
+
+    def report(self, what, count, elapsed):
+        log.msg("%s: %d operations in %.3fs (%.1fus each)"
+                % (what, count, elapsed, elapsed / count * 1e6))
+
+    def fill(self, exclusiveEvery=None):
+        for i in xrange(self.MAX_COUNT):
+            self.lock.claim(('owner', i), self.counting)
+        for i in xrange(self.WAITERS):
+            access = self.counting
+            if exclusiveEvery and i % exclusiveEvery == 0:
+                access = self.exclusive
+            self.lock.waitUntilMaybeAvailable(i, access)
+
+    def test_isAvailable(self):
+        self.fill()
+        start = time.time()
+        # every waiter polls the lock, as the build chooser does
+        for i in xrange(self.WAITERS):
+            self.lock.isAvailable(i, self.counting)
+        self.report("isAvailable with %d waiters" % self.WAITERS,
+                    self.WAITERS, time.time() - start)
+
+    def test_claim_release(self):
+        self.fill(exclusiveEvery=100)
+        start = time.time()
+        owners = [(('owner', i), self.counting)
+                  for i in xrange(self.MAX_COUNT)]
+        ops = 0
+        # release the oldest owner, and let the head of the queue claim
+        while owners:
+            owner, access = owners.pop(0)
+            self.lock.release(owner, access)
+            ops += 1
+            while self.lock.waiting:
+                w_owner = self.lock.waiting.head()
+                w_access, d = self.lock.waiting.get(w_owner)
+                if not self.lock.isAvailable(w_owner, w_access):
+                    break
+                self.lock.claim(w_owner, w_access)
+                owners.append((w_owner, w_access))
+                ops += 1
+        self.assertEqual(len(self.lock.waiting), 0)
+        self.report("claim/release with %d waiters" % self.WAITERS,
+                    ops, time.time() - start)
+
+    def test_stopWaiting(self):
+        self.fill()
+        start = time.time()
+        # waiters give up from the middle of the queue
+        for i in xrange(self.WAITERS / 2, self.WAITERS):
+            access, d = self.lock.waiting.get(i)
+            self.lock.stopWaitingUntilAvailable(i, access, d)
+        self.report("stopWaitingUntilAvailable with %d waiters" % self.WAITERS,
+                    self.WAITERS / 2, time.time() - start)
+
+
+# delete this test case entirely if benchmarks are not enabled
+if 'BUILDBOT_BENCHMARK' not in os.environ:
+    del LockBenchmark
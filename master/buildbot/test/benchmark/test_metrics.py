@@ -0,0 +1,95 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+import os
+import random
+import time
+
+from buildbot.process import metrics
+from buildbot.test.fake import fakemaster
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class MetricsBenchmark(unittest.TestCase):
+
+    EVENTS = 100000
+
+    def setUp(self):
+        rand = random.Random(1234)
+        # timings spread over several orders of magnitude
+        self.samples = [rand.lognormvariate(-5, 2) for i in xrange(self.EVENTS)]
+
+    def report(self, what, count, elapsed):
+        log.msg("%s: %d events in %.3fs (%.2fus each)"
+                % (what, count, elapsed, elapsed / count * 1e6))
+
+    def test_handle(self):
+        averages = metrics.AveragingFiniteList()
+        start = time.time()
+        for v in self.samples:
+            averages.append(v)
+        self.report("AveragingFiniteList.append", self.EVENTS,
+                    time.time() - start)
+
+        hist = metrics.Histogram()
+        start = time.time()
+        for v in self.samples:
+            hist.add(v)
+        self.report("Histogram.add", self.EVENTS, time.time() - start)
+
+        handler = metrics.MetricTimeHandler(None)
+        events = [metrics.MetricTimeEvent('timer', v) for v in self.samples]
+        start = time.time()
+        for ev in events:
+            handler.handle({}, ev)
+        self.report("MetricTimeHandler.handle", self.EVENTS,
+                    time.time() - start)
+
+        handler = metrics.MetricCountHandler(None)
+        events = [metrics.MetricCountEvent('counter', labels={'kind': i % 5})
+                  for i in xrange(self.EVENTS)]
+        start = time.time()
+        for ev in events:
+            handler.handle({}, ev)
+        self.report("MetricCountHandler.handle, labelled", self.EVENTS,
+                    time.time() - start)
+
+    def test_log(self):
+        observer = metrics.MetricLogObserver()
+        observer.parent = master = fakemaster.make_master()
+        master.config.db['db_poll_interval'] = 60
+        master.config.metrics = dict(log_interval=0, periodic_interval=0)
+        observer.startService()
+        observer.reconfigService(master.config)
+        try:
+            start = time.time()
+            for v in self.samples:
+                metrics.MetricTimeEvent.log('timer', v)
+            self.report("MetricTimeEvent.log", self.EVENTS,
+                        time.time() - start)
+
+            start = time.time()
+            for i in xrange(100):
+                observer.exposition()
+            self.report("exposition", 100, time.time() - start)
+        finally:
+            observer.stopService()
+
+
+# delete this test case entirely if benchmarks are not enabled
+if 'BUILDBOT_BENCHMARK' not in os.environ:
+    del MetricsBenchmark
@@ -0,0 +1,91 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import time
+
+from buildbot.process.properties import Interpolate
+from buildbot.process.properties import Properties
+from buildbot.process.properties import WithProperties
+from twisted.internet import defer
+from twisted.python import log
+from twisted.trial import unittest
+
+
+def makeProperties():
+    props = Properties()
+    for i in range(30):
+        props.setProperty('prop%d' % i, 'value%d' % i, 'bench')
+    props.setProperty('branch', 'trunk', 'bench')
+    props.setProperty('empty', '', 'bench')
+    return props
+
+
+def makeRenderables(count=200):
+    # the kind of arguments found in a large factory
+    fmts = [
+        "make -C build/%(prop:prop1)s BRANCH=%(prop:branch)s",
+        "%(prop:prop2:-default)s/%(prop:missing:-other)s",
+        "%(prop:empty:~fallback)s-%(prop:prop3:~x)s",
+        "%(prop:branch:?|release|dev)s %(prop:prop4:+--flag)s",
+    ]
+    renderables = []
+    for i in range(count):
+        if i % 5 == 4:
+            renderables.append(
+                WithProperties("%(prop5)s/%(missing:-x)s/%(branch)s"))
+        else:
+            renderables.append(Interpolate(fmts[i % len(fmts)]))
+    return renderables
+
+
+class PropertiesBenchmark(unittest.TestCase):
+
+    def report(self, what, count, elapsed):
+        log.msg("%s: %d renders in %.3fs (%.1fus each)"
+                % (what, count, elapsed, elapsed / count * 1e6))
+
+    @defer.inlineCallbacks
+    def time(self, what, render, builds=100):
+        props = makeProperties()
+        renderables = makeRenderables()
+        start = time.time()
+        for i in xrange(builds):
+            rendered = yield defer.gatherResults(
+                [render(props, r) for r in renderables])
+        self.report(what, builds * len(renderables), time.time() - start)
+        defer.returnValue(rendered)
+
+    @defer.inlineCallbacks
+    def test_render(self):
+        def uncompiled(props, r):
+            # rendering as it was done before format strings were compiled
+            if isinstance(r, WithProperties):
+                return defer.succeed(r._renderWithPropertyMap(props))
+            d = props.render(r.interpolations)
+            d.addCallback(lambda res: r.fmtstring % res)
+            return d
+
+        def compiled(props, r):
+            return props.render(r)
+
+        old = yield self.time("uncompiled", uncompiled)
+        new = yield self.time("compiled", compiled)
+        self.assertEqual(new, old)
+
+
+# delete this test case entirely if benchmarks are not enabled
+if 'BUILDBOT_BENCHMARK' not in os.environ:
+    del PropertiesBenchmark
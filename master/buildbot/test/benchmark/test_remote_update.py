@@ -0,0 +1,119 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+import mock
+import os
+import random
+import time
+
+from buildbot import config
+from buildbot.process import buildstep
+from buildbot.status import logfile
+from buildbot.test.util import dirs
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class Watcher:
+
+    def __init__(self):
+        self.bytes = 0
+
+    def logChunk(self, build, step, log, channel, text):
+        self.bytes += len(text)
+
+
+def recordedStream(messages=2000, updatesPerMessage=4, seed=1234):
+    # an update stream like the one a slave sends for a noisy compile: each
+    # update carries a few interleaved stdout/stderr segments, and several
+    # updates arrive in each message
+    rand = random.Random(seed)
+    stream = []
+    num = 0
+    for i in xrange(messages):
+        updates = []
+        for j in xrange(updatesPerMessage):
+            segments = []
+            for k in xrange(rand.randint(1, 8)):
+                line = "gcc -c -O2 -o obj/file%d.o src/file%d.c\n" % (num, k)
+                if rand.random() < 0.2:
+                    segments.append(('stderr', 'warning: ' + line))
+                else:
+                    segments.append(('stdout', line))
+            num += 1
+            updates.append(({'segments': segments}, num))
+        stream.append(updates)
+    return stream
+
+
+class RemoteUpdateBenchmark(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.stream = recordedStream()
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def report(self, what, count, elapsed):
+        log.msg("%s: %d messages in %.3fs (%.1fus each)"
+                % (what, count, elapsed, elapsed / count * 1e6))
+
+    def makeCommand(self):
+        step = mock.Mock(name='build_step_status')
+        step.build.builder.basedir = self.basedir
+        loog = logfile.LogFile(step, 'stdio', 'bench-stdio')
+        loog.master = mock.Mock()
+        loog.master.config = config.MasterConfig()
+        watcher = Watcher()
+        loog.watchers.append(watcher)
+
+        cmd = buildstep.RemoteCommand('shell', {})
+        cmd.active = True
+        cmd.buildslave = mock.Mock()
+        cmd.logs = {'stdio': loog}
+        cmd._closeWhenFinished = {'stdio': True}
+        return cmd, loog, watcher
+
+    def replay(self, what, deliver):
+        cmd, loog, watcher = self.makeCommand()
+        start = time.time()
+        for updates in self.stream:
+            deliver(cmd, updates)
+        loog.finish()
+        self.report(what, len(self.stream), time.time() - start)
+        return loog, watcher
+
+    def test_remote_update(self):
+        def unbatched(cmd, updates):
+            for update, num in updates:
+                cmd.remoteUpdate(update)
+
+        def batched(cmd, updates):
+            cmd.remote_update(updates)
+
+        loog1, watcher1 = self.replay("one update at a time", unbatched)
+        text1 = loog1.getText()
+        loog2, watcher2 = self.replay("batched remote_update", batched)
+        # both paths must produce the same log
+        self.assertEqual(loog2.getText(), text1)
+        self.assertEqual(watcher1.bytes, watcher2.bytes)
+
+
+# delete this test case entirely if benchmarks are not enabled
+if 'BUILDBOT_BENCHMARK' not in os.environ:
+    del RemoteUpdateBenchmark
@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+from buildbot import locks
 from twisted.application import service
 
 
@@ -28,7 +29,9 @@ class FakeBotMaster(service.MultiService):
 
     def getLockByID(self, lockid):
         if not lockid in self.locks:
-            self.locks[lockid] = lockid.lockClass(lockid)
+            lock = self.locks[lockid] = lockid.lockClass(lockid)
+            if isinstance(lockid, locks.DistributedMasterLock):
+                lock.master = self.master
         # if the master.cfg file has changed maxCount= on the lock, the next
         # time a build is started, they'll get a new RealLock instance. Note
         # that this requires that MasterLock and SlaveLock (marker) instances
@@ -41,5 +44,8 @@ class FakeBotMaster(service.MultiService):
     def getBuildersForSlave(self, slavename):
         return self.builders.get(slavename, [])
 
+    def builderConfigChanged(self, builder):
+        pass
+
     def maybeStartBuildsForSlave(self, slavename):
         self.buildsStartedForSlaves.append(slavename)
@@ -24,6 +24,7 @@ import copy
 
 from buildbot.db import buildrequests
 from buildbot.util import datetime2epoch
+from buildbot.util import epoch2datetime
 from buildbot.util import json
 from twisted.internet import defer
 from twisted.internet import reactor
@@ -275,6 +276,21 @@ class Buildslave(Row):
     required_columns = ('name', )
 
 
+class LockLease(Row):
+    table = "lock_leases"
+
+    defaults = dict(
+        id=None,
+        name='lock',
+        objectid=None,
+        mode='counting',
+        heartbeat_at=0,
+    )
+
+    id_column = 'id'
+    required_columns = ('objectid', )
+
+
 class Object(Row):
     table = "objects"
 
@@ -380,6 +396,16 @@ class FakeChangesComponent(FakeDBComponent):
 
     # component methods
 
+    def pruneChanges(self, changeHorizon, limit=None):
+        if not changeHorizon:
+            return defer.succeed(0)
+        old = sorted(self.changes)[:-changeHorizon]
+        if limit is not None:
+            old = old[:limit]
+        for changeid in old:
+            del self.changes[changeid]
+        return defer.succeed(len(old))
+
     def addChange(self, author=None, files=None, comments=None, is_dir=0,
                   revision=None, when_timestamp=None, branch=None,
                   category=None, revlink='', properties={}, repository='',
@@ -403,10 +429,18 @@ class FakeChangesComponent(FakeDBComponent):
             project=project,
             codebase=codebase,
             files=files,
-            properties=properties)
+            properties=properties,
+            uids=uid and [uid] or [])
 
         return defer.succeed(changeid)
 
+    def addChanges(self, changes):
+        changeids = []
+        for kwargs in changes:
+            d = self.addChange(**kwargs)
+            d.addCallback(changeids.append)
+        return defer.succeed(changeids)
+
     def getLatestChangeid(self):
         if self.changes:
             return defer.succeed(max(self.changes.iterkeys()))
@@ -420,6 +454,15 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(self._chdict(row))
 
+    def getChangesById(self, changeids):
+        chdicts = []
+        for changeid in changeids:
+            if changeid in self.changes:
+                chdicts.append(self._chdict(self.changes[changeid]))
+            else:
+                chdicts.append(None)
+        return defer.succeed(chdicts)
+
     def getChangeUids(self, changeid):
         try:
             ch_uids = self.changes[changeid]['uids']
@@ -427,6 +470,10 @@ class FakeChangesComponent(FakeDBComponent):
             ch_uids = []
         return defer.succeed(ch_uids)
 
+    def getChangeUidsById(self, changeids):
+        return defer.succeed([self.changes.get(changeid, {}).get('uids', [])
+                              for changeid in changeids])
+
     def getRecentChanges(self, count):
         ids = sorted(self.changes.keys())
         chdicts = [self._chdict(self.changes[id]) for id in ids[-count:]]
@@ -726,6 +773,17 @@ class FakeBuildsetsComponent(FakeDBComponent):
         row = self.buildsets[bsid]
         return defer.succeed(self._row2dict(row))
 
+    def pruneBuildsets(self, buildsetHorizon, limit=None):
+        if not buildsetHorizon:
+            return defer.succeed(0)
+        old = sorted(self.buildsets)[:-buildsetHorizon]
+        old = [bsid for bsid in old if self.buildsets[bsid]['complete']]
+        if limit is not None:
+            old = old[:limit]
+        for bsid in old:
+            del self.buildsets[bsid]
+        return defer.succeed(len(old))
+
     def getBuildsets(self, complete=None):
         rv = []
         for bs in self.buildsets.itervalues():
@@ -886,6 +944,55 @@ class FakeBuildslavesComponent(FakeDBComponent):
         return defer.succeed(None)
 
 
+class FakeLocksComponent(FakeDBComponent):
+
+    def setUp(self):
+        self.leases = {}
+        self.id_num = 0
+
+    def insertTestData(self, rows):
+        for row in rows:
+            if isinstance(row, LockLease):
+                self.leases[row.id] = dict(leaseid=row.id, name=row.name,
+                                           objectid=row.objectid,
+                                           mode=row.mode,
+                                           heartbeat_at=row.heartbeat_at)
+
+    # component methods
+
+    def addLease(self, name, objectid, mode, _reactor=reactor):
+        self.id_num = max(self.id_num, max(self.leases or [0])) + 1
+        self.leases[self.id_num] = dict(leaseid=self.id_num, name=name,
+                                        objectid=objectid, mode=mode,
+                                        heartbeat_at=_reactor.seconds())
+        return defer.succeed(self.id_num)
+
+    def getLeases(self, name):
+        leases = [dict(l, heartbeat_at=epoch2datetime(l['heartbeat_at']))
+                  for l in self.leases.itervalues() if l['name'] == name]
+        leases.sort(key=lambda l: l['leaseid'])
+        return defer.succeed(leases)
+
+    def refreshLeases(self, leaseids, _reactor=reactor):
+        for leaseid in leaseids:
+            if leaseid in self.leases:
+                self.leases[leaseid]['heartbeat_at'] = _reactor.seconds()
+        return defer.succeed(None)
+
+    def removeLeases(self, leaseids):
+        for leaseid in leaseids:
+            self.leases.pop(leaseid, None)
+        return defer.succeed(None)
+
+    def expireLeases(self, name, old, _reactor=reactor):
+        old_epoch = _reactor.seconds() - old
+        expired = [l['leaseid'] for l in self.leases.itervalues()
+                   if l['name'] == name and l['heartbeat_at'] < old_epoch]
+        for leaseid in expired:
+            del self.leases[leaseid]
+        return defer.succeed(len(expired))
+
+
 class FakeStateComponent(FakeDBComponent):
 
     def setUp(self):
@@ -1245,6 +1352,21 @@ class FakeUsersComponent(FakeDBComponent):
             usdict = self._user2dict(uid)
         return defer.succeed(usdict)
 
+    def getUsersByUids(self, uids):
+        usdicts = {}
+        for uid in uids:
+            if uid in self.users:
+                usdicts[uid] = self._user2dict(uid)
+        return defer.succeed(usdicts)
+
+    def getUsersByUsernames(self, usernames):
+        usdicts = {}
+        for uid in self.users:
+            username = self.users[uid]['bb_username']
+            if username in usernames:
+                usdicts[username] = self._user2dict(uid)
+        return defer.succeed(usdicts)
+
     def getUserByUsername(self, username):
         usdict = None
         for uid in self.users:
@@ -1331,6 +1453,8 @@ class FakeDBConnector(object):
         self._components.append(comp)
         self.users = comp = FakeUsersComponent(self, testcase)
         self._components.append(comp)
+        self.locks = comp = FakeLocksComponent(self, testcase)
+        self._components.append(comp)
 
     def setup(self):
         self.is_setup = True
@@ -54,6 +54,10 @@ class FakeStatus(object):
     def builderAdded(self, name, basedir, category=None, description=None):
         return FakeBuilderStatus()
 
+    def loadBuilder(self, name, basedir, category=None, description=None):
+        return defer.succeed(self.builderAdded(name, basedir, category,
+                                               description))
+
     def slaveConnected(self, name):
         pass
 
@@ -81,6 +85,12 @@ class FakeBuilderStatus(object):
     def setBigState(self, state):
         pass
 
+    def addPointEvent(self, text):
+        pass
+
+    def saveYourself(self):
+        pass
+
 
 class FakeMaster(object):
 
@@ -24,8 +24,8 @@ class FakeRequest(Mock):
 
     """
     A fake Twisted Web Request object, including some pointers to the
-    buildmaster and an addChange method on that master which will append its
-    arguments to self.addedChanges.
+    buildmaster and addChange and addChanges methods on that master which
+    will append their arguments to self.addedChanges.
     """
 
     written = ''
@@ -49,6 +49,11 @@ class FakeRequest(Mock):
             return defer.succeed(Mock())
         master.addChange = addChange
 
+        def addChanges(changelist):
+            self.addedChanges.extend(changelist)
+            return defer.succeed([Mock() for _ in changelist])
+        master.addChanges = addChanges
+
         self.deferred = defer.Deferred()
 
     def write(self, data):
@@ -95,7 +95,7 @@ class TestAbstractBuildSlave(unittest.TestCase):
         old.missing_timer = mock.Mock(name='missing_timer')
         yield old.startService()
 
-        new_config = mock.Mock()
+        new_config = config.MasterConfig()
         new_config.protocols = {'pb': {'port': new_port}}
         new_config.slaves = [new]
 
@@ -128,6 +128,36 @@ class TestAbstractBuildSlave(unittest.TestCase):
         self.assertEqual(self.master.pbmanager._registrations, [])
         self.assertTrue(old.updateSlave.called)
 
+    @defer.inlineCallbacks
+    def test_reconfigService_unchanged(self):
+        old = self.ConcreteBuildSlave('bot', 'pass', properties={'a': 'b'})
+        old.updateSlave = mock.Mock(side_effect=lambda: defer.succeed(None))
+        yield self.do_test_reconfigService(
+            old, 'tcp:1234', self.ConcreteBuildSlave('bot', 'pass',
+                                                     properties={'a': 'b'}),
+            'tcp:1234')
+        properties = old.properties
+        old.updateLocks = mock.Mock()
+
+        # reconfig with an identical slave, as loaded from master.cfg
+        new_config = config.MasterConfig()
+        new_config.protocols = {'pb': {'port': 'tcp:1234'}}
+        new_config.slaves = [self.ConcreteBuildSlave('bot', 'pass',
+                                                     properties={'a': 'b'})]
+        yield old.reconfigService(new_config)
+
+        self.assertIdentical(old.properties, properties)
+        self.assertFalse(old.updateLocks.called)
+        # the builders for this slave may still have changed
+        self.assertEqual(old.updateSlave.call_count, 2)
+
+        new_config.slaves = [self.ConcreteBuildSlave('bot', 'pass',
+                                                     properties={'a': 'c'})]
+        yield old.reconfigService(new_config)
+
+        self.assertEqual(old.properties.getProperty('a'), 'c')
+        self.assertTrue(old.updateLocks.called)
+
     @defer.inlineCallbacks
     def test_reconfigService_has_properties(self):
         old = self.ConcreteBuildSlave('bot', 'pass')
@@ -166,11 +196,11 @@ class TestAbstractBuildSlave(unittest.TestCase):
         slave = self.createBuildslave()
         yield slave.startService()
 
-        config = mock.Mock()
-        config.protocols = {'pb': {'port': 'tcp:1234'}}
-        config.slaves = [slave]
+        new_config = config.MasterConfig()
+        new_config.protocols = {'pb': {'port': 'tcp:1234'}}
+        new_config.slaves = [slave]
 
-        yield slave.reconfigService(config)
+        yield slave.reconfigService(new_config)
         yield slave.stopService()
 
         self.assertEqual(self.master.pbmanager._unregistrations, [('tcp:1234', 'bot')])
@@ -20,6 +20,7 @@ import os
 from buildbot.changes import mail
 from buildbot.test.util import changesource
 from buildbot.test.util import dirs
+from twisted.internet import defer
 from twisted.trial import unittest
 
 
@@ -102,3 +103,64 @@ class TestMaildirSource(changesource.ChangeSourceMixin, dirs.DirsMixin,
             self.assertEqual(self.changes_added[0]['src'], 'bzr')
         d.addCallback(check)
         return d
+
+    def test_messagesReceived(self):
+        self.populateMaildir()
+        with open(os.path.join(self.maildir, "new", "othermsg"), "w") as f:
+            f.write("Subject: other\n\nthis is another test")
+        mds = mail.MaildirSource(self.maildir)
+        self.attachChangeSource(mds)
+
+        def parse(message, prefix):
+            if 'this is a test' in message.get_payload():
+                return ('svn', dict(fake_chdict=1))
+            return ('git', dict(fake_chdict=2))
+        mds.parse = parse
+        addChanges = self.master.addChanges
+        batches = []
+        self.master.addChanges = lambda changelist: \
+            batches.append(changelist) or addChanges(changelist)
+
+        d = mds.messagesReceived(['newmsg', 'othermsg', 'missingmsg'])
+
+        def check(_):
+            self.assertMailProcessed()
+            # the messages are parsed first, and their changes added together
+            self.assertEqual(batches, [[dict(fake_chdict=1, src='svn'),
+                                        dict(fake_chdict=2, src='git')]])
+            self.assertEqual(len(self.flushLoggedErrors()), 1)
+        d.addCallback(check)
+        return d
+
+    def test_messagesReceived_addChanges_fails(self):
+        self.populateMaildir()
+        with open(os.path.join(self.maildir, "new", "othermsg"), "w") as f:
+            f.write("Subject: other\n\nthis is another test")
+        mds = mail.MaildirSource(self.maildir)
+        self.attachChangeSource(mds)
+
+        def parse(message, prefix):
+            if 'this is a test' in message.get_payload():
+                return ('svn', dict(fake_chdict=1))
+            return ('git', dict(fake_chdict=2))
+        mds.parse = parse
+        self.master.addChanges = lambda changelist: \
+            defer.fail(RuntimeError("oh noes"))
+        addChange = self.master.addChange
+
+        def addChangeOrFail(**kwargs):
+            if kwargs['fake_chdict'] == 2:
+                return defer.fail(RuntimeError("not this one"))
+            return addChange(**kwargs)
+        self.master.addChange = addChangeOrFail
+
+        d = mds.messagesReceived(['newmsg', 'othermsg'])
+
+        def check(_):
+            # the batch failed, so the changes were added one at a time,
+            # and the one which still failed was logged
+            self.assertEqual(self.changes_added,
+                             [dict(fake_chdict=1, src='svn')])
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 2)
+        d.addCallback(check)
+        return d
@@ -149,6 +149,11 @@ class TestChangePerspective(unittest.TestCase):
             return defer.succeed(mock.Mock())
         self.master.addChange = addChange
 
+        def addChanges(changelist):
+            self.added_changes.extend(changelist)
+            return defer.succeed([mock.Mock() for _ in changelist])
+        self.master.addChanges = addChanges
+
     def test_addChange_noprefix(self):
         cp = pb.ChangePerspective(self.master, None)
         d = cp.perspective_addChange(dict(who="bar", files=['a']))
@@ -159,6 +164,20 @@ class TestChangePerspective(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addChanges(self):
+        cp = pb.ChangePerspective(self.master, 'xx/')
+        d = cp.perspective_addChanges([dict(who="bar", files=['xx/a']),
+                                       dict(who="baz", files=('xx/b',),
+                                            revlink=None)])
+
+        def check(res):
+            self.assertEqual(res, None)
+            self.assertEqual(self.added_changes,
+                             [dict(author="bar", files=['a']),
+                              dict(author="baz", files=['b'], revlink='')])
+        d.addCallback(check)
+        return d
+
     def test_addChange_codebase(self):
         cp = pb.ChangePerspective(self.master, None)
         d = cp.perspective_addChange(dict(who="bar", files=[], codebase='cb'))
@@ -47,6 +47,7 @@ global_defaults = dict(
     eventHorizon=50,
     logHorizon=None,
     buildHorizon=None,
+    buildsetHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
     logMaxTailSize=None,
@@ -329,6 +330,28 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
             self.basedir, self.filename)
         self.assertIsInstance(rv, config.MasterConfig)
 
+    def test_getBuilderConfig(self):
+        cfg = config.MasterConfig()
+        b1 = mock.Mock(name='b1')
+        b1.name = 'b1'
+        cfg.builders = [b1]
+        self.assertIdentical(cfg.getBuilderConfig('b1'), b1)
+        self.assertEqual(cfg.getBuilderConfig('b2'), None)
+        # the index follows changes to the list
+        b2 = mock.Mock(name='b2')
+        b2.name = 'b2'
+        cfg.builders.append(b2)
+        self.assertIdentical(cfg.getBuilderConfig('b2'), b2)
+        cfg.builders = [b2]
+        self.assertEqual(cfg.getBuilderConfig('b1'), None)
+
+    def test_getSlave(self):
+        cfg = config.MasterConfig()
+        sl = mock.Mock(slavename='sl')
+        cfg.slaves = [sl]
+        self.assertIdentical(cfg.getSlave('sl'), sl)
+        self.assertEqual(cfg.getSlave('other'), None)
+
 
 class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
 
@@ -409,6 +432,10 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_changeHorizon_none(self):
         self.do_test_load_global(dict(changeHorizon=None), changeHorizon=None)
 
+    def test_load_global_buildsetHorizon(self):
+        self.do_test_load_global(dict(buildsetHorizon=1000),
+                                 buildsetHorizon=1000)
+
     def test_load_global_eventHorizon(self):
         self.do_test_load_global(dict(eventHorizon=10), eventHorizon=10)
 
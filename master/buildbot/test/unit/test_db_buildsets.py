@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import datetime
+import sqlalchemy as sa
 
 from buildbot.db import buildsets
 from buildbot.test.fake import fakedb
@@ -38,7 +39,8 @@ class TestBuildsetsConnectorComponent(
         d = self.setUpConnectorComponent(
             table_names=['patches', 'changes', 'sourcestamp_changes',
                          'buildsets', 'buildset_properties', 'objects',
-                         'buildrequests', 'sourcestamps', 'sourcestampsets'])
+                         'buildrequests', 'sourcestamps', 'sourcestampsets',
+                         'builds', 'buildrequest_claims'])
 
         def finish_setup(_):
             self.db.buildsets = buildsets.BuildsetsConnectorComponent(self.db)
@@ -455,3 +457,89 @@ class TestBuildsetsConnectorComponent(
             self.assertEqual(bsdictlist, [])
         d.addCallback(check)
         return d
+
+    def insert_test_pruneBuildsets_data(self):
+        return self.insertTestData([
+            fakedb.Object(id=9),
+            fakedb.Change(changeid=1),
+            fakedb.Patch(id=5, patch_author='me', patch_comment='fix'),
+            fakedb.SourceStampSet(id=1),
+            fakedb.SourceStamp(id=11, sourcestampsetid=1, patchid=5),
+            fakedb.SourceStampChange(sourcestampid=11, changeid=1),
+            fakedb.SourceStampSet(id=4),
+            fakedb.SourceStamp(id=14, sourcestampsetid=4),
+            fakedb.SourceStampSet(id=6),
+            fakedb.SourceStamp(id=16, sourcestampsetid=6),
+
+            fakedb.Buildset(id=1, sourcestampsetid=1, complete=1),
+            fakedb.BuildsetProperty(buildsetid=1),
+            fakedb.BuildRequest(id=10, buildsetid=1),
+            fakedb.BuildRequestClaim(brid=10, objectid=9, claimed_at=10),
+            fakedb.Build(id=20, brid=10),
+            # not yet complete, so never pruned
+            fakedb.Buildset(id=2, sourcestampsetid=234, complete=0),
+            fakedb.BuildRequest(id=12, buildsetid=2),
+            # source stamp set 234 is shared with buildset 5
+            fakedb.Buildset(id=3, sourcestampsetid=234, complete=1),
+            fakedb.Buildset(id=4, sourcestampsetid=4, complete=1),
+            fakedb.BuildRequest(id=14, buildsetid=4),
+            fakedb.Buildset(id=5, sourcestampsetid=234, complete=1),
+            fakedb.Buildset(id=6, sourcestampsetid=6, complete=1),
+        ])
+
+    def getTableIds(self):
+        def thd(conn):
+            model = self.db.model
+            results = {}
+            for tbl, col in [(model.buildsets, 'id'),
+                             (model.buildset_properties, 'buildsetid'),
+                             (model.buildrequests, 'id'),
+                             (model.buildrequest_claims, 'brid'),
+                             (model.builds, 'id'),
+                             (model.sourcestampsets, 'id'),
+                             (model.sourcestamps, 'id'),
+                             (model.sourcestamp_changes, 'sourcestampid'),
+                             (model.patches, 'id')]:
+                r = conn.execute(sa.select([tbl.c[col]]))
+                results[tbl.name] = sorted([row[0] for row in r.fetchall()])
+            return results
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets(self):
+        yield self.insert_test_pruneBuildsets_data()
+        count = yield self.db.buildsets.pruneBuildsets(2)
+        self.assertEqual(count, 3)
+        ids = yield self.getTableIds()
+        self.assertEqual(ids, {
+            'buildsets': [2, 5, 6],
+            'buildset_properties': [],
+            'buildrequests': [12],
+            'buildrequest_claims': [],
+            'builds': [],
+            'sourcestampsets': [6, 234],
+            'sourcestamps': [16, 234],
+            'sourcestamp_changes': [],
+            'patches': [],
+        })
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets_limit(self):
+        yield self.insert_test_pruneBuildsets_data()
+        count = yield self.db.buildsets.pruneBuildsets(2, limit=2)
+        self.assertEqual(count, 2)
+        ids = yield self.getTableIds()
+        self.assertEqual((ids['buildsets'], ids['buildrequests']),
+                         ([2, 4, 5, 6], [12, 14]))
+        count = yield self.db.buildsets.pruneBuildsets(2, limit=2)
+        self.assertEqual(count, 1)
+        count = yield self.db.buildsets.pruneBuildsets(2, limit=2)
+        self.assertEqual(count, 0)
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets_None(self):
+        yield self.insert_test_pruneBuildsets_data()
+        count = yield self.db.buildsets.pruneBuildsets(None)
+        self.assertEqual(count, 0)
+        ids = yield self.getTableIds()
+        self.assertEqual(ids['buildsets'], [1, 2, 3, 4, 5, 6])
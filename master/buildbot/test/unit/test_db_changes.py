@@ -145,6 +145,46 @@ class TestChangesConnectorComponent(
         d.addCallback(check14)
         return d
 
+    def test_getChangesById(self):
+        d = self.insertTestData(self.change13_rows + self.change14_rows)
+
+        def get(_):
+            return self.db.changes.getChangesById([14, 99, 13])
+        d.addCallback(get)
+
+        def check(chdicts):
+            self.assertEqual(chdicts[0], self.change14_dict)
+            self.assertEqual(chdicts[1], None)
+            self.assertEqual(chdicts[2]['changeid'], 13)
+            self.assertEqual(sorted(chdicts[2]['files']),
+                             [u'master/README.txt', u'slave/README.txt'])
+            self.assertEqual(chdicts[2]['properties'],
+                             {u'notest': (u'no', u'Change')})
+        d.addCallback(check)
+        return d
+
+    def test_getChangesById_many(self):
+        rows = []
+        for changeid in range(1, 251):
+            rows.extend([
+                fakedb.Change(changeid=changeid, author="me",
+                              when_timestamp=266738400),
+                fakedb.ChangeFile(changeid=changeid,
+                                  filename='f%d' % changeid),
+            ])
+        d = self.insertTestData(rows)
+
+        def get(_):
+            return self.db.changes.getChangesById(range(1, 251))
+        d.addCallback(get)
+
+        def check(chdicts):
+            self.assertEqual([(chd['changeid'], chd['files'])
+                              for chd in chdicts],
+                             [(i, [u'f%d' % i]) for i in range(1, 251)])
+        d.addCallback(check)
+        return d
+
     def test_Change_fromChdict_with_chdict(self):
         # test that the chdict getChange returns works with Change.fromChdict
         d = Change.fromChdict(mock.Mock(), self.change14_dict)
@@ -321,6 +361,34 @@ class TestChangesConnectorComponent(
         d.addCallback(check_change_users)
         return d
 
+    def test_addChanges(self):
+        clock = task.Clock()
+        clock.advance(1239898353)
+        d = self.db.changes.addChanges([
+            dict(author=u'dustin', files=[u'a'], comments=u'one',
+                 revision=u'2d6caa52', branch=u'master',
+                 properties={u'x': (1, u'Change')}),
+            dict(author=u'tom', files=[u'b', u'c'], comments=u'two',
+                 revision=u'f00ba7', branch=u'master'),
+        ], _reactor=clock)
+
+        def check(changeids):
+            self.assertEqual(len(changeids), 2)
+            self.assertTrue(changeids[0] < changeids[1])
+            return defer.gatherResults([self.db.changes.getChange(changeid)
+                                        for changeid in changeids])
+        d.addCallback(check)
+
+        def check_chdicts(chdicts):
+            self.assertEqual([(ch['author'], ch['comments'], sorted(ch['files']),
+                               ch['properties']) for ch in chdicts],
+                             [(u'dustin', u'one', [u'a'], {u'x': (1, u'Change')}),
+                              (u'tom', u'two', [u'b', u'c'], {})])
+            self.assertEqual(chdicts[1]['when_timestamp'],
+                             epoch2datetime(1239898353))
+        d.addCallback(check_chdicts)
+        return d
+
     def test_addChange_with_uid(self):
         d = self.insertTestData([
             fakedb.User(uid=1, identifier="one"),
@@ -419,6 +487,22 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getChangeUidsById(self):
+        d = self.insertTestData(self.change14_rows + self.change13_rows + [
+            fakedb.User(uid=1, identifier="one"),
+            fakedb.User(uid=2, identifier="two"),
+            fakedb.ChangeUser(changeid=14, uid=1),
+            fakedb.ChangeUser(changeid=14, uid=2),
+        ])
+        d.addCallback(lambda _:
+                      self.db.changes.getChangeUidsById([14, 13, 99]))
+
+        def check(res):
+            self.assertEqual([sorted(uids) for uids in res],
+                             [[1, 2], [], []])
+        d.addCallback(check)
+        return d
+
     def test_pruneChanges(self):
         d = self.insertTestData([
             fakedb.Object(id=29),
@@ -494,6 +578,28 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_pruneChanges_limit(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=n)
+            for n in xrange(1, 151)
+        ])
+
+        d.addCallback(lambda _: self.db.changes.pruneChanges(10, limit=120))
+
+        def check(count):
+            self.assertEqual(count, 120)
+
+            def thd(conn):
+                tbl = self.db.model.changes
+                r = conn.execute(sa.select([tbl.c.changeid]))
+                self.assertEqual(sorted([row[0] for row in r.fetchall()]),
+                                 range(121, 151))
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        d.addCallback(lambda _: self.db.changes.pruneChanges(10, limit=120))
+        d.addCallback(lambda count: self.assertEqual(count, 20))
+        return d
+
     def test_pruneChanges_None(self):
         d = self.insertTestData(self.change13_rows)
 
@@ -66,17 +66,18 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
 
     def test_doCleanup_unconfigured(self):
         self.db.changes.pruneChanges = mock.Mock(
-            return_value=defer.succeed(None))
+            return_value=defer.succeed(0))
         self.db._doCleanup()
         self.assertFalse(self.db.changes.pruneChanges.called)
 
     def test_doCleanup_configured(self):
         self.db.changes.pruneChanges = mock.Mock(
-            return_value=defer.succeed(None))
+            return_value=defer.succeed(0))
         d = self.startService()
 
         @d.addCallback
         def check(_):
+            self.master.config.changeHorizon = 10
             self.db._doCleanup()
             self.assertTrue(self.db.changes.pruneChanges.called)
         return d
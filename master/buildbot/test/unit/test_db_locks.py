@@ -0,0 +1,123 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+from buildbot.db import locks
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import connector_component
+from buildbot.util import epoch2datetime
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class Tests(object):
+
+    # leases on two locks, from two masters
+    background_data = [
+        fakedb.Object(id=11, name='m1', class_name='BuildMaster'),
+        fakedb.Object(id=12, name='m2', class_name='BuildMaster'),
+        fakedb.LockLease(id=100, name='lk', objectid=11, mode='counting',
+                         heartbeat_at=1000),
+        fakedb.LockLease(id=101, name='other', objectid=11,
+                         mode='exclusive', heartbeat_at=1000),
+        fakedb.LockLease(id=102, name='lk', objectid=12, mode='exclusive',
+                         heartbeat_at=1100),
+    ]
+
+    def setUpTests(self):
+        self.clock = task.Clock()
+        self.clock.advance(1200)
+        return self.insertTestData(self.background_data)
+
+    @defer.inlineCallbacks
+    def test_getLeases(self):
+        leases = yield self.db.locks.getLeases('lk')
+        self.assertEqual(leases, [
+            dict(leaseid=100, name='lk', objectid=11, mode='counting',
+                 heartbeat_at=epoch2datetime(1000)),
+            dict(leaseid=102, name='lk', objectid=12, mode='exclusive',
+                 heartbeat_at=epoch2datetime(1100)),
+        ])
+
+    @defer.inlineCallbacks
+    def test_getLeases_none(self):
+        leases = yield self.db.locks.getLeases('nosuch')
+        self.assertEqual(leases, [])
+
+    @defer.inlineCallbacks
+    def test_addLease(self):
+        leaseid = yield self.db.locks.addLease('lk', 12, 'counting',
+                                               _reactor=self.clock)
+        leases = yield self.db.locks.getLeases('lk')
+        # new leases go at the end of the queue
+        self.assertEqual([l['leaseid'] for l in leases], [100, 102, leaseid])
+        self.assertEqual(leases[-1]['mode'], 'counting')
+        self.assertEqual(leases[-1]['heartbeat_at'], epoch2datetime(1200))
+
+    @defer.inlineCallbacks
+    def test_refreshLeases(self):
+        yield self.db.locks.refreshLeases([100, 101, 999],
+                                          _reactor=self.clock)
+        leases = yield self.db.locks.getLeases('lk')
+        self.assertEqual([l['heartbeat_at'] for l in leases],
+                         [epoch2datetime(1200), epoch2datetime(1100)])
+        leases = yield self.db.locks.getLeases('other')
+        self.assertEqual(leases[0]['heartbeat_at'], epoch2datetime(1200))
+
+    @defer.inlineCallbacks
+    def test_removeLeases(self):
+        yield self.db.locks.removeLeases([100, 999])
+        leases = yield self.db.locks.getLeases('lk')
+        self.assertEqual([l['leaseid'] for l in leases], [102])
+
+    @defer.inlineCallbacks
+    def test_expireLeases(self):
+        count = yield self.db.locks.expireLeases('lk', 150,
+                                                 _reactor=self.clock)
+        self.assertEqual(count, 1)
+        leases = yield self.db.locks.getLeases('lk')
+        self.assertEqual([l['leaseid'] for l in leases], [102])
+        # other locks are untouched
+        leases = yield self.db.locks.getLeases('other')
+        self.assertEqual([l['leaseid'] for l in leases], [101])
+
+
+class TestFakeDB(unittest.TestCase, Tests):
+
+    def setUp(self):
+        self.master = fakemaster.make_master(wantDb=True, testcase=self)
+        self.db = self.master.db
+        self.insertTestData = self.db.insertTestData
+        return self.setUpTests()
+
+
+class TestRealDB(unittest.TestCase,
+                 connector_component.ConnectorComponentMixin,
+                 Tests):
+
+    def setUp(self):
+        d = self.setUpConnectorComponent(
+            table_names=['objects', 'lock_leases'])
+
+        @d.addCallback
+        def finish_setup(_):
+            self.db.locks = locks.LocksConnectorComponent(self.db)
+        d.addCallback(lambda _: self.setUpTests())
+        return d
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
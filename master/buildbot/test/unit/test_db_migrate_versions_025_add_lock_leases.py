@@ -0,0 +1,66 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+import sqlalchemy as sa
+
+from buildbot.test.util import migration
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def test_migration(self):
+        def setup_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            objects = sa.Table("objects", metadata,
+                               sa.Column("id", sa.Integer, primary_key=True),
+                               sa.Column('name', sa.String(128),
+                                         nullable=False),
+                               sa.Column('class_name', sa.String(128),
+                                         nullable=False),
+                               )
+            objects.create()
+            conn.execute(objects.insert(), id=10, name='master',
+                         class_name='BuildMaster')
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            lock_leases = sa.Table('lock_leases', metadata, autoload=True)
+
+            # table starts empty, and accepts a lease
+            res = conn.execute(lock_leases.select())
+            self.assertEqual(res.fetchall(), [])
+            conn.execute(lock_leases.insert(), name='lk', objectid=10,
+                         mode='counting', heartbeat_at=1000)
+
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = insp.get_indexes('lock_leases')
+            self.assertEqual(
+                sorted([i['name'] for i in indexes]),
+                ['lock_leases_name'])
+
+        return self.do_test_migration(24, 25, setup_thd, verify_thd)
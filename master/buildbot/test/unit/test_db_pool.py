@@ -18,9 +18,11 @@ import sqlalchemy as sa
 import time
 
 from buildbot.db import pool
+from buildbot.process import metrics
 from buildbot.test.util import db
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.python import log
 from twisted.trial import unittest
 
 
@@ -97,6 +99,83 @@ class Basic(unittest.TestCase):
         return d
 
 
+class Instrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = sa.create_engine('sqlite://')
+        self.engine.optimal_thread_pool_size = 1
+        self.pool = pool.DBThreadPool(self.engine)
+        self.events = []
+
+        def observer(eventDict):
+            if isinstance(eventDict.get('metric'),
+                          metrics.MetricDBQueryEvent):
+                self.events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    @defer.inlineCallbacks
+    def test_metrics(self):
+        def select(conn):
+            return conn.execute("SELECT 1 UNION SELECT 2").fetchall()
+        res = yield self.pool.do(select)
+        self.assertEqual(len(res), 2)
+
+        def select_engine(engine):
+            return engine.execute("SELECT 1").scalar()
+        yield self.pool.do_with_engine(select_engine)
+
+        self.assertEqual([(ev.method, ev.rows) for ev in self.events],
+                         [('test_db_pool.test_metrics', 2),
+                          ('test_db_pool.test_metrics', 1)])
+        for ev in self.events:
+            self.assertTrue(ev.wait >= 0 and ev.elapsed >= 0)
+        self.assertEqual(len(self.pool.slowQueries), 0)
+
+    @defer.inlineCallbacks
+    def test_error(self):
+        def fail(conn):
+            conn.execute("EAT COOKIES")
+        try:
+            yield self.pool.do(fail)
+        except sa.exc.OperationalError:
+            pass
+        else:
+            self.fail("no exception")
+        self.assertEqual([(ev.method, ev.rows) for ev in self.events],
+                         [('test_db_pool.test_error', 0)])
+
+    @defer.inlineCallbacks
+    def test_slow_query(self):
+        self.pool.slowQueryThreshold = 0
+
+        def select(conn):
+            conn.execute("SELECT 1").fetchall()
+            conn.execute("SELECT 2").fetchall()
+        yield self.pool.do(select)
+        [slow] = self.pool.slowQueries
+        self.assertEqual(slow['method'], 'test_db_pool.test_slow_query')
+        self.assertEqual(slow['statements'], ['SELECT 1', 'SELECT 2'])
+        self.assertEqual(slow['rows'], 0)
+
+
+class InstrumentationWithDebug(Instrumentation):
+
+    # same thing, with the do methods wrapped by timed_do_fn; queries are
+    # still named after their callers
+
+    def setUp(self):
+        pool.debug = True
+        Instrumentation.setUp(self)
+
+    def tearDown(self):
+        pool.debug = False
+        Instrumentation.tearDown(self)
+
+
 class Stress(unittest.TestCase):
 
     def setUp(self):
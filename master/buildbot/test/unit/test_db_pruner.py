@@ -0,0 +1,136 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+import mock
+
+from buildbot import config
+from buildbot.db import pruner
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class Pruner(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(pruner.Pruner, '_reactor', self.clock)
+        self.master = fakemaster.make_master()
+        self.master.config = config.MasterConfig()
+        self.db = fakedb.FakeDBConnector(self)
+        self.db.master = self.master
+        self.db.running = True
+        self.pruner = pruner.Pruner(self.db)
+
+    def fakePrune(self, name, counts):
+        # each call prunes the next count from the list
+        calls = []
+
+        def prune(horizon, limit=None):
+            calls.append((horizon, limit))
+            return defer.succeed(counts.pop(0))
+        self.patch(getattr(self.db, name), 'prune' + name.capitalize(),
+                   prune)
+        return calls
+
+    def getState(self, name):
+        objectid = self.db.state.objects[('pruner',
+                                          'buildbot.db.pruner.Pruner')]
+        return self.db.state.getState(objectid, name)
+
+    def test_prune_in_batches(self):
+        self.master.config.changeHorizon = 10
+        self.master.config.buildsetHorizon = 20
+        change_calls = self.fakePrune('changes', [100, 100, 30])
+        buildset_calls = self.fakePrune('buildsets', [5])
+        d = self.pruner.prune()
+
+        # one batch at a time, with a pause in between
+        self.assertEqual(len(change_calls), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(change_calls), 2)
+        self.clock.advance(1)
+        self.assertEqual(change_calls, [(10, 100)] * 3)
+        self.assertEqual(buildset_calls, [(20, 100)])
+        self.assertTrue(d.called)
+
+        d.addCallback(lambda _: self.getState('pruned_changes'))
+        d.addCallback(lambda total: self.assertEqual(total, 230))
+        d.addCallback(lambda _: self.getState('pruned_buildsets'))
+        d.addCallback(lambda total: self.assertEqual(total, 5))
+        return d
+
+    def test_prune_no_horizons(self):
+        self.patch(self.db.changes, 'pruneChanges', mock.Mock())
+        self.patch(self.db.buildsets, 'pruneBuildsets', mock.Mock())
+        d = self.pruner.prune()
+        self.assertFalse(self.db.changes.pruneChanges.called)
+        self.assertFalse(self.db.buildsets.pruneBuildsets.called)
+        return d
+
+    def test_prune_fake_db(self):
+        self.master.config.changeHorizon = 2
+        self.master.config.buildsetHorizon = 1
+        self.db.insertTestData([
+            fakedb.Change(changeid=n) for n in range(1, 6)
+        ] + [
+            fakedb.Buildset(id=1, complete=0, sourcestampsetid=1),
+            fakedb.Buildset(id=2, complete=1, sourcestampsetid=1),
+            fakedb.Buildset(id=3, complete=1, sourcestampsetid=1),
+        ])
+        d = self.pruner.prune()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(sorted(self.db.changes.changes), [4, 5])
+            self.assertEqual(sorted(self.db.buildsets.buildsets), [1, 3])
+        return d
+
+    def test_prune_not_reentrant(self):
+        self.master.config.changeHorizon = 10
+        calls = self.fakePrune('changes', [100, 0])
+        d1 = self.pruner.prune()
+        d2 = self.pruner.prune()
+        self.assertTrue(d2.called)
+        self.clock.advance(1)
+        self.assertEqual(len(calls), 2)
+        return d1
+
+    def test_prune_failure_stops_timer(self):
+        self.master.config.changeHorizon = 10
+        self.patch(self.db.changes, 'pruneChanges',
+                   lambda horizon, limit=None: defer.fail(RuntimeError('oh')))
+        timers = []
+        self.patch(pruner.metrics, 'Timer', lambda name:
+                   timers.append(mock.Mock(name=name)) or timers[-1])
+        d = self.pruner.prune()
+
+        def check(f):
+            f.trap(RuntimeError)
+            self.assertTrue(timers[0].stop.called)
+        d.addCallbacks(lambda _: self.fail("should have failed"), check)
+        return d
+
+    def test_prune_stops_with_db(self):
+        self.master.config.changeHorizon = 10
+        calls = self.fakePrune('changes', [100, 100])
+        d = self.pruner.prune()
+        self.db.running = False
+        self.clock.advance(1)
+        self.assertEqual(len(calls), 1)
+        return d
@@ -254,6 +254,49 @@ class TestUsersConnectorComponent(connector_component.ConnectorComponentMixin,
         d.addCallback(check3)
         return d
 
+    def test_getUsersByUids(self):
+        d = self.insertTestData(self.user1_rows + self.user2_rows +
+                                self.user3_rows)
+
+        def get(_):
+            return self.db.users.getUsersByUids([3, 2, 4, 2])
+        d.addCallback(get)
+
+        def check(res):
+            self.assertEqual(res, {2: self.user2_dict, 3: self.user3_dict})
+        d.addCallback(check)
+        return d
+
+    def test_getUsersByUids_large(self):
+        rows = []
+        for uid in range(1, 251):
+            rows.append(fakedb.User(uid=uid, identifier='u%d' % uid))
+            rows.append(fakedb.UserInfo(uid=uid, attr_type='email',
+                                        attr_data='u%d@example.com' % uid))
+        d = self.insertTestData(rows)
+
+        def get(_):
+            return self.db.users.getUsersByUids(range(1, 251))
+        d.addCallback(get)
+
+        def check(res):
+            self.assertEqual(sorted(res), range(1, 251))
+            self.assertEqual(res[123]['email'], 'u123@example.com')
+        d.addCallback(check)
+        return d
+
+    def test_getUsersByUsernames(self):
+        d = self.insertTestData(self.user1_rows + self.user3_rows)
+
+        def get(_):
+            return self.db.users.getUsersByUsernames(['marla', 'tyler'])
+        d.addCallback(get)
+
+        def check(res):
+            self.assertEqual(res, {'marla': self.user3_dict})
+        d.addCallback(check)
+        return d
+
     def test_getUsers_none(self):
         d = self.db.users.getUsers()
 
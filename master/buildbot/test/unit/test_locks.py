@@ -0,0 +1,412 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+import random
+
+from buildbot import locks
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.util import eventual
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class WaitQueue(unittest.TestCase):
+
+    def test_fifo(self):
+        q = locks._WaitQueue()
+        for w in 'abc':
+            q.put(w, w.upper(), None)
+        self.assertEqual(list(q), [('a', 'A', None), ('b', 'B', None),
+                                   ('c', 'C', None)])
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.head(), 'a')
+
+    def test_put_keeps_position(self):
+        q = locks._WaitQueue()
+        for w in 'abc':
+            q.put(w, w.upper(), None)
+        q.put('a', 'X', 'd')
+        self.assertEqual(q.get('a'), ('X', 'd'))
+        self.assertEqual([e[0] for e in q], ['a', 'b', 'c'])
+
+    def test_remove_and_requeue(self):
+        q = locks._WaitQueue()
+        for w in 'abc':
+            q.put(w, w.upper(), None)
+        q.remove('a')
+        q.remove('b')
+        q.put('a', 'A', None)
+        q.remove('nosuch')
+        self.assertEqual([e[0] for e in q], ['c', 'a'])
+        self.assertEqual(q.head(), 'c')
+        self.assertFalse('b' in q)
+        self.assertEqual(q.get('b'), None)
+
+    def test_compaction(self):
+        q = locks._WaitQueue()
+        for i in range(1000):
+            q.put(i, None, None)
+        for i in range(1, 999):
+            q.remove(i)
+        self.assertEqual([e[0] for e in q], [0, 999])
+        self.assertTrue(len(q._order) < 100)
+
+
+class BaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = locks.MasterLock('lock', maxCount=3)
+        self.lock = locks.BaseLock('lock', maxCount=3)
+
+    def tearDown(self):
+        return eventual.flushEventualQueue()
+
+    def counting(self):
+        return locks.LockAccess(self.lockid, 'counting')
+
+    def exclusive(self):
+        return locks.LockAccess(self.lockid, 'exclusive')
+
+    def test_counting_up_to_maxCount(self):
+        for owner in 'abc':
+            self.assertTrue(self.lock.isAvailable(owner, self.counting()))
+            self.lock.claim(owner, self.counting())
+        self.assertFalse(self.lock.isAvailable('d', self.counting()))
+        self.assertFalse(self.lock.isAvailable('d', self.exclusive()))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 3))
+
+    def test_exclusive(self):
+        self.lock.claim('a', self.exclusive())
+        self.assertFalse(self.lock.isAvailable('b', self.counting()))
+        self.assertFalse(self.lock.isAvailable('b', self.exclusive()))
+        self.lock.release('a', self.exclusive())
+        self.assertTrue(self.lock.isAvailable('b', self.exclusive()))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 0))
+
+    def test_waiters_ahead_count(self):
+        self.lock.claim('a', self.counting())
+        self.lock.claim('b', self.counting())
+        self.lock.claim('c', self.counting())
+        self.lock.waitUntilMaybeAvailable('w1', self.counting())
+        self.lock.waitUntilMaybeAvailable('w2', self.counting())
+        self.lock.release('a', self.counting())
+        # only the first waiter fits
+        self.assertTrue(self.lock.isAvailable('w1', self.counting()))
+        self.assertFalse(self.lock.isAvailable('w2', self.counting()))
+        self.assertFalse(self.lock.isAvailable('x', self.counting()))
+        # a full lock does not admit even the head of the queue
+        self.lock.claim('w1', self.counting())
+        self.assertFalse(self.lock.isAvailable('w2', self.counting()))
+
+    def test_exclusive_waiter_not_starved(self):
+        self.lock.claim('a', self.counting())
+        self.lock.waitUntilMaybeAvailable('x', self.exclusive())
+        self.lock.waitUntilMaybeAvailable('c', self.counting())
+        # counting waiters behind the exclusive waiter must wait
+        self.assertFalse(self.lock.isAvailable('c', self.counting()))
+        self.assertFalse(self.lock.isAvailable('d', self.counting()))
+        self.lock.release('a', self.counting())
+        self.assertTrue(self.lock.isAvailable('x', self.exclusive()))
+        self.assertFalse(self.lock.isAvailable('c', self.counting()))
+
+    def test_release_wakes_waiters(self):
+        self.lock.claim('a', self.exclusive())
+        woken = []
+        for owner in 'bcde':
+            d = self.lock.waitUntilMaybeAvailable(owner, self.counting())
+            d.addCallback(lambda _, owner=owner: woken.append(owner))
+        self.lock.release('a', self.exclusive())
+        d = eventual.flushEventualQueue()
+
+        def check(_):
+            # only as many waiters as fit in the lock are woken
+            self.assertEqual(woken, ['b', 'c', 'd'])
+            self.assertEqual(self.lock.waiting.get('b'),
+                             (self.counting(), None))
+        d.addCallback(check)
+        return d
+
+    def test_stopWaiting(self):
+        self.lock.claim('a', self.exclusive())
+        d = self.lock.waitUntilMaybeAvailable('b', self.exclusive())
+        self.lock.waitUntilMaybeAvailable('c', self.exclusive())
+        self.lock.stopWaitingUntilAvailable('b', self.exclusive(), d)
+        self.lock.release('a', self.exclusive())
+        self.assertTrue(self.lock.isAvailable('c', self.exclusive()))
+        self.assertFalse('b' in self.lock.waiting)
+
+    def test_matches_linear_scan(self):
+        # compare isAvailable against the straightforward definition, over a
+        # random sequence of operations
+        rand = random.Random(1234)
+        modes = {}
+        for i in range(2000):
+            owner = rand.randint(0, 15)
+            if (owner, self.counting()) in self.lock.owners \
+                    or (owner, self.exclusive()) in self.lock.owners:
+                access = modes[owner]
+                self.lock.release(owner, access)
+                continue
+            access = rand.choice([self.counting(), self.counting(),
+                                  self.exclusive()])
+            if owner in self.lock.waiting and rand.random() < 0.2:
+                old_access, d = self.lock.waiting.get(owner)
+                if d:
+                    self.lock.stopWaitingUntilAvailable(owner, old_access, d)
+                    continue
+
+            waiting = list(self.lock.waiting)
+            owners = self.lock.owners
+            num_excl = len([o for o in owners if o[1].mode == 'exclusive'])
+            num_counting = len(owners) - num_excl
+            ahead = waiting
+            for idx, w in enumerate(waiting):
+                if w[0] == owner:
+                    ahead = waiting[:idx]
+                    break
+            if access.mode == 'counting':
+                expected = num_excl == 0 and \
+                    num_counting + len(ahead) < self.lock.maxCount and \
+                    all([w[1].mode == 'counting' for w in ahead])
+            else:
+                expected = num_excl == 0 and num_counting == 0 \
+                    and not ahead
+
+            self.assertEqual(self.lock.isAvailable(owner, access), expected)
+            if expected:
+                self.lock.claim(owner, access)
+                modes[owner] = access
+            else:
+                self.lock.waitUntilMaybeAvailable(owner, access)
+
+
+class DistributedLock(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.patch(locks.RealDistributedLock, '_reactor', self.clock)
+        # two masters sharing a database
+        self.master1 = fakemaster.make_master(wantDb=True, testcase=self,
+                                              master_id=1)
+        self.master2 = fakemaster.make_master(master_id=2)
+        self.master2.db = self.master1.db
+
+    def tearDown(self):
+        return eventual.flushEventualQueue()
+
+    def makeLock(self, master, maxCount=1):
+        self.lockid = locks.DistributedMasterLock('lk', maxCount=maxCount,
+                                                  pollInterval=10,
+                                                  leaseTimeout=60)
+        lock = self.lockid.lockClass(self.lockid)
+        lock.master = master
+        return lock
+
+    def access(self, mode):
+        return locks.LockAccess(self.lockid, mode)
+
+    def wait(self, lock, owner, mode):
+        woken = []
+        d = lock.waitUntilMaybeAvailable(owner, self.access(mode))
+        d.addCallback(lambda _: woken.append(owner))
+        return woken, d
+
+    def test_exclusive_across_masters(self):
+        lock1 = self.makeLock(self.master1)
+        lock2 = self.makeLock(self.master2)
+        a_woken, _ = self.wait(lock1, 'a', 'exclusive')
+        b_woken, _ = self.wait(lock2, 'b', 'exclusive')
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check_first(_):
+            self.assertEqual((a_woken, b_woken), (['a'], []))
+            self.assertTrue(lock1.isAvailable('a', self.access('exclusive')))
+            self.assertFalse(lock2.isAvailable('b', self.access('exclusive')))
+            lock1.claim('a', self.access('exclusive'))
+            lock1.release('a', self.access('exclusive'))
+            # master2 notices at its next poll
+            self.clock.advance(10)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check_second(_):
+            self.assertEqual(b_woken, ['b'])
+            lock2.claim('b', self.access('exclusive'))
+            self.assertTrue(lock2.isOwner('b', self.access('exclusive')))
+            lock2.release('b', self.access('exclusive'))
+            self.assertEqual(self.master1.db.locks.leases, {})
+            # master1 polls once more to see that b was released
+            self.clock.advance(10)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check_idle(_):
+            # nothing left to poll for
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        return d
+
+    def test_fifo_across_masters(self):
+        lock1 = self.makeLock(self.master1, maxCount=2)
+        lock2 = self.makeLock(self.master2, maxCount=2)
+        x_woken, _ = self.wait(lock1, 'x', 'counting')
+        y_woken, _ = self.wait(lock2, 'y', 'exclusive')
+        z_woken, _ = self.wait(lock1, 'z', 'counting')
+        self.clock.advance(10)
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            # z must not pass the exclusive waiter ahead of it
+            self.assertEqual((x_woken, y_woken, z_woken), (['x'], [], []))
+            lock1.claim('x', self.access('counting'))
+            lock1.release('x', self.access('counting'))
+            self.clock.advance(10)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check_exclusive(_):
+            self.assertEqual((y_woken, z_woken), (['y'], []))
+        return d
+
+    def test_expired_lease(self):
+        # master 2 died while holding the lock
+        self.master1.db.insertTestData([
+            fakedb.LockLease(id=1, name='lk', objectid=2, mode='exclusive',
+                             heartbeat_at=990),
+        ])
+        lock1 = self.makeLock(self.master1)
+        a_woken, _ = self.wait(lock1, 'a', 'counting')
+        self.clock.pump([10] * 5)
+        self.assertEqual(a_woken, [])
+        self.clock.pump([10] * 2)
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(a_woken, ['a'])
+            # our own lease is kept fresh
+            lease, = self.master1.db.locks.leases.values()
+            self.assertEqual(lease['heartbeat_at'], 1070)
+        return d
+
+    def test_owner_lease_expired(self):
+        lock1 = self.makeLock(self.master1)
+        build = mock.Mock(name='build')
+        woken, _ = self.wait(lock1, build, 'exclusive')
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def expire(_):
+            self.assertEqual(woken, [build])
+            lock1.claim(build, self.access('exclusive'))
+            # another master expires the lease, as if we had not refreshed it
+            # in time
+            leaseid, = self.master1.db.locks.leases.keys()
+            return self.master1.db.locks.removeLeases([leaseid])
+
+        @d.addCallback
+        def poll(_):
+            self.clock.advance(10)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            build.stopBuild.assert_called_once_with(
+                "lease on <DistributedMasterLock(lk, 1)> expired")
+            # the build releases the lock as it stops, without a new lease
+            lock1.release(build, self.access('exclusive'))
+            self.assertEqual(self.master1.db.locks.leases, {})
+        return d
+
+    def test_isAvailable_no_requester(self):
+        lock1 = self.makeLock(self.master1, maxCount=2)
+        lock2 = self.makeLock(self.master2, maxCount=2)
+        # nothing is known before the first poll
+        self.assertTrue(lock1.isAvailable(None, self.access('exclusive')))
+        self.wait(lock2, 'a', 'counting')
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            lock1._poll()
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check_counting(_):
+            self.assertTrue(lock1.isAvailable(None, self.access('counting')))
+            self.assertFalse(lock1.isAvailable(None, self.access('exclusive')))
+            # a waiter of our own that is not yet in the database counts too
+            self.wait(lock1, 'b', 'counting')
+            self.assertFalse(lock1.isAvailable(None, self.access('counting')))
+
+        return d
+
+    def test_released_after_stopped_waiting(self):
+        lock1 = self.makeLock(self.master1)
+        lock2 = self.makeLock(self.master2)
+        released = []
+        lock1.subscribeToReleases(lambda: released.append(True))
+        self.wait(lock2, 'a', 'exclusive')
+        b_woken, b_d = self.wait(lock1, 'b', 'exclusive')
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def stop_waiting(_):
+            lock2.claim('a', self.access('exclusive'))
+            self.clock.advance(10)
+            self.assertFalse(lock1.isAvailable(None,
+                                               self.access('exclusive')))
+            # the build waiting on master1 goes away; master1 has no leases
+            # of its own after this
+            lock1.stopWaitingUntilAvailable('b', self.access('exclusive'),
+                                            b_d)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def release(_):
+            lock2.release('a', self.access('exclusive'))
+            self.clock.pump([10] * 20)
+            return eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.master1.db.locks.leases, {})
+            self.assertEqual(b_woken, [])
+            self.assertTrue(lock1.isAvailable(None, self.access('exclusive')))
+            self.assertEqual(released, [True])
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        return d
+
+    def test_stopWaiting(self):
+        lock1 = self.makeLock(self.master1)
+        lock2 = self.makeLock(self.master2)
+        self.wait(lock2, 'a', 'exclusive')
+        b_woken, d = self.wait(lock1, 'b', 'exclusive')
+        c_woken, _ = self.wait(lock1, 'c', 'exclusive')
+        lock1.stopWaitingUntilAvailable('b', self.access('exclusive'), d)
+        self.assertEqual(len(self.master1.db.locks.leases), 2)
+        lock2.claim('a', self.access('exclusive'))
+        lock2.release('a', self.access('exclusive'))
+        self.clock.advance(10)
+        d = eventual.flushEventualQueue()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual((b_woken, c_woken), ([], ['c']))
+        return d
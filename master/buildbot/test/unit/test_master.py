@@ -195,6 +195,53 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
             kwargs=dict(who='me', src='git'),
             exp_args=(self.master, 'me', 'git'))
 
+    @defer.inlineCallbacks
+    def test_addChanges(self):
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.patch(users, 'createUserObject',
+                   mock.Mock(return_value=defer.succeed(13)))
+        cb = mock.Mock()
+        self.master.subscribeToChanges(cb)
+
+        newchanges = yield self.master.addChanges([
+            dict(who=u'me', files=[u'a'], comments=u'first', src='git'),
+            dict(author=u'you', files=[u'b'], comments=u'second',
+                 properties={'x': 'y'}),
+        ])
+
+        self.assertEqual([(ch.who, ch.files, ch.comments)
+                          for ch in newchanges],
+                         [(u'me', [u'a'], u'first'),
+                          (u'you', [u'b'], u'second')])
+        self.assertEqual(newchanges[1].properties.getProperty('x'), 'y')
+        users.createUserObject.assert_called_once_with(self.master, u'me',
+                                                       'git')
+        self.master.db.changes.assertChangeUsers(newchanges[0].number, [13])
+        self.master.db.changes.assertChangeUsers(newchanges[1].number, [])
+        # the changes are announced in order, after all were added
+        self.assertEqual(cb.call_args_list,
+                         [((newchanges[0],), {}), ((newchanges[1],), {})])
+
+    @defer.inlineCallbacks
+    def test_addChanges_batched(self):
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.patch(users, 'createUserObject',
+                   mock.Mock(return_value=defer.succeed(13)))
+        self.master.db.changes.getChange = mock.Mock(
+            side_effect=AssertionError("changes fetched one at a time"))
+
+        newchanges = yield self.master.addChanges([
+            dict(author=u'me', files=[], comments=u'c%d' % i, src='git')
+            for i in range(10)])
+
+        self.assertEqual([ch.comments for ch in newchanges],
+                         [u'c%d' % i for i in range(10)])
+        # the author is only looked up once
+        users.createUserObject.assert_called_once_with(self.master, u'me',
+                                                       'git')
+        for ch in newchanges:
+            self.master.db.changes.assertChangeUsers(ch.number, [13])
+
     def test_buildset_subscription(self):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
@@ -19,6 +19,7 @@ from buildbot import config
 from buildbot import interfaces
 from buildbot.process import factory
 from buildbot.process.botmaster import BotMaster
+from buildbot.process.builder import Builder
 from buildbot.test.fake import fakemaster
 from twisted.application import service
 from twisted.internet import defer
@@ -138,13 +139,14 @@ class TestBotMaster(unittest.TestCase):
         self.botmaster.startService()
 
     def tearDown(self):
-        return self.botmaster.stopService()
+        if self.botmaster.running:
+            return self.botmaster.stopService()
 
     def test_reconfigService(self):
         # check that reconfigServiceSlaves and reconfigServiceBuilders are
         # both called; they will be tested invidually below
         self.patch(self.botmaster, 'reconfigServiceBuilders',
-                   mock.Mock(side_effect=lambda c: defer.succeed(None)))
+                   mock.Mock(side_effect=lambda c: defer.succeed([])))
         self.patch(self.botmaster, 'reconfigServiceSlaves',
                    mock.Mock(side_effect=lambda c: defer.succeed(None)))
         self.patch(self.botmaster, 'maybeStartBuildsForAllBuilders',
@@ -163,6 +165,52 @@ class TestBotMaster(unittest.TestCase):
                 self.botmaster.maybeStartBuildsForAllBuilders.called)
         return d
 
+    def test_reconfigService_yields_between_chunks(self):
+        self.patch(self.botmaster, 'reconfigServiceBuilders',
+                   mock.Mock(side_effect=lambda c: defer.succeed([])))
+        self.patch(self.botmaster, 'reconfigServiceSlaves',
+                   mock.Mock(side_effect=lambda c: defer.succeed(None)))
+        self.botmaster.reconfig_chunk_size = 2
+        slaves = []
+        for i in range(5):
+            sl = FakeBuildSlave('sl%d' % i)
+            sl.setServiceParent(self.botmaster)
+            slaves.append(sl)
+
+        d = self.botmaster.reconfigService(self.new_config)
+        # only the first chunk runs before the reactor gets a turn
+        self.assertEqual([s.reconfig_count for s in slaves],
+                         [1, 1, 0, 0, 0])
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual([s.reconfig_count for s in slaves],
+                             [1] * 5)
+        return d
+
+    @defer.inlineCallbacks
+    def test_reconfigService_configures_new_builders_once(self):
+        bc = config.BuilderConfig(name='bldr', factory=factory.BuildFactory(),
+                                  slavename='f')
+        self.new_config.slaves = []
+        self.new_config.builders = [bc]
+        self.new_config.getBuilderConfig = {'bldr': bc}.get
+        self.new_config.caches = {'Builds': 15}
+        self.patch(self.botmaster, 'maybeStartBuildsForAllBuilders',
+                   mock.Mock())
+        reconfigs = []
+        reconfigService = Builder.reconfigService
+        self.patch(Builder, 'reconfigService',
+                   lambda bldr, cfg: reconfigs.append(bldr.name)
+                   or reconfigService(bldr, cfg))
+
+        yield self.botmaster.reconfigService(self.new_config)
+        self.assertEqual(reconfigs, ['bldr'])
+
+        # an existing builder is reconfigured with the other services
+        yield self.botmaster.reconfigService(self.new_config)
+        self.assertEqual(reconfigs, ['bldr', 'bldr'])
+
     @defer.inlineCallbacks
     def test_reconfigServiceSlaves_add_remove(self):
         sl = FakeBuildSlave('sl1')
@@ -217,6 +265,8 @@ class TestBotMaster(unittest.TestCase):
         bc = config.BuilderConfig(name='bldr', factory=factory.BuildFactory(),
                                   slavename='f')
         self.new_config.builders = [bc]
+        self.new_config.getBuilderConfig = {'bldr': bc}.get
+        self.new_config.caches = {'Builds': 15}
 
         yield self.botmaster.reconfigServiceBuilders(self.new_config)
 
@@ -224,6 +274,10 @@ class TestBotMaster(unittest.TestCase):
         self.assertIdentical(bldr.parent, self.botmaster)
         self.assertIdentical(bldr.master, self.master)
         self.assertEqual(self.botmaster.builderNames, ['bldr'])
+        # the status of the new builder is loaded, and the builder is
+        # configured, before it is added
+        self.assertNotEqual(bldr.builder_status, None)
+        self.assertIdentical(bldr.config, bc)
 
         self.new_config.builders = []
 
@@ -234,6 +288,54 @@ class TestBotMaster(unittest.TestCase):
         self.assertEqual(self.botmaster.builders, {})
         self.assertEqual(self.botmaster.builderNames, [])
 
+    def test_reconfigServiceBuilders_configured_before_added(self):
+        bc = config.BuilderConfig(name='bldr', factory=factory.BuildFactory(),
+                                  slavename='f')
+        self.new_config.builders = [bc]
+        self.new_config.getBuilderConfig = {'bldr': bc}.get
+        self.new_config.caches = {'Builds': 15}
+        loaded = defer.Deferred()
+        self.master.status.loadBuilder = mock.Mock(return_value=loaded)
+
+        d = self.botmaster.reconfigServiceBuilders(self.new_config)
+        # while its status loads, the reactor runs; the builder is not
+        # visible to slaves or the build request distributor until it has a
+        # config
+        self.assertEqual(self.botmaster.builders, {})
+        self.assertEqual(self.botmaster.getBuildersForSlave('f'), [])
+        loaded.callback(mock.Mock(name='builder_status'))
+
+        @d.addCallback
+        def check(_):
+            bldr = self.botmaster.builders['bldr']
+            self.assertIdentical(bldr.config, bc)
+            self.assertEqual(self.botmaster.getBuildersForSlave('f'), [bldr])
+        return d
+
+    def test_getBuildersForSlave(self):
+        def makeBuilder(name, slavenames):
+            bldr = mock.Mock(name=name)
+            bldr.config.slavenames = slavenames
+            self.botmaster.builders[name] = bldr
+            return bldr
+        b1 = makeBuilder('b1', ['sl1', 'sl2'])
+        b2 = makeBuilder('b2', ['sl2'])
+
+        self.assertEqual(self.botmaster.getBuildersForSlave('sl1'), [b1])
+        self.assertEqual(
+            sorted(self.botmaster.getBuildersForSlave('sl2')), sorted([b1, b2]))
+        self.assertEqual(self.botmaster.getBuildersForSlave('sl3'), [])
+
+        # a new builder is noticed
+        b3 = makeBuilder('b3', ['sl3'])
+        self.assertEqual(self.botmaster.getBuildersForSlave('sl3'), [b3])
+
+        # as is a change to an existing builder's slaves, once the builder
+        # reports it
+        b1.config.slavenames = ['sl2']
+        self.botmaster.builderConfigChanged(b1)
+        self.assertEqual(self.botmaster.getBuildersForSlave('sl1'), [])
+
     def test_maybeStartBuildsForBuilder(self):
         brd = self.botmaster.brd = mock.Mock()
 
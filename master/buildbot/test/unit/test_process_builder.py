@@ -437,3 +437,59 @@ class TestReconfig(BuilderMixin, unittest.TestCase):
                  category=self.bldr.builder_status.getCategory()),
             dict(description="New",
                  category="NewCat"))
+
+    @defer.inlineCallbacks
+    def test_reconfig_same_slavenames(self):
+        yield self.makeBuilder(description="Old", category="OldCat")
+        self.patch(self.bldr.botmaster, 'builderConfigChanged', mock.Mock())
+
+        # an identical config, as loaded from master.cfg on a reconfig
+        new_builder_config = config.BuilderConfig(
+            name="bldr", slavename="slv", builddir="bdir",
+            slavebuilddir="sbdir", factory=factory.BuildFactory(),
+            description="Old", category="OldCat")
+        mastercfg = config.MasterConfig()
+        mastercfg.builders = [new_builder_config]
+        yield self.bldr.reconfigService(mastercfg)
+
+        self.assertIdentical(self.bldr.config, new_builder_config)
+        self.assertFalse(self.bldr.botmaster.builderConfigChanged.called)
+
+    @defer.inlineCallbacks
+    def test_reconfig_unchanged(self):
+        yield self.makeBuilder(description="Old", category="OldCat")
+        self.patch(self.bldr.builder_status, 'setDescription', mock.Mock())
+        self.patch(self.bldr.builder_status, 'setCacheSize', mock.Mock())
+
+        # the factory is new, but the builder reads it from its config when
+        # it starts a build, so only the config itself is replaced
+        new_builder_config = config.BuilderConfig(
+            name="bldr", slavename="slv", builddir="bdir",
+            slavebuilddir="sbdir", factory=factory.BuildFactory(),
+            description="Old", category="OldCat")
+        mastercfg = config.MasterConfig()
+        mastercfg.builders = [new_builder_config]
+        yield self.bldr.reconfigService(mastercfg)
+
+        self.assertIdentical(self.bldr.config, new_builder_config)
+        self.assertFalse(self.bldr.builder_status.setDescription.called)
+
+        # a change to the build cache size is applied
+        mastercfg.caches = dict(mastercfg.caches, Builds=99)
+        yield self.bldr.reconfigService(mastercfg)
+        self.bldr.builder_status.setCacheSize.assert_called_with(99)
+
+    @defer.inlineCallbacks
+    def test_reconfig_slavenames(self):
+        yield self.makeBuilder()
+        self.patch(self.bldr.botmaster, 'builderConfigChanged', mock.Mock())
+        self.patch(self.bldr.builder_status, 'setSlavenames', mock.Mock())
+        mastercfg = config.MasterConfig()
+        mastercfg.builders = [config.BuilderConfig(
+            name="bldr", slavenames=["slv", "slv2"], builddir="bdir",
+            slavebuilddir="sbdir", factory=factory.BuildFactory())]
+        yield self.bldr.reconfigService(mastercfg)
+
+        self.bldr.builder_status.setSlavenames.assert_called_with(
+            ['slv', 'slv2'])
+        self.bldr.botmaster.builderConfigChanged.assert_called_with(self.bldr)
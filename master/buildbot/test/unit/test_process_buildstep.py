@@ -333,6 +333,80 @@ class TestCustomStepExecution(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestRemoteCommand(unittest.TestCase):
+
+    def test_remoteUpdate_segments(self):
+        cmd = buildstep.RemoteCommand('cmd', {}, collectStdout=True)
+        calls = []
+
+        class Log:
+
+            def __init__(self, name):
+                self.name = name
+
+            def __getattr__(self, meth):
+                return lambda data: calls.append((self.name, meth, data))
+        cmd.logs = {'stdio': Log('stdio'), 'x': Log('x')}
+        cmd.remoteUpdate({'segments': [
+            ('stdout', 'out1'),
+            ('stderr', 'err'),
+            ('header', 'hdr'),
+            (('log', 'x'), 'logged'),
+            ('stdout', 'out2'),
+        ]})
+        self.assertEqual(calls, [
+            ('stdio', 'addStdout', 'out1'),
+            ('stdio', 'addStderr', 'err'),
+            ('stdio', 'addHeader', 'hdr'),
+            ('x', 'addStdout', 'logged'),
+            ('stdio', 'addStdout', 'out2'),
+        ])
+        self.assertEqual(cmd.stdout, 'out1out2')
+        self.assertEqual(cmd.updates, {})
+
+
+    def test_remote_update_batched(self):
+        cmd = buildstep.RemoteCommand('cmd', {})
+        cmd.active = True
+        cmd.buildslave = mock.Mock()
+        stdio = mock.Mock(name='stdio')
+        other = mock.Mock(name='other', spec=['addStdout'])
+        cmd.logs = {'stdio': stdio, 'other': other}
+        num = cmd.remote_update([
+            ({'header': 'hdr'}, 1),
+            ({'segments': [('stdout', 'out'), (('log', 'other'), 'o'),
+                           ('stderr', 'err')]}, 2),
+            ({'stdout': 'more', 'rc': 0}, 3),
+        ])
+        self.assertEqual(num, 3)
+        stdio.addEntries.assert_called_once_with([
+            (2, 'hdr'), (0, 'out'), (1, 'err'), (0, 'more'),
+            (2, 'program finished with exit code 0\n')])
+        self.assertFalse(stdio.addStdout.called)
+        # logs without addEntries get the output directly
+        other.addStdout.assert_called_once_with('o')
+        self.assertEqual(cmd._logBatch, None)
+
+    def test_remote_update_failure_flushes(self):
+        cmd = buildstep.RemoteCommand('cmd', {})
+        cmd.active = True
+        cmd.buildslave = mock.Mock()
+        cmd.deferred = defer.Deferred()
+        stdio = mock.Mock(name='stdio')
+        cmd.logs = {'stdio': stdio}
+        cmd._closeWhenFinished = {'stdio': True}
+
+        def remoteUpdate(update):
+            cmd.addStdout(update['stdout'])
+            raise RuntimeError('oops')
+        cmd.remoteUpdate = remoteUpdate
+        cmd.remote_update([({'stdout': 'out'}, 1), ({'stdout': 'lost'}, 2)])
+        self.assertEqual(stdio.method_calls[0],
+                         mock.call.addEntries([(0, 'out')]))
+        stdio.finish.assert_called_once_with()
+        self.assertFailure(cmd.deferred, RuntimeError)
+        return cmd.deferred
+
 class TestRemoteShellCommand(unittest.TestCase):
 
     def test_obfuscated_arguments(self):
@@ -15,6 +15,7 @@
 
 import gc
 import sys
+import thread
 
 from buildbot.process import metrics
 from buildbot.test.fake import fakemaster
@@ -64,6 +65,18 @@ class TestMetricCountEvent(TestMetricBase):
         report = self.observer.asDict()
         self.assertEquals(report['counters']['num_widgets'], 10)
 
+    def testLabelled(self):
+        metrics.MetricCountEvent.log('queries', labels=dict(table='changes'))
+        metrics.MetricCountEvent.log('queries', 2,
+                                     labels=dict(table='changes'))
+        metrics.MetricCountEvent.log('queries', labels=dict(table='builds'))
+        h = self.observer.getHandler(metrics.MetricCountEvent)
+        self.assertEqual(h.getLabelled('queries'),
+                         {(('table', 'changes'),): 3,
+                          (('table', 'builds'),): 1})
+        # labelled counts are kept apart from the plain counters
+        self.assertFalse('queries' in self.observer.asDict()['counters'])
+
     def testCountMethod(self):
         @metrics.countMethod('foo_called')
         def foo():
@@ -125,6 +138,20 @@ class TestMetricTimeEvent(TestMetricBase):
         report = self.observer.asDict()
         self.assertEquals(report['timers']['foo_time'], 5)
 
+    def testHistogram(self):
+        for i in range(1, 101):
+            metrics.MetricTimeEvent.log('foo_time', i / 100.0)
+        h = self.observer.getHandler(metrics.MetricTimeEvent)
+        hist = h.getHistogram('foo_time')
+        self.assertEqual(hist.count, 100)
+        self.assertAlmostEqual(hist.sum, 50.5)
+        # estimates are within one bucket of the true value
+        for q, expected in [(0.5, 0.5), (0.9, 0.9), (0.99, 0.99)]:
+            est = hist.quantile(q)
+            self.assertTrue(expected <= est <= expected * hist.GROWTH,
+                            (q, est))
+        self.assertEqual(hist.quantile(1), 1.0)
+
     def testAverages(self):
         data = range(10)
         for i in data:
@@ -217,6 +244,145 @@ class TestReconfig(TestMetricBase):
         # (service will be stopped by tearDown)
 
 
+class TestHistogram(unittest.TestCase):
+
+    def testEmpty(self):
+        self.assertEqual(metrics.Histogram().quantile(0.5), None)
+
+    def testSmallValues(self):
+        h = metrics.Histogram()
+        for v in [0, -0.5, 1e-9]:
+            h.add(v)
+        self.assertEqual(h.buckets, {0: 3})
+        self.assertEqual(h.quantile(0.99), 1e-9)
+
+    def testWideRange(self):
+        h = metrics.Histogram()
+        values = [10 ** (i / 10.0) * 1e-5 for i in range(100)]
+        for v in values:
+            h.add(v)
+        for q in (0.1, 0.5, 0.75, 0.99):
+            true = values[int(q * len(values)) - 1]
+            self.assertTrue(true <= h.quantile(q) <= true * h.GROWTH)
+
+
+class TestExposition(TestMetricBase):
+
+    def testExposition(self):
+        metrics.MetricCountEvent.log('num_foo', 3)
+        metrics.MetricCountEvent.log('queries', labels={'table': 'a"b'})
+        metrics.MetricTimeEvent.log('Foo.bar()', 2)
+        metrics.MetricAlarmEvent.log('alarm_foo', level=metrics.ALARM_WARN)
+        text = self.observer.exposition()
+        lines = text.splitlines()
+        self.assertTrue(text.endswith('\n'))
+        for line in [
+            '# TYPE buildbot_counter gauge',
+            'buildbot_counter{counter="num_foo"} 3',
+            'buildbot_counter{table="a\\"b",counter="queries"} 1',
+            '# TYPE buildbot_timer_seconds summary',
+            'buildbot_timer_seconds{quantile="0.5",timer="Foo.bar()"} 2.0',
+            'buildbot_timer_seconds_sum{timer="Foo.bar()"} 2.0',
+            'buildbot_timer_seconds_count{timer="Foo.bar()"} 1',
+            'buildbot_alarm_level{alarm="alarm_foo"} 1',
+            # timers which were looked up but never logged
+            'buildbot_timer_seconds{quantile="0.5",'
+            'timer="BuildMaster.pollDatabaseChanges()"} NaN',
+        ]:
+            self.assertIn(line, lines)
+
+
+class TestStallDetector(TestMetricBase):
+
+    def setUp(self):
+        TestMetricBase.setUp(self)
+        self.now = 100.0
+        self.sd = metrics.StallDetector(1.0, _reactor=self.clock)
+        self.sd._time = lambda: self.now
+        # pretend this thread is the reactor, without starting the threads
+        self.sd._reactorThread = thread.get_ident()
+        self.sd._lastBeat = self.now
+
+    def test_no_stall(self):
+        self.now += 0.3
+        self.sd.check()
+        self.sd._beat()
+        self.assertEqual((self.sd.stalls, dict(self.sd.blockers)), (0, {}))
+
+    def test_stall(self):
+        self.now += 3.25
+        for i in range(2):
+            self.sd.check()
+        self.sd._beat()
+        self.assertEqual(self.sd.stalls, 1)
+        [(count, stack)] = self.sd.topBlockers()
+        self.assertEqual(count, 2)
+        self.assertTrue(stack[-1].endswith('(check)'))
+        self.assertTrue([f for f in stack if f.endswith('(test_stall)')])
+
+        report = self.observer.asDict()
+        self.assertEqual(report['timers']['reactorStall'], 3)
+        counters = self.observer.getHandler(metrics.MetricCountEvent)
+        self.assertEqual(counters.getLabelled('reactorStall.blocker'),
+                         {(('frame', stack[-1]),): 1})
+        self.assertTrue(self.sd.report().startswith("1 reactor stalls\n"
+                                                    "2 samples in:\n"))
+
+    def test_profile(self):
+        self.sd.profileInterval = 1
+        self.sd._nextProfile = self.now + 1
+        for dt in (0.5, 0.5, 0.5, 0.5):
+            self.now += dt
+            self.sd.check()
+            self.sd._beat()
+        [(count, stack)] = self.sd.topBlockers(profile=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(self.sd.topBlockers(), [])
+
+    def test_bounded(self):
+        self.sd.maxStacks = 3
+        for i in range(3):
+            self.sd._addSample(self.sd.blockers, ('f%d' % i,))
+        self.sd._addSample(self.sd.blockers, ('f1',))
+        self.sd._addSample(self.sd.blockers, ('f2',))
+        # a new stack replaces the least sampled one
+        self.sd._addSample(self.sd.blockers, ('f3',))
+        self.assertEqual(dict(self.sd.blockers),
+                         {('f1',): 2, ('f2',): 2, ('f3',): 1})
+
+        # and the counter labels are limited too
+        for i in range(5):
+            self.now += 3.25
+            self.sd._stallStack = ('f%d' % i,)
+            self.sd._beat()
+        counters = self.observer.getHandler(metrics.MetricCountEvent)
+        self.assertEqual(counters.getLabelled('reactorStall.blocker'),
+                         {(('frame', 'f0'),): 1, (('frame', 'f1'),): 1,
+                          (('frame', 'f2'),): 1, (('frame', 'other'),): 2})
+
+    def test_reconfig(self):
+        self.master.config.metrics['stall_threshold'] = 2
+        self.observer.reconfigService(self.master.config)
+        sd = self.observer.stallDetector
+        self.assertEqual((sd.threshold, sd.profileInterval), (2, None))
+        self.assertTrue(sd._watchdog.isAlive())
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 0.5)
+
+        # unchanged config keeps the detector
+        self.observer.reconfigService(self.master.config)
+        self.assertIdentical(self.observer.stallDetector, sd)
+
+        self.master.config.metrics['profile_interval'] = 5
+        self.observer.reconfigService(self.master.config)
+        self.assertNotIdentical(self.observer.stallDetector, sd)
+        self.assertEqual(sd._watchdog, None)
+
+        self.master.config.metrics = None
+        self.observer.reconfigService(self.master.config)
+        self.assertEqual(self.observer.stallDetector, None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
 class _LogObserver:
 
     def __init__(self):
@@ -242,6 +408,27 @@ class TestReports(unittest.TestCase):
         self.assertEquals("Timer time_foo: 1", handler.report())
         self.assertEquals({"timers": {"time_foo": 1}}, handler.asDict())
 
+    def testMetricDBQueryReport(self):
+        handler = metrics.MetricDBQueryHandler(None)
+        for wait, elapsed, rows in [(0, 0.5, 3), (1, 1.5, 1)]:
+            handler.handle({}, metrics.MetricDBQueryEvent('changes.getChange',
+                                                          wait, elapsed, rows))
+
+        self.assertEquals("Query changes.getChange: 2 queries, 1s waiting, "
+                          "2s executing, 4 rows", handler.report())
+        self.assertEquals({"queries": {"changes.getChange":
+                                       dict(queries=2, wait=1, elapsed=2,
+                                            rows=4)}}, handler.asDict())
+        lines = handler.exposition()
+        for line in [
+            'buildbot_db_queries_total{method="changes.getChange"} 2',
+            'buildbot_db_rows_total{method="changes.getChange"} 4',
+            'buildbot_db_wait_seconds_count 2',
+            'buildbot_db_execute_seconds{method="changes.getChange",'
+            'quantile="0.99"} 1.5',
+        ]:
+            self.assertIn(line, lines)
+
     def testMetricAlarmReport(self):
         handler = metrics.MetricAlarmHandler(None)
         handler.handle({}, metrics.MetricAlarmEvent('alarm_foo', msg='Uh oh', level=metrics.ALARM_WARN))
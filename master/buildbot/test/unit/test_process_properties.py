@@ -13,7 +13,9 @@
 #
 # Copyright Buildbot Team Members
 
+import StringIO
 import mock
+import pickle
 
 from buildbot.interfaces import IProperties
 from buildbot.interfaces import IRenderable
@@ -513,6 +515,32 @@ class TestInterpolateProperties(unittest.TestCase):
                       "echo 'false'")
         return d
 
+    def test_renders_immediately(self):
+        # interpolations that only look at properties need no Deferreds
+        self.props.setProperty("one", "proj1", "test")
+        command = Interpolate("%(prop:one)s-%(prop:two:-%(prop:one)s)s"
+                              "-%(prop:three:+x)s")
+        self.assertEqual(command._renderNow(self.props), "proj1-proj1-")
+        d = self.build.render(command)
+        self.assertTrue(d.called)
+        d.addCallback(self.failUnlessEqual, "proj1-proj1-")
+        return d
+
+    def test_renderable_property_value(self):
+        renderable = DeferredRenderable()
+        self.props.properties['dfr'] = (renderable, 'test')
+        command = Interpolate("echo %(prop:dfr)s")
+        d = self.build.render(command)
+        d.addCallback(self.failUnlessEqual, "echo x")
+        renderable.callback('x')
+        return d
+
+    def test_error(self):
+        # no build to get a source stamp from
+        command = Interpolate("%(src::branch)s")
+        d = command.getRenderingFor(Properties())
+        return self.assertFailure(d, AttributeError)
+
 
 class TestInterpolateSrc(unittest.TestCase):
 
@@ -905,6 +933,32 @@ class TestWithProperties(unittest.TestCase):
         d.addCallback(self.failUnlessEqual, 'with:default')
         return d
 
+    def testNumericFormat(self):
+        self.props.setProperty('x', 10, 'test')
+        command = WithProperties('%(x)03d-%(y:-4)s')
+        d = self.build.render(command)
+        d.addCallback(self.failUnlessEqual, '010-4')
+        return d
+
+    def testTemplateReused(self):
+        self.props.setProperty('x', 10, 'test')
+        command = WithProperties('%(x)s')
+        template = command._getTemplate()
+        self.assertEqual(template.lookups, [('x', None, 'x', None)])
+        d = self.build.render(command)
+        d.addCallback(self.failUnlessEqual, '10')
+        d.addCallback(lambda _:
+                      self.assertIdentical(command._getTemplate(), template))
+        return d
+
+    def testUnparseableFormat(self):
+        # errors in the format string are the same as before templates
+        self.props.setProperty('x', 10, 'test')
+        command = WithProperties('%(x)s and 100%')
+        self.assertEqual(command._getTemplate(), None)
+        d = self.build.render(command)
+        return self.assertFailure(d, ValueError)
+
 
 class TestProperties(unittest.TestCase):
 
@@ -973,6 +1027,88 @@ class TestProperties(unittest.TestCase):
         self.failUnlessEqual(self.props.getProperty('a'), 1)
         self.failUnlessEqual(self.props.getPropertySource('a'), 'new')
 
+    def testUpdateFromPropertiesCopyOnWrite(self):
+        newprops = Properties()
+        newprops.setProperty('a', 1, "new")
+        self.props.updateFromProperties(newprops)
+        # the layer is shared, not copied..
+        self.assertIdentical(self.props._layers[-1], newprops._local)
+
+        # ..but writes on either side are not seen by the other
+        newprops.setProperty('a', 2, "newer")
+        newprops.setProperty('b', 3, "newer")
+        self.props.setProperty('c', 4, "old")
+        self.assertEqual(self.props.asList(),
+                         [('a', 1, 'new'), ('c', 4, 'old')])
+        self.assertEqual(newprops.asList(),
+                         [('a', 2, 'newer'), ('b', 3, 'newer')])
+
+    def testUpdateFromPropertiesManyLayers(self):
+        for i in range(20):
+            newprops = Properties()
+            newprops.setProperty('p%d' % i, i, "new")
+            newprops.setProperty('last', i, "new")
+            self.props.updateFromProperties(newprops)
+        self.assertTrue(len(self.props._layers) <= Properties.max_layers)
+        self.assertEqual(self.props.getProperty('p0'), 0)
+        self.assertEqual(self.props.getProperty('last'), 19)
+
+    def testPropertiesAttribute(self):
+        # direct access to the dictionary sees all layers, and writes to it
+        # are seen by the Properties object
+        newprops = Properties()
+        newprops.setProperty('a', 1, "new")
+        self.props.updateFromProperties(newprops)
+        self.props.properties['b'] = (2, 'direct')
+        self.assertEqual(self.props.asList(),
+                         [('a', 1, 'new'), ('b', 2, 'direct')])
+        self.assertEqual(newprops.asList(), [('a', 1, 'new')])
+
+    def testPickleFlattens(self):
+        newprops = Properties()
+        newprops.setProperty('a', 1, "new", runtime=True)
+        self.props.updateFromProperties(newprops)
+        self.props.setProperty('b', 2, "old")
+        self.props.build = mock.Mock()
+        state = self.props.__getstate__()
+        self.assertEqual(state, dict(properties={'a': (1, 'new'),
+                                                 'b': (2, 'old')},
+                                     runtime=set(['a']), build=None))
+        props = pickle.loads(pickle.dumps(self.props))
+        self.assertEqual(props, self.props)
+        self.assertEqual(props.build, None)
+
+    def testPickleLoadsInOlderVersions(self):
+        # older versions have an old-style Properties class, which can only
+        # load pickles of another old-style class
+        class OldProperties:
+
+            def __setstate__(self, d):
+                self.__dict__ = d
+
+        class OldUnpickler(pickle.Unpickler):
+
+            def find_class(self, module, name):
+                if (module, name) == ('buildbot.process.properties',
+                                      'Properties'):
+                    return OldProperties
+                return pickle.Unpickler.find_class(self, module, name)
+
+        newprops = Properties()
+        newprops.setProperty('a', 1, "new")
+        self.props.updateFromProperties(newprops)
+        for protocol in 0, 2, -1:
+            data = pickle.dumps(self.props, protocol)
+            old = OldUnpickler(StringIO.StringIO(data)).load()
+            self.assertEqual(old.properties, {'a': (1, 'new')})
+
+    def testCompareLayered(self):
+        newprops = Properties()
+        newprops.setProperty('a', 1, "new")
+        self.props.updateFromProperties(newprops)
+        self.assertEqual(self.props, Properties.fromDict({'a': (1, 'new')}))
+        self.assertNotEqual(self.props, Properties.fromDict({'a': (2, 'new')}))
+
     def testUpdateFromPropertiesNoRuntime(self):
         self.props.setProperty("a", 94, "old")
         self.props.setProperty("b", 84, "old")
@@ -160,6 +160,46 @@ class UsersTests(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_getBuildsContacts(self):
+        self.db.insertTestData([
+            fakedb.Change(changeid=1), fakedb.Change(changeid=2),
+            fakedb.ChangeUser(changeid=1, uid=1),
+            fakedb.ChangeUser(changeid=2, uid=1),
+            fakedb.ChangeUser(changeid=2, uid=2),
+            fakedb.User(uid=1, identifier='tdurden'),
+            fakedb.UserInfo(uid=1, attr_type='email',
+                            attr_data='tyler@mayhem.net'),
+            fakedb.User(uid=2, identifier='marla'),
+            fakedb.User(uid=3, identifier='bob', bb_username='bob',
+                        bb_password='x'),
+            fakedb.UserInfo(uid=3, attr_type='email',
+                            attr_data='bob@mayhem.net'),
+        ])
+
+        def makeBuild(changeids):
+            build = mock.Mock()
+            ss = mock.Mock()
+            ss.changes = [mock.Mock(number=changeid) for changeid in changeids]
+            build.getSourceStamps.return_value = [ss]
+            build.getInterestedUsers.return_value = ['bob']
+            return build
+        builds = [makeBuild([1, 2]), makeBuild([2])]
+
+        for component, method in [(self.db.changes, 'getChangeUidsById'),
+                                  (self.db.users, 'getUsersByUids'),
+                                  (self.db.users, 'getUsersByUsernames')]:
+            self.patch(component, method,
+                       mock.Mock(side_effect=getattr(component, method)))
+        d = users.getBuildsContacts(self.master, builds, ['email'])
+
+        def check(contacts):
+            self.assertEqual(contacts, ['tyler@mayhem.net', 'bob@mayhem.net'])
+            self.db.changes.getChangeUidsById.assert_called_once_with([1, 2])
+            self.db.users.getUsersByUids.assert_called_once_with([1, 2])
+            self.db.users.getUsersByUsernames.assert_called_once_with(['bob'])
+        d.addCallback(check)
+        return d
+
     def test_check_passwd(self):
         res = users.check_passwd("cancer", self.test_sha)
         self.assertEqual(res, True)
@@ -186,6 +186,50 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
             self.makeFakeChange(),
             True)
 
+    @defer.inlineCallbacks
+    def test_change_consumption_batched(self):
+        sched = self.makeScheduler()
+        sched.startService()
+        batches = []
+        first = defer.Deferred()
+
+        def gotChanges(changes):
+            batches.append([(c.number, imp) for c, imp in changes])
+            if len(batches) == 1:
+                return first
+            return defer.succeed(None)
+        sched.gotChanges = gotChanges
+        yield sched.startConsumingChanges(
+            fileIsImportant=lambda c: c.number != 2)
+
+        callback = self.master.getSubscriptionCallbacks()['changes']
+        for number in 1, 2, 3:
+            callback(self.makeFakeChange(number=number))
+        # the changes which arrived while the first one was being processed
+        # are handed over together
+        self.assertEqual(batches, [[(1, True)]])
+        first.callback(None)
+        self.assertEqual(batches, [[(1, True)], [(2, False), (3, True)]])
+        yield sched.stopService()
+
+    def test_gotChanges_default(self):
+        sched = self.makeScheduler()
+        got = []
+
+        def gotChange(change, important):
+            got.append(change.number)
+            if change.number == 1:
+                raise RuntimeError("oh noes")
+        sched.gotChange = gotChange
+        d = sched.gotChanges([(self.makeFakeChange(number=1), True),
+                              (self.makeFakeChange(number=2), True)])
+
+        def check(_):
+            self.assertEqual(got, [1, 2])
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d.addCallback(check)
+        return d
+
     def test_addBuilsetForLatest_args(self):
         sched = self.makeScheduler(name='xyz', builderNames=['y', 'z'])
         d = sched.addBuildsetForLatest(reason='cuz', branch='default',
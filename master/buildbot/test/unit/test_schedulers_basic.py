@@ -268,6 +268,58 @@ class BaseBasicScheduler(CommonStuffMixin,
 
         yield sched.stopService()
 
+    @defer.inlineCallbacks
+    def test_gotChanges_treeStableTimer_batched(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10, branch='master')
+        sched.startService()
+        self.patch(sched, 'gotChange', mock.Mock())
+
+        yield sched.gotChanges([
+            (self.makeFakeChange(branch='master', number=13), True),
+            (self.makeFakeChange(branch='master', number=14), False)])
+
+        self.assertFalse(sched.gotChange.called)
+        self.db.schedulers.assertClassifications(self.OBJECTID, {13: True, 14: False})
+        self.assertEqual(sched.getPendingBuildTimes(), [10])
+        yield sched.stopService()
+
+    @defer.inlineCallbacks
+    def test_gotChanges_treeStableTimer_locked(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10, branch='master')
+        sched.startService()
+
+        # the batch waits for a timer that is firing
+        yield sched._stable_timers_lock.acquire()
+        d = sched.gotChanges([
+            (self.makeFakeChange(branch='master', number=13), True),
+            (self.makeFakeChange(branch='master', number=14), False)])
+        self.db.schedulers.assertClassifications(self.OBJECTID, {})
+        sched._stable_timers_lock.release()
+        yield d
+
+        self.db.schedulers.assertClassifications(self.OBJECTID, {13: True, 14: False})
+        yield sched.stopService()
+
+    @defer.inlineCallbacks
+    def test_gotChanges_gotChange_overridden(self):
+        class Overrider(self.Subclass):
+            def gotChange(self, change, important):
+                self.seen.append(change.number)
+                return basic.BaseBasicScheduler.gotChange(self, change,
+                                                          important)
+        sched = self.makeScheduler(Overrider, treeStableTimer=10, branch='master')
+        sched.seen = []
+        sched.startService()
+
+        yield sched.gotChanges([
+            (self.makeFakeChange(branch='master', number=13), True),
+            (self.makeFakeChange(branch='master', number=14), False)])
+
+        # the subclass sees each change
+        self.assertEqual(sched.seen, [13, 14])
+        self.db.schedulers.assertClassifications(self.OBJECTID, {13: True, 14: False})
+        yield sched.stopService()
+
 
 class SingleBranchScheduler(CommonStuffMixin,
                             scheduler.SchedulerMixin, unittest.TestCase):
@@ -406,6 +458,35 @@ class SingleBranchScheduler(CommonStuffMixin,
         d.addCallback(lambda _: sched.stopService())
         return d
 
+    @defer.inlineCallbacks
+    def test_gotChanges_batched(self):
+        sched = self.makeFullScheduler(name='test', builderNames=['test'],
+                                       treeStableTimer=10, branch='master',
+                                       codebases=self.codebases,
+                                       createAbsoluteSourceStamps=True)
+        self.db.insertTestData([
+            fakedb.Object(id=self.OBJECTID, name='test', class_name='SingleBranchScheduler')])
+        yield sched.startService(_returnDeferred=True)
+        self.patch(self.db.schedulers, 'classifyChanges', mock.Mock(
+            side_effect=self.db.schedulers.classifyChanges))
+        self.patch(sched, 'setState', mock.Mock(side_effect=sched.setState))
+
+        yield sched.gotChanges([
+            (self.mkch(codebase='a', revision='1', repository='A', number=1), True),
+            (self.mkch(codebase='b', revision='2', repository='B', number=2), False),
+            (self.mkch(codebase='a', revision='3', repository='A', number=3), False),
+        ])
+
+        # one database write for the classifications, and one for the state
+        self.db.schedulers.classifyChanges.assert_called_once_with(
+            self.OBJECTID, {1: True, 2: False, 3: False})
+        self.assertEqual(sched.setState.call_count, 1)
+        self.db.state.assertState(self.OBJECTID, lastCodebases={
+            'a': dict(branch='master', repository='A', revision=u'3', lastChange=3),
+            'b': dict(branch='master', repository='B', revision=u'2', lastChange=2)})
+        self.assertEqual(sched.getPendingBuildTimes(), [10])
+        yield sched.stopService()
+
     def do_test_gotChange_buildsets(self, abs_ss=False, treeStableTimer=None):
         # test combination of createAbsoluteSourceStamps and treeStableTimer
         # for multiple codebases.
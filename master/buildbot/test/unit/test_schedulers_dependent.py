@@ -98,11 +98,13 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
         callbacks['buildsets'](bsid=44,
                                properties=dict(scheduler=(scheduler_name, 'Scheduler')))
 
-        # check whether scheduler is subscribed to that buildset
+        # check whether scheduler is subscribed to that buildset; the state
+        # is only written when it changes
         if expect_subscription:
             self.assertBuildsetSubscriptions([44])
         else:
-            self.assertBuildsetSubscriptions([])
+            self.db.state.assertState(self.OBJECTID,
+                                      missing_keys=['upstream_bsids'])
 
         # pretend that the buildset is finished
         self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=result)
@@ -157,3 +159,86 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
 
         # and check that it wrote the correct value back to the state
         self.db.state.assertState(self.OBJECTID, upstream_bsids=[11, 13])
+
+    def makeBuildsets(self, *bsids):
+        self.db.insertTestData([fakedb.SourceStampSet(id=1000 + bsid)
+                                for bsid in bsids] +
+                               [fakedb.Buildset(id=bsid,
+                                                sourcestampsetid=1000 + bsid)
+                                for bsid in bsids])
+
+    def addUpstream(self, callbacks, bsid):
+        callbacks['buildsets'](bsid=bsid, sourcestampsetid=1000 + bsid,
+                               properties=dict(scheduler=(self.UPSTREAM_NAME,
+                                                          'Scheduler')))
+
+    def test_completions_use_cached_state(self):
+        sched = self.makeScheduler()
+        sched.startService()
+        callbacks = self.master.getSubscriptionCallbacks()
+        self.makeBuildsets(1, 2, 3)
+
+        # hold up the state writes
+        writes = []
+
+        def setState(objectid, name, value):
+            d = defer.Deferred()
+            writes.append((value, d))
+            return d
+        self.patch(self.db.state, 'setState', setState)
+        self.patch(self.db.buildsets, 'getBuildset',
+                   lambda bsid: self.fail("unexpected getBuildset"))
+
+        for bsid in (1, 2, 3):
+            self.addUpstream(callbacks, bsid)
+        callbacks['buildset_completion'](1, SUCCESS)
+        callbacks['buildset_completion'](2, FAILURE)
+        callbacks['buildset_completion'](7, SUCCESS)
+
+        # one write went out at once, and the rest are combined
+        self.assertEqual([w[0] for w in writes], [[1]])
+        writes[0][1].callback(None)
+        self.assertEqual([w[0] for w in writes], [[1], [3]])
+        stopped = []
+        sched.stopService().addCallback(stopped.append)
+        self.assertEqual(stopped, [])
+        writes[1][1].callback(None)
+        self.assertEqual(stopped, [None])
+
+        # only the successful upstream triggered a build
+        self.db.buildsets.assertBuildsets(4)
+        bsid = max(self.db.buildsets.allBuildsetIds())
+        self.assertEqual(self.db.buildsets.buildsets[bsid]['sourcestampsetid'],
+                         1001)
+
+    def test_stopService_waits_for_handlers(self):
+        sched = self.makeScheduler()
+        sched.startService()
+        self.assertEqual(sched._upstream, {})
+
+        # a buildset handler is still running
+        sched._subscription_lock.acquire()
+        stopped = []
+        sched.stopService().addCallback(stopped.append)
+        self.assertEqual(stopped, [])
+        self.assertEqual(sched._upstream, {})
+
+        sched._subscription_lock.release()
+        self.assertEqual(stopped, [None])
+        self.assertEqual(sched._upstream, None)
+
+    def test_startService_completed_while_stopped(self):
+        sched = self.makeScheduler()
+        self.makeBuildsets(2)
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=1001),
+            fakedb.Buildset(id=1, sourcestampsetid=1001, complete=1,
+                            results=WARNINGS),
+            fakedb.Object(id=self.OBJECTID),
+            fakedb.ObjectState(objectid=self.OBJECTID,
+                               name='upstream_bsids', value_json='[1,2]'),
+        ])
+        sched.startService()
+
+        self.assertBuildsetSubscriptions([2])
+        self.db.buildsets.assertBuildsets(3)
@@ -171,3 +171,25 @@ class SchedulerManager(unittest.TestCase):
         self.assertIdentical(sch1_new.master, self.master)
         self.assertIdentical(sch2.parent, self.sm)
         self.assertIdentical(sch2.master, self.master)
+
+    @defer.inlineCallbacks
+    def test_reconfigService_unchanged_no_reconfig(self):
+        sch1 = self.makeSched(self.Sched, 'sch1', attr='alpha')
+        self.new_config.schedulers = dict(sch1=sch1)
+
+        yield self.sm.reconfigService(self.new_config)
+
+        for attr in 'alpha', 'alpha', 'beta':
+            sch1_new = self.makeSched(self.Sched, 'sch1', attr=attr)
+            self.new_config.schedulers = dict(sch1=sch1_new)
+
+            yield self.sm.reconfigService(self.new_config)
+
+            if attr == 'alpha':
+                # sch1 compares equal, so it stays active
+                self.assertIdentical(sch1.parent, self.sm)
+                self.assertIdentical(sch1_new.parent, None)
+
+        # .. until its attribute changes
+        self.assertIdentical(sch1.parent, None)
+        self.assertIdentical(sch1_new.parent, self.sm)
@@ -81,6 +81,21 @@ class JobdirService(dirs.DirsMixin, unittest.TestCase):
         # run it
         svc.messageReceived('jobdata')
 
+    def test_messagesReceived(self):
+        svc = trysched.JobdirService(self.jobdir)
+        for name in 'job1', 'job2':
+            with open(os.path.join(self.newdir, name), "w") as f:
+                f.write(name.upper())
+
+        svc.parent = mock.Mock()
+        svc.messagesReceived(['job1', 'missing', 'job2'])
+
+        # the jobs which could be read are handled together
+        (jobfiles,), _ = svc.parent.handleJobFiles.call_args
+        self.assertEqual([(fn, f.read()) for fn, f in jobfiles],
+                         [('job1', 'JOB1'), ('job2', 'JOB2')])
+        self.assertEqual(len(self.flushLoggedErrors()), 1)
+
 
 class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
 
@@ -589,6 +604,26 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
             lambda f: self.makeSampleParsedJob(properties=['foo', 'bar']))
         return self.assertFailure(d, AttributeError)
 
+    def test_handleJobFiles(self):
+        sched = self.attachScheduler(
+            trysched.Try_Jobdir(
+                name='tsched', builderNames=['buildera', 'builderb'],
+                jobdir='foo'), self.OBJECTID)
+        jobs = dict(good=self.makeSampleParsedJob(jobid='good'),
+                    bad_builders=self.makeSampleParsedJob(builderNames=['x']),
+                    bad_props=self.makeSampleParsedJob(properties=['foo']))
+        sched.parseJob = lambda f: jobs[f]
+
+        d = sched.handleJobFiles([(name, name) for name in sorted(jobs)])
+
+        def check(_):
+            # the good job is submitted, and the error from the other is
+            # logged rather than stopping it
+            self.db.buildsets.assertBuildsets(1)
+            self.assertEqual(len(self.flushLoggedErrors(AttributeError)), 1)
+        d.addCallback(check)
+        return d
+
 
 class Try_Userpass_Perspective(scheduler.SchedulerMixin, unittest.TestCase):
 
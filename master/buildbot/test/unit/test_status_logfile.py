@@ -20,6 +20,8 @@ import cStringIO
 import mock
 import os
 
+from collections import deque
+
 from buildbot import config
 from buildbot.status import logfile
 from buildbot.test.util import dirs
@@ -297,6 +299,48 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
                            for args in watcher.logChunk.call_args_list]
         self.assertEqual(logChunk_chunks, [(0, 'x')] * 15)
 
+    def do_test_addEntries(self, entries, expected):
+        self.logfile.addEntries(entries)
+        self.logfile.finish()
+        fp = self.logfile.getFile()
+        fp.seek(0, 0)
+        self.assertEqual(fp.read(), expected)
+
+    def test_addEntries(self):
+        return self.do_test_addEntries([(0, 'hel'), (0, u'lo'), (1, 'x'),
+                                        (2, 'y'), (2, 'z'), (0, '!')],
+                                       '6:0hello,2:1x,3:2yz,2:0!,')
+
+    def test_addEntries_single_write(self):
+        self.logfile.addEntry(0, 'a')
+        f = self.logfile.openfile = mock.Mock(wraps=self.logfile.openfile)
+        self.logfile.addEntries([(1, 'b'), (0, 'c'), (1, 'd')])
+        self.assertEqual(f.write.call_args_list,
+                         [mock.call('2:0a,2:1b,2:0c,')])
+        self.assertEqual(self.logfile.runEntries, [(1, 'd')])
+        self.assertEqual(self.logfile.length, 4)
+
+    def test_addEntries_logMaxSize(self):
+        self.config.logMaxSize = 10
+        return self.do_test_addEntries([(0, 'abcdef')] * 10,
+                                       '11:0abcdefabcd,'
+                                       '64:2\nOutput exceeded 10 bytes, remaining output has been '
+                                       'truncated\n,')
+
+    def test_addEntries_watchers(self):
+        watcher = mock.Mock(name='watcher', spec=['logChunk'])
+        batchWatcher = mock.Mock(name='batchWatcher')
+        self.logfile.watchers.extend([watcher, batchWatcher])
+        self.do_test_addEntries([(0, 'x'), (0, 'y'), (1, 'z')],
+                                '3:0xy,2:1z,')
+        self.assertEqual([tuple(args[0][3:])
+                          for args in watcher.logChunk.call_args_list],
+                         [(0, 'xy'), (1, 'z')])
+        batchWatcher.logChunks.assert_called_once_with(
+            self.build_step_status.build, self.build_step_status,
+            self.logfile, [(0, 'xy'), (1, 'z')])
+        self.assertFalse(batchWatcher.logChunk.called)
+
     def test_addStdout(self):
         addEntry = mock.Mock()
         self.patch(self.logfile, 'addEntry', addEntry)
@@ -340,3 +384,201 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
     def test_compressLog_none(self):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
+
+    def add_numbered_lines(self, count, chunkSize=50):
+        # lines with commas and colons, to tempt the chunk boundary search
+        self.logfile.chunkSize = chunkSize
+        self.logfile.BUFFERSIZE = 64
+        for i in range(count):
+            self.logfile.addStdout('line %d, 3:0x,\n' % i)
+            if i % 10 == 0:
+                self.logfile.addHeader('header %d\n' % i)
+        return ''.join(['line %d, 3:0x,\n' % i for i in range(count)])
+
+    def test_getTailChunks(self):
+        self.add_numbered_lines(1000)
+        self.logfile.finish()
+        chunks = self.logfile.getTailChunks(3, [logfile.STDOUT])
+        self.assertEqual(''.join(t for c, t in chunks),
+                         'line 997, 3:0x,\nline 998, 3:0x,\nline 999, 3:0x,\n')
+        self.assertEqual(set(c for c, t in chunks), set([logfile.STDOUT]))
+
+    def test_getTailChunks_all_channels(self):
+        self.add_numbered_lines(991)
+        self.logfile.finish()
+        chunks = self.logfile.getTailChunks(2)
+        self.assertEqual(chunks, [(logfile.STDOUT, 'line 990, 3:0x,\n'),
+                                  (logfile.HEADER, 'header 990\n')])
+
+    def test_getTailChunks_running(self):
+        self.add_numbered_lines(100)
+        self.logfile.addStdout('partial')
+        chunks = self.logfile.getTailChunks(1, [logfile.STDOUT])
+        self.assertEqual(chunks, [(logfile.STDOUT, 'partial')])
+
+    def test_getTailChunks_short(self):
+        expected = self.add_numbered_lines(10)
+        self.logfile.finish()
+        chunks = self.logfile.getTailChunks(100, [logfile.STDOUT])
+        self.assertEqual(''.join(t for c, t in chunks), expected)
+
+    def test_getTailChunks_compressed(self):
+        self.add_numbered_lines(100)
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'gz'
+        d = self.logfile.compressLog()
+
+        def check(_):
+            chunks = self.logfile.getTailChunks(1, [logfile.STDOUT])
+            self.assertEqual(chunks, [(logfile.STDOUT, 'line 99, 3:0x,\n')])
+        d.addCallback(check)
+        return d
+
+    def test_getTailChunks_compressed_bounded(self):
+        self.add_numbered_lines(1000)
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'bz2'
+        d = self.logfile.compressLog()
+
+        lengths = []
+
+        class RecordingDeque(deque):
+
+            def append(self, item):
+                deque.append(self, item)
+                lengths.append(len(self))
+
+        def check(_):
+            self.patch(logfile, 'deque', RecordingDeque)
+            self.patch(logfile, '_fileSize', mock.Mock())
+            chunks = self.logfile.getTailChunks(3, [logfile.STDOUT])
+            self.assertEqual(''.join(t for c, t in chunks),
+                             'line 997, 3:0x,\nline 998, 3:0x,\n'
+                             'line 999, 3:0x,\n')
+            # the whole log went through, but only the last few chunks
+            # were kept, and the size of the log was not needed
+            self.assertTrue(len(lengths) > 100)
+            self.assertTrue(max(lengths) <= 5, max(lengths))
+            self.assertFalse(logfile._fileSize.called)
+        d.addCallback(check)
+        return d
+
+    def do_test_getTextRange_compressed(self, method):
+        self.logfile.chunkIndexInterval = 3
+        expected = self.add_numbered_lines(300)
+        self.logfile.finish()
+        self.config.logCompressionMethod = method
+        d = self.logfile.compressLog()
+
+        def check(_):
+            # the compressed log is read forwards, once to index it and then
+            # from an indexed chunk; neither its size nor its chunk headers
+            # are looked up by seeking around in it
+            opened = []
+            self.patch(self.logfile, 'getFile',
+                       lambda getFile=self.logfile.getFile:
+                       opened.append(1) or getFile())
+            self.patch(logfile, '_fileSize', mock.Mock())
+            self.patch(logfile, '_readChunkHeader', mock.Mock())
+            channels = [logfile.STDOUT]
+            total = len(expected)
+            for first, last in [(0, 10), (1234, 2345), (total - 30, None)]:
+                stop = total if last is None else last + 1
+                self.assertEqual(
+                    self.logfile.getTextRange(first, last, channels),
+                    (first, stop - 1, total, expected[first:stop]))
+            self.assertEqual(len(opened), 4)
+            self.assertFalse(logfile._fileSize.called)
+            self.assertFalse(logfile._readChunkHeader.called)
+            self.assertTrue(len(self.logfile._chunkIndexOffsets) > 10)
+
+            text = ''.join(self.logfile.getChunks(onlyText=True))
+            self.assertEqual(self.logfile.getTextRange(1000, 1999),
+                             (1000, 1999, len(text), text[1000:2000]))
+        d.addCallback(check)
+        return d
+
+    def test_getTextRange_compressed_gz(self):
+        return self.do_test_getTextRange_compressed('gz')
+
+    def test_getTextRange_compressed_bz2(self):
+        return self.do_test_getTextRange_compressed('bz2')
+
+    def test_getTextRange(self):
+        expected = self.add_numbered_lines(300)
+        self.logfile.addStdout('partial')
+        expected += 'partial'
+        channels = [logfile.STDOUT]
+        total = len(expected)
+        for first, last in [(0, 10), (5, 5), (100, 3000), (1000, None),
+                            (total - 3, None)]:
+            stop = total if last is None else last + 1
+            self.assertEqual(
+                self.logfile.getTextRange(first, last, channels),
+                (first, min(stop, total) - 1, total,
+                 expected[first:stop]))
+        # suffix
+        self.assertEqual(self.logfile.getTextRange(None, 10, channels),
+                         (total - 10, total - 1, total, expected[-10:]))
+        self.assertEqual(self.logfile.getTextRange(None, total * 2, channels),
+                         (0, total - 1, total, expected))
+
+    def test_getTextRange_index(self):
+        self.logfile.chunkIndexInterval = 3
+        expected = self.add_numbered_lines(100)
+        channels = [logfile.STDOUT]
+        self.assertEqual(self.logfile.getTextRange(500, 999, channels),
+                         (500, 999, len(expected), expected[500:1000]))
+        self.assertTrue(len(self.logfile._chunkIndexOffsets) > 10)
+
+        # more output only has its headers read by the next call
+        expected += self.add_numbered_lines(200)
+        self.logfile.finish()
+        scanned = self.logfile._chunkIndexEnd[0]
+        headers = []
+        self.patch(logfile, '_readChunkHeader',
+                   lambda f, offset, orig=logfile._readChunkHeader:
+                   headers.append(offset) or orig(f, offset))
+        total = len(expected)
+        for first, last in [(0, 10), (1234, 2345), (total - 30, None)]:
+            stop = total if last is None else last + 1
+            self.assertEqual(
+                self.logfile.getTextRange(first, last, channels),
+                (first, stop - 1, total, expected[first:stop]))
+        self.assertEqual(min(headers), 0)
+        self.assertTrue(len([o for o in headers if o < scanned]) < 100)
+
+        # all channels, including headers
+        text = ''.join(self.logfile.getChunks(onlyText=True))
+        self.assertEqual(self.logfile.getTextRange(1000, 1999),
+                         (1000, 1999, len(text), text[1000:2000]))
+
+        # and getTailChunks uses the index too
+        chunks = self.logfile.getTailChunks(1, [logfile.STDOUT])
+        self.assertEqual(chunks, [(logfile.STDOUT, 'line 199, 3:0x,\n')])
+
+    def test_getTextRange_unsatisfiable(self):
+        expected = self.add_numbered_lines(10)
+        self.logfile.finish()
+        self.assertEqual(self.logfile.getTextRange(1000, None,
+                                                   [logfile.STDOUT]),
+                         (None, None, len(expected), ''))
+
+    def test_tail_producer_follows(self):
+        self.add_numbered_lines(100)
+        consumer = mock.Mock()
+        written = []
+        consumer.writeChunk = written.append
+        lfp = logfile.LogFileProducer(self.logfile, consumer, tail=1,
+                                      channels=[logfile.STDOUT])
+        chunks = lfp.chunkGenerator
+        self.assertEqual(chunks.next(), (0, 'line 99, 3:0x,\n'))
+        # new output while the tail is delivered is held back..
+        self.logfile.addStdout('more\n')
+        self.assertEqual(written, [])
+        self.assertEqual(list(chunks), [(0, 'more\n')])
+        # ..and then sent directly
+        self.logfile.addStdout('again\n')
+        self.assertEqual(written, [(0, 'again\n')])
+        self.logfile.finish()
+        consumer.finish.assert_called_with()
@@ -15,9 +15,12 @@
 
 import sys
 
+from email.message import Message
+
 from buildbot import config
 from buildbot.config import ConfigErrors
 from buildbot.process import properties
+from buildbot.status import mail
 from buildbot.status.mail import MailNotifier
 from buildbot.status.results import EXCEPTION
 from buildbot.status.results import FAILURE
@@ -28,7 +31,11 @@ from buildbot.test.fake.fakebuild import FakeBuildStatus
 from buildbot.test.util.config import ConfigErrorsMixin
 from mock import Mock
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import reactor
+from twisted.mail import smtp
 from twisted.trial import unittest
+from zope.interface import implements
 
 py_27 = sys.version_info[0] > 2 or (sys.version_info[0] == 2
                                     and sys.version_info[1] >= 7)
@@ -640,15 +647,18 @@ class TestMailNotifier(ConfigErrorsMixin, unittest.TestCase):
     def do_test_sendToInterestedUsers(self, lookup=None, extraRecipients=[],
                                       sendToInterestedUsers=True,
                                       exp_called_with=None, exp_TO=None,
-                                      exp_CC=None):
+                                      exp_CC=None, notifierClass=MailNotifier,
+                                      useUsers=None):
         from email.message import Message
         m = Message()
 
-        mn = MailNotifier(fromaddr='from@example.org',
-                          lookup=lookup,
-                          sendToInterestedUsers=sendToInterestedUsers,
-                          extraRecipients=extraRecipients)
+        mn = notifierClass(fromaddr='from@example.org',
+                           lookup=lookup,
+                           sendToInterestedUsers=sendToInterestedUsers,
+                           extraRecipients=extraRecipients)
         mn.sendMessage = Mock()
+        if useUsers:
+            mn.useUsers = useUsers
 
         def fakeGetBuild(number):
             return build
@@ -746,6 +756,26 @@ class TestMailNotifier(ConfigErrorsMixin, unittest.TestCase):
             exp_TO="tyler@mayhem.net",
             exp_CC="marla@mayhem.net")
 
+    def test_sendToInterestedUsers_useUsers_overridden(self):
+        class MyMailNotifier(MailNotifier):
+
+            def useUsers(self, build):
+                return defer.succeed(['%s@example.org' % build.reason])
+
+        self.do_test_sendToInterestedUsers(
+            notifierClass=MyMailNotifier,
+            exp_called_with=['testReason@example.org'],
+            exp_TO="testReason@example.org")
+
+    def test_sendToInterestedUsers_useUsers_instance_attribute(self):
+        def useUsers(build):
+            return defer.succeed(['%s@example.org' % build.reason])
+
+        self.do_test_sendToInterestedUsers(
+            useUsers=useUsers,
+            exp_called_with=['testReason@example.org'],
+            exp_TO="testReason@example.org")
+
     def test_sendToInterestedUsers_False(self):
         self.do_test_sendToInterestedUsers(
             extraRecipients=["marla@mayhem.net"],
@@ -848,6 +878,16 @@ class TestMailNotifier(ConfigErrorsMixin, unittest.TestCase):
         mn.buildMessage(builder.name, [build1, build2], build1.result)
         self.assertEqual(m['To'], "tyler@mayhem.net, user2@example.net")
 
+    def test_useUsersOverridden(self):
+        class MyMailNotifier(MailNotifier):
+
+            def useUsers(self, build):
+                return defer.succeed([])
+
+        self.assertFalse(MailNotifier('from@example.org')._useUsersOverridden())
+        self.assertTrue(
+            MyMailNotifier('from@example.org')._useUsersOverridden())
+
     def test_valid_emails(self):
         valid_emails = [
             'foo+bar@example.com',            # + comment in local part
@@ -861,6 +901,56 @@ class TestMailNotifier(ConfigErrorsMixin, unittest.TestCase):
         # MailNotifier raising a ConfigErrors exception.
         MailNotifier('foo@example.com', extraRecipients=valid_emails)
 
+    def test_init_maxLogLines_invalid(self):
+        self.assertRaisesConfigError("maxLogLines must be a positive integer",
+                                     lambda: MailNotifier('from@example.org',
+                                                          maxLogLines=0))
+
+    def test_createEmail_maxLogLines(self):
+        mn = MailNotifier('from@example.org', addLogs=True, maxLogLines=2)
+        log = FakeLog('line1\nline2\nline3\n')
+        log.getTailChunks = Mock(return_value=[(0, 'line2\n'),
+                                               (1, 'line3\n')])
+        d = mn.createEmail(create_msgdict(), u'builder-name', u'project-name',
+                           SUCCESS, [FakeBuildStatus(name='build')],
+                           logs=[log])
+
+        @d.addCallback
+        def check(m):
+            log.getTailChunks.assert_called_with(2, [0, 1])
+            attachment = m.get_payload()[1]
+            self.assertEqual(attachment.get_payload(decode=True),
+                             'line2\nline3\n')
+        return d
+
+    def test_buildMessage_limits_pending_messages(self):
+        mn = MailNotifier('from@example.org', sendToInterestedUsers=False,
+                          extraRecipients=['to@example.org'])
+        mn._messageSlots = defer.DeferredSemaphore(1)
+        mn.master_status = Mock()
+        mn.buildMessageDict = Mock(return_value={"body": "body",
+                                                 "type": "plain"})
+        mn.createEmail = Mock(side_effect=lambda *args: defer.succeed(
+            Message()))
+        sent = []
+
+        def sendMessage(m, recipients):
+            sent.append(defer.Deferred())
+            return sent[-1]
+        mn.sendMessage = sendMessage
+
+        builds = [FakeBuildStatus(name='build%d' % i) for i in range(2)]
+        for build in builds:
+            build.getSourceStamps.return_value = []
+        d1 = mn.buildMessage('bldr', builds[:1], SUCCESS)
+        d2 = mn.buildMessage('bldr', builds[1:], SUCCESS)
+        # the second message isn't even formatted until the first is sent
+        self.assertEqual(mn.createEmail.call_count, 1)
+        sent[0].callback(None)
+        self.assertEqual(mn.createEmail.call_count, 2)
+        sent[1].callback(None)
+        return defer.gatherResults([d1, d2])
+
     def test_invalid_email(self):
         for invalid in ['@', 'foo', 'foo@', '@example.com', 'foo@invalid',
                         'foobar@ex+ample.com',        # + in domain part
@@ -872,6 +962,157 @@ class TestMailNotifier(ConfigErrorsMixin, unittest.TestCase):
                 'foo@example.com', extraRecipients=[invalid])
 
 
+class FakeSMTPMessage(object):
+    implements(smtp.IMessage)
+
+    def __init__(self, server, recipient):
+        self.server = server
+        self.recipient = recipient
+        self.lines = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def eomReceived(self):
+        self.server.messages.append((self.recipient,
+                                     '\n'.join(self.lines)))
+        return defer.succeed(None)
+
+    def connectionLost(self):
+        pass
+
+
+class FakeESMTP(smtp.ESMTP):
+
+    def connectionLost(self, reason):
+        smtp.ESMTP.connectionLost(self, reason)
+        self.factory.open -= 1
+        if not self.factory.open:
+            waiters, self.factory.closeWaiters = self.factory.closeWaiters, []
+            for d in waiters:
+                d.callback(None)
+
+
+class FakeSMTPServer(smtp.SMTPFactory):
+
+    """A local SMTP server which accepts everything, except mail for
+    reject@example.org"""
+
+    implements(smtp.IMessageDelivery)
+    protocol = FakeESMTP
+
+    def __init__(self):
+        smtp.SMTPFactory.__init__(self)
+        self.connections = 0
+        self.open = 0
+        self.closeWaiters = []
+        self.messages = []
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        self.open += 1
+        p = smtp.SMTPFactory.buildProtocol(self, addr)
+        p.delivery = self
+        return p
+
+    def waitForClose(self):
+        if not self.open:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.closeWaiters.append(d)
+        return d
+
+    def receivedHeader(self, helo, origin, recipients):
+        return None
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        if user.dest.local == 'reject':
+            raise smtp.SMTPBadRcpt(user)
+        return lambda: FakeSMTPMessage(self, str(user.dest))
+
+
+class TestSMTPSenderPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSMTPServer()
+        self.port = reactor.listenTCP(0, self.server, interface='127.0.0.1')
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pool.waitUntilIdle()
+        yield self.server.waitForClose()
+        yield self.port.stopListening()
+
+    def makePool(self, **kwargs):
+        self.pool = mail.SMTPSenderPool('127.0.0.1', self.port.getHost().port,
+                                        'from@example.org', **kwargs)
+        return self.pool
+
+    def test_reuses_connections(self):
+        pool = self.makePool(maxConnections=2)
+        d = defer.gatherResults([
+            pool.send('Subject: %d\n\nbody %d\n' % (i, i),
+                      ['to%d@example.org' % i])
+            for i in range(5)])
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.server.connections, 2)
+            self.assertEqual(sorted(r for r, text in self.server.messages),
+                             ['to%d@example.org' % i for i in range(5)])
+        return d
+
+    def test_rejected_recipient(self):
+        pool = self.makePool(maxConnections=1)
+        d1 = pool.send('Subject: x\n\nx\n', ['reject@example.org'])
+        d2 = pool.send('Subject: y\n\ny\n', ['to@example.org'])
+        d = self.assertFailure(d1, smtp.SMTPDeliveryError)
+        d.addCallback(lambda _: d2)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.server.connections, 1)
+            self.assertEqual([r for r, text in self.server.messages],
+                             ['to@example.org'])
+        return d
+
+    def test_mailnotifier_sendMessage(self):
+        mn = MailNotifier('from@example.org', relayhost='127.0.0.1',
+                          smtpPort=self.port.getHost().port)
+        m = Message()
+        m['Subject'] = 'hello'
+        m.set_payload('body')
+        d = defer.gatherResults([mn.sendMessage(m, ['to@example.org']),
+                                 mn.sendMessage(m, ['to@example.org'])])
+        self.pool = mn.senderPool
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.server.connections, 2)
+            self.assertIn('Subject: hello', self.server.messages[0][1])
+        return d
+
+    def test_relay_unreachable(self):
+        pool = self.makePool(maxConnections=2)
+        d = self.port.stopListening()
+
+        @d.addCallback
+        def send(_):
+            dl = [self.assertFailure(pool.send('x', ['to@example.org']),
+                                     error.ConnectionRefusedError)
+                  for i in range(3)]
+            return defer.gatherResults(dl)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(pool.factories, [])
+            self.assertEqual(len(pool.queue), 0)
+        return d
+
+
 def create_msgdict(funny_chars=u'\u00E5\u00E4\u00F6'):
     unibody = u'Unicode body with non-ascii (%s).' % funny_chars
     msg_dict = dict(body=unibody, type='plain')
@@ -13,9 +13,14 @@
 #
 # Copyright Buildbot Team Members
 
+from __future__ import with_statement
+
 import mock
+import os
+import threading
 
 from buildbot.status import base
+from buildbot.status import builder
 from buildbot.status import master
 from buildbot.test.fake import fakedb
 from twisted.internet import defer
@@ -98,3 +103,138 @@ class TestStatus(unittest.TestCase):
         self.assertIdentical(sr0.master, None)
         self.assertIdentical(sr1.master, None)
         self.assertIdentical(sr2.master, None)
+
+
+class TestBuilderLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+
+    def makeStatus(self):
+        m = mock.Mock(name='master')
+        m.basedir = self.basedir
+        m.config.eventHorizon = 50
+        return master.Status(m)
+
+    def touch(self, *path):
+        open(os.path.join(self.basedir, *path), "w").close()
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_new(self):
+        bs = yield self.makeStatus().loadBuilder('bldr', 'bdir', 'cat', 'desc')
+        self.assertEqual((bs.name, bs.category, bs.description),
+                         ('bldr', 'cat', 'desc'))
+        self.assertEqual(bs.basedir, os.path.join(self.basedir, 'bdir'))
+        self.assertTrue(os.path.isdir(bs.basedir))
+        self.assertEqual(bs.nextBuildNumber, 0)
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_saved(self):
+        bs = self.makeStatus().builderAdded('bldr', 'bdir', 'cat')
+        bs.newBuild()
+        bs.newBuild()
+        bs.saveYourself()
+
+        bs2 = yield self.makeStatus().loadBuilder('bldr', 'bdir', 'newcat')
+        self.assertNotIdentical(bs2, bs)
+        self.assertEqual(bs2.category, 'newcat')
+        self.assertEqual(len(bs2.events), len(bs.events))
+        self.assertEqual(bs2.nextBuildNumber, 2)
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_lazy(self):
+        bs = self.makeStatus().builderAdded('bldr', 'bdir')
+        bs.addPointEvent(['saved'])
+        bs.saveYourself()
+
+        loads, reads = [], []
+        self.patch(builder, 'loads',
+                   lambda s, orig=builder.loads: loads.append(s) or orig(s))
+        readBuilderFiles = master.Status._readBuilderFiles
+
+        def _readBuilderFiles(status, builddir):
+            reads.append(threading.currentThread())
+            return readBuilderFiles(status, builddir)
+        self.patch(master.Status, '_readBuilderFiles', _readBuilderFiles)
+        bs2 = yield self.makeStatus().loadBuilder('bldr', 'bdir')
+        # the pickle is read in a thread, but not unpickled yet
+        self.assertNotIdentical(reads[0], threading.currentThread())
+        bs2.setSlavenames(['sl'])
+        bs2.setBigState('idle')
+        self.assertEqual(loads, [])
+
+        # the saved events are loaded on first use, and new events follow
+        bs2.addPointEvent(['new'])
+        self.assertEqual(len(loads), 1)
+        self.assertEqual([e.getText() for e in bs2.events],
+                         [['builder', 'created'], ['saved'], ['new']])
+        self.assertEqual(bs2.getEvent(2).getText(), ['new'])
+        self.assertEqual(len(loads), 1)
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_lazy_saveYourself(self):
+        bs = self.makeStatus().builderAdded('bldr', 'bdir')
+        bs.saveYourself()
+
+        # saving a builder whose events were never loaded keeps them
+        bs2 = yield self.makeStatus().loadBuilder('bldr', 'bdir')
+        bs2.saveYourself()
+        bs3 = yield self.makeStatus().loadBuilder('bldr', 'bdir')
+        self.assertEqual([e.getText() for e in bs3.events],
+                         [['builder', 'created']])
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_lazy_attributes(self):
+        bs = self.makeStatus().builderAdded('bldr', 'bdir')
+        bs.customAttribute = 'saved'
+        bs.category = 'old'
+        bs.saveYourself()
+
+        # anything else in the pickle is restored along with the events,
+        # but the configuration wins
+        bs2 = yield self.makeStatus().loadBuilder('bldr', 'bdir',
+                                                  category='new')
+        self.assertEqual(bs2.customAttribute, 'saved')
+        self.assertEqual(bs2.category, 'new')
+        self.assertEqual([e.getText() for e in bs2.events],
+                         [['builder', 'created']])
+
+    @defer.inlineCallbacks
+    def test_loadBuilder_corrupt(self):
+        os.makedirs(os.path.join(self.basedir, 'bdir'))
+        with open(os.path.join(self.basedir, 'bdir', 'builder'), 'w') as f:
+            f.write('not a pickle')
+        bs = yield self.makeStatus().loadBuilder('bldr', 'bdir')
+        self.assertEqual(bs.events, [])
+        self.assertEqual(len(self.flushLoggedErrors()), 1)
+
+    def test_builderAdded_announced(self):
+        status = self.makeStatus()
+        target = mock.Mock()
+        status.watchers.append(target)
+        bs = status.builderAdded('bldr', 'bdir')
+        target.builderAdded.assert_called_with('bldr', bs)
+
+    def test_nextBuildNumber_metadata(self):
+        bs = self.makeStatus().builderAdded('bldr', 'bdir')
+        bs.newBuild()
+        # the metadata is only written along with the builder's pickle
+        self.assertFalse(os.path.exists(
+            os.path.join(bs.basedir, builder.METADATA_FILENAME)))
+        bs.saveYourself()
+        # a build saved after the metadata was written is skipped
+        self.touch('bdir', '1')
+        self.assertEqual(builder.loadNextBuildNumber(bs.basedir), 2)
+
+    def test_nextBuildNumber_scan(self):
+        os.makedirs(os.path.join(self.basedir, 'bdir'))
+        for f in '3', '7', '7-log-compile-stdio', 'builder':
+            self.touch('bdir', f)
+        self.assertEqual(
+            builder.loadNextBuildNumber(os.path.join(self.basedir, 'bdir')), 8)
+
+        # an unreadable metadata file is ignored
+        self.touch('bdir', builder.METADATA_FILENAME)
+        self.assertEqual(
+            builder.loadNextBuildNumber(os.path.join(self.basedir, 'bdir')), 8)
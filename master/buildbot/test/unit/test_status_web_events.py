@@ -0,0 +1,251 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from buildbot.status.results import FAILURE
+from buildbot.status.web import events
+from buildbot.test.fake.web import FakeRequest
+from buildbot.util import json
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.web import server
+
+
+class StatusEventsResource(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock()
+        self.clock = task.Clock()
+        self.rsrc = events.StatusEventsResource(self.status)
+        self.hub = self.rsrc.hub
+        self.hub._reactor = self.clock
+
+        self.builder = mock.Mock()
+        self.builder.getName.return_value = 'bldr'
+        self.build = mock.Mock()
+        self.build.getBuilder.return_value = self.builder
+        self.build.getNumber.return_value = 7
+        self.build.getReason.return_value = 'because'
+        self.build.getText.return_value = ['failed']
+        self.step = mock.Mock()
+        self.step.getName.return_value = 'compile'
+        self.step.getText.return_value = ['compile', 'failed']
+        self.log = mock.Mock()
+        self.log.getName.return_value = 'stdio'
+
+    def makeRequest(self, headers={}, **args):
+        req = FakeRequest(args=dict((k, [v]) for k, v in args.items()))
+        req.getHeader = headers.get
+        req.finished_d = defer.Deferred()
+        req.notifyFinish = lambda: req.finished_d
+        return req
+
+    def render(self, **kwargs):
+        req = self.makeRequest(**kwargs)
+        self.assertEqual(self.rsrc.render_GET(req), server.NOT_DONE_YET)
+        return req
+
+    def frames(self, req):
+        return [f for f in req.written.split('\n\n')
+                if f and not f.startswith(':')]
+
+    def test_subscribes_once(self):
+        self.render()
+        self.render()
+        self.status.subscribe.assert_called_once_with(self.hub)
+
+    def test_stream_fanout(self):
+        req1 = self.render()
+        req2 = self.render()
+        self.hub.buildStarted('bldr', self.build)
+        self.assertEqual(self.frames(req1), self.frames(req2))
+        frame = self.frames(req1)[0]
+        self.assertEqual(frame, 'id: %s-1\nevent: buildStarted\n'
+                         'data: {"builder":"bldr","number":7,"reason":"because"}'
+                         % self.hub.generation)
+
+    def test_stream_builder_filter(self):
+        req = self.render(builder='other')
+        self.hub.buildStarted('bldr', self.build)
+        self.hub.builderChangedState('other', 'idle')
+        self.assertEqual([f.split('\n')[1] for f in self.frames(req)],
+                         ['event: builderChangedState'])
+
+    def test_stream_resume(self):
+        self.hub.builderChangedState('bldr', 'idle')
+        cursor = self.hub.makeCursor(self.hub.seq)
+        self.hub.builderChangedState('bldr', 'building')
+        self.hub.buildStarted('bldr', self.build)
+        req = self.render(headers={'Last-Event-ID': cursor})
+        self.assertEqual([f.split('\n')[1] for f in self.frames(req)],
+                         ['event: builderChangedState', 'event: buildStarted'])
+
+    def test_stream_resume_too_old(self):
+        self.hub.bufferSize = 2
+        for i in range(5):
+            self.hub.builderChangedState('bldr', 'idle')
+        req = self.render(since=self.hub.makeCursor(1))
+        self.assertEqual([f.split('\n')[1] for f in self.frames(req)],
+                         ['event: reset'])
+
+    def test_stream_resume_other_generation(self):
+        self.hub.builderChangedState('bldr', 'idle')
+        req = self.render(since='abc-1')
+        self.assertEqual([f.split('\n')[1] for f in self.frames(req)],
+                         ['event: reset'])
+
+    def test_stream_disconnect(self):
+        req = self.render()
+        req.finished_d.callback(None)
+        self.assertEqual(self.hub.subscribers, [])
+
+    def test_keepalive(self):
+        req = self.render()
+        req.written = ''
+        self.clock.advance(self.hub.keepaliveInterval)
+        self.assertEqual(req.written, ': keepalive\n\n')
+        req.finished_d.callback(None)
+        self.clock.advance(self.hub.keepaliveInterval)
+        self.assertEqual(self.clock.getDelayedCalls(), [self.hub.idle])
+
+    def test_logs_only_when_wanted(self):
+        self.render()
+        self.assertEqual(self.hub.stepStarted(self.build, self.step), None)
+        self.hub.logChunk(self.build, self.step, self.log, 0, 'hello')
+        self.assertEqual(self.hub.seq, 1)
+
+        req = self.render(logs='1')
+        self.assertEqual(self.hub.stepStarted(self.build, self.step),
+                         self.hub)
+        self.hub.logChunk(self.build, self.step, self.log, 0, 'hello')
+        data = json.loads(self.frames(req)[-1].split('data: ')[1])
+        self.assertEqual(data, dict(builder='bldr', number=7, step='compile',
+                                    log='stdio', channel=0, text='hello'))
+
+    def test_poll_backlog(self):
+        self.hub.builderChangedState('bldr', 'idle')
+        cursor = self.hub.makeCursor(self.hub.seq)
+        self.hub.stepFinished(self.build, self.step, (FAILURE, []))
+        req = self.render(poll='1', since=cursor)
+        self.assertTrue(req.finished)
+        self.assertEqual(json.loads(req.written), {
+            'cursor': self.hub.makeCursor(2),
+            'events': [{'type': 'stepFinished',
+                        'data': {'builder': 'bldr', 'number': 7,
+                                 'step': 'compile', 'results': FAILURE,
+                                 'text': ['compile', 'failed']}}]})
+
+    def test_poll_waits(self):
+        req = self.render(poll='1')
+        self.assertFalse(req.finished)
+        self.hub.buildFinished('bldr', self.build, FAILURE)
+        self.assertTrue(req.finished)
+        body = json.loads(req.written)
+        self.assertEqual([e['type'] for e in body['events']],
+                         ['buildFinished'])
+        self.assertEqual(self.hub.subscribers, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [self.hub.idle])
+
+    def test_poll_timeout(self):
+        req = self.render(poll='1', timeout='5')
+        self.clock.advance(5)
+        self.assertTrue(req.finished)
+        self.assertEqual(json.loads(req.written),
+                         {'cursor': self.hub.makeCursor(0), 'events': []})
+        self.assertEqual(self.hub.subscribers, [])
+
+    def test_unsubscribe(self):
+        req = self.render()
+        self.hub.builderAdded('bldr', self.builder)
+        self.hub.unsubscribe()
+        self.status.unsubscribe.assert_called_once_with(self.hub)
+        self.builder.unsubscribe.assert_called_once_with(self.hub)
+        self.assertTrue(req.finished)
+
+    def test_stream_producer(self):
+        req = self.render()
+        sub = self.hub.subscribers[0]
+        req.registerProducer.assert_called_once_with(sub, True)
+
+        # nothing is written while the transport has paused the stream
+        sub.pauseProducing()
+        req.written = ''
+        self.hub.builderChangedState('bldr', 'idle')
+        self.hub.buildStarted('bldr', self.build)
+        self.clock.advance(self.hub.keepaliveInterval)
+        self.assertEqual(req.written, '')
+
+        # the missed events are sent from the buffer on resume
+        sub.resumeProducing()
+        self.assertEqual([f.split('\n')[1] for f in self.frames(req)],
+                         ['event: builderChangedState', 'event: buildStarted'])
+        self.assertEqual(sub.seq, self.hub.seq)
+
+    def test_stream_producer_reset(self):
+        self.hub.bufferSize = 2
+        req = self.render()
+        sub = self.hub.subscribers[0]
+        sub.pauseProducing()
+        for i in range(5):
+            self.hub.builderChangedState('bldr', 'idle')
+
+        # a client which fell out of the buffer is told to reset
+        sub.resumeProducing()
+        self.assertEqual([f.split('\n')[:2] for f in self.frames(req)],
+                         [['id: %s' % self.hub.makeCursor(5), 'event: reset']])
+        self.hub.builderChangedState('bldr', 'building')
+        self.assertEqual(self.frames(req)[-1].split('\n')[0],
+                         'id: %s' % self.hub.makeCursor(6))
+
+    def test_unsubscribe_when_idle(self):
+        req = self.render()
+        cursor = self.hub.makeCursor(self.hub.seq)
+        req.finished_d.callback(None)
+
+        # a client returning soon keeps the subscription
+        req = self.render(poll='1', since=cursor)
+        self.clock.advance(5)
+        self.hub.buildStarted('bldr', self.build)
+        self.assertTrue(req.finished)
+        cursor = json.loads(req.written)['cursor']
+
+        self.clock.advance(self.hub.idleTimeout)
+        self.status.unsubscribe.assert_called_once_with(self.hub)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+        # events were missed in the meantime, so the cursor can't be resumed
+        req = self.render(poll='1', since=cursor)
+        self.assertEqual(json.loads(req.written)['reset'], True)
+        self.assertEqual(self.status.subscribe.call_count, 2)
+
+    def test_unsubscribe_when_idle_after_backlog_poll(self):
+        cursor = self.hub.makeCursor(self.hub.seq)
+        self.render(poll='1', timeout='0')
+        self.clock.advance(0)
+        self.hub.builderChangedState('bldr', 'idle')
+
+        # a poll answered from the buffer leaves no subscriber behind
+        req = self.render(poll='1', since=cursor)
+        self.assertTrue(req.finished)
+        self.clock.advance(self.hub.idleTimeout)
+        self.status.unsubscribe.assert_called_once_with(self.hub)
+
+    def test_unsubscribe_when_idle_after_reset_poll(self):
+        req = self.render(poll='1', since='old-1')
+        self.assertEqual(json.loads(req.written)['reset'], True)
+        self.clock.advance(self.hub.idleTimeout)
+        self.status.unsubscribe.assert_called_once_with(self.hub)
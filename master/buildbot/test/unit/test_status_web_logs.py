@@ -0,0 +1,82 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from buildbot.status import logfile
+from buildbot.status.web import logs
+from buildbot.test.fake.web import FakeRequest
+from twisted.trial import unittest
+from twisted.web import server
+
+
+class TextLog(unittest.TestCase):
+
+    def setUp(self):
+        self.log = mock.Mock()
+        self.log.isFinished.return_value = True
+        self.rsrc = logs.TextLog(self.log)
+        self.rsrc.asText = True
+
+    def makeRequest(self, range=None, **args):
+        req = FakeRequest(args=dict((k, [v]) for k, v in args.items()))
+        req.getHeader = {'range': range}.get
+        return req
+
+    def test_range(self):
+        self.log.getTextRange.return_value = (10, 19, 100, 'x' * 10)
+        req = self.makeRequest(range='bytes=10-19')
+        self.assertEqual(self.rsrc.render_GET(req), 'x' * 10)
+        self.log.getTextRange.assert_called_with(
+            10, 19, [logfile.STDOUT, logfile.STDERR])
+        req.setResponseCode.assert_called_with(206)
+        req.setHeader.assert_any_call('content-range', 'bytes 10-19/100')
+        self.assertFalse(self.log.subscribeConsumer.called)
+
+    def test_range_open_and_suffix(self):
+        self.log.getTextRange.return_value = (0, 0, 1, 'x')
+        self.rsrc.render_GET(self.makeRequest(range='bytes=0-'))
+        self.log.getTextRange.assert_called_with(
+            0, None, [logfile.STDOUT, logfile.STDERR])
+        self.rsrc.render_GET(self.makeRequest(range='bytes=-500'))
+        self.log.getTextRange.assert_called_with(
+            None, 500, [logfile.STDOUT, logfile.STDERR])
+
+    def test_range_unsatisfiable(self):
+        self.log.getTextRange.return_value = (None, None, 100, '')
+        req = self.makeRequest(range='bytes=200-')
+        self.assertEqual(self.rsrc.render_GET(req), '')
+        req.setResponseCode.assert_called_with(416)
+        req.setHeader.assert_any_call('content-range', 'bytes */100')
+
+    def test_range_ignored(self):
+        for header in ['bytes=1-2,5-6', 'bytes=5-1', 'bytes=x-', 'bytes=-',
+                       'lines=1-2']:
+            req = self.makeRequest(range=header)
+            self.assertEqual(self.rsrc.render_GET(req), server.NOT_DONE_YET)
+        self.assertFalse(self.log.getTextRange.called)
+
+    def test_tail_text(self):
+        req = self.makeRequest(tail='20')
+        self.assertEqual(self.rsrc.render_GET(req), server.NOT_DONE_YET)
+        args, kwargs = self.log.subscribeConsumer.call_args
+        self.assertEqual(kwargs, dict(tail=20, channels=[logfile.STDOUT,
+                                                         logfile.STDERR]))
+
+    def test_no_tail(self):
+        req = self.makeRequest(tail='bogus')
+        self.rsrc.render_GET(req)
+        args, kwargs = self.log.subscribeConsumer.call_args
+        self.assertEqual(kwargs, {})
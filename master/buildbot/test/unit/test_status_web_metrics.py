@@ -0,0 +1,44 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+import mock
+
+from buildbot.status.web import metrics
+from buildbot.test.fake.web import FakeRequest
+from twisted.trial import unittest
+
+
+class MetricsTextResource(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock()
+        self.rsrc = metrics.MetricsTextResource(self.status)
+
+    def test_render(self):
+        observer = self.status.getMetrics.return_value
+        observer.enabled = True
+        observer.exposition.return_value = 'buildbot_counter{counter="x"} 1\n'
+        req = FakeRequest()
+        self.assertEqual(self.rsrc.render_GET(req),
+                         'buildbot_counter{counter="x"} 1\n')
+        req.setHeader.assert_any_call('content-type',
+                                      'text/plain; version=0.0.4; charset=utf-8')
+
+    def test_disabled(self):
+        self.status.getMetrics.return_value.enabled = False
+        req = FakeRequest()
+        self.rsrc.render_GET(req)
+        req.setResponseCode.assert_called_with(404)
@@ -0,0 +1,184 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+import os
+
+from buildbot import util
+from buildbot.status import builder
+from buildbot.status.results import SUCCESS
+from buildbot.status.web import waterfall
+from buildbot.test.fake import fakemaster
+from twisted.trial import unittest
+
+
+class EventColumnCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100000
+        self.patch(util, 'now', lambda *args: self.now)
+
+        m = fakemaster.make_master()
+        m.config.logCompressionLimit = False
+        self.builder_status = b = builder.BuilderStatus(
+            buildername='bldr', category=None, master=m, description=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = mock.Mock()
+
+        self.cache = waterfall.EventColumnCache()
+        self.cache.bucketSize = 100
+        self.cache.builderAdded('bldr', b)
+
+    def startBuild(self, numSteps=2):
+        build = self.builder_status.newBuild()
+        for i in range(numSteps):
+            build.addStepWithName('step%d' % i)
+        build.buildStarted(build)
+        for step in build.getSteps():
+            self.now += 10
+            step.stepStarted()
+        return build
+
+    def finishBuild(self, build):
+        for step in build.getSteps():
+            step.stepFinished(SUCCESS)
+        build.buildFinished()
+        self.now += 10
+
+    def makeBuilds(self, count, spacing=70):
+        # by default, each build starts in a bucket of its own
+        for i in range(count):
+            self.finishBuild(self.startBuild())
+            self.now += spacing
+        self.now += 1000
+
+    def cachedEvents(self, minTime=0):
+        return list(self.cache.eventGenerator(self.builder_status,
+                                              [], [], [], [], minTime))
+
+    def freshEvents(self):
+        return list(self.builder_status.eventGenerator())
+
+    def countGetBuild(self):
+        calls = []
+        getBuild = self.builder_status.getBuild
+
+        def countingGetBuild(number):
+            calls.append(number)
+            return getBuild(number)
+        self.patch(self.builder_status, 'getBuild', countingGetBuild)
+        return calls
+
+    def test_matches_uncached(self):
+        self.makeBuilds(5)
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+
+    def test_second_call_uses_cache(self):
+        self.makeBuilds(5)
+        self.cachedEvents()
+        calls = self.countGetBuild()
+        self.cachedEvents()
+        # only the newest bucket is recomputed, and the next build is
+        # fetched to find where the cached buckets start
+        self.assertEqual(calls, [4, 3])
+
+    def test_new_builds(self):
+        self.makeBuilds(5)
+        self.cachedEvents()
+        self.builder_status.addPointEvent(['connect'])
+        running = self.startBuild()
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+        self.finishBuild(running)
+        self.makeBuilds(2)
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+        calls = self.countGetBuild()
+        self.cachedEvents()
+        self.assertEqual(calls, [7, 6])
+
+    def test_keeps_older_buckets(self):
+        self.makeBuilds(5)
+        self.cachedEvents()
+        self.makeBuilds(3)
+        calls = self.countGetBuild()
+        events = self.cachedEvents()
+        # the buckets frozen since the last call are read, up to the first
+        # cached one, and the older builds are taken from the cache
+        self.assertEqual(calls, [7, 6, 5, 4, 3])
+        self.assertEqual(events, self.freshEvents())
+
+    def test_same_bucket_not_frozen(self):
+        self.makeBuilds(3, spacing=0)
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+        self.assertEqual(self.cache.columns['bldr'], {})
+
+    def test_running_build_not_frozen(self):
+        self.makeBuilds(2)
+        running = self.startBuild()
+        self.now += 1000
+        self.cachedEvents()
+        column = self.cache.columns['bldr'].values()[0]
+        self.assertEqual([e.getNumber() for bucket, events in column.buckets
+                          for e in events
+                          if isinstance(e, builder.BuildStatus)], [0])
+        self.assertTrue(column.bucket < running.getTimes()[0])
+
+    def test_partial_consumption(self):
+        self.makeBuilds(5)
+        gen = self.cache.eventGenerator(self.builder_status,
+                                        [], [], [], [], 0)
+        for i in range(5):
+            gen.next()
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+        self.assertEqual(self.cachedEvents(), self.freshEvents())
+
+    def test_bounded_by_maxEvents(self):
+        self.cache.maxEventsPerColumn = 9
+        self.makeBuilds(10)
+        for i in range(20):
+            self.makeBuilds(1)
+            self.assertEqual(self.cachedEvents(), self.freshEvents())
+            column = self.cache.columns['bldr'].values()[0]
+            self.assertEqual(column.size, 9)
+            self.assertTrue(column.truncated)
+
+    def test_invalidate(self):
+        self.makeBuilds(3)
+        self.cachedEvents()
+        self.cache.buildFinished('bldr', self.builder_status.getBuild(1),
+                                 SUCCESS)
+        self.assertEqual(self.cache.columns['bldr'], {})
+
+    def test_invalidate_newer_build(self):
+        self.makeBuilds(3)
+        self.cachedEvents()
+        running = self.startBuild()
+        self.cache.stepStarted(running, running.getSteps()[0])
+        self.assertEqual(len(self.cache.columns['bldr']), 1)
+
+    def test_minTime_not_cached(self):
+        self.makeBuilds(3)
+        self.cachedEvents(minTime=1)
+        self.assertEqual(self.cache.columns, {})
+
+    def test_builderRemoved(self):
+        self.makeBuilds(3)
+        self.cachedEvents()
+        self.cache.builderRemoved('bldr')
+        self.assertEqual(self.cache.columns, {})
+        self.assertEqual(self.cache.builders, {})
@@ -21,6 +21,7 @@ from buildbot.test.util import config
 from twisted.application import internet
 from twisted.internet import reactor
 from twisted.internet import task
+from twisted.test import proto_helpers
 from twisted.trial import unittest
 
 
@@ -64,6 +65,12 @@ class TestIrcContactChannel(unittest.TestCase):
             self.sent.append(msg)
         self.contact.send = send
 
+        def broadcast(msg, group, item):
+            if callable(msg):
+                msg = msg()
+            self.sent.append(msg)
+        self.contact.broadcast = broadcast
+
     def patch_act(self):
         self.actions = []
 
@@ -432,6 +439,80 @@ class TestIrcContactChannel(unittest.TestCase):
             "build #42 of dummy started (including [1, 2] and 1 more)")
 
 
+class TestOutboundQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(words.OutboundQueue, '_reactor', self.clock)
+        self.sent = []
+        self.queue = words.OutboundQueue(
+            lambda dest, msg: self.sent.append((dest, msg)),
+            burst=2, interval=2.0)
+
+    def reply(self, msg):
+        self.queue.reply(lambda: self.sent.append(('reply', msg)))
+
+    def test_rate_limit(self):
+        for i in range(4):
+            self.reply('r%d' % i)
+        self.assertEqual(self.sent, [('reply', 'r0'), ('reply', 'r1')])
+        self.clock.advance(2)
+        self.assertEqual(len(self.sent), 3)
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 3)
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 4)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        # the bucket refills while idle, but only up to the burst size
+        self.clock.advance(60)
+        for i in range(3):
+            self.reply('s%d' % i)
+        self.assertEqual(len(self.sent), 6)
+
+    def test_replies_first(self):
+        self.reply('r0')
+        self.reply('r1')
+        self.queue.broadcast('#chan', 'b0', 'builds started', 'b #0')
+        self.reply('r2')
+        self.clock.advance(2)
+        self.clock.advance(2)
+        self.assertEqual(self.sent, [('reply', 'r0'), ('reply', 'r1'),
+                                     ('reply', 'r2'), ('#chan', 'b0')])
+
+    def test_coalesce(self):
+        self.reply('r0')
+        self.reply('r1')
+        formatted = []
+
+        def message(i):
+            def format():
+                formatted.append(i)
+                return 'build %d started' % i
+            return format
+        for i in range(8):
+            self.queue.broadcast('#chan', message(i), 'builds started',
+                                 'b #%d' % i)
+        self.queue.broadcast('#other', message(8), 'builds started', 'b #8')
+        self.queue.broadcast('#chan', message(9), 'builds failed', 'b #9')
+        self.clock.pump([2, 2, 2])
+        self.assertEqual(self.sent[2:], [
+            ('#chan', '8 builds started: b #0, b #1, b #2, b #3, b #4 '
+                      'and 3 more'),
+            ('#other', 'build 8 started'),
+            ('#chan', 'build 9 started'),
+        ])
+        # the coalesced messages were never formatted
+        self.assertEqual(formatted, [8, 9])
+
+    def test_clear(self):
+        for i in range(4):
+            self.reply('r%d' % i)
+        self.queue.clear()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(10)
+        self.assertEqual(len(self.sent), 2)
+
+
 class FakeContact(object):
 
     def __init__(self, bot, name):
@@ -476,6 +557,41 @@ class TestIrcStatusBot(unittest.TestCase):
         b.msgOrNotice('#chan', 'hi')
         self.assertEqual(evts, [('n', '#chan', 'hi')])
 
+    def test_outbox_loopback(self):
+        clock = task.Clock()
+        self.patch(words.OutboundQueue, '_reactor', clock)
+        self.status.getURLForThing.return_value = None
+        b = self.makeBot('nick', None, ['#ch'], [], self.status, None, {})
+        transport = proto_helpers.StringTransport()
+        b.makeConnection(transport)
+        self.addCleanup(b.connectionLost, None)
+        transport.clear()
+
+        contact = b.getContact('#ch')
+        contact.notify_for_finished = lambda build: True
+        for i in range(10):
+            builder = mock.Mock()
+            builder.getName.return_value = 'bldr%d' % i
+            builder.category = None
+            build = mock.Mock()
+            build.getBuilder.return_value = builder
+            build.getNumber.return_value = 1
+            build.getResults.return_value = 2
+            build.getText.return_value = ['failed']
+            contact.buildFinished('bldr%d' % i, build, 2)
+        b.privmsg('dustin!~dustin@host', '#ch', 'nick: hello')
+        clock.advance(b.messageInterval * 2)
+
+        lines = transport.value().splitlines()
+        self.assertEqual(len(lines), b.messageBurst + 2)
+        self.assertEqual(lines[0],
+                         'PRIVMSG #ch :build #1 of bldr0 is complete: '
+                         'Failure [\x034failed\x03]')
+        self.assertEqual(lines[-2], 'PRIVMSG #ch :yes?')
+        self.assertEqual(lines[-1],
+                         'PRIVMSG #ch :5 builds completed with failure: '
+                         'bldr5 #1, bldr6 #1, bldr7 #1, bldr8 #1, bldr9 #1')
+
     def test_getContact(self):
         b = self.makeBot()
 
@@ -15,6 +15,7 @@
 
 import stat
 
+from buildbot import config
 from buildbot.interfaces import BuildSlaveTooOldError
 from buildbot.process import buildstep
 from buildbot.process import properties
@@ -174,6 +175,23 @@ class TestCopyDirectory(steps.BuildStepMixin, unittest.TestCase):
                            status_text=["Copied", "s", "to", "d"])
         return self.runStep()
 
+    def test_hardlink(self):
+        self.setupStep(slave.CopyDirectory(src="s", dest="d",
+                                           method='hardlink'))
+        self.expectCommands(
+            Expect('cpdir', {'fromdir': 's', 'todir': 'd',
+                             'method': 'hardlink'})
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["Copied", "s", "to", "d"])
+        return self.runStep()
+
+    def test_bad_method(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          slave.CopyDirectory(src="s", dest="d",
+                                              method='symlink'))
+
     def test_failure(self):
         self.setupStep(slave.CopyDirectory(src="s", dest="d"))
         self.expectCommands(
@@ -215,6 +233,16 @@ class TestRemoveDirectory(steps.BuildStepMixin, unittest.TestCase):
                            status_text=["Deleted"])
         return self.runStep()
 
+    def test_background(self):
+        self.setupStep(slave.RemoveDirectory(dir="d", background=True))
+        self.expectCommands(
+            Expect('rmdir', {'dir': 'd', 'background': True})
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["Deleted"])
+        return self.runStep()
+
     def test_failure(self):
         self.setupStep(slave.RemoveDirectory(dir="d"))
         self.expectCommands(
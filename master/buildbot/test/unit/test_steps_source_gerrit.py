@@ -33,7 +33,8 @@ class TestGerrit(sourcesteps.SourceStepMixin, config.ConfigErrorsMixin, unittest
     def test_mode_full_clean(self):
         self.setupStep(
             gerrit.Gerrit(repourl='http://github.com/buildbot/buildbot.git',
-                          mode='full', method='clean'))
+                          mode='full', method='clean'),
+            slave_version={'*': '2.18'})
         self.build.setProperty("event.patchSet.ref", "gerrit_branch")
 
         self.expectCommands(
@@ -76,7 +77,8 @@ class TestGerrit(sourcesteps.SourceStepMixin, config.ConfigErrorsMixin, unittest
     def test_mode_full_clean_force_build(self):
         self.setupStep(
             gerrit.Gerrit(repourl='http://github.com/buildbot/buildbot.git',
-                          mode='full', method='clean'))
+                          mode='full', method='clean'),
+            slave_version={'*': '2.18'})
         self.build.setProperty("gerrit_change", "1234/567")
 
         self.expectCommands(
@@ -115,3 +117,25 @@ class TestGerrit(sourcesteps.SourceStepMixin, config.ConfigErrorsMixin, unittest
         self.expectOutcome(result=SUCCESS, status_text=["update"])
         self.expectProperty('got_revision', 'f6ad368298bd941e934a41f3babc827b2aa95a1d', 'Gerrit')
         return self.runStep()
+
+    def test_mode_full_clean_gitsync(self):
+        self.setupStep(
+            gerrit.Gerrit(repourl='http://github.com/buildbot/buildbot.git',
+                          mode='full', method='clean'))
+        self.build.setProperty("event.patchSet.ref", "gerrit_branch")
+
+        self.expectCommands(
+            Expect('gitsync', dict(workdir='wkdir',
+                                   repourl='http://github.com/buildbot/buildbot.git',
+                                   branch='gerrit_branch', revision=None,
+                                   mode='full', method='clean',
+                                   submodules=False, progress=False,
+                                   retryFetch=False, config=None, env=None,
+                                   logEnviron=True, timeout=1200))
+            + Expect.update('got_revision',
+                            'f6ad368298bd941e934a41f3babc827b2aa95a1d')
+            + 0,
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["update"])
+        self.expectProperty('got_revision', 'f6ad368298bd941e934a41f3babc827b2aa95a1d', 'Gerrit')
+        return self.runStep()
@@ -20,7 +20,12 @@ import shutil
 import stat
 import tarfile
 import tempfile
+import threading
 
+from hashlib import sha1
+
+from cStringIO import StringIO
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from mock import Mock
@@ -77,6 +82,72 @@ class TestFileWriter(unittest.TestCase):
         mockedMkstemp.assert_called_once_with(dir=absdir)
         mockedFdopen.assert_called_once_with(7, 'wb')
 
+    def makeWriter(self, maxsize=None):
+        fd, destfile = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(lambda: os.path.exists(destfile) and os.unlink(destfile))
+        return transfer._FileWriter(destfile, maxsize, None)
+
+    @defer.inlineCallbacks
+    def test_operations_queued(self):
+        writer = self.makeWriter(maxsize=10)
+        threadNames = []
+        write = writer._write
+
+        def _write(data):
+            threadNames.append(threading.currentThread().getName())
+            write(data)
+        writer._write = _write
+        # the operations run in order, even if the caller does not wait
+        writer.remote_write('x' * 6)
+        writer.remote_write('y' * 6)
+        yield writer.remote_close()
+        with open(writer.destfile, 'rb') as f:
+            self.assertEqual(f.read(), 'xxxxxxyyyy')
+        self.assertNotIn(threading.currentThread().getName(), threadNames)
+
+    @defer.inlineCallbacks
+    def test_cancel(self):
+        writer = self.makeWriter()
+        tmpname = writer.tmpname
+        writer.remote_write('data')
+        yield writer.cancel()
+        self.assertFalse(os.path.exists(tmpname))
+        self.assertFalse(os.path.exists(writer.destfile))
+
+
+class TestDirectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = os.path.abspath('destdir')
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def tearDown(self):
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    @defer.inlineCallbacks
+    def test_unpack_progress(self):
+        progress = []
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz', 0600,
+                                           progress=progress.append)
+        writer.progressInterval = 2
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, name='fake.tar', mode='w:gz')
+        for i in range(5):
+            data = 'file %d' % i
+            info = tarfile.TarInfo('f%d' % i)
+            info.size = len(data)
+            archive.addfile(info, StringIO(data))
+        archive.close()
+        yield writer.remote_write(f.getvalue())
+        yield writer.remote_unpack()
+        self.assertEqual(sorted(os.listdir(self.destdir)),
+                         ['f0', 'f1', 'f2', 'f3', 'f4'])
+        self.assertEqual(progress, [2, 4])
+        self.assertFalse(os.path.exists(writer.tarname))
+
 # Test buildbot.steps.transfer._TransferBuildStep class.
 
 
@@ -125,6 +196,7 @@ class TestFileUpload(unittest.TestCase):
         self.assertRaises(config.ConfigErrors, lambda:
                           transfer.FileUpload(slavesrc=__file__, masterdest='xyz', mode='g+rwx'))
 
+    @defer.inlineCallbacks
     def testBasic(self):
         s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile)
         s.build = Mock()
@@ -145,9 +217,9 @@ class TestFileUpload(unittest.TestCase):
                 self.assertEquals(kwargs['slavesrc'], __file__)
                 writer = kwargs['writer']
                 with open(__file__, "rb") as f:
-                    writer.remote_write(f.read())
+                    yield writer.remote_write(f.read())
                 self.assert_(not os.path.exists(self.destfile))
-                writer.remote_close()
+                yield writer.remote_close()
                 break
         else:
             self.assert_(False, "No uploadFile command found")
@@ -156,6 +228,7 @@ class TestFileUpload(unittest.TestCase):
             with open(__file__, "rb") as expect:
                 self.assertEquals(dest.read(), expect.read())
 
+    @defer.inlineCallbacks
     def testTimestamp(self):
         s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile, keepstamp=True)
         s.build = Mock()
@@ -177,10 +250,10 @@ class TestFileUpload(unittest.TestCase):
                 self.assertEquals(kwargs['slavesrc'], __file__)
                 writer = kwargs['writer']
                 with open(__file__, "rb") as f:
-                    writer.remote_write(f.read())
+                    yield writer.remote_write(f.read())
                 self.assert_(not os.path.exists(self.destfile))
-                writer.remote_close()
-                writer.remote_utime(timestamp)
+                yield writer.remote_close()
+                yield writer.remote_utime(timestamp)
                 break
         else:
             self.assert_(False, "No uploadFile command found")
@@ -194,6 +267,7 @@ class TestFileUpload(unittest.TestCase):
         self.assertEquals(timestamp[0], desttimestamp[0])
         self.assertEquals(timestamp[1], desttimestamp[1])
 
+    @defer.inlineCallbacks
     def testURL(self):
         s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile, url="http://server/file")
         s.build = Mock()
@@ -214,9 +288,9 @@ class TestFileUpload(unittest.TestCase):
                 self.assertEquals(kwargs['slavesrc'], __file__)
                 writer = kwargs['writer']
                 with open(__file__, "rb") as f:
-                    writer.remote_write(f.read())
+                    yield writer.remote_write(f.read())
                 self.assert_(not os.path.exists(self.destfile))
-                writer.remote_close()
+                yield writer.remote_close()
                 break
         else:
             self.assert_(False, "No uploadFile command found")
@@ -245,13 +319,12 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
             transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir))
 
         def upload_behavior(command):
-            from cStringIO import StringIO
             f = StringIO()
             archive = tarfile.TarFile(fileobj=f, name='fake.tar', mode='w')
             archive.addfile(tarfile.TarInfo("test"), StringIO("Hello World!"))
             writer = command.args['writer']
             writer.remote_write(f.getvalue())
-            writer.remote_unpack()
+            return writer.remote_unpack()
 
         self.expectCommands(
             Expect('uploadDirectory', dict(
@@ -266,6 +339,242 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestCachedTransfers(steps.BuildStepMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.srcfile = os.path.abspath('srcfile')
+        open(self.srcfile, 'wb').write('some content')
+        self.digest = sha1('some content').hexdigest()
+        self.destfile = os.path.abspath('destfile')
+        self.cachedir = os.path.abspath(os.path.join('basedir',
+                                                     'upload-cache'))
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        for path in self.srcfile, self.destfile:
+            if os.path.exists(path):
+                os.unlink(path)
+        if os.path.exists('basedir'):
+            shutil.rmtree('basedir')
+        return self.tearDownBuildStep()
+
+    def test_download_cached(self):
+        self.setupStep(transfer.FileDownload(mastersrc=self.srcfile,
+                                             slavedest='dest', cache=True))
+        self.expectCommands(
+            Expect('fileCache', dict(action='fetch', workdir='wkdir',
+                                     file='dest', digest=self.digest,
+                                     mode=None))
+            + Expect.update('cached', True)
+            + 0)
+        self.expectOutcome(result=SUCCESS,
+                           status_text=['downloaded', 'to', 'dest', '(cached)'])
+        return self.runStep()
+
+    def test_download_not_cached(self):
+        self.setupStep(transfer.FileDownload(mastersrc=self.srcfile,
+                                             slavedest='dest', cache=True))
+        self.expectCommands(
+            Expect('fileCache', dict(action='fetch', workdir='wkdir',
+                                     file='dest', digest=self.digest,
+                                     mode=None))
+            + Expect.update('cached', False)
+            + 0,
+            Expect('downloadFile', dict(
+                slavedest='dest', workdir='wkdir', blocksize=16384,
+                maxsize=None, mode=None,
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + 0,
+            Expect('fileCache', dict(action='store', workdir='wkdir',
+                                     file='dest',
+                                     cachesize=transfer.DEFAULT_CACHE_SIZE))
+            + 0)
+        self.expectOutcome(result=SUCCESS,
+                           status_text=['downloading', 'to', 'dest'])
+        return self.runStep()
+
+    def test_download_cache_old_slave(self):
+        self.setupStep(transfer.FileDownload(mastersrc=self.srcfile,
+                                             slavedest='dest', cache=True),
+                       slave_version={'*': '2.19'})
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                slavedest='dest', workdir='wkdir', blocksize=16384,
+                maxsize=None, mode=None,
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + 0)
+        self.expectOutcome(result=SUCCESS,
+                           status_text=['downloading', 'to', 'dest'])
+        return self.runStep()
+
+    def test_upload_cached(self):
+        os.makedirs(self.cachedir)
+        shutil.copyfile(self.srcfile, os.path.join(self.cachedir, self.digest))
+        self.setupStep(transfer.FileUpload(slavesrc='src',
+                                           masterdest=self.destfile,
+                                           keepstamp=True, cache=True))
+        self.expectCommands(
+            Expect('fileCache', dict(action='digest', workdir='wkdir',
+                                     file='src'))
+            + Expect.update('digest', self.digest)
+            + Expect.update('stamp', [1000000, 2000000])
+            + 0)
+        self.expectOutcome(result=SUCCESS,
+                           status_text=['uploaded', 'src', '(cached)'])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(open(self.destfile, 'rb').read(), 'some content')
+            self.assertEqual(int(os.path.getmtime(self.destfile)), 2000000)
+        return d
+
+    def test_upload_not_cached(self):
+        self.setupStep(transfer.FileUpload(slavesrc='src',
+                                           masterdest=self.destfile,
+                                           cache=True))
+
+        def upload_behavior(command):
+            writer = command.args['writer']
+            writer.remote_write('some content')
+            return writer.remote_close()
+        self.expectCommands(
+            Expect('fileCache', dict(action='digest', workdir='wkdir',
+                                     file='src'))
+            + Expect.update('digest', self.digest)
+            + Expect.update('stamp', [1000000, 2000000])
+            + 0,
+            Expect('uploadFile', dict(
+                slavesrc='src', workdir='wkdir', blocksize=16384,
+                maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(upload_behavior)
+            + 0)
+        self.expectOutcome(result=SUCCESS, status_text=['uploading', 'src'])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            cached = os.path.join(self.cachedir, self.digest)
+            self.assertEqual(open(cached, 'rb').read(), 'some content')
+            if hasattr(os, 'link'):
+                self.assertTrue(os.path.samefile(cached, self.destfile))
+        return d
+
+    def test_upload_hostile_digest(self):
+        # a digest naming a file outside the cache is not trusted, and the
+        # file is uploaded as usual
+        os.makedirs(self.cachedir)
+        secret = os.path.abspath(os.path.join('basedir', 'master.cfg'))
+        open(secret, 'wb').write('secret')
+        self.setupStep(transfer.FileUpload(slavesrc='src',
+                                           masterdest=self.destfile,
+                                           cache=True))
+
+        def upload_behavior(command):
+            writer = command.args['writer']
+            writer.remote_write('some content')
+            return writer.remote_close()
+        self.expectCommands(
+            Expect('fileCache', dict(action='digest', workdir='wkdir',
+                                     file='src'))
+            + Expect.update('digest', '../master.cfg')
+            + Expect.update('stamp', [1000000, 2000000])
+            + 0,
+            Expect('uploadFile', dict(
+                slavesrc='src', workdir='wkdir', blocksize=16384,
+                maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(upload_behavior)
+            + 0)
+        self.expectOutcome(result=SUCCESS, status_text=['uploading', 'src'])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(open(self.destfile, 'rb').read(), 'some content')
+        return d
+
+    def test_fetchFromCache_invalid_digest(self):
+        os.makedirs(self.cachedir)
+        for digest in ['../srcfile', self.srcfile, self.digest.upper(),
+                       self.digest + '0', None]:
+            self.assertFalse(transfer._fetchFromCache(
+                self.cachedir, digest, self.destfile, None))
+        self.assertFalse(os.path.exists(self.destfile))
+
+    def test_storeInCache_prunes_oldest(self):
+        os.makedirs(self.cachedir)
+        for i, name in enumerate(['a' * 40, 'b' * 40]):
+            path = os.path.join(self.cachedir, name)
+            open(path, 'wb').write('x' * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+        # a copy in progress is left alone
+        open(os.path.join(self.cachedir, 'tmpXYZ'), 'wb').write('x' * 100)
+        # leave room for the new file and one old one
+        transfer._storeInCache(self.cachedir, self.srcfile, 22)
+        self.assertEqual(sorted(os.listdir(self.cachedir)),
+                         sorted(['b' * 40, self.digest, 'tmpXYZ']))
+
+    def test_fetchFromCache_marks_used(self):
+        os.makedirs(self.cachedir)
+        cached = os.path.join(self.cachedir, self.digest)
+        shutil.copyfile(self.srcfile, cached)
+        os.utime(cached, (1000, 1000))
+        self.assertTrue(transfer._fetchFromCache(
+            self.cachedir, self.digest, self.destfile, None))
+        self.assertTrue(os.path.getmtime(cached) > 1000)
+
+    def test_fetchFromCache_link(self):
+        os.makedirs(self.cachedir)
+        cached = os.path.join(self.cachedir, self.digest)
+        shutil.copyfile(self.srcfile, cached)
+        self.assertTrue(transfer._fetchFromCache(
+            self.cachedir, self.digest, self.destfile, None, link=True))
+        if hasattr(os, 'link'):
+            self.assertTrue(os.path.samefile(cached, self.destfile))
+        # fetching again leaves the link in place
+        self.assertTrue(transfer._fetchFromCache(
+            self.cachedir, self.digest, self.destfile, None, link=True))
+        self.assertEqual(sorted(os.listdir(self.cachedir)), [self.digest])
+        self.assertEqual(open(self.destfile, 'rb').read(), 'some content')
+
+    def test_storeInCache_copy(self):
+        os.makedirs(self.cachedir)
+        transfer._storeInCache(self.cachedir, self.srcfile, 1000)
+        cached = os.path.join(self.cachedir, self.digest)
+        self.assertEqual(open(cached, 'rb').read(), 'some content')
+        self.assertFalse(os.path.samefile(cached, self.srcfile))
+
+    def test_storeInCache_link_fallback(self):
+        # across filesystems, the file is copied instead
+        def link(src, dest):
+            raise OSError(18, 'Invalid cross-device link')
+        self.patch(os, 'link', link)
+        os.makedirs(self.cachedir)
+        transfer._storeInCache(self.cachedir, self.srcfile, 1000, link=True)
+        self.assertEqual(sorted(os.listdir(self.cachedir)), [self.digest])
+        cached = os.path.join(self.cachedir, self.digest)
+        self.assertEqual(open(cached, 'rb').read(), 'some content')
+        self.assertFalse(os.path.samefile(cached, self.srcfile))
+
+    def test_fileDigest_cached(self):
+        self.patch(transfer, '_digests', {})
+        hashed = []
+        self.patch(transfer, '_hashFile',
+                   lambda path, orig=transfer._hashFile:
+                   hashed.append(path) or orig(path))
+        self.assertEqual(transfer._fileDigest(self.srcfile), self.digest)
+        self.assertEqual(transfer._fileDigest(self.srcfile), self.digest)
+        self.assertEqual(len(hashed), 1)
+
+        # a changed file is hashed again
+        open(self.srcfile, 'wb').write('other content')
+        self.assertEqual(transfer._fileDigest(self.srcfile),
+                         sha1('other content').hexdigest())
+        self.assertEqual(len(hashed), 2)
+
+
 class TestStringDownload(unittest.TestCase):
 
     # check that ConfigErrors is raised on invalid 'mode' argument
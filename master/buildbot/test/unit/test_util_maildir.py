@@ -20,6 +20,8 @@ import os
 from buildbot.test.util import dirs
 from buildbot.util import maildir
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
 from twisted.trial import unittest
 
 
@@ -83,6 +85,82 @@ class TestMaildirService(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check_nonempty)
         return d
 
+    def addMessage(self, name):
+        tmpfile = os.path.join(self.tmpdir, name)
+        open(tmpfile, "w").close()
+        os.rename(tmpfile, os.path.join(self.newdir, name))
+
+    @defer.inlineCallbacks
+    def test_messagesReceived_batched(self):
+        self.svc = maildir.MaildirService(self.maildir)
+        batches = []
+        self.svc.messagesReceived = lambda fns: batches.append(fns)
+        self.patch(self.svc, '_reactor', task.Clock())
+
+        self.addMessage("2")
+        self.addMessage("1")
+        yield self.svc.poll()
+        self.assertEqual(batches, [['1', '2']])
+
+        # several notifications lead to one poll
+        for name in "345":
+            self.addMessage(name)
+            self.svc.inotify_callback(None, None, 0)
+        self.assertEqual(len(self.svc._reactor.getDelayedCalls()), 1)
+        self.svc._reactor.advance(self.svc.notifyDelay)
+        self.assertEqual(batches, [['1', '2'], ['3', '4', '5']])
+
+        # files which left new/ are forgotten
+        self.svc.moveToCurDir("1")
+        yield self.svc.poll()
+        self.assertEqual(self.svc.files, set("2345"))
+        self.assertEqual(len(batches), 2)
+
+    def test_messagesReceived_errors(self):
+        self.svc = maildir.MaildirService(self.maildir)
+        received = []
+
+        def messageReceived(filename):
+            received.append(filename)
+            if filename == 'a':
+                raise RuntimeError("oh noes")
+        self.svc.messageReceived = messageReceived
+        d = self.svc.messagesReceived(['a', 'b'])
+
+        def check(_):
+            self.assertEqual(received, ['a', 'b'])
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d.addCallback(check)
+        return d
+
+    def test_polling_fallback(self):
+        self.patch(maildir, 'inotify', None)
+        self.patch(maildir, 'dnotify', None)
+        self.svc = maildir.MaildirService(self.maildir)
+        self.svc.startService()
+        self.assertEqual(self.svc.timerService.step, self.svc.pollinterval)
+
+    def test_inotify(self):
+        if not maildir.inotify:
+            raise unittest.SkipTest("inotify is not available")
+        self.svc = maildir.MaildirService(self.maildir)
+        self.svc.startService()
+        if not self.svc.inotify:
+            raise unittest.SkipTest("inotify is not supported here")
+        # a slow poll picks up anything that inotify missed
+        self.assertEqual(self.svc.timerService.step,
+                         self.svc.notifyPollInterval)
+
+        d = defer.Deferred()
+        self.svc.messagesReceived = d.callback
+        # give the reactor a chance to start the watch before adding a file
+        reactor.callLater(0, self.addMessage, "newmsg")
+
+        def check(filenames):
+            self.assertEqual(filenames, ['newmsg'])
+        d.addCallback(check)
+        return d
+
     def test_moveToCurDir(self):
         self.svc = maildir.MaildirService(self.maildir)
         tmpfile = os.path.join(self.tmpdir, "newmsg")
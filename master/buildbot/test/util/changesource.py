@@ -27,7 +27,8 @@ class ChangeSourceMixin(object):
 
      - starting and stopping a ChangeSource service
      - a fake C{self.master.addChange}, which adds its args
-       to the list C{self.changes_added}
+       to the list C{self.changes_added}, and C{self.master.addChanges},
+       which adds each of the changes in its list
     """
 
     changesource = None
@@ -48,8 +49,12 @@ class ChangeSourceMixin(object):
                             "non-ascii string for key '%s': %r" % (k, v))
             self.changes_added.append(kwargs)
             return defer.succeed(mock.Mock())
+        def addChanges(changelist):
+            return defer.gatherResults([addChange(**kwargs)
+                                        for kwargs in changelist])
         self.master = make_master(testcase=self, wantDb=True)
         self.master.addChange = addChange
+        self.master.addChanges = addChanges
         return defer.succeed(None)
 
     def tearDownChangeSource(self):
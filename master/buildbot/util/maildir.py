@@ -15,9 +15,12 @@
 
 
 # This is a class which watches a maildir for new messages. It uses the
-# linux dirwatcher API (if available) to look for new files. The
-# .messageReceived method is invoked with the filename of the new message,
-# relative to the top of the maildir (so it will look like "new/blahblah").
+# linux inotify or dnotify APIs (if available) to look for new files, and
+# polls otherwise; it also polls now and then when using inotify or dnotify,
+# in case a notification was lost. All new files found at each wakeup are
+# handed to the .messagesReceived method, which by default invokes
+# .messageReceived with the filename of each new message, relative to the
+# new/ directory.
 
 import os
 
@@ -25,13 +28,21 @@ from twisted.application import internet
 from twisted.application import service
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.python import filepath
 from twisted.python import log
 from twisted.python import runtime
+inotify = None
+try:
+    from twisted.internet import inotify
+except:
+    pass
 dnotify = None
 try:
     import dnotify
 except:
-    log.msg("unable to import dnotify, so Maildir will use polling instead")
+    if not inotify:
+        log.msg("unable to import inotify or dnotify, so Maildir will use "
+                "polling instead")
 
 
 class NoSuchMaildir(Exception):
@@ -39,15 +50,21 @@ class NoSuchMaildir(Exception):
 
 
 class MaildirService(service.MultiService):
-    pollinterval = 10  # only used if we don't have DNotify
+    pollinterval = 10  # only used if we don't have INotify or DNotify
+    notifyPollInterval = 300  # used if we do, in case notifications are lost
+    notifyDelay = 0.1  # wait between a notification and the next poll
+
+    _reactor = reactor  # for tests
 
     def __init__(self, basedir=None):
         service.MultiService.__init__(self)
         if basedir:
             self.setBasedir(basedir)
-        self.files = []
+        self.files = set()
+        self.inotify = None
         self.dnotify = None
         self.timerService = None
+        self._pollCall = None
 
     def setBasedir(self, basedir):
         # some users of MaildirService (scheduler.Try_Jobdir, in particular)
@@ -62,8 +79,21 @@ class MaildirService(service.MultiService):
         service.MultiService.startService(self)
         if not os.path.isdir(self.newdir) or not os.path.isdir(self.curdir):
             raise NoSuchMaildir("invalid maildir '%s'" % self.basedir)
+        if inotify:
+            try:
+                self.inotify = inotify.INotify()
+                self.inotify.startReading()
+                self.inotify.watch(filepath.FilePath(self.newdir),
+                                   mask=inotify.IN_CREATE | inotify.IN_MOVED_TO,
+                                   callbacks=[self.inotify_callback])
+            except Exception:
+                # inotify is only available on linux>=2.6.13
+                log.msg("INotify failed, falling back to DNotify or polling")
+                if self.inotify:
+                    self.inotify.loseConnection()
+                self.inotify = None
         try:
-            if dnotify:
+            if dnotify and not self.inotify:
                 # we must hold an fd open on the directory, so we can get
                 # notified when it changes.
                 self.dnotify = dnotify.DNotify(self.newdir,
@@ -74,11 +104,21 @@ class MaildirService(service.MultiService):
             # dnotify. OverflowError will occur on some 64-bit machines
             # because of a python bug
             log.msg("DNotify failed, falling back to polling")
-        if not self.dnotify:
-            self.timerService = internet.TimerService(self.pollinterval, self.poll)
-            self.timerService.setServiceParent(self)
+        if self.inotify or self.dnotify:
+            # inotify drops events when its queue overflows, so poll slowly
+            # to pick up any files that were not noticed
+            interval = self.notifyPollInterval
+        else:
+            interval = self.pollinterval
+        self.timerService = internet.TimerService(interval, self.poll)
+        self.timerService.setServiceParent(self)
         self.poll()
 
+    def inotify_callback(self, ignored, path, mask):
+        # called once per new file; the files arriving before the delayed
+        # poll runs are all handled by that poll
+        self._schedulePoll()
+
     def dnotify_callback(self):
         log.msg("dnotify noticed something, now polling")
 
@@ -91,9 +131,24 @@ class MaildirService(service.MultiService):
         # why, and I'd have to hack qmail to investigate further, so it's
         # easier to just wait a second before yanking the message out of new/
 
-        reactor.callLater(0.1, self.poll)
+        self._schedulePoll()
+
+    def _schedulePoll(self):
+        if self._pollCall is None:
+            self._pollCall = self._reactor.callLater(self.notifyDelay,
+                                                     self._delayedPoll)
+
+    def _delayedPoll(self):
+        self._pollCall = None
+        self.poll()
 
     def stopService(self):
+        if self._pollCall is not None:
+            self._pollCall.cancel()
+            self._pollCall = None
+        if self.inotify:
+            self.inotify.loseConnection()
+            self.inotify = None
         if self.dnotify:
             self.dnotify.remove()
             self.dnotify = None
@@ -106,23 +161,25 @@ class MaildirService(service.MultiService):
     def poll(self):
         try:
             assert self.basedir
-            # see what's new
-            for f in self.files:
-                if not os.path.isfile(os.path.join(self.newdir, f)):
-                    self.files.remove(f)
-            newfiles = []
-            for f in os.listdir(self.newdir):
-                if not f in self.files:
-                    newfiles.append(f)
-            self.files.extend(newfiles)
-            for n in newfiles:
-                try:
-                    yield self.messageReceived(n)
-                except:
-                    log.err(None, "while reading '%s' from maildir '%s':" % (n, self.basedir))
+            # see what's new; forget the files that have left new/
+            current = set(os.listdir(self.newdir))
+            self.files &= current
+            # maildir filenames start with the delivery time
+            newfiles = sorted(current - self.files)
+            self.files.update(newfiles)
+            if newfiles:
+                yield self.messagesReceived(newfiles)
         except Exception:
             log.err(None, "while polling maildir '%s':" % (self.basedir,))
 
+    @defer.inlineCallbacks
+    def messagesReceived(self, filenames):
+        for n in filenames:
+            try:
+                yield self.messageReceived(n)
+            except:
+                log.err(None, "while reading '%s' from maildir '%s':" % (n, self.basedir))
+
     def moveToCurDir(self, filename):
         if runtime.platformType == "posix":
             # open the file before moving it, because I'm afraid that once
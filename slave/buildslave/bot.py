@@ -62,6 +62,10 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # .masterFeatures lists the optional features of the master, such as
+    # the update formats it understands; see remote_setMasterFeatures
+    masterFeatures = ()
+
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
@@ -100,6 +104,16 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def remote_setMaster(self, remote):
         self.remote = remote
         self.remote.notifyOnDisconnect(self.lostRemote)
+        # older masters do not call remote_setMasterFeatures
+        self.masterFeatures = ()
+
+    def remote_setMasterFeatures(self, features):
+        """
+        Called by newer masters after setMaster, with a list of the optional
+        features they support.  With 'segments', the master accepts updates
+        carrying interleaved output as a list of (logname, data) pairs.
+        """
+        self.masterFeatures = tuple(features)
 
     def remote_print(self, message):
         log.msg("SlaveBuilder.remote_print(%s): message from master: %s" %
@@ -297,7 +311,10 @@ class Bot(pb.Referenceable, service.MultiService):
         # finally warn about any leftover dirs
         for dir in os.listdir(self.basedir):
             if os.path.isdir(os.path.join(self.basedir, dir)):
-                if dir not in wanted_dirs:
+                # the default location of the shared git mirrors, and the
+                # cache of transferred files
+                if dir not in wanted_dirs and \
+                        dir not in ('git-mirrors', 'file-cache'):
                     log.msg("I have a leftover directory '%s' that is not "
                             "being used by the buildmaster: you can delete "
                             "it now" % dir)
@@ -37,7 +37,7 @@ from buildslave.interfaces import ISlaveCommand
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.16"
+command_version = "2.21"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -71,6 +71,10 @@ command_version = "2.16"
 #  >= 2.15: 'interruptSignal' option is added to SlaveShellCommand
 #  >= 2.16: 'sigtermTime' option is added to SlaveShellCommand
 #  >= 2.17: listdir command added to read a directory
+#  >= 2.18: gitmirror command added to maintain shared git mirrors
+#  >= 2.19: gitsync command added to update a git checkout in one command
+#  >= 2.20: fileCache command added to share transferred files by content
+#  >= 2.21: rmdir can remove in the background, cpdir can hardlink or reflink
 
 
 class Command:
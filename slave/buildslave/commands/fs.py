@@ -13,9 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+import errno
 import os
 import shutil
 import sys
+import tempfile
 
 from twisted.internet import defer
 from twisted.internet import threads
@@ -27,6 +29,106 @@ from buildslave.commands import base
 from buildslave.commands import utils
 
 
+class Reaper(object):
+
+    """
+    Remove directory trees in the background, with at most C{parallelism}
+    removals running at once.  Each tree is split into the entries of its
+    first directory that holds more than one, so that large trees are
+    removed in parallel, too.
+    """
+
+    parallelism = 4
+
+    def __init__(self):
+        self.lock = defer.DeferredSemaphore(self.parallelism)
+        self.reaping = set()
+        self.pending = []
+
+    def reap(self, path):
+        """Remove the tree at C{path}, which nothing else uses any more"""
+        if path in self.reaping:
+            return
+        self.reaping.add(path)
+
+        dl = [self._remove(entry) for entry in self._split(path)]
+        d = defer.DeferredList(dl)
+        d.addCallback(lambda _: self._remove(path))
+
+        @d.addBoth
+        def done(res):
+            self.reaping.discard(path)
+            self.pending.remove(d)
+            return res
+        self.pending.append(d)
+
+    def _split(self, path):
+        # descend through directories that hold a single directory, like
+        # the 'dir' that RemoveDirectory moves each tree to, and return the
+        # entries where the tree branches
+        while True:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return []
+            if len(names) != 1:
+                break
+            child = os.path.join(path, names[0])
+            if os.path.islink(child) or not os.path.isdir(child):
+                break
+            path = child
+        return [os.path.join(path, name) for name in names]
+
+    def _remove(self, path):
+        d = self.lock.run(threads.deferToThread, _removeEntry, path)
+        d.addErrback(log.err, 'while removing %s in the background' % path)
+        return d
+
+    def wait(self):
+        """Return a Deferred that fires when all pending removals are done"""
+        return defer.DeferredList(list(self.pending))
+
+
+def _removeEntry(path):
+    # rmdirRecursive is shutil.rmtree on POSIX, which refuses plain files
+    # and symlinks
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.remove(path)
+    else:
+        utils.rmdirRecursive(path)
+
+reaper = Reaper()
+
+# prefix of the directories where RemoveDirectory moves trees to be removed in
+# the background
+TRASH_PREFIX = '.buildbot-trash-'
+
+
+def _linkTree(src, dst):
+    """
+    Copy the tree at C{src} to C{dst} like shutil.copytree, but hardlink files
+    instead of copying them where possible.
+    """
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if os.path.islink(srcname):
+            os.symlink(os.readlink(srcname), dstname)
+        elif os.path.isdir(srcname):
+            _linkTree(srcname, dstname)
+        else:
+            try:
+                os.link(srcname, dstname)
+            except OSError, e:
+                # fall back to copying across filesystems, or where links
+                # are not allowed
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                shutil.copy2(srcname, dstname)
+    shutil.copystat(src, dst)
+
+
 class MakeDirectory(base.Command):
 
     header = "mkdir"
@@ -51,6 +153,7 @@ class RemoveDirectory(base.Command):
 
     def setup(self, args):
         self.logEnviron = args.get('logEnviron', True)
+        self.background = args.get('background', False)
 
     @defer.deferredGenerator
     def start(self):
@@ -82,6 +185,8 @@ class RemoveDirectory(base.Command):
 
     def removeSingleDir(self, dirname):
         self.dir = os.path.join(self.builder.basedir, dirname)
+        if self.background:
+            return defer.maybeDeferred(self._moveAside)
         if runtime.platformType != "posix":
             d = threads.deferToThread(utils.rmdirRecursive, self.dir)
 
@@ -97,6 +202,26 @@ class RemoveDirectory(base.Command):
 
         return d
 
+    def _moveAside(self):
+        # rename the directory out of the way, which is quick, and remove it
+        # in the background.  The trash directory is created next to it, to
+        # stay on the same filesystem.
+        if not os.path.lexists(self.dir):
+            return 0
+        parent = os.path.dirname(os.path.normpath(self.dir))
+        try:
+            trash = tempfile.mkdtemp(prefix=TRASH_PREFIX, dir=parent)
+            os.rename(self.dir, os.path.join(trash, 'dir'))
+        except OSError, e:
+            self.sendStatus({'header': 'could not move %s aside: %s\n'
+                             % (self.dir, e)})
+            return -1
+        # reap the trash of any earlier interrupted removals, too
+        for name in os.listdir(parent):
+            if name.startswith(TRASH_PREFIX):
+                reaper.reap(os.path.join(parent, name))
+        return 0
+
     def _clobber(self, dummy, chmodDone=False):
         command = ["rm", "-rf", self.dir]
         c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
@@ -144,6 +269,7 @@ class CopyDirectory(base.Command):
 
     def setup(self, args):
         self.logEnviron = args.get('logEnviron', True)
+        self.method = args.get('method', 'copy')
 
     def start(self):
         args = self.args
@@ -158,7 +284,23 @@ class CopyDirectory(base.Command):
         self.timeout = args.get('timeout', 120)
         self.maxTime = args.get('maxTime', None)
 
-        if runtime.platformType != "posix":
+        if self.method == 'hardlink':
+            if not os.path.exists(os.path.dirname(todir)):
+                os.makedirs(os.path.dirname(todir))
+            d = threads.deferToThread(_linkTree, fromdir, todir)
+
+            def cb(_):
+                return 0  # rc=0
+
+            def eb(f):
+                self.sendStatus({'header': 'exception from linking tree\n' + f.getTraceback()})
+                return -1  # rc=-1
+            d.addCallbacks(cb, eb)
+
+            @d.addCallback
+            def send_rc(rc):
+                self.sendStatus({'rc': rc})
+        elif runtime.platformType != "posix":
             d = threads.deferToThread(shutil.copytree, fromdir, todir)
 
             def cb(_):
@@ -179,7 +321,14 @@ class CopyDirectory(base.Command):
                 # I don't think this happens, but just in case..
                 log.msg("cp target '%s' already exists -- cp will not do what you think!" % todir)
 
-            command = ['cp', '-R', '-P', '-p', '-v', fromdir, todir]
+            if self.method == 'reflink':
+                # share data blocks on filesystems that support it, otherwise
+                # copy as usual; listing millions of files would only slow
+                # the copy down, so leave out -v
+                command = ['cp', '-R', '-P', '-p', '--reflink=auto',
+                           fromdir, todir]
+            else:
+                command = ['cp', '-R', '-P', '-p', '-v', fromdir, todir]
             c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
                                       sendRC=False, timeout=self.timeout, maxTime=self.maxTime,
                                       logEnviron=self.logEnviron, usePTY=False)
@@ -15,9 +15,13 @@
 
 import os
 
+from hashlib import sha1
 from twisted.internet import defer
+from twisted.python import log
 
 from buildslave import runprocess
+from buildslave.commands import base
+from buildslave.commands import utils
 from buildslave.commands.base import AbandonChain
 from buildslave.commands.base import SourceBaseCommand
 
@@ -217,3 +221,296 @@ class Git(SourceBaseCommand):
                 return None
             return hash
         return self._dovccmd(command, _parse, keepStdout=True)
+
+
+# mirror updates in progress, keyed by mirror path; each value is the list of
+# Deferreds waiting for the result of that update
+_mirrorUpdates = {}
+
+
+class GitMirror(base.Command):
+
+    """Maintain a bare mirror of a Git repository, shared by all builders on
+    this slave, for use as a reference repository by the Git source step.
+    This command reads the following keys:
+
+    ['repourl'] (required):   the upstream Git repository string
+    ['mirrordir'] (required): directory containing the mirrors, relative to
+                              the builder's basedir
+
+    The mirror is cloned on first use, and fetched into on later uses.  If
+    another builder is already updating the same mirror, this command waits
+    for that update instead of starting its own.  On success, the absolute
+    path of the mirror is sent back in a 'mirror' status update.
+    """
+
+    header = "git mirror"
+
+    def setup(self, args):
+        self.repourl = args['repourl']
+        self.mirrordir = args['mirrordir']
+        self.timeout = args.get('timeout', 1200)
+        self.maxTime = args.get('maxTime', None)
+        self.logEnviron = args.get('logEnviron', True)
+        self.command = None
+        self.waiter = None
+
+    def start(self):
+        mirrordir = os.path.join(self.builder.basedir, self.mirrordir)
+        self.mirror = os.path.abspath(os.path.join(mirrordir,
+                                                   sha1(self.repourl).hexdigest() + '.git'))
+
+        if self.mirror in _mirrorUpdates:
+            self.sendStatus({'header': 'waiting for update of %s\n' % self.mirror})
+            d = self.waiter = defer.Deferred()
+            _mirrorUpdates[self.mirror].append(d)
+        else:
+            _mirrorUpdates[self.mirror] = []
+            d = defer.maybeDeferred(self._update)
+
+            @d.addErrback
+            def eb(f):
+                log.err(f, "while updating git mirror %s" % self.mirror)
+                return -1, False
+
+            @d.addCallback
+            def notify(res):
+                for waiter in _mirrorUpdates.pop(self.mirror):
+                    if not waiter.called:
+                        waiter.callback(res)
+                return res
+        d.addCallback(self._finished)
+        return d
+
+    def _update(self):
+        git = utils.getCommand('git')
+        existed = os.path.isdir(self.mirror)
+        if existed:
+            self.sendStatus({'header': 'updating mirror %s\n' % self.mirror})
+            d = self._dovccmd([git, 'fetch', '--prune', 'origin'], self.mirror)
+        else:
+            self.sendStatus({'header': 'creating mirror %s\n' % self.mirror})
+            parent = os.path.dirname(self.mirror)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            d = self._dovccmd([git, 'clone', '--mirror', self.repourl,
+                               self.mirror], parent)
+
+            @d.addCallback
+            def disableGc(rc):
+                # builds refer to the mirror's objects through alternates, so
+                # they must never be pruned by an automatic gc
+                if rc != 0:
+                    return rc
+                return self._dovccmd([git, 'config', 'gc.auto', '0'],
+                                     self.mirror)
+
+            @d.addCallback
+            def cleanup(rc):
+                # do not leave a half-cloned mirror behind for the next build
+                if rc != 0:
+                    utils.rmdirRecursive(self.mirror)
+                return rc
+
+        @d.addCallback
+        def checkExisted(rc):
+            # a failed fetch still leaves a usable (if stale) mirror
+            return rc, (rc == 0 or existed)
+        return d
+
+    def _dovccmd(self, command, workdir):
+        if self.interrupted:
+            return defer.succeed(-1)
+        c = runprocess.RunProcess(self.builder, command, workdir,
+                                  sendRC=False, timeout=self.timeout,
+                                  maxTime=self.maxTime,
+                                  logEnviron=self.logEnviron, usePTY=False)
+        self.command = c
+        return c.start()
+
+    def _finished(self, res):
+        rc, usable = res
+        if usable and not self.interrupted:
+            self.sendStatus({'mirror': self.mirror})
+        self.sendStatus({'rc': rc})
+
+    def interrupt(self):
+        self.interrupted = True
+        if self.waiter and not self.waiter.called:
+            self.waiter.callback((-1, False))
+        elif self.command:
+            self.command.kill("command interrupted")
+
+
+class GitSync(base.Command):
+
+    """Bring an existing Git checkout up to date in a single command, running
+    the same sequence of git commands as the new-style Git source step
+    would run one by one.  This command reads the following keys:
+
+    ['workdir'] (required):      the checkout, relative to the builder's
+                                 basedir
+    ['repourl'] (required):      the upstream Git repository string
+    ['branch'] (required):       the branch to fetch, or 'HEAD'
+    ['revision'] (optional):     the revision to check out
+    ['mode'] (required):         'incremental' or 'full'
+    ['method'] (optional):       for mode 'full', 'clean' or 'fresh'
+    ['submodules'] (optional):   whether to update submodules
+    ['progress'] (optional):     pass --progress to git fetch
+    ['retryFetch'] (optional):   retry the fetch once if the checkout fails
+    ['config'] (optional):       dict of git configuration options
+    ['env'] (optional):          environment for the git commands
+
+    If the workdir does not hold a Git checkout, or git is not installed,
+    nothing is done and {'action': 'fallback'} is sent, so that the step can
+    handle the situation command by command.  Otherwise the revision that
+    was checked out is sent as 'got_revision', followed by 'rc'.
+    """
+
+    header = "git sync"
+
+    def setup(self, args):
+        self.workdir = os.path.join(self.builder.basedir, args['workdir'])
+        self.repourl = args['repourl']
+        self.branch = args['branch']
+        self.revision = args.get('revision')
+        self.mode = args['mode']
+        self.method = args.get('method')
+        self.submodules = args.get('submodules', False)
+        self.progress = args.get('progress', False)
+        self.retryFetch = args.get('retryFetch', False)
+        self.config = args.get('config') or {}
+        self.env = args.get('env')
+        self.timeout = args.get('timeout', 1200)
+        self.maxTime = args.get('maxTime', None)
+        self.logEnviron = args.get('logEnviron', True)
+        self.command = None
+
+    @defer.deferredGenerator
+    def start(self):
+        try:
+            self.git = utils.getCommand('git')
+        except RuntimeError:
+            self.git = None
+        if not self.git or not os.path.isdir(os.path.join(self.workdir, '.git')):
+            self.sendStatus({'action': 'fallback'})
+            self.sendStatus({'rc': 0})
+            return
+
+        wfd = defer.waitForDeferred(defer.maybeDeferred(self._sync))
+        yield wfd
+        try:
+            rc = wfd.getResult()
+        except AbandonChain, e:
+            rc = e.args[0]
+        self.sendStatus({'rc': rc})
+
+    @defer.deferredGenerator
+    def _sync(self):
+        if os.path.exists(os.path.join(self.workdir, '.buildbot-patched')):
+            wfd = defer.waitForDeferred(
+                self._dovccmd(['clean', '-f', '-f', '-d', '-x']))
+            yield wfd
+            wfd.getResult()
+
+        if self.mode == 'full':
+            command = ['clean', '-f', '-f', '-d']
+            if self.method == 'fresh':
+                command.append('-x')
+            wfd = defer.waitForDeferred(self._dovccmd(command))
+            yield wfd
+            wfd.getResult()
+            rc = 1
+        elif self.revision:
+            # test for existence of the revision; rc=1 indicates it does
+            # not exist
+            wfd = defer.waitForDeferred(
+                self._dovccmd(['cat-file', '-e', self.revision],
+                              abandonOnFailure=False))
+            yield wfd
+            rc = wfd.getResult()
+        else:
+            rc = 1
+
+        if rc == 0:
+            wfd = defer.waitForDeferred(
+                self._checkout(self.revision, abandonOnFailure=True))
+            yield wfd
+            wfd.getResult()
+        else:
+            wfd = defer.waitForDeferred(self._fetch())
+            yield wfd
+            rc = wfd.getResult()
+            if rc != 0 and self.retryFetch:
+                wfd = defer.waitForDeferred(self._fetch())
+                yield wfd
+                rc = wfd.getResult()
+            self._abandonOnFailure(rc)
+
+        if self.submodules:
+            wfd = defer.waitForDeferred(
+                self._dovccmd(['submodule', 'update', '--init', '--recursive']))
+            yield wfd
+            wfd.getResult()
+            if self.mode == 'full':
+                command = ['submodule', 'foreach', 'git', 'clean', '-f', '-f', '-d']
+                if self.method == 'fresh':
+                    command.append('-x')
+                wfd = defer.waitForDeferred(self._dovccmd(command))
+                yield wfd
+                wfd.getResult()
+
+        wfd = defer.waitForDeferred(
+            self._dovccmd(['rev-parse', 'HEAD'], keepStdout=True))
+        yield wfd
+        wfd.getResult()
+        self.sendStatus({'got_revision': self.command.stdout.strip()})
+        yield 0
+
+    def _fetch(self):
+        command = ['fetch', '-t', self.repourl, self.branch]
+        if self.progress:
+            command.append('--progress')
+        d = self._dovccmd(command)
+        d.addCallback(lambda _:
+                      self._checkout(self.revision or 'FETCH_HEAD',
+                                     abandonOnFailure=False))
+        return d
+
+    def _checkout(self, rev, abandonOnFailure):
+        d = self._dovccmd(['reset', '--hard', rev, '--'],
+                          abandonOnFailure=abandonOnFailure)
+
+        def renameBranch(rc):
+            if rc != 0 or self.branch == 'HEAD':
+                return rc
+            d = self._dovccmd(['branch', '-M', self.branch],
+                              abandonOnFailure=False)
+            # ignore errors
+            d.addCallback(lambda _: rc)
+            return d
+        d.addCallback(renameBranch)
+        return d
+
+    def _dovccmd(self, command, abandonOnFailure=True, keepStdout=False):
+        if self.interrupted:
+            raise AbandonChain(-1)
+        full_command = [self.git]
+        for name, value in sorted(self.config.items()):
+            full_command.extend(['-c', '%s=%s' % (name, value)])
+        full_command.extend(command)
+        c = runprocess.RunProcess(self.builder, full_command, self.workdir,
+                                  environ=self.env, sendRC=False,
+                                  timeout=self.timeout, maxTime=self.maxTime,
+                                  keepStdout=keepStdout,
+                                  logEnviron=self.logEnviron, usePTY=False)
+        self.command = c
+        d = c.start()
+        if abandonOnFailure:
+            d.addCallback(self._abandonOnFailure)
+        return d
+
+    def interrupt(self):
+        self.interrupted = True
+        if self.command:
+            self.command.kill("command interrupted")
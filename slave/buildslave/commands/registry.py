@@ -21,11 +21,14 @@ commandRegistry = {
     "uploadFile": "buildslave.commands.transfer.SlaveFileUploadCommand",
     "uploadDirectory": "buildslave.commands.transfer.SlaveDirectoryUploadCommand",
     "downloadFile": "buildslave.commands.transfer.SlaveFileDownloadCommand",
+    "fileCache": "buildslave.commands.transfer.SlaveFileCacheCommand",
     "svn": "buildslave.commands.svn.SVN",
     "bk": "buildslave.commands.bk.BK",
     "cvs": "buildslave.commands.cvs.CVS",
     "darcs": "buildslave.commands.darcs.Darcs",
     "git": "buildslave.commands.git.Git",
+    "gitmirror": "buildslave.commands.git.GitMirror",
+    "gitsync": "buildslave.commands.git.GitSync",
     "repo": "buildslave.commands.repo.Repo",
     "bzr": "buildslave.commands.bzr.Bzr",
     "hg": "buildslave.commands.hg.Mercurial",
@@ -14,10 +14,15 @@
 # Copyright Buildbot Team Members
 
 import os
+import re
+import shutil
 import tarfile
 import tempfile
 
+from hashlib import sha1
+
 from twisted.internet import defer
+from twisted.internet import threads
 from twisted.python import log
 
 from buildslave.commands.base import Command
@@ -370,3 +375,140 @@ class SlaveFileDownloadCommand(TransferCommand):
             self.fp.close()
 
         return TransferCommand.finished(self, res)
+
+
+class SlaveFileCacheCommand(Command):
+
+    """
+    Look up and store files in a content-addressed cache shared by all
+    builders on this slave, so that files the slave already has need not be
+    transferred again.
+    Arguments:
+
+        - ['action']:    'digest', 'fetch' or 'store'
+        - ['workdir']:   base directory to use
+        - ['file']:      name of the slave-side file
+        - ['digest']:    SHA1 hex digest of the file contents, for fetch
+        - ['mode']:      access mode for a fetched file
+        - ['cachesize']: maximum total size of the cache, in bytes, for store
+
+    The 'digest' action sends the SHA1 digest and the access and modification
+    times of the file.  The 'fetch' action copies the file with the given
+    digest from the cache, if present, and sends whether it did.  The 'store'
+    action adds the file to the cache, then removes the least recently used
+    files until the cache is no larger than 'cachesize'.
+    """
+
+    default_cachesize = 1024 * 1024 * 1024
+    digest_re = re.compile(r'^[0-9a-f]{40}$')
+
+    def setup(self, args):
+        self.action = args['action']
+        self.workdir = args['workdir']
+        self.filename = args['file']
+        self.digest = args.get('digest')
+        self.mode = args.get('mode')
+        self.cachesize = args.get('cachesize', self.default_cachesize)
+
+    def start(self):
+        self.path = os.path.join(self.builder.basedir, self.workdir,
+                                 os.path.expanduser(self.filename))
+        self.cachedir = os.path.join(os.path.dirname(self.builder.basedir),
+                                     'file-cache')
+        assert self.action in ('digest', 'fetch', 'store')
+        d = threads.deferToThread(getattr(self, '_' + self.action))
+
+        def done(update):
+            if update:
+                self.sendStatus(update)
+            self.sendStatus({'rc': 0})
+
+        def failed(f):
+            self.sendStatus({'stderr': 'fileCache %s of %r failed: %s\n'
+                             % (self.action, self.path, f.getErrorMessage())})
+            self.sendStatus({'rc': 1})
+        d.addCallbacks(done, failed)
+        return d
+
+    def _hash(self, path):
+        digest = sha1()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(64 * 1024)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            f.close()
+        return digest.hexdigest()
+
+    def _copy(self, src, dest):
+        # copy through a temporary file, so that dest never holds a partial
+        # file
+        dirname = os.path.dirname(dest)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmpname)
+            if os.path.exists(dest):
+                # on windows, os.rename does not automatically unlink
+                os.unlink(dest)
+            os.rename(tmpname, dest)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def _digest(self):
+        st = os.stat(self.path)
+        return {'digest': self._hash(self.path),
+                'stamp': (st.st_atime, st.st_mtime)}
+
+    def _fetch(self):
+        if not self.digest_re.match(str(self.digest)):
+            raise ValueError("invalid digest %r" % (self.digest,))
+        cached = os.path.join(self.cachedir, self.digest)
+        if not os.path.exists(cached):
+            return {'cached': False}
+        self._copy(cached, self.path)
+        # mark the entry as recently used, so that pruning keeps it
+        os.utime(cached, None)
+        if self.mode is not None:
+            os.chmod(self.path, self.mode)
+        return {'cached': True}
+
+    def _store(self):
+        # store the file under its actual digest, in case it has changed
+        # since it was transferred
+        cached = os.path.join(self.cachedir, self._hash(self.path))
+        if not os.path.exists(cached):
+            self._copy(self.path, cached)
+        self._prune()
+        return {}
+
+    def _prune(self):
+        # remove the least recently used entries until the cache fits in
+        # self.cachesize bytes
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not self.digest_re.match(name):
+                continue  # a copy in progress
+            path = os.path.join(self.cachedir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.cachesize:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
@@ -26,7 +26,6 @@ import sys
 import traceback
 import types
 
-from collections import deque
 from tempfile import NamedTemporaryFile
 
 from twisted.internet import defer
@@ -346,7 +345,9 @@ class RunProcess:
         self.keepStdout = keepStdout
         self.keepStderr = keepStderr
 
-        self.buffered = deque()
+        # (logname, [data, ..]) pairs, in the order the data was produced;
+        # consecutive data for the same log shares a pair
+        self.buffered = []
         self.buflen = 0
         self.sendBuffersTimer = None
 
@@ -399,8 +400,10 @@ class RunProcess:
         # completes
         if self.keepStdout:
             self.stdout = ""
+            self._stdoutChunks = []
         if self.keepStderr:
             self.stderr = ""
+            self._stderrChunks = []
         self.deferred = defer.Deferred()
         try:
             self._startCommand()
@@ -601,28 +604,22 @@ class RunProcess:
         for i in range(0, len(data), LIMIT):
             yield data[i:i + LIMIT]
 
-    def _collapseMsg(self, msg):
+    def _sendSegments(self, segments):
         """
-        Take msg, which is a dictionary of lists of output chunks, and
-        concatenate all the chunks into a single string
+        Send a list of (logname, data) segments to the master, as a single
+        update if the master understands that, and as one update per segment
+        otherwise.
         """
-        retval = {}
-        for log in msg:
-            data = "".join(msg[log])
-            if isinstance(log, tuple) and log[0] == 'log':
-                retval['log'] = (log[1], data)
-            else:
-                retval[log] = data
-        return retval
-
-    def _sendMessage(self, msg):
-        """
-        Collapse and send msg to the master
-        """
-        if not msg:
+        if not segments:
             return
-        msg = self._collapseMsg(msg)
-        self.sendStatus(msg)
+        if 'segments' in getattr(self.builder, 'masterFeatures', ()):
+            self.sendStatus({'segments': segments})
+            return
+        for logname, data in segments:
+            if isinstance(logname, tuple) and logname[0] == 'log':
+                self.sendStatus({'log': (logname[1], data)})
+            else:
+                self.sendStatus({logname: data})
 
     def _bufferTimeout(self):
         self.sendBuffersTimer = None
@@ -632,50 +629,26 @@ class RunProcess:
         """
         Send all the content in our buffers.
         """
-        msg = {}
+        buffered, self.buffered = self.buffered, []
+        self.buflen = 0
+        segments = []
         msg_size = 0
-        lastlog = None
-        logdata = []
-        while self.buffered:
-            # Grab the next bits from the buffer
-            logname, data = self.buffered.popleft()
-
-            # If this log is different than the last one, then we have to send
-            # out the message so far.  This is because the message is
-            # transferred as a dictionary, which makes the ordering of keys
-            # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
-            # On our first pass through this loop lastlog is None
-            if lastlog is None:
-                lastlog = logname
-            elif logname != lastlog:
-                self._sendMessage(msg)
-                msg = {}
-                msg_size = 0
-            lastlog = logname
-
-            logdata = msg.setdefault(logname, [])
-
+        for logname, chunks in buffered:
             # Chunkify the log data to make sure we're not sending more than
             # CHUNK_LIMIT at a time
-            for chunk in self._chunkForSend(data):
+            for chunk in self._chunkForSend("".join(chunks)):
                 if len(chunk) == 0:
                     continue
-                logdata.append(chunk)
+                segments.append((logname, chunk))
                 msg_size += len(chunk)
                 if msg_size >= self.CHUNK_LIMIT:
                     # We've gone beyond the chunk limit, so send out our
                     # message.  At worst this results in a message slightly
                     # larger than (2*CHUNK_LIMIT)-1
-                    self._sendMessage(msg)
-                    msg = {}
-                    logdata = msg.setdefault(logname, [])
+                    self._sendSegments(segments)
+                    segments = []
                     msg_size = 0
-        self.buflen = 0
-        if logdata:
-            self._sendMessage(msg)
+        self._sendSegments(segments)
         if self.sendBuffersTimer:
             if self.sendBuffersTimer.active():
                 self.sendBuffersTimer.cancel()
@@ -691,7 +664,10 @@ class RunProcess:
         n = len(data)
 
         self.buflen += n
-        self.buffered.append((logname, data))
+        if self.buffered and self.buffered[-1][0] == logname:
+            self.buffered[-1][1].append(data)
+        else:
+            self.buffered.append((logname, [data]))
         if self.buflen > self.BUFFER_SIZE:
             self._sendBuffers()
         elif not self.sendBuffersTimer:
@@ -702,7 +678,7 @@ class RunProcess:
             self._addToBuffers('stdout', data)
 
         if self.keepStdout:
-            self.stdout += data
+            self._stdoutChunks.append(data)
         if self.ioTimeoutTimer:
             self.ioTimeoutTimer.reset(self.timeout)
 
@@ -711,7 +687,7 @@ class RunProcess:
             self._addToBuffers('stderr', data)
 
         if self.keepStderr:
-            self.stderr += data
+            self._stderrChunks.append(data)
         if self.ioTimeoutTimer:
             self.ioTimeoutTimer.reset(self.timeout)
 
@@ -728,6 +704,7 @@ class RunProcess:
             # this will send the final updates
             w.stop()
         self._sendBuffers()
+        self._collectKept()
         if sig is not None:
             rc = -1
         if self.sendRC:
@@ -744,8 +721,16 @@ class RunProcess:
         else:
             log.msg("Hey, command %s finished twice" % self)
 
+    def _collectKept(self):
+        # join the kept output once, rather than growing a string
+        if self.keepStdout:
+            self.stdout = "".join(self._stdoutChunks)
+        if self.keepStderr:
+            self.stderr = "".join(self._stderrChunks)
+
     def failed(self, why):
         self._sendBuffers()
+        self._collectKept()
         log.msg("RunProcess.failed: command failed: %s" % (why,))
         self._cancelTimers()
         d = self.deferred
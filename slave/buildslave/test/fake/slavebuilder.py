@@ -24,6 +24,7 @@ class FakeSlaveBuilder:
     showing the updates.  Set debug to True to show updates as they happen.
     """
     debug = False
+    masterFeatures = ()
 
     def __init__(self, usePTY=False, basedir="/slavebuilder/basedir"):
         self.updates = []
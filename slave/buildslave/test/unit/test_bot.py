@@ -244,6 +244,20 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         # master is not part of the interface (and, in fact, it does very little)
         return self.sb.callRemote("setMaster", mock.Mock())
 
+    def test_setMasterFeatures(self):
+        d = self.sb.callRemote("setMaster", mock.Mock())
+        d.addCallback(lambda _:
+                      self.sb.callRemote("setMasterFeatures", ['segments']))
+
+        def check(_):
+            self.assertEqual(self.sb.original.masterFeatures, ('segments',))
+            # a master that does not send its features has none
+            return self.sb.callRemote("setMaster", mock.Mock())
+        d.addCallback(check)
+        d.addCallback(lambda _:
+                      self.assertEqual(self.sb.original.masterFeatures, ()))
+        return d
+
     def test_shutdown(self):
         # don't *actually* shut down the reactor - that would be silly
         stop = mock.Mock()
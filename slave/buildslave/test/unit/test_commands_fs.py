@@ -20,6 +20,7 @@ from twisted.trial import unittest
 
 from buildslave.commands import fs
 from buildslave.commands import utils
+from buildslave.test.fake.runprocess import Expect
 from buildslave.test.util.command import CommandTestMixin
 from twisted.python import runtime
 
@@ -79,6 +80,70 @@ class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_background(self):
+        self.patch(fs, 'reaper', fs.Reaper())
+        # the trash of an earlier, interrupted removal
+        stale = os.path.join(self.basedir, fs.TRASH_PREFIX + 'stale')
+        os.makedirs(os.path.join(stale, 'dir', 'sub'))
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', background=True,
+        ), True)
+        workdir = os.path.join(self.basedir, 'workdir')
+        for i in range(10):
+            os.makedirs(os.path.join(workdir, 'd%d' % i))
+            open(os.path.join(workdir, 'f%d' % i), 'w').write('data')
+        d = self.run_command()
+
+        def check(_):
+            self.assertFalse(os.path.exists(workdir))
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+            return fs.reaper.wait()
+        d.addCallback(check)
+
+        def check_reaped(_):
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check_reaped)
+        return d
+
+    def test_background_split(self):
+        self.patch(fs, 'reaper', fs.Reaper())
+        removed = []
+        self.patch(utils, 'rmdirRecursive',
+                   lambda path, orig=utils.rmdirRecursive:
+                   removed.append(os.path.basename(path)) or orig(path))
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', background=True,
+        ), True)
+        workdir = os.path.join(self.basedir, 'workdir')
+        for i in range(4):
+            os.makedirs(os.path.join(workdir, 'd%d' % i, 'sub'))
+        open(os.path.join(workdir, 'file'), 'w').write('data')
+        os.symlink('d0', os.path.join(workdir, 'link'))
+        d = self.run_command()
+        d.addCallback(lambda _: fs.reaper.wait())
+
+        def check(_):
+            # each subdirectory of the tree was removed separately, the
+            # plain file and symlink without rmtree, then the trash itself
+            self.assertEqual(sorted(removed[:4]), ['d0', 'd1', 'd2', 'd3'])
+            self.assertEqual(len(removed), 5)
+            self.assertTrue(removed[4].startswith(fs.TRASH_PREFIX))
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check)
+        return d
+
+    def test_background_missing(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='nosuch', background=True,
+        ), True)
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+            self.assertEqual(os.listdir(self.basedir), ['workdir'])
+        d.addCallback(check)
+        return d
+
 
 class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
 
@@ -124,6 +189,56 @@ class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
         return d
 
 
+    def test_hardlink(self):
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='workdir',
+            todir='copy/here',
+            method='hardlink',
+        ), True)
+        workdir = os.path.join(self.basedir, 'workdir')
+        os.makedirs(os.path.join(workdir, 'sub'))
+        open(os.path.join(workdir, 'sub', 'file'), 'w').write('data')
+        if runtime.platformType == 'posix':
+            os.symlink('sub/file', os.path.join(workdir, 'link'))
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+            copy = os.path.join(self.basedir, 'copy', 'here')
+            self.assertEqual(open(os.path.join(copy, 'sub', 'file')).read(),
+                             'data')
+            if runtime.platformType == 'posix':
+                self.assertEqual(os.readlink(os.path.join(copy, 'link')),
+                                 'sub/file')
+                self.assertEqual(
+                    os.stat(os.path.join(copy, 'sub', 'file')).st_ino,
+                    os.stat(os.path.join(workdir, 'sub', 'file')).st_ino)
+        d.addCallback(check)
+        return d
+
+    def test_reflink(self):
+        if runtime.platformType != "posix":
+            return  # reflinks are made with cp
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='workdir',
+            todir='copy',
+            method='reflink',
+        ), True)
+        self.patch_runprocess(
+            Expect(['cp', '-R', '-P', '-p', '--reflink=auto',
+                    os.path.join(self.basedir, 'workdir'),
+                    os.path.join(self.basedir, 'copy')],
+                   self.basedir,
+                   sendRC=False, timeout=120, usePTY=False)
+            + 0)
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+        d.addCallback(check)
+        return d
+
+
 class TestMakeDirectory(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
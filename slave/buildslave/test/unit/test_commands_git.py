@@ -16,11 +16,13 @@
 import mock
 import os
 
+from hashlib import sha1
 from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildslave.commands import git
 from buildslave.test.fake.runprocess import Expect
+from buildslave.test.util.command import CommandTestMixin
 from buildslave.test.util.sourcecommand import SourceCommandTestMixin
 
 
@@ -701,3 +703,284 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
     # TODO: gerrit_branch
     # TODO: consolidate Expect objects
     # TODO: ignore_ignores (w/ submodules)
+
+
+class TestGitMirror(CommandTestMixin, unittest.TestCase):
+
+    repourl = 'git://github.com/djmitche/buildbot.git'
+
+    def setUp(self):
+        self.setUpCommand()
+        self.patch_getCommand('git', 'path/to/git')
+        self.mirrors = os.path.join(self.basedir, 'mirrors')
+        self.mirror = os.path.join(self.mirrors,
+                                   sha1(self.repourl).hexdigest() + '.git')
+
+    def tearDown(self):
+        self.tearDownCommand()
+
+    def make_mirror_command(self):
+        return self.make_command(git.GitMirror, dict(
+            repourl=self.repourl, mirrordir='mirrors', timeout=10))
+
+    def test_clone(self):
+        self.make_mirror_command()
+        self.patch_runprocess(
+            Expect(['path/to/git', 'clone', '--mirror', self.repourl,
+                    self.mirror], self.mirrors,
+                   sendRC=False, timeout=10, usePTY=False)
+            + 0,
+            Expect(['path/to/git', 'config', 'gc.auto', '0'], self.mirror,
+                   sendRC=False, timeout=10, usePTY=False)
+            + 0,
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'header': 'creating mirror %s\n' % self.mirror},
+            {'mirror': self.mirror},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_clone_fails(self):
+        self.make_mirror_command()
+        self.patch_runprocess(
+            Expect(['path/to/git', 'clone', '--mirror', self.repourl,
+                    self.mirror], self.mirrors,
+                   sendRC=False, timeout=10, usePTY=False)
+            + {'stderr': 'fatal: no such repository\n'}
+            + 128,
+        )
+        self.patch(git.utils, 'rmdirRecursive', mock.Mock())
+        d = self.run_command()
+
+        @d.addCallback
+        def check(_):
+            self.assertUpdates([
+                {'header': 'creating mirror %s\n' % self.mirror},
+                {'stderr': 'fatal: no such repository\n'},
+                {'rc': 128},
+            ])
+            # the partial clone is removed
+            git.utils.rmdirRecursive.assert_called_with(self.mirror)
+        return d
+
+    def test_fetch_fails_existing_mirror(self):
+        os.makedirs(self.mirror)
+        self.make_mirror_command()
+        self.patch_runprocess(
+            Expect(['path/to/git', 'fetch', '--prune', 'origin'], self.mirror,
+                   sendRC=False, timeout=10, usePTY=False)
+            + 1,
+        )
+        d = self.run_command()
+        # the stale mirror is still usable as a reference
+        d.addCallback(lambda _: self.assertUpdates([
+            {'header': 'updating mirror %s\n' % self.mirror},
+            {'mirror': self.mirror},
+            {'rc': 1},
+        ]))
+        return d
+
+    def test_concurrent_updates_coalesced(self):
+        os.makedirs(self.mirror)
+        self.make_mirror_command()
+        self.patch_runprocess(
+            Expect(['path/to/git', 'fetch', '--prune', 'origin'], self.mirror,
+                   sendRC=False, timeout=10, usePTY=False)
+            + {'wait': True}
+            + 0,
+        )
+        cmd1 = self.cmd
+        d1 = self.run_command()
+        # a second builder asks for the same mirror while the fetch runs
+        self.make_mirror_command()
+        d2 = self.run_command()
+        self.assertUpdates([
+            {'header': 'waiting for update of %s\n' % self.mirror},
+        ])
+        cmd1.command._finished()
+        d = defer.gatherResults([d1, d2])
+
+        @d.addCallback
+        def check(_):
+            self.assertUpdates([
+                {'header': 'waiting for update of %s\n' % self.mirror},
+                {'mirror': self.mirror},
+                {'rc': 0},
+            ])
+            self.assertEqual(git._mirrorUpdates, {})
+        return d
+
+    def test_interrupt_while_waiting(self):
+        os.makedirs(self.mirror)
+        self.make_mirror_command()
+        self.patch_runprocess(
+            Expect(['path/to/git', 'fetch', '--prune', 'origin'], self.mirror,
+                   sendRC=False, timeout=10, usePTY=False)
+            + {'wait': True}
+            + 0,
+        )
+        cmd1 = self.cmd
+        d1 = self.run_command()
+        self.make_mirror_command()
+        d2 = self.run_command()
+        self.cmd.doInterrupt()
+        cmd1.command._finished()
+        return defer.gatherResults([d1, d2])
+
+
+class TestGitSync(CommandTestMixin, unittest.TestCase):
+
+    repourl = 'git://github.com/djmitche/buildbot.git'
+    revision = '4026d33b0532b11f36b0875f63699adfa8ee8662'
+
+    def setUp(self):
+        self.setUpCommand()
+        self.patch_getCommand('git', 'path/to/git')
+
+    def tearDown(self):
+        self.tearDownCommand()
+
+    def make_sync_command(self, git_checkout=True, **kwargs):
+        args = dict(workdir='workdir', repourl=self.repourl, branch='HEAD',
+                    mode='incremental', timeout=10)
+        args.update(kwargs)
+        self.make_command(git.GitSync, args, makedirs=True)
+        if git_checkout:
+            os.makedirs(os.path.join(self.basedir_workdir, '.git'))
+
+    def expect_git(self, *args, **kwargs):
+        kwargs.setdefault('sendRC', False)
+        kwargs.setdefault('timeout', 10)
+        kwargs.setdefault('usePTY', False)
+        return Expect(['path/to/git'] + list(args), self.basedir_workdir,
+                      **kwargs)
+
+    def expect_rev_parse(self):
+        return (self.expect_git('rev-parse', 'HEAD', keepStdout=True)
+                + {'stdout': self.revision + '\n'}
+                + 0)
+
+    def test_no_checkout(self):
+        self.make_sync_command(git_checkout=False)
+        self.patch_runprocess()
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'action': 'fallback'},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_no_git(self):
+        self.make_sync_command()
+        self.patch_runprocess()
+        self.patch(git.utils, 'getCommand',
+                   mock.Mock(side_effect=RuntimeError("no git")))
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'action': 'fallback'},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_incremental(self):
+        self.make_sync_command(branch='master')
+        self.patch_runprocess(
+            self.expect_git('fetch', '-t', self.repourl, 'master') + 0,
+            self.expect_git('reset', '--hard', 'FETCH_HEAD', '--') + 0,
+            self.expect_git('branch', '-M', 'master') + 0,
+            self.expect_rev_parse(),
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'stdout': self.revision + '\n'},
+            {'got_revision': self.revision},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_incremental_known_revision(self):
+        self.make_sync_command(revision=self.revision,
+                               config={'user.name': 'bb'})
+        self.patch_runprocess(
+            Expect(['path/to/git', '-c', 'user.name=bb', 'cat-file', '-e',
+                    self.revision], self.basedir_workdir,
+                   sendRC=False, timeout=10, usePTY=False)
+            + 0,
+            Expect(['path/to/git', '-c', 'user.name=bb', 'reset', '--hard',
+                    self.revision, '--'], self.basedir_workdir,
+                   sendRC=False, timeout=10, usePTY=False)
+            + 0,
+            Expect(['path/to/git', '-c', 'user.name=bb', 'rev-parse', 'HEAD'],
+                   self.basedir_workdir,
+                   sendRC=False, timeout=10, usePTY=False, keepStdout=True)
+            + {'stdout': self.revision + '\n'}
+            + 0,
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'stdout': self.revision + '\n'},
+            {'got_revision': self.revision},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_full_fresh_patched_submodules(self):
+        self.make_sync_command(mode='full', method='fresh', submodules=True,
+                               env={'GIT_SSH': 'ssh'})
+        open(os.path.join(self.basedir_workdir, '.buildbot-patched'), 'w')
+        env = {'environ': {'GIT_SSH': 'ssh'}}
+        self.patch_runprocess(
+            self.expect_git('clean', '-f', '-f', '-d', '-x', **env) + 0,
+            self.expect_git('clean', '-f', '-f', '-d', '-x', **env) + 0,
+            self.expect_git('fetch', '-t', self.repourl, 'HEAD', **env) + 0,
+            self.expect_git('reset', '--hard', 'FETCH_HEAD', '--', **env) + 0,
+            self.expect_git('submodule', 'update', '--init', '--recursive',
+                            **env) + 0,
+            self.expect_git('submodule', 'foreach', 'git', 'clean', '-f', '-f',
+                            '-d', '-x', **env) + 0,
+            self.expect_git('rev-parse', 'HEAD', keepStdout=True, **env)
+            + {'stdout': self.revision + '\n'}
+            + 0,
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'stdout': self.revision + '\n'},
+            {'got_revision': self.revision},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_retryFetch(self):
+        self.make_sync_command(revision=self.revision, mode='full',
+                               method='clean', retryFetch=True)
+        self.patch_runprocess(
+            self.expect_git('clean', '-f', '-f', '-d') + 0,
+            self.expect_git('fetch', '-t', self.repourl, 'HEAD') + 0,
+            self.expect_git('reset', '--hard', self.revision, '--') + 128,
+            self.expect_git('fetch', '-t', self.repourl, 'HEAD') + 0,
+            self.expect_git('reset', '--hard', self.revision, '--') + 0,
+            self.expect_rev_parse(),
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'stdout': self.revision + '\n'},
+            {'got_revision': self.revision},
+            {'rc': 0},
+        ]))
+        return d
+
+    def test_fetch_fails(self):
+        self.make_sync_command(progress=True)
+        self.patch_runprocess(
+            self.expect_git('fetch', '-t', self.repourl, 'HEAD', '--progress')
+            + {'stderr': 'fatal: unable to connect\n'}
+            + 128,
+        )
+        d = self.run_command()
+        d.addCallback(lambda _: self.assertUpdates([
+            {'stderr': 'fatal: unable to connect\n'},
+            {'rc': 128},
+        ]))
+        return d
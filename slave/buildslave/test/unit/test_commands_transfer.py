@@ -19,6 +19,8 @@ import shutil
 import sys
 import tarfile
 
+from hashlib import sha1
+
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.python import failure
@@ -534,3 +536,108 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
             ])
         dl.addCallback(check)
         return dl
+
+
+class TestFileCache(CommandTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpCommand()
+        self.datadir = os.path.join(self.basedir, 'workdir')
+        os.makedirs(self.datadir)
+        self.datafile = os.path.join(self.datadir, 'data')
+        open(self.datafile, "wb").write("cached data\n")
+        self.digest = sha1("cached data\n").hexdigest()
+        self.cachedir = os.path.join(os.path.dirname(self.basedir),
+                                     'file-cache')
+
+    def tearDown(self):
+        self.tearDownCommand()
+        if os.path.exists(self.cachedir):
+            shutil.rmtree(self.cachedir)
+
+    def run_action(self, **args):
+        args.setdefault('workdir', 'workdir')
+        args.setdefault('file', 'data')
+        self.make_command(transfer.SlaveFileCacheCommand, args)
+        return self.run_command()
+
+    def test_digest(self):
+        d = self.run_action(action='digest')
+
+        def check(_):
+            update, rc = self.get_updates()[:2]
+            self.assertEqual(update['digest'], self.digest)
+            self.assertEqual(update['stamp'][1],
+                             os.stat(self.datafile).st_mtime)
+            self.assertEqual(rc, {'rc': 0})
+        d.addCallback(check)
+        return d
+
+    def test_digest_missing(self):
+        d = self.run_action(action='digest', file='nosuch')
+
+        def check(_):
+            updates = self.get_updates()
+            self.assertIn('fileCache digest of', updates[0]['stderr'])
+            self.assertEqual(updates[1], {'rc': 1})
+        d.addCallback(check)
+        return d
+
+    def test_fetch_miss(self):
+        d = self.run_action(action='fetch', file='new', digest=self.digest)
+
+        def check(_):
+            self.assertUpdates([{'cached': False}, {'rc': 0}])
+            self.assertFalse(os.path.exists(
+                os.path.join(self.datadir, 'new')))
+        d.addCallback(check)
+        return d
+
+    def test_store_and_fetch(self):
+        d = self.run_action(action='store')
+
+        def fetch(_):
+            self.assertUpdates([{'rc': 0}])
+            self.assertTrue(os.path.exists(
+                os.path.join(self.cachedir, self.digest)))
+            # the cache is shared with other builders
+            self.addCleanup(shutil.rmtree, os.path.abspath('other-builder'))
+            self.patch(self, 'basedir', os.path.abspath('other-builder'))
+            return self.run_action(action='fetch', file='sub/new',
+                                   digest=self.digest, mode=0600)
+        d.addCallback(fetch)
+
+        def check(_):
+            self.assertUpdates([{'cached': True}, {'rc': 0}])
+            newfile = os.path.join('other-builder', 'workdir', 'sub', 'new')
+            self.assertEqual(open(newfile, 'rb').read(), "cached data\n")
+            if runtime.platformType != 'win32':
+                self.assertEqual(os.stat(newfile).st_mode & 0777, 0600)
+        d.addCallback(check)
+        return d
+
+    def test_fetch_invalid_digest(self):
+        d = self.run_action(action='fetch', file='new', digest='../data')
+
+        def check(_):
+            updates = self.get_updates()
+            self.assertIn('fileCache fetch of', updates[0]['stderr'])
+            self.assertEqual(updates[1], {'rc': 1})
+        d.addCallback(check)
+        return d
+
+    def test_store_prunes_oldest(self):
+        os.makedirs(self.cachedir)
+        for i, name in enumerate(['a' * 40, 'b' * 40]):
+            path = os.path.join(self.cachedir, name)
+            open(path, 'wb').write('x' * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+        # leave room for the new file and one old one
+        d = self.run_action(action='store', cachesize=22)
+
+        def check(_):
+            self.assertUpdates([{'rc': 0}])
+            self.assertEqual(sorted(os.listdir(self.cachedir)),
+                             sorted(['b' * 40, self.digest]))
+        d.addCallback(check)
+        return d
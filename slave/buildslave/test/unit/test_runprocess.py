@@ -758,6 +758,38 @@ class TestLogging(BasedirMixin, unittest.TestCase):
             {'stdout': 'world'},
         ])
 
+    def testSendBufferedSegments(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.masterFeatures = ('segments',)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'there ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'x'), 'logged')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [{'segments': [
+            ('stdout', 'hello there '),
+            ('stderr', 'DIEEEEEEE'),
+            (('log', 'x'), 'logged'),
+            ('stdout', 'world'),
+        ]}])
+
+    def testSendChunkedSegments(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.masterFeatures = ('segments',)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        limit = runprocess.RunProcess.CHUNK_LIMIT
+        s.BUFFER_SIZE = limit * 2
+        s._addToBuffers('stdout', 'x' * (limit - 1))
+        s._addToBuffers('stderr', 'yy')
+        s._addToBuffers('stdout', 'z')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            {'segments': [('stdout', 'x' * (limit - 1)), ('stderr', 'yy')]},
+            {'segments': [('stdout', 'z')]},
+        ])
+
     def testSendChunked(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)